@@ -1,14 +1,65 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.admin.widgets import AutocompleteSelect, AutocompleteSelectMultiple
+from django.core.exceptions import PermissionDenied
+from django.db.models import Max, Min, Q
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 from import_export import resources, fields, widgets
 from import_export.admin import ImportExportModelAdmin
+from import_export.formats import base_formats
+from import_export.instance_loaders import ModelInstanceLoader
 from .models import (
-    Consumo, InterfaceConsumo, Medidor, PuntoMedicion, Equipo,
-    CaracteristicaMedicion, CategoriaPuntoMedicion, DocumentoMedicion, RangoMedicion, TipoMedidor, VistaConsumoDiferencia
+    AlertaConsumo, ArchivoConsumo, Consumo, ConsumoContador, ConsumoMes, DemandaMedidor, DemandaTipoMedidor, IncidenciaSerie,
+    InterfaceConsumo, Medidor, PerfilMedidor, PuntoMedicion, Equipo,
+    ImportacionConsumo, CaracteristicaMedicion, CategoriaPuntoMedicion, DocumentoMedicion, EtapaImportacion,
+    MedicionImportacion, RangoMedicion, TipoMedidor, VistaConsumoDiferencia
 )
-from . import views
-from datetime import datetime
+from . import archivo, contadores, exportacion, rangos, views
+from .instrumentacion import Instrumentacion, etapa
+from .paginacion import PaginadorEstimado
+from datetime import datetime, time, timedelta
 from django.db import transaction
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ConsumoInstanceLoader(ModelInstanceLoader):
+    """
+    Carga en una sola consulta los Consumo existentes que pueden coincidir con el
+    dataset (medidores y rango de fechas del archivo), en lugar de un get() por fila.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fecha_field = self.resource.fields['fecha']
+        self.medidor_field = self.resource.fields['medidor']
+        self.existentes = {}
+
+        with etapa('busqueda_duplicados') as medida:
+            claves = [clave for clave in map(self._clave, self.dataset.dict) if clave]
+            if not claves:
+                return
+            fechas = [fecha for fecha, _ in claves]
+            qs = self.get_queryset().filter(
+                medidor_id__in={medidor_id for _, medidor_id in claves},
+                fecha__range=(min(fechas), max(fechas)),
+            )
+            self.existentes = {(c.fecha, c.medidor_id): c for c in qs}
+            medida.filas += len(claves)
+
+    def _clave(self, row):
+        try:
+            return self.fecha_field.clean(row), self.medidor_field.clean(row)
+        except (ValueError, KeyError):
+            return None
+
+    def get_instance(self, row):
+        clave = self._clave(row)
+        return self.existentes.get(clave) if clave else None
 
 
 class ConsumoResource(resources.ModelResource):
@@ -20,10 +71,12 @@ class ConsumoResource(resources.ModelResource):
         attribute='consumo',
         widget=widgets.FloatWidget()
     )
+    # Se asigna medidor_id directamente: los IDs ya se validaron contra el conjunto
+    # precargado en before_import, así no hay un Medidor.objects.get() por fila.
     medidor = fields.Field(
-        attribute='medidor',
+        attribute='medidor_id',
         column_name='medidor',
-        widget=widgets.ForeignKeyWidget(Medidor, 'id')  # Cambia a 'nombre' si prefieres
+        widget=widgets.IntegerWidget()
     )
 
     class Meta:
@@ -36,51 +89,58 @@ class ConsumoResource(resources.ModelResource):
         use_transactions = True
         # skip_unchanged = False
         report_skipped = False
-
-    def get_export_fields(self):
-        fields = super().get_export_fields()
-        print("Export fields:", [f.column_name for f in fields])
-        return fields
-
-    from django.db import transaction
+        instance_loader_class = ConsumoInstanceLoader
+        # Altas y cambios se escriben con bulk_create/bulk_update cada batch_size filas.
+        use_bulk = True
+        batch_size = 1000
+        skip_diff = True
+
+    def import_data(self, dataset, dry_run=False, **kwargs):
+        # Solo se mide la importación real, no la vista previa.
+        if dry_run:
+            return super().import_data(dataset, dry_run=dry_run, **kwargs)
+        with Instrumentacion(MedicionImportacion.ADMIN, kwargs.get('file_name') or '') as medicion:
+            medicion.filas = len(dataset)
+            # Lo que no cae en una etapa anidada es el recorrido de filas de django-import-export y sus bulk_create.
+            with etapa('insercion') as medida:
+                resultado = super().import_data(dataset, dry_run=dry_run, **kwargs)
+                medida.filas += resultado.totals.get('new', 0) + resultado.totals.get('update', 0)
+            medicion.exito = not (resultado.has_errors() or resultado.has_validation_errors())
+        return resultado
 
     def before_import(self, dataset, using_transactions=True, dry_run=False, **kwargs):
+        with etapa('validacion') as medida:
+            medida.filas += len(dataset)
+            self._validar(dataset)
+
+    def _validar(self, dataset):
         from tablib import Dataset
-        import csv
 
-        new_dataset = Dataset()
-        new_dataset.headers = ['fecha', 'consumo', 'medidor']
+        filas = self._separar_filas(dataset)
+        # Una consulta para todos los medidores; se reutilizan para validar IDs y para str(instance).
+        self._medidores = {m.pk: m for m in Medidor.objects.only('id', 'nombre')}
 
-        for row in dataset:
-            if row and len(row) > 0:
-                try:
-                    # Detectar automáticamente el delimitador
-                    sniffer = csv.Sniffer()
-                    dialect = sniffer.sniff(row[0])
-                    row = row[0].split(dialect.delimiter)
-                except Exception as e:
-                    print(f"Error detectando delimitador en la fila: {row} -> {e}")
-                    continue
-
-                print("Procesando fila:", row)
-                if len(row) >= 3:
-                    fecha, consumo, medidor = row[0].strip(), row[1].strip(), row[2].strip()
+        # Una fila por (fecha, medidor): si se repite gana la última, como cuando se guardaba fila a fila.
+        validas = {}
+        for row in filas:
+            if len(row) >= 3:
+                fecha, consumo, medidor = row[0].strip(), row[1].strip(), row[2].strip()
 
-                    if not fecha or not medidor:
-                        continue
+                if not fecha or not medidor:
+                    continue
 
-                    try:
-                        consumo = float(consumo.replace(',', '.'))  
-                    except ValueError:
-                        continue
+                try:
+                    consumo = float(consumo.replace(',', '.'))
+                    medidor_id = int(medidor)
+                except ValueError:
+                    continue
 
-                    try:
-                        medidor_instance = Medidor.objects.get(id=medidor)
-                    except Medidor.DoesNotExist:
-                        continue
+                if medidor_id not in self._medidores:
+                    continue
 
-                    new_dataset.append([fecha, consumo, medidor_instance.id])
+                validas[(fecha, medidor_id)] = [fecha, consumo, medidor_id]
 
+        new_dataset = Dataset(*validas.values(), headers=['fecha', 'consumo', 'medidor'])
         if len(new_dataset) == 0:
             raise ValueError("No hay datos válidos para importar")
 
@@ -90,33 +150,69 @@ class ConsumoResource(resources.ModelResource):
 
         dataset.headers = ['fecha', 'consumo', 'medidor']
 
-    def before_import_row(self, row, **kwargs):
+    @staticmethod
+    def _separar_filas(dataset):
+        """
+        Devuelve las filas del dataset como listas de strings.
+
+        Si el formato de importación no separó las columnas (el archivo usa otro
+        delimitador), cada fila llega como una sola celda: el dialecto se detecta
+        una vez con una muestra del archivo y se usa para todas las filas.
+        """
+        import csv
 
+        filas = [[str(v) if v is not None else '' for v in row] for row in dataset if row and len(row) > 0]
+        if not filas or len(filas[0]) >= 3:
+            return filas
+
+        lineas = [row[0] for row in filas]
+        try:
+            dialect = csv.Sniffer().sniff('\n'.join(lineas[:100]), delimiters=',;\t|')
+        except csv.Error as e:
+            logger.warning(f"No se pudo detectar el delimitador del archivo: {e}")
+            return []
+        return list(csv.reader(lineas, dialect))
+
+    def before_import_row(self, row, **kwargs):
         medidor_id = row.get('medidor') if isinstance(row, dict) else (row[2] if len(row) > 2 else None)
-        if not Medidor.objects.filter(pk=medidor_id).exists():
+        if medidor_id not in self._medidores:
             raise ValueError(f"Medidor con ID {medidor_id} no encontrado")
-        
+
         consumo = row.get('consumo') if isinstance(row, dict) else (row[1] if len(row) > 1 else None)
         try:
             row['consumo'] = float(str(consumo).replace(';', '.'))
         except ValueError:
             raise ValueError(f"Consumo inválido: {consumo}")
-        
-    def save_instance(self, instance, *args, **kwargs):
-        try:
-            result = super().save_instance(instance, *args, **kwargs)
-            medidor_id = instance.medidor.id if instance.medidor else None
-            print(f"Instancia guardada: ID {instance.id}, Fecha {instance.fecha}, Medidor {medidor_id}")
-            return result
-
-        except Exception as e:
-            print(f"Error al guardar: {e} - Fecha {instance.fecha}, Medidor {instance.medidor.id if instance.medidor else 'N/A'}")
-            raise
 
+    def import_instance(self, instance, row, **kwargs):
+        super().import_instance(instance, row, **kwargs)
+        # El resultado de cada fila usa str(instance), que lee medidor.nombre.
+        instance.medidor = self._medidores.get(instance.medidor_id)
 
     def after_import(self, dataset, result, using_transactions=True, dry_run=False, **kwargs):
-        if not dry_run:
-            pass
+        if not dry_run and (result.totals.get('new') or result.totals.get('update')):
+            from .anomalias import detectar
+            from .cache_consultas import invalidar
+            from .calidad import revisar
+            from .demanda import calcular
+            from .diferencias import actualizar_diferencias
+            from .resumenes import refrescar
+            fechas = [self.fields['fecha'].clean(row) for row in dataset.dict]
+            medidores = {row['medidor'] for row in dataset.dict}
+            # Como en tareas.procesar_importacion: se invalida antes de los refrescos y otra vez al
+            # terminar, aunque fallen. Aquí además todo va en la transacción del import.
+            with etapa('cache'):
+                invalidar(medidores)
+            try:
+                for nombre, funcion in [
+                    ('resumenes', refrescar), ('diferencias', actualizar_diferencias), ('calidad', revisar),
+                    ('anomalias', detectar), ('demanda', calcular),
+                ]:
+                    with etapa(nombre):
+                        funcion(medidores, min(fechas), max(fechas))
+            finally:
+                with etapa('cache'):
+                    invalidar(medidores)
 
         if kwargs.get('request'):
             from django.contrib import messages
@@ -162,42 +258,329 @@ class FixedImportExportAdmin(ImportExportModelAdmin):
                 action_flag=ADDITION if new else CHANGE,
                 change_message="Import completed via admin"
             )
+
+
+class ChangeListKeyset(ChangeList):
+    """
+    Paginación por cursor sobre (fecha, id), de lo más reciente a lo más antiguo.
+
+    En lugar de ?p=N (OFFSET, que lee y descarta todas las filas anteriores) cada página
+    se pide con ?despues=<fecha>_<id> o ?antes=<fecha>_<id> de la última/primera fila
+    mostrada, y la consulta arranca desde ahí por el índice de fecha.
+    """
+    CURSORES = ('despues', 'antes')
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor_despues = self._leer_cursor(request, 'despues')
+        self.cursor_antes = self._leer_cursor(request, 'antes')
+        super().__init__(request, *args, **kwargs)
+        # Filtros, búsqueda y orden vuelven a la primera página.
+        for nombre in self.CURSORES:
+            self.params.pop(nombre, None)
+            self.filter_params.pop(nombre, None)
+
+    @staticmethod
+    def _leer_cursor(request, nombre):
+        valor = request.GET.get(nombre)
+        if not valor:
+            return None
+        try:
+            fecha, pk = valor.rsplit('_', 1)
+            return datetime.fromisoformat(fecha), int(pk)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _cursor(obj):
+        return f"{obj.fecha.isoformat()}_{obj.pk}"
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        for nombre in self.CURSORES:
+            lookup_params.pop(nombre, None)
+        return lookup_params
+
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        por_pagina = self.list_per_page
+        # fecha__lte/gte redundante con el OR: deja una condición de índice (y de poda de particiones).
+        if self.cursor_antes:
+            fecha, pk = self.cursor_antes
+            filas = list(
+                self.queryset.filter(Q(fecha__gte=fecha) & (Q(fecha__gt=fecha) | Q(pk__gt=pk)))
+                .order_by('fecha', 'pk')[:por_pagina + 1]
+            )
+            hay_recientes = len(filas) > por_pagina
+            filas = filas[:por_pagina][::-1]
+            hay_antiguos = True
+        else:
+            qs = self.queryset
+            if self.cursor_despues:
+                fecha, pk = self.cursor_despues
+                qs = qs.filter(Q(fecha__lte=fecha) & (Q(fecha__lt=fecha) | Q(pk__lt=pk)))
+            filas = list(qs.order_by('-fecha', '-pk')[:por_pagina + 1])
+            hay_antiguos = len(filas) > por_pagina
+            filas = filas[:por_pagina]
+            hay_recientes = self.cursor_despues is not None
+
+        sin_cursor = list(self.CURSORES)
+        self.url_inicio = self.get_query_string(remove=sin_cursor) if hay_recientes else None
+        self.url_recientes = (
+            self.get_query_string({'antes': self._cursor(filas[0])}, remove=sin_cursor)
+            if hay_recientes and filas else None
+        )
+        self.url_antiguos = (
+            self.get_query_string({'despues': self._cursor(filas[-1])}, remove=sin_cursor)
+            if hay_antiguos else None
+        )
+
+        self.result_count = paginator.count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = filas
+        self.can_show_all = False
+        self.multi_page = hay_recientes or hay_antiguos
+        self.paginator = paginator
+
+
+class FiltroMedidor(admin.SimpleListFilter):
+    """Filtro por medidor con autocompletado (búsqueda de MedidorAdmin) en lugar de listar todos."""
+    title = 'medidor'
+    parameter_name = 'medidor'
+    template = 'admin/core/consumo/filtro_medidor.html'
+
+    class Formulario(forms.Form):
+        medidor = forms.ModelChoiceField(Medidor.objects.all(), required=False)
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        self.formulario = self.Formulario(initial={'medidor': self.value()})
+        campo = self.formulario.fields['medidor']
+        campo.widget = AutocompleteSelect(
+            model._meta.get_field('medidor'), model_admin.admin_site, attrs={'onchange': 'this.form.submit()'},
+        )
+        campo.widget.choices = campo.choices
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        try:
+            return queryset.filter(medidor_id=int(self.value()))
+        except ValueError as e:
+            raise IncorrectLookupParameters(e) from e
+
+    def choices(self, changelist):
+        # El formulario conserva el resto de los parámetros como campos ocultos.
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            'display': 'Todos',
+            'ocultos': [(k, v) for k, v in changelist.params.items() if k != self.parameter_name],
+        }
+
+
+class FiltroMes(admin.SimpleListFilter):
+    """
+    Reemplaza a date_hierarchy, que calcula sus años/meses con un DISTINCT sobre todo Consumo:
+    los meses salen de ConsumoMes y el filtro es un rango de fecha (usa el índice y poda particiones).
+    Los meses archivados en Parquet ya no están en la tabla: se avisa y se remite a la exportación.
+    """
+    title = 'mes'
+    parameter_name = 'mes'
+
+    def lookups(self, request, model_admin):
+        inicios = ConsumoMes.objects.order_by('-inicio').values_list('inicio', flat=True).distinct()
+        return [(f"{timezone.localtime(inicio):%Y-%m}",) * 2 for inicio in inicios]
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        from .resumenes import siguiente_intervalo
+        try:
+            inicio = timezone.make_aware(datetime.strptime(self.value(), '%Y-%m'))
+        except ValueError as e:
+            raise IncorrectLookupParameters(e) from e
+        fin = siguiente_intervalo(inicio, 'mes')
+        if archivo.meses_archivados(inicio, fin):
+            from django.contrib import messages
+            messages.warning(
+                request, f"El mes {self.value()} está archivado en Parquet: la lista muestra solo las lecturas "
+                         f"que quedan en la tabla. La exportación lo incluye completo.",
+            )
+        return queryset.filter(fecha__gte=inicio, fecha__lt=fin)
+
+
+class CSVPuntoYComa(base_formats.CSV):
+    """CSV con ';' como separador; el BOM lo agrega to_encoding. No modifica base_formats.CSV."""
+
+    def export_data(self, dataset, **kwargs):
+        return super().export_data(dataset, delimiter=';', **kwargs)
+
+
+class FormularioExportacion(forms.Form):
+    """Filtros de la exportación por streaming; por GET, así la URL sirve para scripts."""
+    desde = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+    hasta = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}), help_text='Inclusive.')
+    medidores = forms.ModelMultipleChoiceField(Medidor.objects.all(), required=False, help_text='Vacío: todos.')
+    tipos_medidor = forms.ModelMultipleChoiceField(
+        TipoMedidor.objects.all(), required=False, label='Tipos de medidor', help_text='Vacío: todos.',
+    )
+    formato = forms.ChoiceField(choices=[
+        (formato, formato.upper()) for formato in exportacion.FORMATOS
+        if formato != 'parquet' or exportacion.PARQUET_DISPONIBLE
+    ])
+
+    def __init__(self, *args, admin_site, **kwargs):
+        super().__init__(*args, **kwargs)
+        campo = self.fields['medidores']
+        campo.widget = AutocompleteSelectMultiple(Consumo._meta.get_field('medidor'), admin_site)
+        campo.widget.choices = campo.choices
+
+    def clean(self):
+        datos = super().clean()
+        if datos.get('desde') and datos.get('hasta') and datos['hasta'] < datos['desde']:
+            raise forms.ValidationError("La fecha 'hasta' es anterior a 'desde'.")
+        return datos
+
+    def rango(self):
+        """[desde, hasta) como datetimes aware: desde las 0:00 de `desde` hasta el fin del día `hasta`."""
+        desde = timezone.make_aware(datetime.combine(self.cleaned_data['desde'], time.min))
+        hasta = timezone.make_aware(datetime.combine(self.cleaned_data['hasta'] + timedelta(days=1), time.min))
+        return desde, hasta
+
+
 @admin.register(Consumo)
 class ConsumoAdmin(FixedImportExportAdmin):
     resource_class = ConsumoResource
     list_display = ['id','fecha', 'consumo', 'medidor']
-    list_filter = ['fecha', 'medidor']
+    list_filter = [FiltroMedidor, FiltroMes, 'fecha']
+    # Explícito: el select_related() automático del admin no sigue FKs nulables.
+    list_select_related = ['medidor']
     raw_id_fields = ['medidor']
-    date_hierarchy = 'fecha'
     #paginas por defecto
     list_per_page = 10
-    search_fields = ['id','medidor__nombre', 'consumo']
+    # Listado para tablas de decenas de millones de filas: conteo estimado, paginación por
+    # cursor (sin OFFSET), sin date_hierarchy ni orden por columnas, y búsqueda solo por índices.
+    paginator = PaginadorEstimado
+    show_full_result_count = False
+    ordering = ['-fecha', '-id']
+    sortable_by = ()
+    search_fields = ['medidor__nombre']
+    search_help_text = 'ID exacto del consumo o nombre exacto del medidor.'
+
+    def get_changelist(self, request, **kwargs):
+        return ChangeListKeyset
+
+    def get_search_results(self, request, queryset, search_term):
+        termino = search_term.strip()
+        if not termino:
+            return queryset, False
+        filtro = Q()
+        medidores = list(Medidor.objects.filter(nombre=termino).values_list('id', flat=True))
+        if medidores:
+            filtro |= Q(medidor_id__in=medidores)
+        if termino.isdigit():
+            filtro |= Q(pk=int(termino))
+        if not filtro:
+            return queryset.none(), False
+        return queryset.filter(filtro), False
+
+    @property
+    def media(self):
+        # JS/CSS del autocompletado de FiltroMedidor.
+        return super().media + AutocompleteSelect(Consumo._meta.get_field('medidor'), self.admin_site).media
+
+    # Solo lo usa la acción "exportar seleccionados"; la exportación completa va por exportar_view.
+    to_encoding = 'utf-8-sig'
+
     def get_import_formats(self):
-        from import_export.formats import base_formats
         return [base_formats.CSV]
 
     def get_export_formats(self):
-        from import_export.formats import base_formats
-        base_formats.CSV.DELIMITER = ';'
-        base_formats.CSV.ENCODING = 'utf-8-sig'
-        return [base_formats.CSV]
+        return [CSVPuntoYComa]
 
     def get_import_format_class(self, format):
-        from import_export.formats import base_formats
         if format == 'csv':
-            base_formats.CSV.DELIMITER = ';'
-            base_formats.CSV.ENCODING = 'utf-8-sig'
             return base_formats.CSV
         return None
 
+    def export_action(self, request):
+        # El botón Exportar lleva a la exportación por streaming; django-import-export arma todo
+        # el archivo en memoria y solo se conserva para lo que llega de la acción sobre filas elegidas.
+        if request.method == 'POST' and 'export_items' in request.POST:
+            return super().export_action(request)
+        return self.exportar_view(request)
+
+    def exportar_view(self, request):
+        from django.http import StreamingHttpResponse
+        from django.template.response import TemplateResponse
+        if not self.has_export_permission(request):
+            raise PermissionDenied
+        form = FormularioExportacion(request.GET or None, admin_site=self.admin_site)
+        if form.is_valid():
+            desde, hasta = form.rango()
+            formato = form.cleaned_data['formato']
+            lecturas = exportacion.Lecturas(
+                desde, hasta, form.cleaned_data['medidores'], form.cleaned_data['tipos_medidor'],
+            )
+            logger.info(f"Exportación {formato} de Consumo [{desde}, {hasta}) para {request.user}.")
+            respuesta = StreamingHttpResponse(
+                exportacion.generar(lecturas, formato), content_type=exportacion.FORMATOS[formato],
+            )
+            nombre = f"consumo_{form.cleaned_data['desde']:%Y%m%d}_{form.cleaned_data['hasta']:%Y%m%d}.{formato}"
+            respuesta['Content-Disposition'] = f'attachment; filename="{nombre}"'
+            return respuesta
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Exportar consumos',
+            'form': form,
+            'media': self.media + form.media,
+        }
+        return TemplateResponse(request, 'admin/core/consumo/exportar.html', context)
+
     def get_urls(self):
         from django.urls import path
         urls = super().get_urls()
         custom_urls = [
             path('import-excel/', self.admin_site.admin_view(views.import_excel), name='import_consumo'),
+            path('importaciones/<int:pk>/', self.admin_site.admin_view(self.importacion_view), name='core_consumo_importacion'),
+            path('importaciones/<int:pk>/estado/', self.admin_site.admin_view(views.importacion_estado), name='core_consumo_importacion_estado'),
+            path('importaciones/<int:pk>/rechazos/', self.admin_site.admin_view(self.importacion_rechazos_view), name='core_consumo_importacion_rechazos'),
+            path('exportar/', self.admin_site.admin_view(self.exportar_view), name='core_consumo_exportar'),
         ]
         return custom_urls + urls
 
+    def importacion_view(self, request, pk):
+        from django.shortcuts import get_object_or_404
+        from django.template.response import TemplateResponse
+        importacion = get_object_or_404(ImportacionConsumo, pk=pk)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f'Importación #{importacion.pk}',
+            'importacion': importacion,
+        }
+        return TemplateResponse(request, 'admin/core/consumo/importacion_progreso.html', context)
+
+    def importacion_rechazos_view(self, request, pk):
+        from django.http import FileResponse, Http404
+        from django.shortcuts import get_object_or_404
+        importacion = get_object_or_404(ImportacionConsumo, pk=pk)
+        if not importacion.rechazos:
+            raise Http404("La importación no tiene filas rechazadas.")
+        return FileResponse(
+            importacion.rechazos.open('rb'), as_attachment=True,
+            filename=f'rechazos_importacion_{importacion.pk}.csv', content_type='text/csv',
+        )
+
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
         extra_context['import_url'] = 'admin:import_consumo'
@@ -250,12 +633,295 @@ class MedidorAdmin(admin.ModelAdmin):
 # Registrar los modelos fuera de la clase ConsumoAdmin
 admin.site.register(InterfaceConsumo)
 
+@admin.register(ImportacionConsumo)
+class ImportacionConsumoAdmin(admin.ModelAdmin):
+    list_display = ['id', 'nombre_original', 'estado', 'filas_leidas', 'filas_staging', 'filas_fusionadas', 'filas_rechazadas', 'creado', 'progreso', 'descargar_rechazos']
+    list_filter = ['estado']
+    search_fields = ['nombre_original']
+    list_per_page = 10
+    readonly_fields = [f.name for f in ImportacionConsumo._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def progreso(self, obj):
+        from django.urls import reverse
+        from django.utils.html import format_html
+        return format_html('<a href="{}">Ver progreso</a>', reverse('admin:core_consumo_importacion', args=[obj.pk]))
+
+    def descargar_rechazos(self, obj):
+        from django.urls import reverse
+        from django.utils.html import format_html
+        if not obj.rechazos:
+            return '-'
+        return format_html('<a href="{}">CSV</a>', reverse('admin:core_consumo_importacion_rechazos', args=[obj.pk]))
+    descargar_rechazos.short_description = 'Rechazos'
+
+
+
+class EtapaImportacionInline(admin.TabularInline):
+    model = EtapaImportacion
+    fields = ['etapa', 'segundos', 'porcentaje', 'filas', 'filas_por_segundo', 'consultas', 'memoria']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def porcentaje(self, obj):
+        return f"{100 * obj.segundos / obj.medicion.segundos:.0f} %" if obj.medicion.segundos else '-'
+    porcentaje.short_description = '% del total'
+
+    def filas_por_segundo(self, obj):
+        return f"{obj.filas_por_segundo:,.0f}" if obj.filas else '-'
+    filas_por_segundo.short_description = 'Filas/s'
+
+    def memoria(self, obj):
+        return f"{obj.memoria_pico / 2 ** 20:.1f} MiB" if obj.memoria_pico else '-'
+    memoria.short_description = 'Pico de memoria'
+
+
+@admin.register(MedicionImportacion)
+class MedicionImportacionAdmin(admin.ModelAdmin):
+    """Historial de tiempos por importación; el filtro por versión compara antes y después de un despliegue."""
+    list_display = ['creado', 'origen', 'nombre', 'version', 'exito', 'filas', 'duracion', 'filas_por_segundo',
+                    'consultas', 'memoria', 'etapa_mas_lenta']
+    list_filter = ['origen', 'exito', 'version']
+    search_fields = ['nombre']
+    date_hierarchy = 'creado'
+    list_per_page = 20
+    readonly_fields = [f.name for f in MedicionImportacion._meta.fields]
+    inlines = [EtapaImportacionInline]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('etapas')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def duracion(self, obj):
+        return f"{obj.segundos:.2f} s"
+    duracion.short_description = 'Duración'
+    duracion.admin_order_field = 'segundos'
+
+    def filas_por_segundo(self, obj):
+        return f"{obj.filas_por_segundo:,.0f}"
+    filas_por_segundo.short_description = 'Filas/s'
+
+    def memoria(self, obj):
+        return f"{obj.memoria_pico / 2 ** 20:.1f} MiB" if obj.memoria_pico else '-'
+    memoria.short_description = 'Pico de memoria'
+    memoria.admin_order_field = 'memoria_pico'
+
+    def etapa_mas_lenta(self, obj):
+        etapa_lenta = max(obj.etapas.all(), key=lambda e: e.segundos, default=None)
+        return f"{etapa_lenta.etapa} ({etapa_lenta.segundos:.2f} s)" if etapa_lenta else '-'
+    etapa_mas_lenta.short_description = 'Etapa más lenta'
+
+
 admin.site.register(PuntoMedicion)
 admin.site.register(Equipo)
 admin.site.register(CaracteristicaMedicion)
 admin.site.register(CategoriaPuntoMedicion)
-admin.site.register(DocumentoMedicion)
-admin.site.register(RangoMedicion)
+
+
+@admin.register(DocumentoMedicion)
+class DocumentoMedicionAdmin(admin.ModelAdmin):
+    list_display = ['punto_medicion', 'fecha_hora_lectura', 'valor_con_rango', 'lectura_contador']
+    list_select_related = ['punto_medicion']
+    date_hierarchy = 'fecha_hora_lectura'
+
+    def get_changelist_instance(self, request):
+        # Clasifica la página entera de una vez con el índice de rangos, no una búsqueda por fila.
+        cl = super().get_changelist_instance(request)
+        documentos = list(cl.result_list)
+        ids = rangos.clasificar(
+            [d.punto_medicion.caracteristica_id for d in documentos], [d.valor_leido for d in documentos]
+        )
+        for documento, rango_id in zip(documentos, ids):
+            documento.rango_id = int(rango_id) or None
+        cl.result_list = documentos
+        return cl
+
+    def valor_con_rango(self, obj):
+        from django.utils.html import format_html
+        rango_id = getattr(obj, 'rango_id', None)
+        if rango_id is None:
+            return obj.valor_leido
+        indice = rangos.indice(obj.punto_medicion.caracteristica_id)
+        posicion = int((indice.ids == rango_id).argmax())
+        return format_html(
+            '<span style="color: {}" title="{}">{}</span>',
+            indice.colores[posicion], indice.descripciones[posicion], obj.valor_leido,
+        )
+    valor_con_rango.short_description = 'Valor leído'
+    valor_con_rango.admin_order_field = 'valor_leido'
+
+    def delete_queryset(self, request, queryset):
+        # El borrado masivo no dispara el recálculo por lectura: se recalcula una vez el rango borrado.
+        rango = queryset.aggregate(desde=Min('fecha_hora_lectura'), hasta=Max('fecha_hora_lectura'))
+        puntos = list(queryset.values_list('punto_medicion', flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        if puntos:
+            contadores.recalcular(puntos, rango['desde'], rango['hasta'])
+
+
+@admin.register(ConsumoContador)
+class ConsumoContadorAdmin(admin.ModelAdmin):
+    list_display = ['punto_medicion', 'fecha', 'delta', 'tipo']
+    list_filter = ['tipo']
+    list_select_related = ['punto_medicion']
+    date_hierarchy = 'fecha'
+    ordering = ['-fecha']
+    readonly_fields = [f.name for f in ConsumoContador._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(RangoMedicion)
+class RangoMedicionAdmin(admin.ModelAdmin):
+    list_display = ['caracteristica', 'descripcion', 'valor_min', 'valor_max', 'color']
+    list_filter = ['caracteristica']
+
+    def changelist_view(self, request, extra_context=None):
+        # Avisa de solapamientos, huecos y rangos invertidos detectados al armar cada índice.
+        from django.contrib import messages
+        for caracteristica in CaracteristicaMedicion.objects.filter(rangos__isnull=False).distinct():
+            for problema in rangos.indice(caracteristica.pk).problemas:
+                messages.warning(
+                    request, f"{caracteristica}: {problema.tipo} entre {problema.desde} y {problema.hasta} "
+                             f"(rangos {', '.join(map(str, problema.rangos))}).",
+                )
+        return super().changelist_view(request, extra_context)
+
+
+@admin.register(PerfilMedidor)
+class PerfilMedidorAdmin(admin.ModelAdmin):
+    list_display = ['medidor', 'intervalo', 'fase', 'acumulativo', 'muestras', 'actualizado']
+    list_filter = ['acumulativo', 'intervalo']
+    search_fields = ['medidor__nombre']
+    list_select_related = ['medidor']
+    raw_id_fields = ['medidor']
+
+
+@admin.register(IncidenciaSerie)
+class IncidenciaSerieAdmin(admin.ModelAdmin):
+    list_display = ['medidor', 'tipo', 'fecha', 'fecha_anterior', 'faltantes', 'diferencia', 'detectado']
+    list_filter = ['tipo']
+    search_fields = ['medidor__nombre']
+    list_select_related = ['medidor']
+    ordering = ['-fecha']
+    readonly_fields = [f.name for f in IncidenciaSerie._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(AlertaConsumo)
+class AlertaConsumoAdmin(admin.ModelAdmin):
+    list_display = ['medidor', 'tipo', 'severidad', 'desde', 'hasta', 'lecturas', 'valor', 'esperado', 'puntaje', 'detectada']
+    list_filter = ['tipo', 'severidad']
+    search_fields = ['medidor__nombre']
+    list_select_related = ['medidor']
+    ordering = ['-hasta']
+    readonly_fields = [f.name for f in AlertaConsumo._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchivoConsumo)
+class ArchivoConsumoAdmin(admin.ModelAdmin):
+    list_display = ['mes', 'filas', 'medidores', 'suma', 'bytes', 'bytes_por_lectura', 'retiro', 'archivado']
+    list_filter = ['retiro']
+    ordering = ['-mes']
+    readonly_fields = [f.name for f in ArchivoConsumo._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        # Sin el registro, leer() dejaría de ver el mes: se borra a mano junto con el archivo.
+        return False
+
+    def bytes_por_lectura(self, obj):
+        return f"{obj.bytes / obj.filas:.1f}" if obj.filas else '-'
+    bytes_por_lectura.short_description = 'Bytes por lectura'
+
+
+class DemandaMesAdmin(admin.ModelAdmin):
+    """Solo muestra lo que guarda core.demanda: ni la lista ni el detalle agregan lecturas."""
+    date_hierarchy = 'mes'
+    ordering = ['-mes']
+
+    def get_readonly_fields(self, request, obj=None):
+        return [f.name for f in self.model._meta.fields] + ['bandas', 'grafico_perfil']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def bandas(self, obj):
+        return ', '.join(f"{banda}: {energia:.1f}" for banda, energia in sorted(obj.energia_bandas.items()))
+    bandas.short_description = 'Energía por banda'
+
+    def grafico_perfil(self, obj):
+        # Banda p10-p90 y mediana por intervalo del día; los intervalos sin lecturas se saltean.
+        from django.utils.html import format_html
+        ancho, alto = 480, 120
+        escala = max([v for v in obj.perfil.get('maximo', []) if v is not None] or [0]) or 1
+        n = max(len(obj.perfil.get('p50', [])) - 1, 1)
+
+        def puntos(serie, indices):
+            return ' '.join(
+                f"{i * ancho / n:.1f},{alto - serie[i] / escala * alto:.1f}" for i in indices if serie[i] is not None
+            )
+        p10, p50, p90 = (obj.perfil.get(k, []) for k in ('p10', 'p50', 'p90'))
+        return format_html(
+            '<svg width="{}" height="{}" style="background: #f8f8f8">'
+            '<polygon points="{} {}" fill="#79aec8" fill-opacity="0.4"/>'
+            '<polyline points="{}" fill="none" stroke="#417690" stroke-width="2"/></svg>',
+            ancho, alto, puntos(p90, range(len(p90))), puntos(p10, reversed(range(len(p10)))), puntos(p50, range(len(p50))),
+        )
+    grafico_perfil.short_description = 'Perfil diario (p10-p90 y mediana)'
+
+
+@admin.register(DemandaMedidor)
+class DemandaMedidorAdmin(DemandaMesAdmin):
+    list_display = ['medidor', 'mes', 'energia', 'demanda_maxima', 'fecha_demanda_maxima', 'factor_carga', 'bandas', 'dias']
+    list_filter = ['medidor__tipo_medidor']
+    search_fields = ['medidor__nombre']
+    list_select_related = ['medidor']
+
+
+@admin.register(DemandaTipoMedidor)
+class DemandaTipoMedidorAdmin(DemandaMesAdmin):
+    list_display = [
+        'tipo_medidor', 'mes', 'medidores', 'energia', 'demanda_maxima', 'fecha_demanda_maxima', 'factor_carga',
+        'factor_coincidencia', 'bandas',
+    ]
+    list_filter = ['tipo_medidor']
+    list_select_related = ['tipo_medidor']
+
 
 @admin.register(VistaConsumoDiferencia)
 class VistaConsumoDiferenciaAdmin(admin.ModelAdmin):
@@ -0,0 +1,274 @@
+"""
+Detección de anomalías en las series de Consumo: picos, caídas y mesetas.
+
+Cada lectura se compara con dos referencias robustas (mediana y MAD, escaladas a una
+desviación estándar):
+
+- la ventana móvil de VENTANA de lecturas anteriores del mismo medidor;
+- la línea base por hora de la semana (LineaBaseMedidor): mediana y MAD, por hora local de la
+  semana, del consumo medio por lectura de las últimas SEMANAS_BASE semanas de ConsumoHora.
+
+Un pico es una lectura muy por encima de la línea base (Z_PICO; lo que sube todos los lunes a
+las 9 no es un pico) y también de la ventana (Z_LOCAL; un nivel que se sostiene desde hace
+horas tampoco). Sin línea base, Z_PICO se aplica a la ventana. Una caída son MIN_LECTURAS_CAIDA o más lecturas seguidas muy por
+debajo de la línea base (Z_CAIDA), o de la ventana si el medidor no tiene línea base. Una meseta
+es una racha de lecturas idénticas que dura DURACION_MESETA o más; sus lecturas no se evalúan
+como picos ni caídas. La escala de cada referencia es como mínimo ESCALA_MINIMA de la mediana,
+para que una serie muy regular no marque cualquier variación. En los medidores acumulativos
+(PerfilMedidor de core.calidad) se evalúan los deltas entre lecturas y no hay línea base.
+
+Todo es vectorizado sobre un lote de medidores: ventanas móviles de pandas agrupadas por
+medidor, y la línea base como matriz medidor x hora de la semana indexada en bloque. Las alertas
+(AlertaConsumo) agrupan las lecturas consecutivas marcadas de un medidor, con severidad según
+el puntaje o la duración.
+
+Tras una importación solo se puntúa el rango importado, con CONTEXTO de lecturas a cada lado
+para las ventanas y las rachas; se reemplazan las alertas que tocan el rango. Las líneas base
+se guardan y solo se recalculan cuando quedan a más de RECALCULO_BASE del rango puntuado.
+"""
+import logging
+from collections import Counter
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AlertaConsumo, Consumo, ConsumoHora, LineaBaseMedidor, Medidor, PerfilMedidor
+from .staging import rango_staging
+
+logger = logging.getLogger(__name__)
+
+MEDIDORES_POR_LOTE = 500
+VENTANA = timedelta(days=1)
+# Lecturas en la ventana necesarias para puntuar una lectura contra ella.
+MIN_VENTANA = 8
+SEMANAS_BASE = 8
+# Semanas con datos necesarias para tener línea base en una hora de la semana.
+MIN_SEMANAS = 3
+RECALCULO_BASE = timedelta(days=7)
+HORAS_SEMANA = 7 * 24
+Z_PICO = 6.0
+Z_LOCAL = 3.0
+Z_CAIDA = 4.0
+MIN_LECTURAS_CAIDA = 3
+DURACION_MESETA = timedelta(hours=6)
+# Escala mínima de una referencia, como fracción de su mediana.
+ESCALA_MINIMA = 0.1
+MAD_A_SIGMA = 1.4826
+# Severidad media y alta de picos y caídas, en múltiplos de su umbral. Con ESCALA_MINIMA una
+# caída a cero llega a lo sumo a 1 / ESCALA_MINIMA = 10, que es alta para Z_CAIDA.
+SEVERIDAD_MEDIA = 1.5
+SEVERIDAD_ALTA = 2.5
+CONTEXTO = max(VENTANA, DURACION_MESETA)
+
+
+def detectar_importacion(importacion_id):
+    """Puntúa el rango del lote de staging de una importación (antes de borrarlo)."""
+    rango = rango_staging(importacion_id)
+    if rango is None:
+        return Counter()
+    return detectar(*rango)
+
+
+def detectar(medidor_ids=None, desde=None, hasta=None, recalcular_base=False):
+    """
+    Recalcula las alertas de `medidor_ids` (por defecto, todos los medidores). Con `desde` y
+    `hasta` solo las que tocan ese rango; sin rango, las de toda la serie. Con `recalcular_base`
+    rehace las líneas base aunque estén al día. Devuelve un Counter de alertas por tipo.
+    """
+    if medidor_ids is None:
+        medidor_ids = Medidor.objects.values_list('id', flat=True)
+    medidor_ids = sorted(set(medidor_ids))
+    total = Counter()
+    for i in range(0, len(medidor_ids), MEDIDORES_POR_LOTE):
+        total.update(_detectar_lote(medidor_ids[i:i + MEDIDORES_POR_LOTE], desde, hasta, recalcular_base))
+    logger.info(
+        f"Anomalías: {len(medidor_ids)} medidores, {desde or 'inicio'} - {hasta or 'fin'}, "
+        f"alertas: {dict(total) or 'ninguna'}."
+    )
+    return total
+
+
+def _detectar_lote(medidor_ids, desde, hasta, recalcular_base):
+    qs = Consumo.objects.filter(medidor_id__in=medidor_ids, consumo__isnull=False)
+    alertas = AlertaConsumo.objects.filter(medidor_id__in=medidor_ids)
+    if desde is not None:
+        qs = qs.filter(fecha__gte=desde - CONTEXTO, fecha__lte=hasta + CONTEXTO)
+        alertas = alertas.filter(hasta__gte=desde, desde__lte=hasta)
+    df = pd.DataFrame.from_records(
+        list(qs.order_by('medidor_id', 'fecha').values_list('medidor_id', 'fecha', 'consumo')),
+        columns=['medidor', 'fecha', 'consumo'],
+    )
+    df['fecha'] = pd.to_datetime(df['fecha'], utc=True)
+    df['consumo'] = df['consumo'].astype('float64')
+    primera = df['medidor'].ne(df['medidor'].shift())
+    acumulativos = PerfilMedidor.objects.filter(medidor_id__in=medidor_ids, acumulativo=True).values_list('medidor_id', flat=True)
+    acumulativo = df['medidor'].isin(list(acumulativos))
+    # En los acumulativos se evalúa el delta; uno negativo es un reinicio (core.calidad) y se descarta.
+    deltas = df['consumo'].diff().mask(primera)
+    df['valor'] = df['consumo'].where(~acumulativo, deltas.where(deltas >= 0))
+
+    referencia = desde if desde is not None else (df['fecha'].max().to_pydatetime() if len(df) else timezone.now())
+    ids = np.array(medidor_ids, dtype=np.int64)
+    medianas, mads, nuevas = _lineas_base(ids, set(acumulativos), referencia, recalcular_base)
+    filas = _alertas(df, primera, ids, medianas, mads) if len(df) else []
+    if desde is not None:
+        filas = [f for f in filas if f.hasta >= desde and f.desde <= hasta]
+        _extender(filas, alertas, df)
+
+    with transaction.atomic():
+        if nuevas:
+            LineaBaseMedidor.objects.bulk_create(
+                nuevas, update_conflicts=True, unique_fields=['medidor'], update_fields=['mediana', 'mad', 'hasta', 'actualizado'],
+            )
+        alertas.delete()
+        AlertaConsumo.objects.bulk_create(filas, batch_size=1000)
+    return Counter(fila.tipo for fila in filas)
+
+
+def _hora_semana(fechas):
+    locales = fechas.dt.tz_convert(timezone.get_current_timezone())
+    return (locales.dt.dayofweek * 24 + locales.dt.hour).to_numpy()
+
+
+def _lineas_base(ids, acumulativos, referencia, recalcular):
+    """
+    Matrices (len(ids) x HORAS_SEMANA) de mediana y MAD de la línea base de cada medidor, NaN donde
+    no hay, y las LineaBaseMedidor (sin guardar) que hubo que recalcular.
+    """
+    guardadas = {b.medidor_id: b for b in LineaBaseMedidor.objects.filter(medidor_id__in=ids.tolist())}
+    pendientes = [
+        int(m) for m in ids
+        if m not in acumulativos and (recalcular or m not in guardadas or abs(guardadas[m].hasta - referencia) > RECALCULO_BASE)
+    ]
+    nuevas = []
+    if pendientes:
+        horas = pd.DataFrame.from_records(
+            list(ConsumoHora.objects.filter(
+                medidor_id__in=pendientes, inicio__gte=referencia - timedelta(weeks=SEMANAS_BASE), inicio__lt=referencia,
+                lecturas__gt=0, suma__isnull=False,
+            ).values_list('medidor_id', 'inicio', 'suma', 'lecturas')),
+            columns=['medidor', 'inicio', 'suma', 'lecturas'],
+        )
+        horas['hora'] = _hora_semana(pd.to_datetime(horas['inicio'], utc=True))
+        horas['media'] = horas['suma'] / horas['lecturas']
+        grupos = horas.groupby(['medidor', 'hora'])['media']
+        horas['desvio'] = (horas['media'] - grupos.transform('median')).abs()
+        resumen = pd.DataFrame({
+            'mediana': grupos.median(), 'mad': horas.groupby(['medidor', 'hora'])['desvio'].median(), 'semanas': grupos.size(),
+        })
+        resumen = resumen[resumen['semanas'] >= MIN_SEMANAS]
+        for medidor in pendientes:
+            if medidor in resumen.index.get_level_values(0):
+                base = resumen.xs(medidor, level='medidor')
+            else:
+                # Medidor sin línea base: con el MultiIndex de resumen no se podría reindexar por hora.
+                base = resumen.droplevel('medidor').iloc[:0]
+            base = base.reindex(range(HORAS_SEMANA))
+            linea = LineaBaseMedidor(
+                medidor_id=medidor, hasta=referencia,
+                mediana=[None if pd.isna(v) else float(v) for v in base['mediana']],
+                mad=[None if pd.isna(v) else float(v) for v in base['mad']],
+            )
+            guardadas[medidor] = linea
+            nuevas.append(linea)
+
+    medianas = np.full((len(ids), HORAS_SEMANA), np.nan)
+    mads = np.full((len(ids), HORAS_SEMANA), np.nan)
+    for fila, medidor in enumerate(ids):
+        linea = guardadas.get(int(medidor))
+        if linea is not None and medidor not in acumulativos and linea.mediana:
+            medianas[fila] = np.array(linea.mediana, dtype=np.float64)
+            mads[fila] = np.array(linea.mad, dtype=np.float64)
+    return medianas, mads, nuevas
+
+
+def _puntaje(valor, mediana, mad):
+    escala = np.fmax(np.fmax(MAD_A_SIGMA * mad, ESCALA_MINIMA * np.abs(mediana)), 1e-9)
+    return (valor - mediana) / escala
+
+
+def _alertas(df, primera, ids, medianas, mads):
+    """AlertaConsumo (sin guardar) de las lecturas de `df` (ordenado por medidor y fecha)."""
+    valor = df['valor']
+    # Ventana de las lecturas anteriores (closed='left'): la lectura evaluada no entra en su referencia.
+    # El resultado viene indexado por (medidor, fecha), en el mismo orden que df.
+    def movil(columna):
+        ventana = df.groupby('medidor', sort=False).rolling(VENTANA, on='fecha', closed='left', min_periods=MIN_VENTANA)
+        return pd.Series(ventana[columna].median().to_numpy(), index=df.index)
+    mediana = movil('valor')
+    df['desvio'] = (valor - mediana).abs()
+    z_ventana = _puntaje(valor, mediana, movil('desvio'))
+
+    fila = np.searchsorted(ids, df['medidor'].to_numpy())
+    hora = _hora_semana(df['fecha'])
+    esperado = pd.Series(medianas[fila, hora], index=df.index)
+    z_semana = pd.Series(_puntaje(valor.to_numpy(), esperado.to_numpy(), mads[fila, hora]), index=df.index)
+
+    # Mesetas: rachas de valores idénticos de un medidor.
+    racha = (primera | valor.ne(valor.shift())).cumsum()
+    fechas = df['fecha'].groupby(racha)
+    duracion = fechas.transform('max') - fechas.transform('min')
+    en_meseta = valor.notna() & (duracion >= DURACION_MESETA)
+
+    sin_base = z_semana.isna()
+    pico = ((z_semana > Z_PICO) & (z_ventana > Z_LOCAL) | sin_base & (z_ventana > Z_PICO)) & ~en_meseta
+    caida = ((z_semana < -Z_CAIDA) | (sin_base & (z_ventana < -Z_CAIDA))) & ~en_meseta
+    puntaje = z_semana.fillna(z_ventana)
+    referencia = esperado.fillna(mediana)
+
+    filas = []
+    for tipo, marca, umbral, minimo in (
+        (AlertaConsumo.PICO, pico, Z_PICO, 1), (AlertaConsumo.CAIDA, caida, Z_CAIDA, MIN_LECTURAS_CAIDA),
+    ):
+        tramo = (primera | marca.ne(marca.shift())).cumsum()[marca]
+        if tramo.empty:
+            continue
+        # La lectura más extrema de cada tramo da el valor y el puntaje de la alerta.
+        extremo = puntaje[marca].abs().groupby(tramo).idxmax()
+        lecturas = tramo.groupby(tramo).size()
+        desdes, hastas = df['fecha'][marca].groupby(tramo).min(), df['fecha'][marca].groupby(tramo).max()
+        for t in lecturas.index[lecturas >= minimo]:
+            i = extremo[t]
+            z = abs(float(puntaje[i]))
+            filas.append(AlertaConsumo(
+                medidor_id=int(df['medidor'][i]), tipo=tipo,
+                severidad=AlertaConsumo.ALTA if z >= SEVERIDAD_ALTA * umbral
+                else AlertaConsumo.MEDIA if z >= SEVERIDAD_MEDIA * umbral else AlertaConsumo.BAJA,
+                desde=desdes[t].to_pydatetime(), hasta=hastas[t].to_pydatetime(), lecturas=int(lecturas[t]),
+                valor=float(valor[i]), esperado=None if pd.isna(referencia[i]) else float(referencia[i]), puntaje=float(puntaje[i]),
+            ))
+
+    mesetas = df[en_meseta].groupby(racha[en_meseta]).agg(
+        medidor=('medidor', 'first'), desde=('fecha', 'min'), hasta=('fecha', 'max'), lecturas=('fecha', 'size'),
+        valor=('valor', 'first'),
+    )
+    for m in mesetas.itertuples():
+        duracion = m.hasta - m.desde
+        filas.append(AlertaConsumo(
+            medidor_id=int(m.medidor), tipo=AlertaConsumo.MESETA,
+            severidad=AlertaConsumo.ALTA if duracion >= 4 * DURACION_MESETA
+            else AlertaConsumo.MEDIA if duracion >= 2 * DURACION_MESETA else AlertaConsumo.BAJA,
+            desde=m.desde.to_pydatetime(), hasta=m.hasta.to_pydatetime(), lecturas=int(m.lecturas), valor=float(m.valor),
+        ))
+    return filas
+
+
+def _extender(filas, alertas, df):
+    """
+    Una racha que sigue más allá de las lecturas cargadas queda cortada en el borde: se extiende
+    hasta donde llegaba la alerta anterior del mismo tipo que reemplaza.
+    """
+    bordes = df.groupby('medidor')['fecha'].agg(['min', 'max'])
+    anteriores = list(alertas.values_list('medidor_id', 'tipo', 'desde', 'hasta'))
+    for fila in filas:
+        primera, ultima = bordes.loc[fila.medidor_id]
+        for medidor, tipo, desde, hasta in anteriores:
+            if medidor != fila.medidor_id or tipo != fila.tipo or desde > fila.hasta or hasta < fila.desde:
+                continue
+            if fila.desde == primera and desde < fila.desde:
+                fila.desde = desde
+            if fila.hasta == ultima and hasta > fila.hasta:
+                fila.hasta = hasta
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Registra las señales que mantienen la tabla de clausura de medidores, los consumos de
+        # contador y las cachés de rangos y de puntos de la ingesta.
+        from . import contadores, ingesta, jerarquia, rangos  # noqa: F401
@@ -0,0 +1,115 @@
+"""
+Caché de resultados de consultas sobre Consumo (series, resúmenes, diferencias) por medidor.
+
+La clave incluye el tipo de consulta, el rango, la granularidad y la versión de datos de
+cada medidor involucrado (Medidor.version_consumo). Las importaciones suben la versión solo
+de los medidores cuyo consumo cambió (invalidar()), así sus entradas viejas dejan de
+usarse y caducan solas, y las del resto de los medidores siguen sirviendo.
+
+Las versiones viven en la base de datos y no en la caché: la importación corre en otro
+proceso (procesar_importaciones) y con LocMemCache no vería las del proceso web.
+
+El backend es el alias CACHE_CONSULTAS de settings ('consultas', o 'default' si no está
+configurado); por defecto LocMemCache, reemplazable por Redis o Memcached. Los contadores
+de aciertos, fallos, desalojos e invalidaciones se guardan en el mismo backend.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+
+from .models import Medidor
+
+logger = logging.getLogger(__name__)
+
+PREFIJO = 'consultas'
+CONTADORES = ('aciertos', 'fallos', 'desalojos', 'invalidaciones')
+# Claves guardadas por este proceso: un fallo sobre una de ellas es un desalojo del backend.
+MAX_CLAVES_RECORDADAS = 10000
+
+_guardadas = OrderedDict()
+_candado = threading.Lock()
+
+
+def backend():
+    alias = getattr(settings, 'CACHE_CONSULTAS', 'consultas')
+    return caches[alias if alias in settings.CACHES else 'default']
+
+
+def versiones(medidor_ids):
+    """{medidor_id: version_consumo}; los ids inexistentes no aparecen."""
+    return dict(Medidor.objects.filter(pk__in=medidor_ids).values_list('id', 'version_consumo'))
+
+
+def clave(tipo, medidor_ids, desde, hasta, granularidad=''):
+    actuales = versiones(medidor_ids)
+    medidores = ','.join(f"{m}.{actuales.get(m, 0)}" for m in sorted(set(medidor_ids)))
+    texto = f"{tipo}|{granularidad}|{desde.isoformat()}|{hasta.isoformat()}|{medidores}"
+    # Los backends como Memcached limitan el largo de la clave y los caracteres permitidos.
+    return f"{PREFIJO}:{tipo}:" + hashlib.md5(texto.encode('utf-8')).hexdigest()
+
+
+def cacheado(tipo, medidor_ids, desde, hasta, granularidad, calcular, timeout=None):
+    """
+    Devuelve el resultado de `calcular()` para la consulta descrita por los demás argumentos,
+    de la caché si está. `timeout` None usa el del backend.
+    """
+    cache = backend()
+    k = clave(tipo, medidor_ids, desde, hasta, granularidad)
+    resultado = cache.get(k)
+    if resultado is not None:
+        _contar('aciertos')
+        return resultado
+    with _candado:
+        desalojada = _guardadas.pop(k, None) is not None
+    _contar('desalojos' if desalojada else 'fallos')
+
+    resultado = calcular()
+    if timeout is None:
+        cache.set(k, resultado)
+    else:
+        cache.set(k, resultado, timeout)
+    with _candado:
+        _guardadas[k] = True
+        while len(_guardadas) > MAX_CLAVES_RECORDADAS:
+            _guardadas.popitem(last=False)
+    return resultado
+
+
+def invalidar(medidor_ids):
+    """Sube la versión de datos de los medidores: sus consultas cacheadas dejan de usarse."""
+    medidor_ids = list(medidor_ids)
+    if not medidor_ids:
+        return 0
+    cantidad = Medidor.objects.filter(pk__in=medidor_ids).update(version_consumo=F('version_consumo') + 1)
+    _contar('invalidaciones', cantidad)
+    logger.info(f"Caché de consultas: {cantidad} medidores invalidados.")
+    return cantidad
+
+
+def _contar(contador, cantidad=1):
+    cache = backend()
+    k = f"{PREFIJO}:estadisticas:{contador}"
+    # add() no pisa un valor existente; incr() es atómico en Redis y Memcached.
+    cache.add(k, 0, None)
+    try:
+        cache.incr(k, cantidad)
+    except ValueError:  # Desalojado entre add() e incr().
+        cache.set(k, cantidad, None)
+
+
+def estadisticas():
+    """Contadores acumulados y tasa de aciertos (los desalojos cuentan como fallos)."""
+    valores = backend().get_many([f"{PREFIJO}:estadisticas:{c}" for c in CONTADORES])
+    datos = {c: valores.get(f"{PREFIJO}:estadisticas:{c}", 0) for c in CONTADORES}
+    consultas = datos['aciertos'] + datos['fallos'] + datos['desalojos']
+    datos['tasa_aciertos'] = round(datos['aciertos'] / consultas, 4) if consultas else None
+    return datos
+
+
+def reiniciar_estadisticas():
+    backend().delete_many([f"{PREFIJO}:estadisticas:{c}" for c in CONTADORES])
@@ -0,0 +1,185 @@
+"""
+Revisión de la calidad de las series de Consumo: huecos, lecturas fuera de grilla, lecturas
+duplicadas en un mismo intervalo y deltas negativos.
+
+Para cada medidor se infiere un perfil (PerfilMedidor): el intervalo nominal es el salto
+más frecuente entre lecturas consecutivas y la fase es el resto más frecuente de las fechas
+respecto de ese intervalo. Si casi todos los deltas de consumo son >= 0 la serie se toma
+como un contador acumulativo y sus deltas negativos son reinicios; en las series de consumo
+por intervalo un delta negativo es normal y no se marca.
+
+Todo se calcula con operaciones vectorizadas de pandas sobre la serie de fechas (en
+segundos) de un lote de medidores. Las incidencias se guardan en IncidenciaSerie.
+
+Tras una importación solo se revisa el vecindario del rango importado, como en
+core.diferencias. Se usa la lectura anterior al rango de cada medidor como referencia, y
+se reescribe desde el inicio del rango hasta la primera lectura posterior.
+"""
+import logging
+import operator
+from collections import Counter, defaultdict
+from functools import reduce
+
+import pandas as pd
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+
+from .models import Consumo, IncidenciaSerie, Medidor, PerfilMedidor
+from .staging import rango_staging
+
+logger = logging.getLogger(__name__)
+
+MEDIDORES_POR_LOTE = 200
+# Saltos entre lecturas necesarios para inferir el perfil de un medidor.
+MIN_MUESTRAS = 20
+# Proporción de deltas >= 0 a partir de la cual la serie se considera acumulativa.
+UMBRAL_ACUMULATIVO = 0.99
+# Segundos de tolerancia para considerar una lectura dentro de la grilla.
+TOLERANCIA = 1
+
+
+def revisar_importacion(importacion_id):
+    """Revisa el vecindario del lote de staging de una importación (antes de borrarlo)."""
+    rango = rango_staging(importacion_id)
+    if rango is None:
+        return Counter()
+    return revisar(*rango)
+
+
+def revisar(medidor_ids=None, desde=None, hasta=None, reinferir=False):
+    """
+    Recalcula las incidencias de `medidor_ids` (por defecto, todos los medidores). Con `desde` y
+    `hasta` solo las de lecturas desde `desde` hasta la primera posterior a `hasta`; sin rango,
+    las de toda la serie. Los perfiles que faltan se infieren; con `reinferir`, todos.
+    Devuelve un Counter de incidencias por tipo.
+    """
+    if medidor_ids is None:
+        medidor_ids = Medidor.objects.values_list('id', flat=True)
+    medidor_ids = sorted(set(medidor_ids))
+    total = Counter()
+    for i in range(0, len(medidor_ids), MEDIDORES_POR_LOTE):
+        total.update(_revisar_lote(medidor_ids[i:i + MEDIDORES_POR_LOTE], desde, hasta, reinferir))
+    logger.info(
+        f"Revisión de series: {len(medidor_ids)} medidores, {desde or 'inicio'} - {hasta or 'fin'}, "
+        f"incidencias: {dict(total) or 'ninguna'}."
+    )
+    return total
+
+
+def _revisar_lote(medidor_ids, desde, hasta, reinferir):
+    qs = Consumo.objects.filter(medidor_id__in=medidor_ids)
+    incidencias = IncidenciaSerie.objects.filter(medidor_id__in=medidor_ids)
+    if desde is not None:
+        # Por medidor: última lectura antes del rango (referencia) y primera después (se revisa).
+        lecturas = Consumo.objects.filter(medidor=OuterRef('pk')).values('fecha')
+        limites = Medidor.objects.filter(pk__in=medidor_ids).annotate(
+            antes=Subquery(lecturas.filter(fecha__lt=desde).order_by('-fecha')[:1]),
+            despues=Subquery(lecturas.filter(fecha__gt=hasta).order_by('fecha')[:1]),
+        ).values_list('pk', 'antes', 'despues')
+        # Cada medidor se revisa solo en su ventana; los que la comparten van en una sola condición.
+        ventanas = defaultdict(list)
+        for medidor_id, antes, despues in limites:
+            ventanas[(antes or desde, despues or hasta)].append(medidor_id)
+        qs = qs.filter(reduce(operator.or_, (
+            Q(medidor_id__in=ids, fecha__gte=referencia, fecha__lte=fin) for (referencia, fin), ids in ventanas.items()
+        )))
+        incidencias = incidencias.filter(reduce(operator.or_, (
+            Q(medidor_id__in=ids, fecha__gte=desde, fecha__lte=fin) for (_, fin), ids in ventanas.items()
+        )))
+
+    df = pd.DataFrame.from_records(
+        list(qs.order_by('medidor_id', 'fecha').values_list('medidor_id', 'fecha', 'consumo')),
+        columns=['medidor', 'fecha', 'consumo'],
+    )
+    df['fecha'] = pd.to_datetime(df['fecha'], utc=True)
+    df['consumo'] = df['consumo'].astype('float64')
+    segundos = df['fecha'].dt.as_unit('s').astype('int64')
+    primera = df['medidor'].ne(df['medidor'].shift())
+    saltos = segundos.diff().mask(primera)
+    deltas = df['consumo'].diff().mask(primera)
+
+    perfiles = {p.medidor_id: p for p in PerfilMedidor.objects.filter(medidor_id__in=medidor_ids)}
+    nuevos = _inferir_perfiles(df['medidor'], segundos, saltos, deltas, excluir=() if reinferir else perfiles)
+    perfiles.update({p.medidor_id: p for p in nuevos})
+
+    revisar_desde = pd.Timestamp(desde) if desde is not None else None
+    filas = _detectar(df, segundos, saltos, deltas, primera, perfiles, revisar_desde)
+    with transaction.atomic():
+        if nuevos:
+            PerfilMedidor.objects.bulk_create(
+                nuevos, update_conflicts=True, unique_fields=['medidor'],
+                update_fields=['intervalo', 'fase', 'acumulativo', 'muestras', 'actualizado'],
+            )
+        incidencias.delete()
+        IncidenciaSerie.objects.bulk_create(filas, batch_size=1000)
+    return Counter(fila.tipo for fila in filas)
+
+
+def _inferir_perfiles(medidores, segundos, saltos, deltas, excluir):
+    """PerfilMedidor (sin guardar) de los medidores con MIN_MUESTRAS saltos, salvo los de `excluir`."""
+    validos = (saltos > 0) & ~medidores.isin(list(excluir))
+    muestras = validos.groupby(medidores).sum()
+    candidatos = muestras[muestras >= MIN_MUESTRAS].index
+    validos &= medidores.isin(candidatos)
+    if not validos.any():
+        return []
+
+    intervalos = _moda(medidores[validos], saltos[validos].astype('int64'))
+    con_perfil = medidores.isin(intervalos.index)
+    fases = _moda(medidores[con_perfil], segundos[con_perfil] % medidores[con_perfil].map(intervalos))
+    con_delta = deltas.notna() & con_perfil
+    crecientes = (deltas[con_delta] >= 0).groupby(medidores[con_delta]).mean()
+    positivos = (deltas[con_delta] > 0).groupby(medidores[con_delta]).any()
+    return [
+        PerfilMedidor(
+            medidor_id=int(medidor),
+            intervalo=int(intervalo),
+            fase=int(fases[medidor]),
+            acumulativo=bool(crecientes.get(medidor, 0) >= UMBRAL_ACUMULATIVO and positivos.get(medidor, False)),
+            muestras=int(muestras[medidor]),
+        )
+        for medidor, intervalo in intervalos.items()
+    ]
+
+
+def _moda(claves, valores):
+    """Valor más frecuente por clave (el menor ante empates), como Series indexada por clave."""
+    conteo = pd.DataFrame({'clave': claves.to_numpy(), 'valor': valores.to_numpy()}).value_counts().reset_index()
+    conteo = conteo.sort_values(['clave', 'count', 'valor'], ascending=[True, False, True])
+    return conteo.drop_duplicates('clave').set_index('clave')['valor']
+
+
+def _detectar(df, segundos, saltos, deltas, primera, perfiles, desde):
+    """IncidenciaSerie (sin guardar) de las lecturas de `df` con fecha >= `desde`."""
+    medidores = df['medidor']
+    intervalo = medidores.map({m: p.intervalo for m, p in perfiles.items()})
+    fase = medidores.map({m: p.fase for m, p in perfiles.items()})
+    acumulativo = medidores.map({m: p.acumulativo for m, p in perfiles.items()}).fillna(False).astype(bool)
+
+    relativo = segundos - fase
+    resto = relativo % intervalo
+    # Cada lectura cuenta para la ranura de la grilla más cercana: una lectura desfasada no
+    # abre un hueco y dos en la misma ranura son un duplicado.
+    ranura = (relativo / intervalo).round()
+    faltantes = (ranura - ranura.shift() - 1).mask(primera)
+    marcas = {
+        IncidenciaSerie.HUECO: faltantes >= 1,
+        IncidenciaSerie.FUERA_DE_GRILLA: (resto > TOLERANCIA) & (resto < intervalo - TOLERANCIA),
+        IncidenciaSerie.DUPLICADO: ~primera & ranura.eq(ranura.shift()),
+        IncidenciaSerie.DELTA_NEGATIVO: acumulativo & (deltas < 0),
+    }
+    en_rango = df['fecha'] >= desde if desde is not None else pd.Series(True, index=df.index)
+    anteriores = df['fecha'].shift()
+
+    filas = []
+    for tipo, marca in marcas.items():
+        for i in df.index[marca & en_rango]:
+            filas.append(IncidenciaSerie(
+                medidor_id=int(medidores[i]),
+                tipo=tipo,
+                fecha=df['fecha'][i].to_pydatetime(),
+                fecha_anterior=None if primera[i] else anteriores[i].to_pydatetime(),
+                faltantes=int(faltantes[i]) if tipo == IncidenciaSerie.HUECO else None,
+                diferencia=float(deltas[i]) if tipo == IncidenciaSerie.DELTA_NEGATIVO else None,
+            ))
+    return filas
@@ -0,0 +1,174 @@
+"""
+Consumo derivado de los puntos de medición con contador (PuntoMedicion.es_contador).
+
+DocumentoMedicion.lectura_contador es un valor acumulado; el consumo de cada lectura es la
+diferencia con la lectura anterior del mismo punto y se guarda en ConsumoContador. Así el
+consumo de cientos de miles de lecturas es una consulta (un Sum sobre el índice punto/fecha)
+y no un recálculo.
+
+Cuando la lectura baja:
+
+- si el punto tiene limite_contador y la vuelta (limite - anterior + actual) es menor que
+  FRACCION_VUELTA del límite, el contador dio la vuelta y el consumo es la vuelta;
+- si no, el contador se reinició (cambio de equipo, puesta a cero) y el consumo es la lectura
+  actual, contada desde cero.
+
+Las diferencias se calculan en un solo INSERT ... SELECT con LAG por punto, el mismo SQL en
+PostgreSQL y SQLite, como en core.diferencias. Las señales de DocumentoMedicion recalculan
+solo el vecindario de la lectura guardada o borrada: la anterior como referencia y hasta la
+primera posterior. Las cargas que no pasan por save() ni por el delete() de una lectura
+(bulk_create, update(), delete() de un queryset) tienen que llamar a recalcular() con el
+rango afectado.
+"""
+import logging
+from collections import Counter, defaultdict
+
+from django.db import connection as default_connection, transaction
+from django.db.models import Sum
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import ConsumoContador, DocumentoMedicion, PuntoMedicion
+
+logger = logging.getLogger(__name__)
+
+# Una bajada se toma como vuelta del contador si la vuelta es menor que esta fracción del límite.
+FRACCION_VUELTA = 0.5
+COLUMNAS = "documento_id, punto_medicion_id, fecha, documento_anterior_id, delta, tipo"
+
+
+def _select_consumos(filtro):
+    # Mismo esquema que core.diferencias: LAG por punto y se descarta la primera lectura de cada uno.
+    vuelta = "l.limite - l.anterior + l.lectura"
+    es_vuelta = f"l.limite IS NOT NULL AND {vuelta} >= 0 AND {vuelta} < l.limite * {FRACCION_VUELTA}"
+    return (
+        f"SELECT l.id, l.punto_medicion_id, l.fecha_hora_lectura, l.documento_anterior, "
+        f"CASE WHEN l.lectura >= l.anterior THEN l.lectura - l.anterior WHEN {es_vuelta} THEN {vuelta} ELSE l.lectura END, "
+        f"CASE WHEN l.lectura >= l.anterior THEN '{ConsumoContador.NORMAL}' WHEN {es_vuelta} THEN '{ConsumoContador.VUELTA}' "
+        f"ELSE '{ConsumoContador.REINICIO}' END "
+        f"FROM (SELECT d.id, d.punto_medicion_id, d.fecha_hora_lectura, d.lectura_contador AS lectura, p.limite_contador AS limite, "
+        f"LAG(d.lectura_contador) OVER (PARTITION BY d.punto_medicion_id ORDER BY d.fecha_hora_lectura, d.id) AS anterior, "
+        f"LAG(d.id) OVER (PARTITION BY d.punto_medicion_id ORDER BY d.fecha_hora_lectura, d.id) AS documento_anterior "
+        f"{filtro}) l WHERE l.documento_anterior IS NOT NULL"
+    )
+
+
+def _en_ventanas(ventanas, prefijo, fecha):
+    # Una condición por ventana (referencia o desde, fin) con los puntos que la comparten, como en core.diferencias.
+    return ' OR '.join(
+        f"({prefijo}punto_medicion_id IN ({', '.join(['%s'] * len(ids))}) AND {prefijo}{fecha} >= %s AND {prefijo}{fecha} <= %s)"
+        for ids in ventanas.values()
+    )
+
+
+def recalcular(punto_ids=None, desde=None, hasta=None, connection=None):
+    """
+    Recalcula los ConsumoContador de `punto_ids` (por defecto, todos los puntos). Con `desde` y
+    `hasta` solo los de lecturas desde `desde` hasta la primera posterior a `hasta` de cada punto;
+    sin rango, los de toda la serie. Los puntos que ya no son contadores pierden sus consumos.
+    Devuelve un Counter de consumos escritos por tipo.
+    """
+    connection = connection or default_connection
+    puntos = PuntoMedicion.objects.all() if punto_ids is None else PuntoMedicion.objects.filter(pk__in=punto_ids)
+    ConsumoContador.objects.filter(punto_medicion__in=puntos.filter(es_contador=False)).delete()
+    contadores = sorted(puntos.filter(es_contador=True).values_list('pk', flat=True))
+    if not contadores:
+        return Counter()
+    tabla = ConsumoContador._meta.db_table
+    documento = DocumentoMedicion._meta.db_table
+    en_puntos = ', '.join(['%s'] * len(contadores))
+    lecturas = (
+        f"FROM {documento} d JOIN {PuntoMedicion._meta.db_table} p ON p.numero_interno = d.punto_medicion_id "
+        f"WHERE d.punto_medicion_id IN ({en_puntos}) AND d.lectura_contador IS NOT NULL"
+    )
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        if desde is None:
+            cursor.execute(f"DELETE FROM {tabla} WHERE punto_medicion_id IN ({en_puntos})", contadores)
+            cursor.execute(f"INSERT INTO {tabla} ({COLUMNAS}) {_select_consumos(lecturas)}", contadores)
+            cursor.execute(f"SELECT tipo, COUNT(*) FROM {tabla} WHERE punto_medicion_id IN ({en_puntos}) GROUP BY tipo", contadores)
+        else:
+            # En SQLite las fechas se comparan como texto: hay que pasarlas con el mismo formato que guarda Django.
+            desde, hasta = (connection.ops.adapt_datetimefield_value(f) for f in (desde, hasta))
+            # Por punto: última lectura antes del rango (referencia) y primera después (se recalcula).
+            cursor.execute(
+                f"SELECT p.numero_interno, "
+                f"(SELECT MAX(a.fecha_hora_lectura) FROM {documento} a WHERE a.punto_medicion_id = p.numero_interno "
+                f"AND a.lectura_contador IS NOT NULL AND a.fecha_hora_lectura < %s), "
+                f"(SELECT MIN(s.fecha_hora_lectura) FROM {documento} s WHERE s.punto_medicion_id = p.numero_interno "
+                f"AND s.lectura_contador IS NOT NULL AND s.fecha_hora_lectura > %s) "
+                f"FROM {PuntoMedicion._meta.db_table} p WHERE p.numero_interno IN ({en_puntos})",
+                [desde, hasta, *contadores],
+            )
+            # Cada punto se recalcula solo en su ventana; los que la comparten van en una sola condición.
+            ventanas = defaultdict(list)
+            for punto_id, antes, despues in cursor.fetchall():
+                ventanas[(antes or desde, despues or hasta)].append(punto_id)
+            en_rango = [p for (_, fin), ids in ventanas.items() for p in (*ids, desde, fin)]
+            # También los consumos de lecturas que ahora caen en el rango pero se guardaron con otra fecha.
+            cursor.execute(
+                f"DELETE FROM {tabla} WHERE punto_medicion_id IN ({en_puntos}) AND ({_en_ventanas(ventanas, '', 'fecha')} "
+                f"OR documento_id IN (SELECT id FROM {documento} WHERE {_en_ventanas(ventanas, '', 'fecha_hora_lectura')}))",
+                [*contadores, *en_rango, *en_rango],
+            )
+            vecindario = f"{lecturas} AND ({_en_ventanas(ventanas, 'd.', 'fecha_hora_lectura')})"
+            cursor.execute(
+                f"INSERT INTO {tabla} ({COLUMNAS}) SELECT * FROM ({_select_consumos(vecindario)}) c "
+                f"WHERE c.fecha_hora_lectura >= %s",
+                [*contadores, *(p for (referencia, fin), ids in ventanas.items() for p in (*ids, referencia, fin)), desde],
+            )
+            cursor.execute(
+                f"SELECT tipo, COUNT(*) FROM {tabla} WHERE {_en_ventanas(ventanas, '', 'fecha')} GROUP BY tipo",
+                en_rango,
+            )
+        escritos = Counter(dict(cursor.fetchall()))
+    logger.info(
+        f"Consumos de contador: {len(contadores)} puntos, {desde or 'inicio'} - {hasta or 'fin'}, "
+        f"{dict(escritos) or 'sin lecturas'}."
+    )
+    return escritos
+
+
+def consumo(punto_ids, desde, hasta):
+    """{punto_id: consumo} de las lecturas de contador en [desde, hasta), sumando los ConsumoContador guardados."""
+    return dict(
+        ConsumoContador.objects.filter(punto_medicion__in=punto_ids, fecha__gte=desde, fecha__lt=hasta)
+        .values_list('punto_medicion').annotate(total=Sum('delta')).order_by()
+    )
+
+
+@receiver(pre_save, sender=PuntoMedicion)
+def _recordar_configuracion(sender, instance, raw=False, **kwargs):
+    instance._configuracion_anterior = None if raw or instance.pk is None else PuntoMedicion.objects.filter(
+        pk=instance.pk).values_list('es_contador', 'limite_contador').first()
+
+
+@receiver(post_save, sender=PuntoMedicion)
+def _recalcular_punto(sender, instance, created, raw=False, **kwargs):
+    # Cambiar es_contador o el límite cambia todos los consumos del punto.
+    if raw or created:
+        return
+    if getattr(instance, '_configuracion_anterior', None) != (instance.es_contador, instance.limite_contador):
+        recalcular([instance.pk])
+
+
+@receiver(pre_save, sender=DocumentoMedicion)
+def _recordar_lectura(sender, instance, raw=False, **kwargs):
+    # Si la lectura cambia de punto o de fecha, también hay que recalcular su vecindario anterior.
+    instance._lectura_anterior = None if raw or instance.pk is None else DocumentoMedicion.objects.filter(
+        pk=instance.pk).values_list('punto_medicion_id', 'fecha_hora_lectura').first()
+
+
+@receiver(post_save, sender=DocumentoMedicion)
+@receiver(post_delete, sender=DocumentoMedicion)
+def _recalcular_documento(sender, instance, raw=False, origin=None, **kwargs):
+    # Los borrados en cascada o de un queryset entero no recalculan lectura por lectura: el que
+    # borra llama a recalcular() con el rango (o el punto desaparece con sus consumos).
+    if raw or (origin is not None and origin is not instance):
+        return
+    lecturas = {(instance.punto_medicion_id, instance.fecha_hora_lectura)}
+    if getattr(instance, '_lectura_anterior', None):
+        lecturas.add(instance._lectura_anterior)
+    for punto_id, fecha in lecturas:
+        if PuntoMedicion.objects.filter(pk=punto_id, es_contador=True).exists():
+            recalcular([punto_id], fecha, fecha)
@@ -0,0 +1,245 @@
+"""
+Indicadores de demanda por mes de cada medidor y de cada TipoMedidor: demanda máxima, factor
+de carga, energía por banda horaria y perfil diario típico.
+
+Las lecturas de un mes se pivotean en una matriz día x intervalo del día (hora local), una por
+clave, y todo sale de numpy sobre esas matrices: la máxima con nanargmax, el perfil con
+percentiles por columna (un solo sort) y las bandas sumando columnas. Los medidores van en lotes de
+MEDIDORES_POR_LOTE.
+
+- Medidores: desde Consumo, con el intervalo de su PerfilMedidor (core.calidad) si divide la
+  hora, o por hora si no lo tiene; nunca más fino que INTERVALO_MINIMO. En los acumulativos se
+  usan los deltas entre lecturas.
+- Tipos de medidor: desde ConsumoHora, sumando hora a hora los medidores del tipo que no son
+  acumulativos. El factor de coincidencia compara la máxima del conjunto con la suma de las
+  máximas horarias de cada medidor.
+
+La demanda es la energía de un intervalo por hora (kW con consumos en kWh). Las bandas horarias
+son las de settings.DEMANDA_BANDAS_HORARIAS (por defecto BANDAS_HORARIAS), por hora local y
+todos los días; las horas sin banda van a BANDA_RESTO.
+
+Los resultados se guardan por mes en DemandaMedidor y DemandaTipoMedidor; el admin los muestra
+sin agregar nada. Tras una importación se recalculan los meses que toca el lote, para sus
+medidores y los tipos de esos medidores.
+"""
+import logging
+import warnings
+from collections import Counter
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, Sum
+from django.utils import timezone
+
+from .models import Consumo, ConsumoHora, DemandaMedidor, DemandaTipoMedidor, Medidor, PerfilMedidor
+from .resumenes import cubrir, siguiente_intervalo
+from .staging import rango_staging
+
+logger = logging.getLogger(__name__)
+
+MEDIDORES_POR_LOTE = 500
+HORA = 3600
+DIA = 24 * HORA
+INTERVALO_MINIMO = 300
+# {banda: [(hora desde, hora hasta), ...]}, horas locales, hasta exclusiva.
+BANDAS_HORARIAS = {'punta': [(18, 23)], 'valle': [(0, 7)]}
+BANDA_RESTO = 'llano'
+PERCENTILES = (10, 50, 90)
+
+
+def calcular_importacion(importacion_id):
+    """Recalcula los meses que toca el lote de staging de una importación (antes de borrarlo)."""
+    rango = rango_staging(importacion_id)
+    if rango is None:
+        return Counter()
+    return calcular(*rango)
+
+
+def calcular(medidor_ids=None, desde=None, hasta=None):
+    """
+    Recalcula los meses que tocan [desde, hasta] (sin rango, todos los meses con lecturas) de
+    `medidor_ids` (por defecto, todos los medidores) y de sus tipos de medidor. Devuelve un
+    Counter de meses guardados, con las claves 'medidores' y 'tipos'.
+    """
+    if medidor_ids is None:
+        medidor_ids = Medidor.objects.values_list('id', flat=True)
+    medidor_ids = sorted(set(medidor_ids))
+    if desde is None:
+        rango = Consumo.objects.filter(medidor_id__in=medidor_ids).aggregate(desde=Min('fecha'), hasta=Max('fecha'))
+        desde, hasta = rango['desde'], rango['hasta']
+    total = Counter()
+    if desde is None:
+        return total
+    tipos = sorted(set(
+        Medidor.objects.filter(pk__in=medidor_ids, tipo_medidor__isnull=False).values_list('tipo_medidor_id', flat=True)
+    ))
+    mes, fin = cubrir(desde, hasta, 'mes')
+    while mes < fin:
+        siguiente = siguiente_intervalo(mes, 'mes')
+        for i in range(0, len(medidor_ids), MEDIDORES_POR_LOTE):
+            total['medidores'] += _calcular_medidores(medidor_ids[i:i + MEDIDORES_POR_LOTE], mes, siguiente)
+        total['tipos'] += _calcular_tipos(tipos, mes, siguiente)
+        mes = siguiente
+    logger.info(
+        f"Demanda: {len(medidor_ids)} medidores y {len(tipos)} tipos, {desde} - {hasta}, "
+        f"{total['medidores']} meses de medidor y {total['tipos']} de tipo."
+    )
+    return total
+
+
+def _intervalo(perfil):
+    """Intervalo de la matriz de un medidor: el de su perfil si divide la hora, redondeado a INTERVALO_MINIMO."""
+    if not perfil or HORA % perfil:
+        return HORA
+    intervalo = perfil
+    while intervalo < INTERVALO_MINIMO or HORA % intervalo:
+        intervalo += perfil
+    return intervalo
+
+
+def _calcular_medidores(medidor_ids, mes, fin):
+    perfiles = {m: (i, a) for m, i, a in PerfilMedidor.objects.filter(medidor_id__in=medidor_ids).values_list(
+        'medidor_id', 'intervalo', 'acumulativo')}
+    acumulativos = [m for m, (_, acumulativo) in perfiles.items() if acumulativo]
+    # Los acumulativos necesitan una lectura anterior al mes para el delta de la primera.
+    qs = Consumo.objects.filter(
+        medidor_id__in=medidor_ids, consumo__isnull=False, fecha__gte=mes - timedelta(days=1) if acumulativos else mes, fecha__lt=fin,
+    )
+    df = pd.DataFrame.from_records(
+        list(qs.order_by('medidor_id', 'fecha').values_list('medidor_id', 'fecha', 'consumo')),
+        columns=['medidor', 'fecha', 'consumo'],
+    )
+    df['fecha'] = pd.to_datetime(df['fecha'], utc=True)
+    df['consumo'] = df['consumo'].astype('float64')
+    deltas = df['consumo'].diff().mask(df['medidor'].ne(df['medidor'].shift()))
+    # Un delta negativo es un reinicio del contador (core.calidad) y se descarta.
+    df['valor'] = df['consumo'].where(~df['medidor'].isin(acumulativos), deltas.where(deltas >= 0))
+    df = df[(df['fecha'] >= mes) & df['valor'].notna()]
+    intervalos = df['medidor'].map({m: _intervalo(i) for m, (i, _) in perfiles.items()}).fillna(HORA).astype('int64')
+
+    filas = []
+    for intervalo, grupo in df.groupby(intervalos):
+        for medidor, indicadores in _indicadores(grupo['medidor'], grupo['fecha'], grupo['valor'], int(intervalo), mes, fin):
+            filas.append(DemandaMedidor(medidor_id=int(medidor), mes=mes, intervalo=int(intervalo), **indicadores))
+    with transaction.atomic():
+        DemandaMedidor.objects.filter(medidor_id__in=medidor_ids, mes=mes).delete()
+        DemandaMedidor.objects.bulk_create(filas, batch_size=1000)
+    return len(filas)
+
+
+def _calcular_tipos(tipo_ids, mes, fin):
+    if not tipo_ids:
+        return 0
+    horas = ConsumoHora.objects.filter(
+        medidor__tipo_medidor__in=tipo_ids, inicio__gte=mes, inicio__lt=fin, suma__isnull=False,
+    ).exclude(medidor__in=PerfilMedidor.objects.filter(acumulativo=True).values('medidor_id'))
+    # La suma por tipo y hora y la máxima de cada medidor se agregan en la base.
+    suma = pd.DataFrame.from_records(
+        list(horas.values_list('medidor__tipo_medidor', 'inicio').annotate(total=Sum('suma')).order_by()),
+        columns=['tipo', 'inicio', 'suma'],
+    )
+    maximas, medidores = Counter(), Counter()
+    for tipo, _, maxima in horas.values_list('medidor__tipo_medidor', 'medidor').annotate(maxima=Max('suma')).order_by():
+        maximas[tipo] += maxima
+        medidores[tipo] += 1
+
+    filas = []
+    fechas = pd.to_datetime(suma['inicio'], utc=True)
+    for tipo, indicadores in _indicadores(suma['tipo'], fechas, suma['suma'].astype('float64'), HORA, mes, fin):
+        maxima = indicadores['demanda_maxima']
+        filas.append(DemandaTipoMedidor(
+            tipo_medidor_id=int(tipo), mes=mes, intervalo=HORA, medidores=medidores[tipo],
+            factor_coincidencia=maxima / maximas[tipo] if maxima is not None and maximas[tipo] > 0 else None,
+            **indicadores,
+        ))
+    with transaction.atomic():
+        DemandaTipoMedidor.objects.filter(tipo_medidor_id__in=tipo_ids, mes=mes).delete()
+        DemandaTipoMedidor.objects.bulk_create(filas, batch_size=1000)
+    return len(filas)
+
+
+def _bandas(intervalo):
+    """Nombre de la banda horaria de cada intervalo del día."""
+    por_hora = np.full(24, BANDA_RESTO, dtype=object)
+    for banda, tramos in getattr(settings, 'DEMANDA_BANDAS_HORARIAS', BANDAS_HORARIAS).items():
+        for desde, hasta in tramos:
+            por_hora[desde:hasta] = banda
+    return por_hora[np.arange(DIA // intervalo) * intervalo // HORA]
+
+
+def _percentiles(matriz, percentiles):
+    """
+    np.nanpercentile(matriz, percentiles, axis=1) con un solo sort (los NaN quedan al final) e
+    interpolación lineal vectorizada: nanpercentile recorre columna por columna en Python.
+    """
+    ordenada = np.sort(matriz, axis=1)
+    validos = (~np.isnan(matriz)).sum(axis=1)
+    resultado = []
+    for p in percentiles:
+        posicion = np.maximum(validos - 1, 0) * p / 100
+        abajo, arriba = np.floor(posicion).astype('int64'), np.ceil(posicion).astype('int64')
+        a = np.take_along_axis(ordenada, abajo[:, None, :], axis=1)[:, 0, :]
+        b = np.take_along_axis(ordenada, arriba[:, None, :], axis=1)[:, 0, :]
+        resultado.append(np.where(validos > 0, a + (b - a) * (posicion - abajo), np.nan))
+    return np.array(resultado)
+
+
+def _lista(valores):
+    return [None if np.isnan(v) else float(v) for v in valores]
+
+
+def _indicadores(claves, fechas, valores, intervalo, mes, fin):
+    """
+    (clave, campos de DemandaMes) de cada clave de `claves`, con las lecturas de [mes, fin)
+    pivoteadas en una matriz clave x día x intervalo del día.
+    """
+    if claves.empty:
+        return []
+    inicio = timezone.localtime(mes).replace(tzinfo=None)
+    dias = (timezone.localtime(fin).replace(tzinfo=None) - inicio).days
+    ranuras = DIA // intervalo
+    locales = fechas.dt.tz_convert(timezone.get_current_timezone()).dt.tz_localize(None)
+    dia = (locales.dt.normalize() - inicio).dt.days.to_numpy()
+    ranura = ((locales.dt.hour * HORA + locales.dt.minute * 60 + locales.dt.second) // intervalo).to_numpy()
+    codigos, unicas = pd.factorize(claves)
+    # Las lecturas de un mismo intervalo (dos en la hora repetida del cambio de horario) se suman.
+    celda = (codigos * dias + dia) * ranuras + ranura
+    forma = (len(unicas), dias, ranuras)
+    energia = np.bincount(celda, weights=valores.to_numpy(), minlength=np.prod(forma)).reshape(forma)
+    con_datos = np.bincount(celda, minlength=np.prod(forma)).reshape(forma) > 0
+    demanda = np.where(con_datos, energia * (HORA / intervalo), np.nan)
+
+    plana = demanda.reshape(len(unicas), -1)
+    posicion = np.nanargmax(plana, axis=1)
+    maxima = plana[np.arange(len(unicas)), posicion]
+    total = energia.sum(axis=(1, 2))
+    media = total / (con_datos.sum(axis=(1, 2)) * intervalo / HORA)
+    percentiles = _percentiles(demanda, PERCENTILES)
+    with warnings.catch_warnings():
+        # Intervalos del día sin ninguna lectura en el mes: quedan en NaN.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        maximo = np.nanmax(demanda, axis=1)
+    bandas = _bandas(intervalo)
+    por_ranura = energia.sum(axis=1)
+    energia_bandas = {banda: por_ranura[:, bandas == banda].sum(axis=1) for banda in np.unique(bandas)}
+    dias_con_datos = con_datos.any(axis=2).sum(axis=1)
+
+    resultado = []
+    for i, clave in enumerate(unicas):
+        dia_maxima, ranura_maxima = divmod(int(posicion[i]), ranuras)
+        perfil = {f'p{p}': _lista(percentiles[j, i]) for j, p in enumerate(PERCENTILES)}
+        perfil['maximo'] = _lista(maximo[i])
+        resultado.append((clave, {
+            'dias': int(dias_con_datos[i]),
+            'energia': float(total[i]),
+            'demanda_maxima': float(maxima[i]),
+            'fecha_demanda_maxima': timezone.make_aware(inicio + timedelta(days=dia_maxima, seconds=ranura_maxima * intervalo)),
+            'demanda_media': float(media[i]),
+            'factor_carga': float(media[i] / maxima[i]) if maxima[i] > 0 else None,
+            'energia_bandas': {banda: float(v[i]) for banda, v in energia_bandas.items()},
+            'perfil': perfil,
+        }))
+    return resultado
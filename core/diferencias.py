@@ -0,0 +1,119 @@
+"""
+Mantenimiento de la tabla vista_consumo_diferencia (VistaConsumoDiferencia).
+
+Cada fila es una lectura de Consumo con la lectura anterior del mismo medidor y su
+diferencia. Tras una importación solo se recalcula el vecindario afectado de cada
+medidor: las lecturas del rango importado más la primera posterior, cuya lectura
+anterior puede haber cambiado. La lectura previa al rango se usa como referencia
+pero no se reescribe. El SQL (LAG sobre ventanas) es el mismo en PostgreSQL y SQLite.
+"""
+import logging
+from collections import defaultdict
+
+from django.db import connection as default_connection, transaction
+
+from .models import Consumo, Medidor, VistaConsumoDiferencia
+from .staging import rango_staging
+
+logger = logging.getLogger(__name__)
+
+COLUMNAS = "medidor_id, fecha, consumo, consumo_anterior, diferencia_consumo"
+
+
+def _select_diferencias(filtro):
+    # fecha_anterior distingue la primera lectura del medidor (sin diferencia) de una anterior con consumo NULL.
+    return (
+        f"SELECT medidor_id, fecha, consumo, anterior, consumo - anterior FROM ("
+        f"SELECT c.medidor_id, c.fecha, c.consumo, "
+        f"LAG(c.consumo) OVER (PARTITION BY c.medidor_id ORDER BY c.fecha) AS anterior, "
+        f"LAG(c.fecha) OVER (PARTITION BY c.medidor_id ORDER BY c.fecha) AS fecha_anterior "
+        f"{filtro}) lecturas WHERE fecha_anterior IS NOT NULL"
+    )
+
+
+def _en_ventanas(ventanas, prefijo):
+    # Una condición por ventana (referencia o desde, fin) con los medidores que la comparten.
+    return ' OR '.join(
+        f"({prefijo}medidor_id IN ({', '.join(['%s'] * len(ids))}) AND {prefijo}fecha >= %s AND {prefijo}fecha <= %s)"
+        for ids in ventanas.values()
+    )
+
+
+def actualizar_diferencias_importacion(importacion_id, connection=None):
+    """Recalcula las diferencias que toca el lote de staging de una importación (antes de borrarlo)."""
+    rango = rango_staging(importacion_id, connection)
+    if rango is None:
+        return 0
+    return actualizar_diferencias(*rango, connection=connection)
+
+
+def actualizar_diferencias(medidor_ids, desde, hasta, connection=None):
+    """
+    Recalcula las diferencias de `medidor_ids` con fecha en [desde, hasta] y la de la primera
+    lectura posterior a `hasta` de cada medidor. Devuelve la cantidad de filas escritas.
+    """
+    connection = connection or default_connection
+    medidor_ids = sorted(set(medidor_ids))
+    if not medidor_ids:
+        return 0
+    tabla = VistaConsumoDiferencia._meta.db_table
+    consumo = Consumo._meta.db_table
+    en_medidores = ', '.join(['%s'] * len(medidor_ids))
+    # En SQLite las fechas se comparan como texto: hay que pasarlas con el mismo formato que guarda Django.
+    desde, hasta = (connection.ops.adapt_datetimefield_value(f) for f in (desde, hasta))
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        # Por medidor: última lectura antes del rango (referencia) y primera después (se recalcula).
+        cursor.execute(
+            f"SELECT m.id, (SELECT MAX(a.fecha) FROM {consumo} a WHERE a.medidor_id = m.id AND a.fecha < %s), "
+            f"(SELECT MIN(p.fecha) FROM {consumo} p WHERE p.medidor_id = m.id AND p.fecha > %s) "
+            f"FROM {Medidor._meta.db_table} m WHERE m.id IN ({en_medidores})",
+            [desde, hasta, *medidor_ids],
+        )
+        # Cada medidor se recalcula solo en su ventana. Los que comparten ventana (lo habitual: lecturas con el
+        # mismo intervalo) van en una sola condición; las consultas no crecen con los medidores.
+        ventanas = defaultdict(list)
+        for medidor_id, antes, despues in cursor.fetchall():
+            ventanas[(antes or desde, despues or hasta)].append(medidor_id)
+        cursor.execute(
+            f"DELETE FROM {tabla} WHERE {_en_ventanas(ventanas, '')}",
+            [p for (_, fin), ids in ventanas.items() for p in (*ids, desde, fin)],
+        )
+        vecindario = f"FROM {consumo} c WHERE {_en_ventanas(ventanas, 'c.')}"
+        leer = [p for (referencia, fin), ids in ventanas.items() for p in (*ids, referencia, fin)]
+        cursor.execute(
+            f"INSERT INTO {tabla} ({COLUMNAS}) "
+            f"SELECT * FROM ({_select_diferencias(vecindario)}) d WHERE d.fecha >= %s",
+            [*leer, desde],
+        )
+        escritas = cursor.rowcount
+    logger.info(f"Diferencias de consumo actualizadas: {len(medidor_ids)} medidores, {desde} - {hasta}, {escritas} filas.")
+    return escritas
+
+
+def reconstruir_diferencias(medidor_ids=None, connection=None):
+    """Vuelve a calcular toda la tabla (o solo `medidor_ids`) desde Consumo."""
+    connection = connection or default_connection
+    tabla = VistaConsumoDiferencia._meta.db_table
+    consumo = Consumo._meta.db_table
+    if medidor_ids:
+        filtro = f"IN ({', '.join(['%s'] * len(medidor_ids))})"
+        params = list(medidor_ids)
+    else:
+        filtro = "IS NOT NULL"
+        params = []
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        if medidor_ids:
+            cursor.execute(f"DELETE FROM {tabla} WHERE medidor_id {filtro}", params)
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f"TRUNCATE {tabla}")
+        else:
+            cursor.execute(f"DELETE FROM {tabla}")
+        cursor.execute(
+            f"INSERT INTO {tabla} ({COLUMNAS}) "
+            f"{_select_diferencias(f'FROM {consumo} c WHERE c.medidor_id {filtro}')}",
+            params,
+        )
+        escritas = cursor.rowcount
+    logger.info(f"Diferencias de consumo reconstruidas: {escritas} filas.")
+    return escritas
@@ -0,0 +1,183 @@
+"""
+Exportación de Consumo por streaming, en CSV o Parquet.
+
+Las filas se leen con un cursor del lado del servidor (QuerySet.iterator(chunk_size=...))
+y se escriben bloque a bloque: la memoria no depende del tamaño del rango y la respuesta
+empieza a salir apenas llega el primer bloque.
+
+En PostgreSQL el recorrido va dentro de una transacción: en autocommit Django declara el
+cursor WITH HOLD y el servidor materializa el resultado completo antes de entregar la
+primera fila.
+
+Los meses archivados en Parquet (core.archivo) no están en la tabla: se leen enteros con
+archivo.leer(), que los mezcla con las lecturas que llegaron después de archivarlos, y se
+escriben en el mismo orden que el resto. Un mes archivado ocupa memoria; uno vivo, no.
+
+El CSV usa ';' y BOM (utf-8-sig), para que Excel lo abra bien, con las columnas y el
+formato de fecha de ConsumoResource: se puede reimportar desde el admin. Parquet
+requiere pyarrow, que es opcional.
+"""
+import csv
+import importlib.util
+import io
+import logging
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import archivo
+from .models import Consumo, Medidor
+from .particiones import consumos_en_rango, sumar_meses
+
+logger = logging.getLogger(__name__)
+
+FILAS_POR_BLOQUE = 10000
+# Un row group de Parquet por bloque; más grande que el de CSV porque comprime mejor.
+FILAS_POR_GRUPO = 100000
+COLUMNAS = ('fecha', 'consumo', 'medidor')
+FORMATO_FECHA = '%m/%d/%Y %H:%M'
+PARQUET_DISPONIBLE = importlib.util.find_spec('pyarrow') is not None
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def consumos_a_exportar(desde, hasta, medidores=None, tipos_medidor=None):
+    """Consumo con fecha en [desde, hasta), en el orden del índice único (fecha, medidor_id)."""
+    qs = consumos_en_rango(desde, hasta, medidores or None)
+    if tipos_medidor:
+        qs = qs.filter(medidor__tipo_medidor__in=tipos_medidor)
+    return qs.order_by('fecha', 'medidor_id')
+
+
+class Lecturas:
+    """
+    Lecturas de Consumo en [desde, hasta) por fecha y medidor, como consumos_a_exportar() pero
+    con los meses archivados: bloques() las entrega en listas de (fecha, consumo, medidor_id).
+    """
+
+    def __init__(self, desde, hasta, medidores=None, tipos_medidor=None):
+        self.desde, self.hasta = desde, hasta
+        self.medidores, self.tipos_medidor = medidores, tipos_medidor
+        self.db = Consumo.objects.db
+
+    def bloques(self, filas_por_bloque):
+        # Tramos vivos y meses archivados alternados, en orden de fecha.
+        tramos, inicio = [], self.desde
+        for mes in archivo.meses_archivados(self.desde, self.hasta):
+            desde_mes, hasta_mes = max(mes, self.desde), min(sumar_meses(mes, 1), self.hasta)
+            tramos += [(inicio, desde_mes, False), (desde_mes, hasta_mes, True)]
+            inicio = hasta_mes
+        tramos.append((inicio, self.hasta, False))
+        for desde, hasta, archivado in tramos:
+            if desde >= hasta:
+                continue
+            if archivado:
+                yield from self._bloques_archivados(desde, hasta, filas_por_bloque)
+            else:
+                yield from _bloques(consumos_a_exportar(desde, hasta, self.medidores, self.tipos_medidor), filas_por_bloque)
+
+    def _bloques_archivados(self, desde, hasta, filas_por_bloque):
+        medidores = None
+        if self.medidores or self.tipos_medidor:
+            qs = Medidor.objects.all()
+            if self.medidores:
+                qs = qs.filter(pk__in=self.medidores)
+            if self.tipos_medidor:
+                qs = qs.filter(tipo_medidor__in=self.tipos_medidor)
+            medidores = list(qs.values_list('pk', flat=True))
+        df = archivo.leer(desde, hasta, medidores).sort_values(['fecha', 'medidor'], kind='stable', ignore_index=True)
+        filas = zip(
+            df['fecha'].dt.to_pydatetime().tolist(),
+            df['consumo'].astype(object).where(df['consumo'].notna(), None).tolist(),
+            df['medidor'].tolist(),
+        )
+        while bloque := list(islice(filas, filas_por_bloque)):
+            yield bloque
+
+
+def _bloques(queryset, filas_por_bloque):
+    filas = queryset.values_list('fecha', 'consumo', 'medidor_id').iterator(chunk_size=filas_por_bloque)
+    while bloque := list(islice(filas, filas_por_bloque)):
+        yield bloque
+
+
+class _Buffer:
+    """Destino de escritura que entrega y descarta lo escrito en cada vaciar()."""
+
+    closed = False
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b''.join(self.partes)
+        self.partes = []
+        return datos
+
+
+def generar_csv(lecturas, filas_por_bloque=FILAS_POR_BLOQUE):
+    """Genera el CSV en trozos de bytes; el primero (BOM y encabezado) sale antes de consultar."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';', lineterminator='\r\n')
+    escritor.writerow(COLUMNAS)
+    yield buffer.getvalue().encode('utf-8-sig')
+
+    zona = timezone.get_current_timezone()
+    filas = 0
+    with transaction.atomic(using=lecturas.db):
+        for bloque in lecturas.bloques(filas_por_bloque):
+            buffer.seek(0)
+            buffer.truncate()
+            escritor.writerows(
+                (fecha.astimezone(zona).strftime(FORMATO_FECHA), consumo, medidor)
+                for fecha, consumo, medidor in bloque
+            )
+            filas += len(bloque)
+            yield buffer.getvalue().encode('utf-8')
+    logger.info(f"Exportación CSV de Consumo: {filas} filas.")
+
+
+def generar_parquet(lecturas, filas_por_grupo=FILAS_POR_GRUPO):
+    """Genera un archivo Parquet en trozos de bytes, un row group por bloque."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    esquema = pa.schema([
+        ('fecha', pa.timestamp('us', tz='UTC')),
+        ('consumo', pa.float64()),
+        ('medidor', pa.int64()),
+    ])
+    destino = _Buffer()
+    escritor = pq.ParquetWriter(destino, esquema)
+    filas = 0
+    try:
+        with transaction.atomic(using=lecturas.db):
+            for bloque in lecturas.bloques(filas_por_grupo):
+                escritor.write_table(pa.Table.from_arrays(
+                    [pa.array(columna, type=campo.type) for columna, campo in zip(zip(*bloque), esquema)],
+                    schema=esquema,
+                ))
+                filas += len(bloque)
+                yield destino.vaciar()
+    finally:
+        # Cierra el archivo con el pie de metadatos (también si el cliente cortó la descarga).
+        escritor.close()
+    yield destino.vaciar()
+    logger.info(f"Exportación Parquet de Consumo: {filas} filas.")
+
+
+def generar(lecturas, formato):
+    if formato == 'parquet':
+        return generar_parquet(lecturas)
+    return generar_csv(lecturas)
@@ -0,0 +1,171 @@
+"""
+Parser de la columna 'fecha' de las importaciones de consumo.
+
+En lugar de encadenar varios pd.to_datetime sobre lo que va fallando, se toma
+una muestra de la columna, se detecta qué formatos aparecen y se parsea cada
+grupo en una sola pasada vectorizada con su formato exacto. Los formatos
+detectados se recuerdan por medidor en el alias CACHE_FORMATOS_FECHA de settings
+('formatos_fecha', o 'default' si no está configurado), así una nueva carga de los
+mismos medidores no repite la detección. Ese backend tiene que ser compartido entre
+procesos (en disco, Redis o Memcached): las importaciones corren en los workers de
+procesar_importaciones y con LocMemCache cada una empezaría sin formatos.
+
+Las fechas sin zona horaria se interpretan en settings.TIME_ZONE y se
+devuelven en UTC (USE_TZ=True).
+"""
+import hashlib
+import logging
+import re
+
+import pandas as pd
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# (formato strptime, expresión regular que lo reconoce). El orden es la preferencia ante empates.
+FORMATOS_CANDIDATOS = [
+    ('%d/%m/%Y %H:%M', r'\d{1,2}/\d{1,2}/\d{4} \d{1,2}:\d{2}'),
+    ('%d/%m/%Y %H:%M:%S', r'\d{1,2}/\d{1,2}/\d{4} \d{1,2}:\d{2}:\d{2}'),
+    ('%d/%m/%Y %H', r'\d{1,2}/\d{1,2}/\d{4} \d{1,2}'),
+    ('%d/%m/%Y', r'\d{1,2}/\d{1,2}/\d{4}'),
+    ('%d-%m-%Y %H:%M', r'\d{1,2}-\d{1,2}-\d{4} \d{1,2}:\d{2}'),
+    ('%d-%m-%Y', r'\d{1,2}-\d{1,2}-\d{4}'),
+    ('%Y-%m-%d %H:%M:%S', r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}'),
+    ('%Y-%m-%d %H:%M', r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}'),
+    ('%Y-%m-%d', r'\d{4}-\d{2}-\d{2}'),
+    ('ISO8601', r'\d{4}-\d{2}-\d{2}T[\d:.]+(Z|[+-]\d{2}:?\d{2})?'),
+]
+REGEX_POR_FORMATO = {formato: re.compile(regex) for formato, regex in FORMATOS_CANDIDATOS}
+TAMANO_MUESTRA = 500
+CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def backend():
+    alias = getattr(settings, 'CACHE_FORMATOS_FECHA', 'formatos_fecha')
+    return caches[alias if alias in settings.CACHES else 'default']
+
+
+def _clave_cache(medidor):
+    # Los nombres de medidor pueden tener espacios o caracteres no válidos para memcached.
+    return 'importacion:formato_fecha:' + hashlib.md5(str(medidor).encode('utf-8')).hexdigest()
+
+
+def detectar_formatos(texto, tamano_muestra=TAMANO_MUESTRA):
+    """Formatos candidatos presentes en una muestra de `texto`, del más al menos frecuente."""
+    muestra = pd.Series(texto.dropna().unique()[:tamano_muestra])
+    if muestra.empty:
+        return []
+    conteos = []
+    for formato, regex in FORMATOS_CANDIDATOS:
+        coincidencias = int(muestra.str.fullmatch(regex).sum())
+        if coincidencias:
+            conteos.append((coincidencias, formato))
+    # sorted es estable: ante empates se respeta el orden de FORMATOS_CANDIDATOS.
+    return [formato for _, formato in sorted(conteos, key=lambda c: -c[0])]
+
+
+class ParserFechas:
+    """
+    Parser de fechas para una importación. Se crea uno por archivo y se reutiliza en todos
+    sus bloques, así la detección de formatos se hace una sola vez.
+    """
+
+    def __init__(self, zona=None, usar_cache=True):
+        self.zona = zona or timezone.get_default_timezone()
+        self.usar_cache = usar_cache
+        self.formatos = []
+        self.detecciones = 0  # Cuántas veces hubo que muestrear la columna
+
+    def parse(self, serie, medidores=None):
+        """Devuelve una Serie datetime64 en UTC alineada con `serie`; NaT donde no se pudo interpretar."""
+        resultado = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns, UTC]')
+        if serie.empty:
+            return resultado
+
+        es_texto = self._mascara_texto(serie)
+        # Celdas que ya vienen como fecha (p. ej. desde Excel): solo hay que localizarlas.
+        otras = ~es_texto & serie.notna()
+        if otras.any():
+            resultado[otras] = self._a_utc(pd.to_datetime(serie[otras], errors='coerce'))
+
+        texto = serie[es_texto].astype(str).str.strip()
+        if texto.empty:
+            return resultado
+
+        if not self.formatos and self.usar_cache and medidores is not None:
+            self.formatos = self._formatos_en_cache(medidores[es_texto])
+
+        pendientes = pd.Series(True, index=texto.index)
+        usados = {}
+        for intento in range(2):
+            for formato in self.formatos:
+                if not pendientes.any():
+                    break
+                parsed = self._parse_formato(texto[pendientes], formato)
+                ok = parsed.notna()
+                if ok.any():
+                    indices = ok[ok].index
+                    resultado[indices] = parsed[indices]
+                    pendientes[indices] = False
+                    usados[formato] = indices
+            if intento == 1 or not pendientes.any():
+                break
+            # Quedan valores sin formato conocido: se muestrean solo esos y se agregan los formatos nuevos.
+            nuevos = [f for f in detectar_formatos(texto[pendientes]) if f not in self.formatos]
+            self.detecciones += 1
+            if not nuevos:
+                break
+            logger.debug(f"Formatos de fecha detectados: {nuevos}")
+            self.formatos.extend(nuevos)
+
+        if pendientes.any():
+            indices = pendientes[pendientes].index
+            resultado[indices] = self._parse_generico(texto[indices])
+
+        if self.usar_cache and medidores is not None and usados:
+            self._guardar_en_cache(medidores, usados)
+        return resultado
+
+    def _parse_generico(self, texto):
+        """Último recurso para lo que no coincide con ningún formato: inferencia sobre los valores únicos."""
+        unicos = pd.Series(texto.unique())
+        try:
+            parsed = self._a_utc(pd.to_datetime(unicos, format='mixed', dayfirst=True, errors='coerce'))
+        except (ValueError, TypeError):
+            # Mezcla de fechas con y sin zona horaria: se interpretan todas como UTC.
+            parsed = pd.to_datetime(unicos, format='mixed', dayfirst=True, utc=True, errors='coerce')
+        return texto.map(pd.Series(parsed.array, index=unicos)).astype('datetime64[ns, UTC]')
+
+    def _parse_formato(self, texto, formato):
+        if formato == 'ISO8601':
+            return pd.to_datetime(texto, format='ISO8601', utc=True, errors='coerce')
+        return self._a_utc(pd.to_datetime(texto, format=formato, errors='coerce'))
+
+    def _a_utc(self, fechas):
+        if fechas.dt.tz is None:
+            # Horas inexistentes o ambiguas por cambio de horario quedan como NaT (fila rechazada).
+            fechas = fechas.dt.tz_localize(self.zona, ambiguous='NaT', nonexistent='NaT')
+        return fechas.dt.tz_convert('UTC')
+
+    @staticmethod
+    def _mascara_texto(serie):
+        if pd.api.types.infer_dtype(serie, skipna=True) in ('string', 'empty'):
+            return serie.notna()
+        return serie.map(lambda v: isinstance(v, str)).astype(bool)
+
+    def _formatos_en_cache(self, medidores):
+        claves = [_clave_cache(m) for m in medidores.dropna().unique()]
+        if not claves:
+            return []
+        conteo = pd.Series(list(backend().get_many(claves).values()), dtype=object).value_counts()
+        return [f for f in conteo.index if f in REGEX_POR_FORMATO]
+
+    def _guardar_en_cache(self, medidores, usados):
+        valores = {}
+        # Se recorren de menos a más usado para que, si un medidor tiene varios, quede el más frecuente.
+        for formato, indices in sorted(usados.items(), key=lambda item: len(item[1])):
+            for medidor in medidores[indices].dropna().unique():
+                valores[_clave_cache(medidor)] = formato
+        backend().set_many(valores, timeout=CACHE_TIMEOUT)
@@ -0,0 +1,159 @@
+"""
+Motor de importación por bloques (streaming) para archivos de consumo.
+
+El archivo se lee en bloques de tamaño acotado; cada bloque se valida y se
+convierte con operaciones vectorizadas sobre columnas y se vuelca a la tabla
+de staging (InterfaceConsumo, ver core/staging.py) antes de leer el siguiente. Así la memoria pico
+no depende del tamaño del archivo.
+"""
+import csv
+import logging
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from .fechas import ParserFechas
+from .instrumentacion import etapa
+from .validacion import validar_bloque, describir_rechazos
+
+logger = logging.getLogger(__name__)
+
+COLUMNAS_REQUERIDAS = ['fecha', 'consumo', 'medidor']  # Nombres de columnas en Excel/CSV
+EXTENSIONES_SOPORTADAS = ('.xlsx', '.xls', '.csv')
+TAMANO_BLOQUE = 50_000
+MAX_EJEMPLOS_ERROR = 20  # Solo guardamos unos pocos mensajes; el resto se cuenta
+
+
+class FormatoNoSoportado(ValueError):
+    pass
+
+
+class ColumnasFaltantes(ValueError):
+    def __init__(self, faltantes):
+        self.faltantes = faltantes
+        super().__init__(f"Columnas faltantes en el archivo: {', '.join(faltantes)}. Se requieren: {', '.join(COLUMNAS_REQUERIDAS)}")
+
+
+@dataclass
+class ResultadoImportacion:
+    """Contadores acumulados durante una importación por bloques."""
+    filas_leidas: int = 0
+    filas_validas: int = 0
+    filas_rechazadas: int = 0
+    filas_staging: int = 0
+    filas_duplicadas: int = 0  # Duplicados (fecha, medidor) dentro del archivo
+    bloques: int = 0
+    errores: list = field(default_factory=list)  # Ejemplos de errores (acotado)
+    rechazos_por_motivo: dict = field(default_factory=dict)
+
+    def agregar_rechazos(self, rechazos):
+        self.filas_rechazadas += len(rechazos)
+        for motivo, cantidad in rechazos['motivo'].value_counts().items():
+            self.rechazos_por_motivo[motivo] = self.rechazos_por_motivo.get(motivo, 0) + int(cantidad)
+        espacio = MAX_EJEMPLOS_ERROR - len(self.errores)
+        if espacio > 0:
+            self.errores.extend(describir_rechazos(rechazos, espacio))
+
+
+def iter_bloques(archivo, nombre, tamano_bloque=TAMANO_BLOQUE):
+    """Genera DataFrames de como máximo `tamano_bloque` filas, todas las columnas como texto."""
+    nombre = nombre.lower()
+    if nombre.endswith('.csv'):
+        separador = detectar_separador(archivo)
+        yield from pd.read_csv(archivo, encoding='utf-8-sig', sep=separador, dtype=str, chunksize=tamano_bloque)
+    elif nombre.endswith('.xlsx'):
+        yield from _iter_bloques_xlsx(archivo, tamano_bloque)
+    elif nombre.endswith('.xls'):
+        # xlrd no permite lectura incremental: se lee la hoja completa y se parte en bloques.
+        df = pd.read_excel(archivo, engine='xlrd', dtype=object)
+        for inicio in range(0, len(df), tamano_bloque):
+            yield df.iloc[inicio:inicio + tamano_bloque]
+    else:
+        raise FormatoNoSoportado("Formato de archivo no soportado. Use .xlsx, .xls o .csv.")
+
+
+def detectar_separador(archivo, muestra=64 * 1024):
+    """Detecta una sola vez por archivo el separador del CSV (',' por defecto) y rebobina el archivo."""
+    datos = archivo.read(muestra)
+    archivo.seek(0)
+    completo = len(datos) < muestra
+    if isinstance(datos, bytes):
+        datos = datos.decode('utf-8-sig', errors='ignore')
+    lineas = datos.splitlines()
+    if not completo:
+        lineas = lineas[:-1]  # La última línea puede haber quedado cortada por el tamaño de la muestra.
+    try:
+        return csv.Sniffer().sniff('\n'.join(lineas[:50]), delimiters=',;\t|').delimiter
+    except csv.Error:
+        return ','
+
+
+def _iter_bloques_xlsx(archivo, tamano_bloque):
+    from openpyxl import load_workbook
+
+    # read_only=True hace que openpyxl recorra el XML de la hoja sin cargarla entera.
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        filas = libro.active.iter_rows(values_only=True)
+        encabezados = next(filas, None)
+        if encabezados is None:
+            return
+        columnas = [str(c).strip() if c is not None else '' for c in encabezados]
+        buffer = []
+        for fila in filas:
+            buffer.append(fila)
+            if len(buffer) >= tamano_bloque:
+                yield pd.DataFrame.from_records(buffer, columns=columnas)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame.from_records(buffer, columns=columnas)
+    finally:
+        libro.close()
+
+
+def importar_a_staging(archivo, nombre, cargador, tamano_bloque=TAMANO_BLOQUE, progreso=None, rechazos=None):
+    """
+    Lee el archivo por bloques, valida cada bloque y lo vuelca a staging con `cargador`
+    (normalmente un CargadorStaging del lote de la importación).
+
+    `progreso`, si se indica, se llama con el ResultadoImportacion parcial después de cada bloque;
+    `rechazos` recibe la tabla de filas rechazadas (fila, motivo, valor) de cada bloque.
+    Cada paso se mide como una etapa de core.instrumentacion (lectura, validacion, staging...).
+    """
+    resultado = ResultadoImportacion()
+    parser_fechas = ParserFechas()
+    bloques = iter_bloques(archivo, nombre, tamano_bloque)
+    while True:
+        with etapa('lectura') as medida:
+            bloque = next(bloques, None)
+            if bloque is None:
+                break
+            medida.filas += len(bloque)
+        if resultado.bloques == 0:
+            faltantes = [col for col in COLUMNAS_REQUERIDAS if col not in bloque.columns]
+            if faltantes:
+                raise ColumnasFaltantes(faltantes)
+
+        with etapa('validacion') as medida:
+            limpio, tabla_rechazos = validar_bloque(bloque, resultado.filas_leidas, parser_fechas)
+            medida.filas += len(bloque)
+        with etapa('staging') as medida:
+            cargador.cargar(limpio)
+            medida.filas += len(limpio)
+        if rechazos is not None and not tabla_rechazos.empty:
+            with etapa('rechazos') as medida:
+                rechazos(tabla_rechazos)
+                medida.filas += len(tabla_rechazos)
+
+        resultado.bloques += 1
+        resultado.filas_leidas += len(bloque)
+        resultado.filas_validas += len(limpio)
+        resultado.filas_staging = cargador.insertadas
+        resultado.filas_duplicadas = cargador.duplicadas
+        resultado.agregar_rechazos(tabla_rechazos)
+        logger.debug(f"Bloque {resultado.bloques}: {len(bloque)} filas leídas, {len(limpio)} válidas.")
+        if progreso is not None:
+            with etapa('progreso'):
+                progreso(resultado)
+
+    return resultado
@@ -0,0 +1,358 @@
+"""
+Ingesta masiva de lecturas (DocumentoMedicion) enviadas por colectores de campo (/api/lecturas/).
+
+El cuerpo es JSON por líneas (un objeto por lectura) o CSV con encabezado, con los campos
+punto (numero_interno de PuntoMedicion), fecha (ISO 8601; sin zona se toma la del proyecto)
+y valor, y opcionalmente lectura_contador, unidad y observaciones. Se lee en bloques de
+FILAS_POR_LOTE: cada bloque se valida por columnas, como en core.validacion, y se escribe en
+su propia transacción, así un envío grande no se guarda entero en memoria ni retiene una
+transacción larga.
+
+Los puntos se resuelven contra un diccionario {numero_interno: (unidad, es_contador)} guardado
+en el backend de core.cache_consultas y borrado por las señales de PuntoMedicion y
+CaracteristicaMedicion. Si una lectura trae unidad, tiene que ser la de la característica
+del punto.
+
+La escritura es idempotente sobre (punto_medicion, fecha_hora_lectura): reenviar un lote no
+duplica lecturas, y con `sobrescribir` las existentes toman los valores nuevos. En PostgreSQL
+cada bloque va por COPY a una tabla temporal y de ahí a DocumentoMedicion con un
+INSERT ... ON CONFLICT, como en core.staging; en otros motores, con executemany. Como no pasa
+por save(), los consumos de contador (core.contadores) se recalculan una vez al final.
+"""
+import io
+import json
+import logging
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from django.db import connection as default_connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import contadores
+from .cache_consultas import backend
+from .models import CaracteristicaMedicion, DocumentoMedicion, PuntoMedicion
+from .staging import _copy_from_buffer
+
+logger = logging.getLogger(__name__)
+
+FILAS_POR_LOTE = 10000
+# Rechazos que se devuelven fila por fila; del resto solo se cuentan los motivos.
+MAX_RECHAZOS = 1000
+CAMPOS = ['punto', 'fecha', 'valor', 'lectura_contador', 'unidad', 'observaciones']
+FORMATOS = {
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+}
+MOTIVOS = {
+    'json_invalido': "La línea no es un objeto JSON válido",
+    'punto_invalido': "Valor de 'punto' no es un número de punto válido",
+    'punto_desconocido': "El punto de medición no existe",
+    'fecha_invalida': "Fecha no pudo ser procesada (use ISO 8601)",
+    'valor_invalido': "Valor de 'valor' no es un número válido",
+    'lectura_contador_invalida': "Valor de 'lectura_contador' no es un número válido",
+    'unidad_incorrecta': "La unidad no es la de la característica del punto",
+    'duplicado': "Lectura repetida (punto, fecha) dentro del envío",
+}
+CLAVE_PUNTOS = 'ingesta:puntos'
+TABLA_TEMPORAL = '_carga_documento_medicion'
+# Fechas con hora y zona explícita (Z, +hh, +hh:mm o +hhmm).
+CON_ZONA = r'[T ]\d{2}:\d{2}.*(?:Z|[+-]\d{2}(?::?\d{2})?)$'
+
+
+def puntos_conocidos():
+    """{numero_interno: (unidad en minúsculas, es_contador)} de todos los puntos, cacheado."""
+    cache = backend()
+    puntos = cache.get(CLAVE_PUNTOS)
+    if puntos is None:
+        puntos = {
+            numero: (unidad.strip().casefold(), es_contador)
+            for numero, unidad, es_contador in PuntoMedicion.objects.values_list(
+                'numero_interno', 'caracteristica__unidad_medida', 'es_contador')
+        }
+        cache.set(CLAVE_PUNTOS, puntos)
+    return puntos
+
+
+@receiver(post_save, sender=PuntoMedicion)
+@receiver(post_delete, sender=PuntoMedicion)
+@receiver(post_save, sender=CaracteristicaMedicion)
+@receiver(post_delete, sender=CaracteristicaMedicion)
+def _invalidar_puntos(sender, **kwargs):
+    backend().delete(CLAVE_PUNTOS)
+
+
+def formato(content_type):
+    """'ndjson', 'csv' o None según el Content-Type (sin parámetros como charset)."""
+    return FORMATOS.get((content_type or '').split(';')[0].strip().lower())
+
+
+def leer_bloques(archivo, formato):
+    """Bloques de `archivo`: DataFrames con CAMPOS (como texto u objeto) y '_fila', el número de fila en el envío."""
+    if formato == 'csv':
+        # +2: encabezado y base 1, como en los rechazos de las importaciones de consumo.
+        fila = 2
+        for df in pd.read_csv(_Flujo(archivo), dtype=str, chunksize=FILAS_POR_LOTE, skipinitialspace=True, encoding='utf-8-sig'):
+            yield df.reindex(columns=CAMPOS).assign(_fila=np.arange(fila, fila + len(df)))
+            fila += len(df)
+        return
+    lineas = []
+    for numero, linea in enumerate(archivo, start=1):
+        if linea.strip():
+            lineas.append((numero, linea))
+        if len(lineas) == FILAS_POR_LOTE:
+            yield _objetos(lineas)
+            lineas = []
+    if lineas:
+        yield _objetos(lineas)
+
+
+class _Flujo:
+    """Solo lectura de bytes: pandas rechaza un HttpRequest porque su atributo encoding no es el del lector."""
+
+    def __init__(self, archivo):
+        self.archivo = archivo
+
+    def read(self, *args):
+        return self.archivo.read(*args)
+
+    def __iter__(self):
+        return iter(self.archivo)
+
+
+def _objetos(lineas):
+    # El lector de pandas (en C) parsea el bloque entero; solo si alguna línea es inválida se
+    # parsea línea por línea para rechazar únicamente esas.
+    texto = [linea.decode('utf-8', 'replace') if isinstance(linea, bytes) else linea for _, linea in lineas]
+    try:
+        df = pd.read_json(io.StringIO('\n'.join(t.strip() for t in texto)), lines=True, dtype=False, convert_dates=False)
+        if len(df) != len(lineas) or '0' in df.columns or 0 in df.columns:
+            raise ValueError("líneas que no son objetos")
+    except ValueError:
+        registros = []
+        for linea in texto:
+            try:
+                objeto = json.loads(linea)
+            except ValueError:
+                objeto = None
+            # Queda como fila vacía con la marca para rechazarla en validar_bloque().
+            registros.append(objeto if isinstance(objeto, dict) else {'_invalida': linea.strip()[:100]})
+        df = pd.DataFrame.from_records(registros)
+    df = df.reindex(columns=CAMPOS + (['_invalida'] if '_invalida' in df.columns else []))
+    return df.assign(_fila=[numero for numero, _ in lineas])
+
+
+def validar_bloque(df, puntos):
+    """
+    Valida un bloque por columnas. Devuelve (DataFrame válido con punto/fecha/valor/lectura/
+    observaciones, DataFrame de rechazos fila/motivo/valor); cada fila se rechaza por el primer motivo.
+    """
+    df = df.reset_index(drop=True)
+    numero_fila = df['_fila'].to_numpy()
+    invalida = df['_invalida'].notna().to_numpy() if '_invalida' in df.columns else np.zeros(len(df), dtype=bool)
+
+    numeros = pd.to_numeric(df['punto'], errors='coerce')
+    punto_valido = numeros.notna() & (numeros == numeros.round())
+    punto = numeros.where(punto_valido).astype('Int64')
+    unidad_punto = punto.map(lambda p: puntos[p][0] if p in puntos else None, na_action='ignore')
+    fechas = _fechas(df['fecha'])
+    valores = pd.to_numeric(df['valor'], errors='coerce').astype('float64')
+    lecturas = pd.to_numeric(df['lectura_contador'], errors='coerce').astype('float64')
+    unidades = df['unidad'].astype('string').str.strip().str.casefold()
+
+    chequeos = [
+        ('json_invalido', '_invalida', invalida),
+        ('punto_invalido', 'punto', ~punto_valido.to_numpy()),
+        ('punto_desconocido', 'punto', unidad_punto.isna().to_numpy()),
+        ('fecha_invalida', 'fecha', fechas.isna().to_numpy()),
+        ('valor_invalido', 'valor', ~np.isfinite(valores.to_numpy())),
+        ('lectura_contador_invalida', 'lectura_contador', (df['lectura_contador'].notna() & ~np.isfinite(lecturas)).to_numpy()),
+        ('unidad_incorrecta', 'unidad',
+         (unidades.notna() & (unidades != '') & (unidades != unidad_punto)).to_numpy(dtype=bool, na_value=False)),
+    ]
+    rechazada = np.zeros(len(df), dtype=bool)
+    partes = []
+    for motivo, columna, mascara in chequeos:
+        nuevas = mascara & ~rechazada
+        if nuevas.any():
+            partes.append(_tabla_rechazos(numero_fila[nuevas], motivo, df[columna].to_numpy()[nuevas]))
+            rechazada |= nuevas
+
+    limpio = pd.DataFrame({
+        'punto': punto[~rechazada].astype('int64'),
+        'fecha': fechas[~rechazada],
+        'valor': valores[~rechazada],
+        'lectura': lecturas[~rechazada],
+        'observaciones': df['observaciones'][~rechazada].astype(object),
+    })
+    duplicada = limpio.duplicated(['punto', 'fecha'], keep='first').to_numpy()
+    if duplicada.any():
+        partes.append(_tabla_rechazos(
+            numero_fila[~rechazada][duplicada], 'duplicado',
+            (limpio['punto'].astype(str) + ' / ' + limpio['fecha'].astype(str)).to_numpy()[duplicada],
+        ))
+        limpio = limpio[~duplicada]
+
+    if partes:
+        rechazos = pd.concat(partes, ignore_index=True).sort_values('fila', kind='stable', ignore_index=True)
+    else:
+        rechazos = pd.DataFrame(columns=['fila', 'motivo', 'valor'])
+    return limpio, rechazos
+
+
+def _tabla_rechazos(filas, motivo, valores):
+    return pd.DataFrame({'fila': filas, 'motivo': motivo, 'valor': pd.Series(valores, dtype=object).astype(str)})
+
+
+def _fechas(serie):
+    """Fechas ISO 8601 en UTC; las que no traen zona se toman en la zona del proyecto. NaT si no se entienden."""
+    texto = serie.astype('string').str.strip()
+    con_zona = texto.str.contains(CON_ZONA, regex=True, na=False)
+    fechas = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns, UTC]')
+    if con_zona.any():
+        fechas[con_zona] = pd.to_datetime(texto[con_zona], format='ISO8601', utc=True, errors='coerce')
+    sin_zona = ~con_zona & texto.notna()
+    if sin_zona.any():
+        locales = pd.to_datetime(texto[sin_zona], format='ISO8601', errors='coerce')
+        fechas[sin_zona] = locales.dt.tz_localize(
+            timezone.get_current_timezone(), ambiguous='NaT', nonexistent='NaT').dt.tz_convert('UTC')
+    return fechas
+
+
+class CargadorLecturas:
+    """Escribe bloques validados en DocumentoMedicion, uno por transacción, y acumula conteos."""
+
+    def __init__(self, sobrescribir=False, connection=None):
+        self.sobrescribir = sobrescribir
+        self.connection = connection or default_connection
+        self.tabla = DocumentoMedicion._meta.db_table
+        self.insertadas = 0
+        self.actualizadas = 0
+        self.duplicadas = 0
+
+    @property
+    def conflicto(self):
+        if self.sobrescribir:
+            return ("DO UPDATE SET valor_leido = EXCLUDED.valor_leido, lectura_contador = EXCLUDED.lectura_contador, "
+                    "observaciones = EXCLUDED.observaciones")
+        return "DO NOTHING"
+
+    def cargar(self, df):
+        if df.empty:
+            return 0
+        with transaction.atomic(using=self.connection.alias):
+            if self.connection.vendor == 'postgresql':
+                insertadas, actualizadas = self._cargar_copy(df)
+            else:
+                insertadas, actualizadas = self._cargar_executemany(df)
+        self.insertadas += insertadas
+        self.actualizadas += actualizadas
+        self.duplicadas += len(df) - insertadas - actualizadas
+        return insertadas
+
+    def _cargar_copy(self, df):
+        buffer = io.StringIO()
+        # Las fechas van como microsegundos desde la época: formatear enteros es varias veces más
+        # rápido que formatear fechas, aun sin zona.
+        df.assign(fecha=df['fecha'].dt.as_unit('us').astype('int64'))[
+            ['punto', 'fecha', 'valor', 'lectura', 'observaciones']
+        ].to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {TABLA_TEMPORAL} (punto integer, fecha bigint, "
+                f"valor double precision, lectura double precision, observaciones text) ON COMMIT DROP"
+            )
+            cursor.execute(f"TRUNCATE {TABLA_TEMPORAL}")
+            _copy_from_buffer(
+                cursor, f"COPY {TABLA_TEMPORAL} (punto, fecha, valor, lectura, observaciones) FROM STDIN WITH (FORMAT csv)", buffer)
+            # xmax = 0 en la fila devuelta: la insertó esta sentencia; si no, la actualizó el ON CONFLICT.
+            cursor.execute(
+                f"WITH afectadas AS ("
+                f"INSERT INTO {self.tabla} (punto_medicion_id, fecha_hora_lectura, valor_leido, lectura_contador, observaciones) "
+                f"SELECT punto, TIMESTAMPTZ 'epoch' + fecha * INTERVAL '1 microsecond', valor, lectura, observaciones FROM {TABLA_TEMPORAL} "
+                f"ON CONFLICT (punto_medicion_id, fecha_hora_lectura) {self.conflicto} RETURNING xmax = 0 AS insertada) "
+                f"SELECT COUNT(*) FILTER (WHERE insertada), COUNT(*) FILTER (WHERE NOT insertada) FROM afectadas"
+            )
+            return cursor.fetchone()
+
+    def _cargar_executemany(self, df):
+        adapt = self.connection.ops.adapt_datetimefield_value
+        puntos = sorted(set(df['punto'].tolist()))
+        contar = f"SELECT COUNT(*) FROM {self.tabla} WHERE punto_medicion_id IN ({', '.join(['%s'] * len(puntos))})"
+        filas = zip(
+            df['punto'].tolist(),
+            [adapt(f) for f in df['fecha'].dt.to_pydatetime()],
+            df['valor'].tolist(),
+            [None if pd.isna(v) else v for v in df['lectura'].tolist()],
+            [None if pd.isna(v) else v for v in df['observaciones'].tolist()],
+        )
+        with self.connection.cursor() as cursor:
+            cursor.execute(contar, puntos)
+            antes = cursor.fetchone()[0]
+            cursor.executemany(
+                f"INSERT INTO {self.tabla} (punto_medicion_id, fecha_hora_lectura, valor_leido, lectura_contador, observaciones) "
+                f"VALUES (%s, %s, %s, %s, %s) ON CONFLICT (punto_medicion_id, fecha_hora_lectura) {self.conflicto}",
+                filas,
+            )
+            afectadas = cursor.rowcount
+            cursor.execute(contar, puntos)
+            insertadas = cursor.fetchone()[0] - antes
+        return insertadas, afectadas - insertadas
+
+
+def ingestar(archivo, formato, sobrescribir=False, connection=None):
+    """
+    Valida y escribe las lecturas de `archivo` ('ndjson' o 'csv'). Devuelve los conteos, los
+    rechazos por motivo y los primeros MAX_RECHAZOS rechazos fila por fila. Un CSV mal formado
+    corta la lectura: lo escrito hasta ahí queda y el motivo va en 'error'.
+    """
+    puntos = puntos_conocidos()
+    cargador = CargadorLecturas(sobrescribir, connection)
+    recibidas = 0
+    por_motivo = Counter()
+    rechazos = []
+    error = None
+    tocados, desde, hasta = set(), None, None
+    try:
+        for df in leer_bloques(archivo, formato):
+            recibidas += len(df)
+            validos, rechazados = validar_bloque(df, puntos)
+            por_motivo.update(rechazados['motivo'].tolist())
+            if len(rechazos) < MAX_RECHAZOS:
+                rechazos.extend(rechazados.head(MAX_RECHAZOS - len(rechazos)).to_dict('records'))
+            if validos.empty:
+                continue
+            cargador.cargar(validos)
+            contador = validos[validos['punto'].map(lambda p: puntos[p][1]).astype(bool)]
+            if not contador.empty:
+                tocados.update(contador['punto'].tolist())
+                primera, ultima = contador['fecha'].min().to_pydatetime(), contador['fecha'].max().to_pydatetime()
+                desde, hasta = min(desde or primera, primera), max(hasta or ultima, ultima)
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        error = f"El cuerpo no se pudo leer como {formato}: {e}"
+    if tocados:
+        contadores.recalcular(sorted(tocados), desde, hasta, connection=connection)
+
+    resultado = {
+        'recibidas': recibidas,
+        'insertadas': cargador.insertadas,
+        'actualizadas': cargador.actualizadas,
+        'duplicadas': cargador.duplicadas,
+        'rechazadas': sum(por_motivo.values()),
+        'rechazos_por_motivo': dict(por_motivo),
+        'rechazos': [
+            {'fila': int(r['fila']), 'motivo': r['motivo'], 'mensaje': MOTIVOS[r['motivo']], 'valor': r['valor']}
+            for r in rechazos
+        ],
+    }
+    if error:
+        resultado['error'] = error
+    logger.info(
+        f"Ingesta de lecturas: {recibidas} recibidas, {cargador.insertadas} insertadas, {cargador.actualizadas} "
+        f"actualizadas, {cargador.duplicadas} duplicadas, {resultado['rechazadas']} rechazadas."
+    )
+    return resultado
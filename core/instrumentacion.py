@@ -0,0 +1,291 @@
+"""
+Medición por etapa de las importaciones de consumo.
+
+Una importación corre dentro de `with Instrumentacion(...)`; el código de cada etapa se
+envuelve en `with etapa('nombre') as e:` y suma sus filas en `e.filas`. Por etapa se acumulan
+el tiempo de reloj, las filas, las consultas SQL (con un execute_wrapper de la conexión, sin
+depender de DEBUG) y el pico de memoria. Una misma etapa puede repetirse (una vez por bloque)
+y se suma; las etapas anidadas descuentan su tiempo de la que las contiene, y lo que no cae en
+ninguna etapa queda en 'otros', así las etapas suman el total sin contar dos veces.
+
+La memoria se mide según settings.INSTRUMENTACION_MEMORIA:
+
+- 'rss' (por defecto): pico de RSS del proceso, el VmHWM de Linux, que se reinicia en cada
+  etapa escribiendo en /proc/self/clear_refs. No cuesta nada, pero incluye todo el proceso
+  (Django, otros hilos). Fuera de Linux no se mide.
+- 'tracemalloc': pico de memoria asignada por Python y numpy desde el inicio de la
+  importación. Es más preciso pero duplica el tiempo de la validación y del staging: solo
+  para investigar una regresión puntual.
+- '' : no se mide.
+
+Al terminar se guarda un MedicionImportacion con sus EtapaImportacion, con la versión
+desplegada (settings.VERSION_DESPLIEGUE) para comparar antes y después de cada despliegue.
+metricas_prometheus() expone el historial en el formato de texto de Prometheus.
+
+etapa() fuera de una Instrumentacion no hace nada: importacion, validacion y staging la usan
+y funcionan igual desde la consola o los tests.
+"""
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connection as default_connection
+from django.db.models import Count, Max, Sum
+
+from .models import EtapaImportacion, MedicionImportacion
+
+logger = logging.getLogger(__name__)
+
+_actual = ContextVar('instrumentacion', default=None)
+
+
+@dataclass
+class Etapa:
+    """Acumulado de una etapa durante una importación."""
+    nombre: str
+    segundos: float = 0.0
+    filas: int = 0
+    consultas: int = 0
+    memoria_pico: int = 0
+    _hijos: float = 0.0
+
+
+class _SinMedicion:
+    filas = 0
+
+
+class _MemoriaRSS:
+    CLEAR_REFS = '/proc/self/clear_refs'
+
+    @classmethod
+    def disponible(cls):
+        return os.access(cls.CLEAR_REFS, os.W_OK)
+
+    def iniciar(self):
+        self.reiniciar()
+
+    def pico(self):
+        with open('/proc/self/status') as estado:
+            for linea in estado:
+                if linea.startswith('VmHWM:'):
+                    return int(linea.split()[1]) * 1024
+        return 0
+
+    def reiniciar(self):
+        # '5' solo reinicia el pico de RSS (ver proc(5)).
+        with open(self.CLEAR_REFS, 'w') as archivo:
+            archivo.write('5')
+
+    def detener(self):
+        pass
+
+
+class _MemoriaTracemalloc:
+    def iniciar(self):
+        # Si ya estaba activo (p. ej. con PYTHONTRACEMALLOC) no se lo detiene al final.
+        self._detener = not tracemalloc.is_tracing()
+        if self._detener:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+    def pico(self):
+        return tracemalloc.get_traced_memory()[1]
+
+    def reiniciar(self):
+        tracemalloc.reset_peak()
+
+    def detener(self):
+        if self._detener:
+            tracemalloc.stop()
+
+
+def _medidor_memoria():
+    modo = getattr(settings, 'INSTRUMENTACION_MEMORIA', 'rss')
+    if modo == 'tracemalloc':
+        return _MemoriaTracemalloc()
+    if modo == 'rss' and _MemoriaRSS.disponible():
+        return _MemoriaRSS()
+    return None
+
+
+class Instrumentacion:
+    """Mide las etapas de una importación y las guarda al salir del `with`."""
+
+    def __init__(self, origen, nombre='', importacion_id=None, connection=None):
+        self.origen = origen
+        self.nombre = nombre
+        self.importacion_id = importacion_id
+        self.connection = connection or default_connection
+        self.filas = 0
+        self.exito = True
+        self.etapas = {}
+        self.consultas = 0
+        self.medicion = None
+        self._pila = []
+        self._pico = 0
+
+    def __enter__(self):
+        self._token = _actual.set(self)
+        self._wrapper = self.connection.execute_wrapper(self._contar_consulta)
+        self._wrapper.__enter__()
+        self._memoria = _medidor_memoria()
+        if self._memoria:
+            self._memoria.iniciar()
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, *exc_info):
+        self.segundos = time.perf_counter() - self._inicio
+        self.memoria_pico = 0
+        if self._memoria:
+            self.memoria_pico = max(self._pico, self._memoria.pico())
+            self._memoria.detener()
+        self._wrapper.__exit__(None, None, None)
+        _actual.reset(self._token)
+        if tipo is not None:
+            self.exito = False
+        try:
+            self._guardar()
+        except Exception as e:
+            # La medición nunca debe tumbar la importación.
+            logger.warning(f"No se pudo guardar la medición de la importación {self.nombre}: {e}", exc_info=True)
+
+    def _contar_consulta(self, execute, sql, params, many, context):
+        self.consultas += 1
+        if self._pila:
+            self._pila[-1].consultas += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def etapa(self, nombre):
+        acumulado = self.etapas.setdefault(nombre, Etapa(nombre))
+        padre = self._pila[-1] if self._pila else None
+        if self._memoria:
+            pico = self._memoria.pico()
+            self._pico = max(self._pico, pico)
+            if padre is not None:
+                padre.memoria_pico = max(padre.memoria_pico, pico)
+            self._memoria.reiniciar()
+        hijos_antes = acumulado._hijos
+        self._pila.append(acumulado)
+        inicio = time.perf_counter()
+        try:
+            yield acumulado
+        finally:
+            duracion = time.perf_counter() - inicio
+            self._pila.pop()
+            # Tiempo propio: lo de las etapas anidadas se cuenta en ellas.
+            acumulado.segundos += duracion - (acumulado._hijos - hijos_antes)
+            if padre is not None:
+                padre._hijos += duracion
+            if self._memoria:
+                pico = self._memoria.pico()
+                self._pico = max(self._pico, pico)
+                acumulado.memoria_pico = max(acumulado.memoria_pico, pico)
+                if padre is not None:
+                    padre.memoria_pico = max(padre.memoria_pico, pico)
+                self._memoria.reiniciar()
+
+    def _guardar(self):
+        etapas = list(self.etapas.values())
+        resto = self.segundos - sum(e.segundos for e in etapas)
+        if etapas and resto > 0:
+            etapas.append(Etapa('otros', segundos=resto, consultas=self.consultas - sum(e.consultas for e in etapas)))
+        self.medicion = MedicionImportacion.objects.using(self.connection.alias).create(
+            importacion_id=self.importacion_id,
+            origen=self.origen,
+            nombre=self.nombre[:255],
+            version=getattr(settings, 'VERSION_DESPLIEGUE', '')[:100],
+            exito=self.exito,
+            filas=self.filas,
+            segundos=self.segundos,
+            consultas=self.consultas,
+            memoria_pico=self.memoria_pico,
+        )
+        EtapaImportacion.objects.using(self.connection.alias).bulk_create([
+            EtapaImportacion(
+                medicion=self.medicion, orden=orden, etapa=e.nombre, segundos=e.segundos, filas=e.filas,
+                consultas=e.consultas, memoria_pico=e.memoria_pico,
+            )
+            for orden, e in enumerate(etapas)
+        ])
+        detalle = ', '.join(f"{e.nombre} {e.segundos:.2f} s/{e.consultas} consultas" for e in etapas)
+        logger.info(
+            f"Importación {self.origen} {self.nombre}: {self.filas} filas en {self.segundos:.2f} s "
+            f"({self.medicion.filas_por_segundo:.0f} filas/s), {self.consultas} consultas, "
+            f"pico {self.memoria_pico / 2 ** 20:.1f} MiB. Etapas: {detalle or 'ninguna'}."
+        )
+
+
+@contextmanager
+def etapa(nombre):
+    """Mide el bloque como la etapa `nombre` de la Instrumentacion en curso, si hay una."""
+    actual = _actual.get()
+    if actual is None:
+        yield _SinMedicion()
+        return
+    with actual.etapa(nombre) as acumulado:
+        yield acumulado
+
+
+def _etiquetas(**valores):
+    texto = ','.join(
+        f'{k}="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for k, v in valores.items()
+    )
+    return '{' + texto + '}'
+
+
+def metricas_prometheus():
+    """Historial de mediciones en el formato de texto de Prometheus (0.0.4)."""
+    lineas = []
+
+    def metrica(nombre, tipo, ayuda, muestras):
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        lineas.extend(f"{nombre}{_etiquetas(**etiquetas)} {valor}" for etiquetas, valor in muestras)
+
+    importaciones = list(
+        MedicionImportacion.objects.values('origen', 'exito')
+        .annotate(cantidad=Count('id'), filas=Sum('filas'), segundos=Sum('segundos')).order_by('origen', 'exito')
+    )
+    metrica('energiaccg_importaciones_total', 'counter', 'Importaciones medidas.', [
+        ({'origen': i['origen'], 'exito': str(i['exito']).lower()}, i['cantidad']) for i in importaciones
+    ])
+    metrica('energiaccg_importacion_filas_total', 'counter', 'Filas leídas por las importaciones medidas.', [
+        ({'origen': i['origen'], 'exito': str(i['exito']).lower()}, i['filas']) for i in importaciones
+    ])
+    metrica('energiaccg_importacion_segundos_total', 'counter', 'Tiempo total de las importaciones medidas.', [
+        ({'origen': i['origen'], 'exito': str(i['exito']).lower()}, i['segundos']) for i in importaciones
+    ])
+
+    etapas = list(
+        EtapaImportacion.objects.values('medicion__origen', 'etapa')
+        .annotate(segundos=Sum('segundos'), filas=Sum('filas'), consultas=Sum('consultas'))
+        .order_by('medicion__origen', 'etapa')
+    )
+    for campo, ayuda in [
+        ('segundos', 'Tiempo propio de la etapa, sin sus etapas anidadas.'),
+        ('filas', 'Filas procesadas por la etapa.'),
+        ('consultas', 'Consultas SQL de la etapa.'),
+    ]:
+        metrica(f'energiaccg_importacion_etapa_{campo}_total', 'counter', ayuda, [
+            ({'origen': e['medicion__origen'], 'etapa': e['etapa']}, e[campo]) for e in etapas
+        ])
+
+    # De la última importación de cada origen: rendimiento y memoria no se suman entre importaciones.
+    ultimas = MedicionImportacion.objects.values('origen').annotate(ultima=Max('id')).values_list('ultima', flat=True)
+    recientes = list(MedicionImportacion.objects.filter(pk__in=ultimas).order_by('origen'))
+    metrica('energiaccg_importacion_ultima_filas_por_segundo', 'gauge', 'Filas por segundo de la última importación.', [
+        ({'origen': m.origen, 'version': m.version}, round(m.filas_por_segundo, 1)) for m in recientes
+    ])
+    metrica('energiaccg_importacion_ultima_memoria_pico_bytes', 'gauge', 'Pico de memoria por etapa de la última importación (settings.INSTRUMENTACION_MEMORIA).', [
+        ({'origen': e.medicion.origen, 'etapa': e.etapa}, e.memoria_pico)
+        for e in EtapaImportacion.objects.filter(medicion__in=recientes, memoria_pico__gt=0).select_related('medicion').order_by('medicion__origen', 'orden')
+    ])
+    return '\n'.join(lineas) + '\n'
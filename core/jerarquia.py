@@ -0,0 +1,185 @@
+"""
+Jerarquía de medidores (Medidor.medidor_padre) como tabla de clausura.
+
+MedidorAncestro guarda todos los pares (ancestro, descendiente) del árbol, así
+"este medidor y todos sus descendientes" es un solo JOIN en lugar de una consulta
+por nivel. La tabla se mantiene con señales de Medidor: al crear se enlaza el nuevo
+medidor bajo los ancestros de su padre y al cambiar de padre se mueve el subárbol
+completo (se borran sus enlaces con los ancestros viejos y se crean con los nuevos).
+Los borrados no necesitan nada: MedidorAncestro cae en cascada con Medidor.
+
+Las operaciones que no pasan por save() (bulk_create, update(), loaddata) no disparan
+las señales: después hay que llamar a reconstruir_jerarquia().
+"""
+import logging
+
+from django.db import connection as default_connection, transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Consumo, Medidor, MedidorAncestro
+
+logger = logging.getLogger(__name__)
+
+# Tope de profundidad de la recursión, por si hubiera un ciclo cargado por fuera del ORM.
+PROFUNDIDAD_MAXIMA = 1000
+
+
+class CicloJerarquia(ValueError):
+    pass
+
+
+def reconstruir_jerarquia(connection=None):
+    """Recalcula toda la tabla de clausura desde medidor_padre con un CTE recursivo."""
+    connection = connection or default_connection
+    tabla = MedidorAncestro._meta.db_table
+    medidor = Medidor._meta.db_table
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {tabla}")
+        cursor.execute(
+            f"INSERT INTO {tabla} (ancestro_id, descendiente_id, profundidad) "
+            f"WITH RECURSIVE arbol (ancestro_id, descendiente_id, profundidad) AS ("
+            f"SELECT id, id, 0 FROM {medidor} "
+            f"UNION ALL "
+            f"SELECT arbol.ancestro_id, m.id, arbol.profundidad + 1 "
+            f"FROM arbol JOIN {medidor} m ON m.medidor_padre_id = arbol.descendiente_id "
+            f"WHERE arbol.profundidad < %s) "
+            f"SELECT ancestro_id, descendiente_id, MIN(profundidad) FROM arbol GROUP BY ancestro_id, descendiente_id",
+            [PROFUNDIDAD_MAXIMA],
+        )
+        filas = cursor.rowcount
+    logger.info(f"Jerarquía de medidores reconstruida: {filas} pares ancestro/descendiente.")
+    return filas
+
+
+def crea_ciclo(medidor_id, padre_id):
+    """True si colgar `medidor_id` de `padre_id` cerraría un ciclo (el padre es el medidor o un descendiente)."""
+    if padre_id is None:
+        return False
+    return padre_id == medidor_id or MedidorAncestro.objects.filter(
+        ancestro_id=medidor_id, descendiente_id=padre_id
+    ).exists()
+
+
+def _enlazar(cursor, medidor_id, padre_id):
+    # Cada ancestro del padre (incluido el padre) pasa a ser ancestro de cada nodo del subárbol.
+    tabla = MedidorAncestro._meta.db_table
+    cursor.execute(
+        f"INSERT INTO {tabla} (ancestro_id, descendiente_id, profundidad) "
+        f"SELECT a.ancestro_id, s.descendiente_id, a.profundidad + s.profundidad + 1 "
+        f"FROM {tabla} a JOIN {tabla} s ON s.ancestro_id = %s WHERE a.descendiente_id = %s",
+        [medidor_id, padre_id],
+    )
+
+
+def _desenlazar(cursor, medidor_id):
+    # Borra los enlaces entre el subárbol y los ancestros de fuera; los internos se conservan.
+    tabla = MedidorAncestro._meta.db_table
+    cursor.execute(
+        f"DELETE FROM {tabla} "
+        f"WHERE descendiente_id IN (SELECT descendiente_id FROM {tabla} WHERE ancestro_id = %s) "
+        f"AND ancestro_id NOT IN (SELECT descendiente_id FROM {tabla} WHERE ancestro_id = %s)",
+        [medidor_id, medidor_id],
+    )
+
+
+@receiver(pre_save, sender=Medidor)
+def _recordar_padre(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        instance._padre_anterior = None
+        return
+    instance._padre_anterior = Medidor.objects.filter(pk=instance.pk).values_list('medidor_padre_id', flat=True).first()
+    if instance.medidor_padre_id != instance._padre_anterior and crea_ciclo(instance.pk, instance.medidor_padre_id):
+        raise CicloJerarquia(f"El medidor {instance.pk} no puede colgar de su propio descendiente {instance.medidor_padre_id}.")
+
+
+@receiver(post_save, sender=Medidor)
+def _actualizar_clausura(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    padre_anterior = getattr(instance, '_padre_anterior', None)
+    if not created and instance.medidor_padre_id == padre_anterior:
+        return
+    with transaction.atomic(), default_connection.cursor() as cursor:
+        if created:
+            MedidorAncestro.objects.create(ancestro_id=instance.pk, descendiente_id=instance.pk, profundidad=0)
+        else:
+            _desenlazar(cursor, instance.pk)
+        if instance.medidor_padre_id:
+            _enlazar(cursor, instance.pk, instance.medidor_padre_id)
+    instance._padre_anterior = instance.medidor_padre_id
+
+
+# --- Consultas --------------------------------------------------------------------------
+
+def descendientes(medidor, incluir_propio=True):
+    """Medidores del subárbol de `medidor` (un Medidor o su id)."""
+    qs = Medidor.objects.filter(ancestros_arbol__ancestro=medidor)
+    if not incluir_propio:
+        qs = qs.exclude(pk=getattr(medidor, 'pk', medidor))
+    return qs
+
+
+def consumo_subarbol(medidor, desde, hasta, usar_resumenes=False):
+    """
+    Suma, mínimo, máximo y cantidad de lecturas de `medidor` y todos sus descendientes en [desde, hasta).
+
+    Por defecto es una sola consulta sobre Consumo cruzada con la tabla de clausura; con
+    usar_resumenes=True se lee de los resúmenes por hora/día/mes (mejor para rangos largos).
+    """
+    if usar_resumenes:
+        from .resumenes import totales
+        return totales(desde, hasta, medidores=descendientes(medidor), por=None)[None]
+    return Consumo.objects.filter(
+        medidor__ancestros_arbol__ancestro=medidor, fecha__gte=desde, fecha__lt=hasta
+    ).aggregate(suma=Sum('consumo'), minimo=Min('consumo'), maximo=Max('consumo'), lecturas=Count('consumo'))
+
+
+def totales_subarboles(raices, desde, hasta):
+    """{id de raíz: {'suma', 'lecturas'}} de cada subárbol de `raices`, en una consulta."""
+    filas = (
+        Consumo.objects.filter(medidor__ancestros_arbol__ancestro__in=raices, fecha__gte=desde, fecha__lt=hasta)
+        .values('medidor__ancestros_arbol__ancestro')
+        .annotate(suma=Sum('consumo'), lecturas=Count('consumo'))
+        .order_by()
+    )
+    return {fila.pop('medidor__ancestros_arbol__ancestro'): fila for fila in filas}
+
+
+def balance(desde, hasta, umbral=None):
+    """
+    Compara el consumo propio de cada medidor padre con la suma de sus hijos directos en [desde, hasta).
+
+    Devuelve una lista de dicts (medidor_id, nombre, propio, hijos, perdida, porcentaje) ordenada por
+    pérdida absoluta; `umbral` deja solo los que pierden al menos ese porcentaje (en valor absoluto).
+    Los totales por medidor salen de los resúmenes (core.resumenes.totales).
+    """
+    from .resumenes import totales
+    por_medidor = totales(desde, hasta, por='medidor')
+    hijos = {}
+    nombres = {}
+    for medidor_id, nombre, padre_id in Medidor.objects.values_list('id', 'nombre', 'medidor_padre_id'):
+        nombres[medidor_id] = nombre
+        if padre_id is not None:
+            hijos.setdefault(padre_id, []).append(medidor_id)
+
+    resultado = []
+    for padre_id, ids in hijos.items():
+        propio = (por_medidor.get(padre_id) or {}).get('suma')
+        if propio is None:
+            continue  # Sin lecturas propias no hay con qué comparar
+        suma_hijos = sum((por_medidor.get(i) or {}).get('suma') or 0 for i in ids)
+        perdida = propio - suma_hijos
+        porcentaje = perdida / propio * 100 if propio else None
+        if umbral is not None and (porcentaje is None or abs(porcentaje) < umbral):
+            continue
+        resultado.append({
+            'medidor_id': padre_id,
+            'nombre': nombres[padre_id],
+            'propio': propio,
+            'hijos': suma_hijos,
+            'perdida': perdida,
+            'porcentaje': porcentaje,
+        })
+    return sorted(resultado, key=lambda fila: abs(fila['perdida']), reverse=True)
@@ -0,0 +1,46 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.archivo import ErrorArchivo, archivar_mes, meses_archivables
+from core.exportacion import PARQUET_DISPONIBLE
+
+
+def mes_argumento(texto):
+    try:
+        return datetime.strptime(texto, '%Y-%m').replace(tzinfo=dt_timezone.utc)
+    except ValueError:
+        raise CommandError(f"Mes inválido: {texto} (usar AAAA-MM).")
+
+
+class Command(BaseCommand):
+    help = ('Archiva meses cerrados de Consumo en Parquet (settings.ARCHIVO_CONSUMO_DIR) y los retira de '
+            'core_consumo. Las consultas de core.archivo.leer y las series los siguen leyendo del archivo. '
+            'Pensado para correr a fin de mes desde cron, antes de particiones_consumo --retener-meses.')
+
+    def add_arguments(self, parser):
+        grupo = parser.add_mutually_exclusive_group(required=True)
+        grupo.add_argument('--retener-meses', type=int, help='Archiva los meses que terminan antes de N meses atrás.')
+        grupo.add_argument('--mes', type=mes_argumento, nargs='+', help='Meses a archivar (AAAA-MM, UTC).')
+        parser.add_argument('--desacoplar', action='store_true',
+                            help='Desacopla la partición del mes (core_consumo_archivo_*) en lugar de eliminarla.')
+        parser.add_argument('--simular', action='store_true', help='Solo muestra los meses que archivaría.')
+
+    def handle(self, *args, **options):
+        if not PARQUET_DISPONIBLE:
+            raise CommandError("El archivo de Consumo requiere pyarrow.")
+        meses = options['mes'] or meses_archivables(options['retener_meses'])
+        if options['simular']:
+            for mes in meses:
+                self.stdout.write(f"[simulación] Archivaría {mes:%Y-%m}")
+            return
+        for mes in meses:
+            try:
+                archivo = archivar_mes(mes, desacoplar=options['desacoplar'])
+            except ErrorArchivo as e:
+                raise CommandError(str(e))
+            self.stdout.write(
+                f"{mes:%Y-%m}: {archivo.filas} lecturas, {archivo.bytes / 2 ** 20:.1f} MiB "
+                f"({archivo.bytes / archivo.filas:.1f} bytes por lectura), {archivo.get_retiro_display().lower()}."
+            )
+        self.stdout.write(self.style.SUCCESS(f"{len(meses)} meses archivados."))
@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max, Min, Sum
+
+from core.archivo import leer
+from core.models import ArchivoConsumo, Consumo
+from core.particiones import DEFAULT, particiones
+from core.management.commands.refrescar_resumenes import fecha_argumento
+
+
+class Command(BaseCommand):
+    help = ('Mide el espacio por lectura de core_consumo y del archivo Parquet y el tiempo de recorrer un '
+            'rango (por defecto, todo) con core.archivo.leer, sumando el consumo por medidor como un reporte anual.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', type=fecha_argumento)
+        parser.add_argument('--hasta', type=fecha_argumento)
+        parser.add_argument('--medidor', type=int, nargs='+', help='Solo estos medidores en el recorrido.')
+        parser.add_argument('--repeticiones', type=int, default=3)
+
+    def handle(self, *args, **options):
+        vivo = Consumo.objects.aggregate(desde=Min('fecha'), hasta=Max('fecha'))
+        archivado = ArchivoConsumo.objects.aggregate(desde=Min('mes'), hasta=Max('mes'))
+        inicios = [f for f in (vivo['desde'], archivado['desde']) if f]
+        if not inicios:
+            self.stdout.write("No hay consumos.")
+            return
+        desde = options['desde'] or min(inicios)
+        hasta = options['hasta'] or max(f for f in (vivo['hasta'], archivado['hasta']) if f)
+
+        self._espacio()
+        mejor, filas = None, 0
+        for _ in range(options['repeticiones']):
+            inicio = time.perf_counter()
+            df = leer(desde, hasta, options['medidor'])
+            df.groupby('medidor')['consumo'].sum()
+            duracion = time.perf_counter() - inicio
+            mejor, filas = duracion if mejor is None else min(mejor, duracion), len(df)
+        self.stdout.write(
+            f"Recorrido {desde:%Y-%m-%d} - {hasta:%Y-%m-%d}: {filas} lecturas en {mejor * 1000:.0f} ms "
+            f"({filas / mejor / 1e6:.1f} M lecturas/s)"
+        )
+
+    def _espacio(self):
+        archivos = ArchivoConsumo.objects.aggregate(filas=Sum('filas'), bytes=Sum('bytes'))
+        if archivos['filas']:
+            self.stdout.write(
+                f"   archivo: {archivos['filas']} lecturas, {archivos['bytes'] / 2 ** 20:.1f} MiB, "
+                f"{archivos['bytes'] / archivos['filas']:.1f} bytes por lectura"
+            )
+        nombres = [nombre for nombre, _, _ in particiones()]
+        if not nombres:
+            self.stdout.write("     tabla: el espacio por lectura solo se mide con core_consumo particionada (PostgreSQL).")
+            return
+        with connection.cursor() as cursor:
+            # Tabla, TOAST e índices de cada partición, la por defecto incluida.
+            cursor.execute(
+                "SELECT SUM(pg_total_relation_size(c.oid)) FROM pg_class c WHERE c.relname = ANY(%s)", [nombres + [DEFAULT]],
+            )
+            tamano = int(cursor.fetchone()[0] or 0)
+        filas = Consumo.objects.count()
+        if filas:
+            self.stdout.write(
+                f"     tabla: {filas} lecturas, {tamano / 2 ** 20:.1f} MiB, {tamano / filas:.1f} bytes por lectura "
+                f"(con índices)"
+            )
@@ -0,0 +1,127 @@
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.importacion import importar_a_staging, TAMANO_BLOQUE
+from core.models import ImportacionConsumo, InterfaceConsumo
+from core.staging import CargadorORM, CargadorStaging
+
+
+def generar_csv(ruta, filas, medidores=300):
+    """Escribe un CSV sintético con lecturas de 15 minutos para `medidores` medidores."""
+    escritas = 0
+    inicio = pd.Timestamp('2024-01-01')
+    with open(ruta, 'w', encoding='utf-8') as f:
+        f.write('fecha,consumo,medidor\n')
+        while escritas < filas:
+            n = min(TAMANO_BLOQUE, filas - escritas)
+            idx = np.arange(escritas, escritas + n)
+            fechas = inicio + pd.to_timedelta((idx // medidores) * 15, unit='min')
+            bloque = pd.DataFrame({
+                'fecha': fechas.strftime('%d/%m/%Y %H:%M'),
+                'consumo': np.round(np.random.default_rng(escritas).random(n) * 100, 3),
+                'medidor': ['MED-%04d' % m for m in idx % medidores],
+            })
+            bloque.to_csv(f, header=False, index=False)
+            escritas += n
+
+
+def parse_fechas_cascada(serie):
+    """Parseo de fechas anterior: un pd.to_datetime por formato sobre lo que va fallando."""
+    parsed = pd.to_datetime(serie, format='%d/%m/%Y %H:%M', errors='coerce')
+    for formato in ('%d/%m/%Y %H', '%d/%m/%Y', None):
+        faltantes = parsed.isna() & serie.notna()
+        if not faltantes.any():
+            break
+        kwargs = {'format': formato} if formato else {}
+        parsed[faltantes] = pd.to_datetime(serie[faltantes], errors='coerce', **kwargs)
+    return parsed
+
+
+def validar_iterrows(ruta):
+    """Validación fila a fila tal como la hacía import_excel antes; solo como referencia."""
+    df = pd.read_csv(ruta, encoding='utf-8', sep=',')
+    df['fecha_for_db'] = parse_fechas_cascada(df['fecha'])
+    validas, errores = [], []
+    for index, row in df.iterrows():
+        if pd.isna(row['fecha_for_db']):
+            errores.append(f"Fila {index + 2}: Fecha '{row['fecha']}' no pudo ser procesada a datetime.")
+            continue
+        try:
+            consumo_valor = float(row['consumo'])
+        except ValueError:
+            errores.append(f"Fila {index + 2}: Valor de 'consumo' ('{row['consumo']}') no es un número válido.")
+            continue
+        medidor = row.get('medidor')
+        if pd.isna(medidor) or not str(medidor).strip():
+            errores.append(f"Fila {index + 2}: Nombre de medidor (columna 'medidor') vacío o ausente.")
+            continue
+        validas.append((row['fecha_for_db'].to_pydatetime(), consumo_valor, str(medidor).strip()))
+    return len(df)
+
+
+class CargadorNulo:
+    insertadas = duplicadas = 0
+
+    def __init__(self, importacion_id=None):
+        pass
+
+    def cargar(self, df):
+        return 0
+
+
+def pico_memoria_mb():
+    # ru_maxrss está en KB en Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = 'Mide el throughput de la importación por bloques sobre archivos sintéticos (10^5 a 10^7 filas).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, nargs='+', default=[10**5, 10**6, 10**7])
+        parser.add_argument('--bloque', type=int, default=TAMANO_BLOQUE)
+        parser.add_argument('--comparar-iterrows', action='store_true',
+                            help='Mide también la validación fila a fila (iterrows) anterior sobre el mismo archivo.')
+        parser.add_argument('--staging', choices=['ninguno', 'copy', 'orm'], default='ninguno',
+                            help='Cargador de staging a medir: copy (COPY/executemany), orm (bulk_create) '
+                                 'o ninguno (solo lectura y validación). Cada corrida se revierte al terminar.')
+
+    def handle(self, *args, **options):
+        cargadores = {'ninguno': CargadorNulo, 'copy': CargadorStaging, 'orm': CargadorORM}
+        self.stdout.write(f"{'filas':>12} {'segundos':>10} {'filas/s':>12} {'pico MB':>10}")
+        for filas in sorted(options['filas']):
+            fd, ruta = tempfile.mkstemp(suffix='.csv')
+            os.close(fd)
+            try:
+                generar_csv(ruta, filas)
+                inicio = time.perf_counter()
+                with transaction.atomic():
+                    importacion = ImportacionConsumo.objects.create(nombre_original=ruta)
+                    with open(ruta, 'rb') as archivo:
+                        cargador = cargadores[options['staging']](importacion.pk)
+                        resultado = importar_a_staging(archivo, ruta, cargador, options['bloque'])
+                    transaction.set_rollback(True)
+                duracion = time.perf_counter() - inicio
+
+                self.stdout.write(
+                    f"{resultado.filas_leidas:>12} {duracion:>10.2f} {resultado.filas_leidas / duracion:>12.0f} {pico_memoria_mb():>10.1f}"
+                )
+                if options['comparar_iterrows']:
+                    inicio = time.perf_counter()
+                    filas_iterrows = validar_iterrows(ruta)
+                    duracion_iterrows = time.perf_counter() - inicio
+                    self.stdout.write(
+                        f"{'iterrows':>12} {duracion_iterrows:>10.2f} {filas_iterrows / duracion_iterrows:>12.0f} "
+                        f"{pico_memoria_mb():>10.1f}  ({duracion_iterrows / duracion:.1f}x más lento)"
+                    )
+            finally:
+                os.remove(ruta)
+        if options['staging'] != 'ninguno':
+            self.stdout.write(f"Staging tras revertir: {InterfaceConsumo.objects.count()} filas.")
@@ -0,0 +1,106 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.jerarquia import balance, consumo_subarbol, reconstruir_jerarquia, totales_subarboles
+from core.models import Consumo, Medidor, MedidorAncestro
+
+
+class _Deshacer(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera un árbol sintético de medidores (dentro de una transacción que se deshace) y mide '
+        'la tabla de clausura contra recorrer el árbol nivel por nivel.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medidores', type=int, default=5000)
+        parser.add_argument('--profundidad', type=int, default=12)
+        parser.add_argument('--lecturas', type=int, default=24, help='Lecturas horarias por medidor.')
+
+    def _medir(self, nombre, funcion):
+        with CaptureQueriesContext(connection) as consultas:
+            inicio = time.perf_counter()
+            resultado = funcion()
+            duracion = time.perf_counter() - inicio
+        self.stdout.write(f"{nombre:>32}: {duracion * 1000:10.1f} ms, {len(consultas)} consultas")
+        return resultado
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._bench(options['medidores'], options['profundidad'], options['lecturas'])
+                raise _Deshacer
+        except _Deshacer:
+            self.stdout.write("Datos de prueba descartados.")
+
+    def _bench(self, cantidad, profundidad, lecturas):
+        rnd = random.Random(0)
+        # Un nivel por bulk_create: la primera fila de cada nivel cuelga de la anterior para
+        # garantizar la profundidad pedida; el resto de un padre al azar del nivel superior.
+        por_nivel = max(1, cantidad // (profundidad + 1))
+        raiz = Medidor.objects.create(nombre='BENCH-0')
+        niveles = [[raiz]]
+        creados = 1
+        for nivel in range(1, profundidad + 1):
+            superior = niveles[-1]
+            n = por_nivel if nivel < profundidad else max(1, cantidad - creados)
+            nuevos = [
+                Medidor(nombre=f'BENCH-{creados + i}', medidor_padre=superior[0] if i == 0 else rnd.choice(superior))
+                for i in range(n)
+            ]
+            niveles.append(Medidor.objects.bulk_create(nuevos, batch_size=900))
+            creados += n
+        self.stdout.write(f"Árbol: {creados} medidores, {profundidad} niveles bajo la raíz.")
+        # bulk_create no dispara señales: se carga la clausura de una vez.
+        self._medir('reconstruir_jerarquia', reconstruir_jerarquia)
+
+        desde = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=365)
+        hasta = desde + timedelta(hours=lecturas)
+        medidores = [m for nivel in niveles for m in nivel]
+        Consumo.objects.bulk_create(
+            (
+                Consumo(medidor=m, fecha=desde + timedelta(hours=h), consumo=rnd.random())
+                for m in medidores for h in range(lecturas)
+            ),
+            batch_size=5000,
+        )
+        self.stdout.write(f"Consumos: {len(medidores) * lecturas} lecturas.")
+        if connection.vendor == 'postgresql':
+            # Dentro de la transacción autovacuum no ve las filas nuevas: sin estadísticas el
+            # planificador estima 1 fila por subárbol y elige nested loops.
+            with connection.cursor() as cursor:
+                for modelo in (Medidor, MedidorAncestro, Consumo):
+                    cursor.execute(f"ANALYZE {modelo._meta.db_table}")
+
+        def por_niveles():
+            # Lo que haría el código sin clausura: una consulta de hijos por nivel y una agregación final.
+            ids, frontera = [raiz.pk], [raiz.pk]
+            while frontera:
+                frontera = list(Medidor.objects.filter(medidor_padre_id__in=frontera).values_list('id', flat=True))
+                ids.extend(frontera)
+            return Consumo.objects.filter(medidor_id__in=ids, fecha__gte=desde, fecha__lt=hasta).aggregate(
+                suma=Sum('consumo'), lecturas=Count('consumo')
+            )
+
+        recorrido = self._medir('subárbol recorriendo niveles', por_niveles)
+        clausura = self._medir('subárbol con clausura', lambda: consumo_subarbol(raiz, desde, hasta))
+        if recorrido['lecturas'] != clausura['lecturas']:
+            self.stdout.write(self.style.WARNING("Los dos métodos no coinciden."))
+        self._medir('totales_subarboles (nivel 1)', lambda: totales_subarboles(niveles[1], desde, hasta))
+        self._medir('balance', lambda: balance(desde, hasta))
+
+        hoja = niveles[-1][-1]
+        self._medir('alta de medidor (señales)', lambda: Medidor.objects.create(nombre='BENCH-nuevo', medidor_padre=hoja))
+        movido = niveles[1][-1]
+        movido.medidor_padre = niveles[2][0]
+        self._medir('mover subárbol de nivel 1', movido.save)
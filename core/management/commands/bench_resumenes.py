@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from core.models import Consumo
+from core.resumenes import totales, tramos
+from core.management.commands.refrescar_resumenes import fecha_argumento
+
+
+class Command(BaseCommand):
+    help = 'Compara totales() leyendo de los resúmenes contra la misma agregación sobre Consumo crudo.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', type=fecha_argumento)
+        parser.add_argument('--hasta', type=fecha_argumento)
+        parser.add_argument('--por', choices=['medidor', 'tipo_medidor', 'total'], default='medidor')
+        parser.add_argument('--repeticiones', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rango = Consumo.objects.aggregate(desde=Min('fecha'), hasta=Max('fecha'))
+        desde = options['desde'] or rango['desde']
+        hasta = options['hasta'] or rango['hasta']
+        if desde is None:
+            self.stdout.write("No hay consumos.")
+            return
+        por = None if options['por'] == 'total' else options['por']
+
+        self.stdout.write(f"Rango {desde} - {hasta}, tramos: {[(n or 'consumo') for n, _, _ in tramos(desde, hasta)]}")
+        tiempos = {}
+        for usar_resumenes in (False, True):
+            mejor = None
+            for _ in range(options['repeticiones']):
+                inicio = time.perf_counter()
+                resultado = totales(desde, hasta, por=por, usar_resumenes=usar_resumenes)
+                duracion = time.perf_counter() - inicio
+                mejor = duracion if mejor is None else min(mejor, duracion)
+            tiempos[usar_resumenes] = (mejor, resultado)
+            origen = 'resúmenes' if usar_resumenes else 'consumo'
+            self.stdout.write(f"{origen:>10}: {mejor * 1000:10.1f} ms, {len(resultado)} grupos")
+
+        crudo, resumido = tiempos[False][1], tiempos[True][1]
+        diferencias = [
+            k for k in crudo
+            if k not in resumido or crudo[k]['lecturas'] != resumido[k]['lecturas']
+            or abs((crudo[k]['suma'] or 0) - (resumido[k]['suma'] or 0)) > 1e-6 * max(1, abs(crudo[k]['suma'] or 0))
+        ]
+        if diferencias:
+            self.stdout.write(self.style.WARNING(
+                f"{len(diferencias)} grupos no coinciden con Consumo; ¿faltan refrescar_resumenes?"
+            ))
+        self.stdout.write(f"Aceleración: {tiempos[False][0] / tiempos[True][0]:.1f}x")
@@ -0,0 +1,55 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Min
+
+from core.management.commands.refrescar_resumenes import fecha_argumento
+from core.models import Consumo, Medidor
+from core.particiones import consumos_en_rango
+from core.series import MAX_PUNTOS, series
+
+
+class Command(BaseCommand):
+    help = ('Compara el JSON de /api/series/ (columnas, con y sin reducción) contra un objeto por '
+            'lectura: tiempo de armado y tamaño de la respuesta.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', type=fecha_argumento)
+        parser.add_argument('--hasta', type=fecha_argumento)
+        parser.add_argument('--medidores', type=int, default=10, help='Cantidad de medidores (los primeros por id).')
+        parser.add_argument('--max-puntos', type=int, default=MAX_PUNTOS)
+        parser.add_argument('--repeticiones', type=int, default=3)
+
+    def _medir(self, nombre, funcion, repeticiones):
+        mejor = None
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            cuerpo = funcion()
+            duracion = time.perf_counter() - inicio
+            mejor = duracion if mejor is None else min(mejor, duracion)
+        self.stdout.write(f"{nombre:>24}: {mejor * 1000:10.1f} ms, {len(cuerpo) / 1024:10.1f} KB")
+
+    def handle(self, *args, **options):
+        rango = Consumo.objects.aggregate(desde=Min('fecha'), hasta=Max('fecha'))
+        desde = options['desde'] or rango['desde']
+        hasta = options['hasta'] or rango['hasta']
+        if desde is None:
+            self.stdout.write("No hay consumos.")
+            return
+        medidores = list(Medidor.objects.order_by('id').values_list('id', flat=True)[:options['medidores']])
+        max_puntos = options['max_puntos']
+        self.stdout.write(f"Rango {desde} - {hasta}, {len(medidores)} medidores, max_puntos={max_puntos}")
+
+        def por_fila():
+            filas = consumos_en_rango(desde, hasta, medidores).order_by('medidor_id', 'fecha')
+            return json.dumps(list(filas.values('fecha', 'consumo', 'medidor_id')), cls=DjangoJSONEncoder)
+
+        def columnas(metodo):
+            return lambda: json.dumps(series(medidores, desde, hasta, max_puntos, metodo), separators=(',', ':'))
+
+        repeticiones = options['repeticiones']
+        self._medir('objeto por lectura', por_fila, repeticiones)
+        for metodo in ('ninguno', 'promedio', 'lttb'):
+            self._medir(f'columnas ({metodo})', columnas(metodo), repeticiones)
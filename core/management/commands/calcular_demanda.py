@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.demanda import calcular
+from core.management.commands.refrescar_resumenes import fecha_argumento
+
+
+class Command(BaseCommand):
+    help = ('Calcula por mes la demanda máxima, el factor de carga, la energía por banda horaria y el perfil '
+            'diario de cada medidor y tipo de medidor (DemandaMedidor, DemandaTipoMedidor). '
+            'Las importaciones recalculan solas los meses que tocan.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medidor', type=int, nargs='+', help='IDs de medidor (por defecto, todos).')
+        parser.add_argument('--desde', type=fecha_argumento, help='Fecha inicial (se extiende al inicio del mes; requiere --hasta).')
+        parser.add_argument('--hasta', type=fecha_argumento, help='Fecha final inclusive.')
+
+    def handle(self, *args, **options):
+        if (options['desde'] is None) != (options['hasta'] is None):
+            raise CommandError("Use --desde y --hasta juntos.")
+        total = calcular(options['medidor'], options['desde'], options['hasta'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Demanda calculada: {total['medidores']} meses de medidor y {total['tipos']} de tipo de medidor."
+        ))
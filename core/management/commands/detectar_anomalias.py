@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.anomalias import detectar
+from core.management.commands.refrescar_resumenes import fecha_argumento
+
+
+class Command(BaseCommand):
+    help = ('Busca picos, caídas y mesetas en las series de Consumo y los guarda en AlertaConsumo. '
+            'Las importaciones puntúan solas su rango.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medidor', type=int, nargs='+', help='IDs de medidor (por defecto, todos).')
+        parser.add_argument('--desde', type=fecha_argumento, help='Solo alertas desde esta fecha (requiere --hasta).')
+        parser.add_argument('--hasta', type=fecha_argumento, help='Fecha final inclusive.')
+        parser.add_argument('--recalcular-base', action='store_true',
+                            help='Rehace la línea base por hora de la semana de cada medidor aunque esté al día.')
+
+    def handle(self, *args, **options):
+        if (options['desde'] is None) != (options['hasta'] is None):
+            raise CommandError("Use --desde y --hasta juntos.")
+        alertas = detectar(options['medidor'], options['desde'], options['hasta'], recalcular_base=options['recalcular_base'])
+        for tipo, cantidad in sorted(alertas.items()):
+            self.stdout.write(f"{tipo}: {cantidad}")
+        self.stdout.write(self.style.SUCCESS(f"Detección terminada: {sum(alertas.values())} alertas."))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import ingesta
+
+
+class Command(BaseCommand):
+    help = ('Carga lecturas (DocumentoMedicion) desde un archivo JSON por líneas o CSV, con la misma '
+            'validación e idempotencia que /api/lecturas/.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo')
+        parser.add_argument('--formato', choices=['ndjson', 'csv'], help='Por defecto, según la extensión.')
+        parser.add_argument('--sobrescribir', action='store_true', help='Actualiza las lecturas que ya existen.')
+
+    def handle(self, *args, **options):
+        formato = options['formato'] or ('csv' if options['archivo'].lower().endswith('.csv') else 'ndjson')
+        try:
+            archivo = open(options['archivo'], 'rb')
+        except OSError as e:
+            raise CommandError(f"No se pudo abrir el archivo: {e}")
+        inicio = time.perf_counter()
+        with archivo:
+            resultado = ingesta.ingestar(archivo, formato, sobrescribir=options['sobrescribir'])
+        duracion = time.perf_counter() - inicio
+        for clave in ('recibidas', 'insertadas', 'actualizadas', 'duplicadas', 'rechazadas'):
+            self.stdout.write(f"{clave}: {resultado[clave]}")
+        for motivo, cantidad in sorted(resultado['rechazos_por_motivo'].items()):
+            self.stdout.write(f"  {motivo}: {cantidad}")
+        if 'error' in resultado:
+            raise CommandError(resultado['error'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Ingesta terminada en {duracion:.1f} s ({resultado['recibidas'] / max(duracion, 1e-9):.0f} lecturas/s)."
+        ))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from core.particiones import esta_particionada, mantener_particiones, particiones
+
+
+class Command(BaseCommand):
+    help = ('Mantiene las particiones mensuales de core_consumo (PostgreSQL): crea las de los próximos '
+            'meses, saca de la partición por defecto los meses que cayeron ahí y retira las más viejas. '
+            'Pensado para correr a diario desde cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meses-adelante', type=int, default=3, help='Meses futuros a tener creados (por defecto 3).')
+        parser.add_argument('--retener-meses', type=int, help='Retira las particiones que terminan antes de N meses atrás.')
+        parser.add_argument('--eliminar', action='store_true',
+                            help='Con --retener-meses, borra las particiones en lugar de desacoplarlas como core_consumo_archivo_*.')
+        parser.add_argument('--simular', action='store_true', help='Solo muestra lo que haría.')
+        parser.add_argument('--listar', action='store_true', help='Lista las particiones actuales y termina.')
+
+    def handle(self, *args, **options):
+        if not esta_particionada():
+            self.stdout.write("core_consumo no está particionada (solo aplica a PostgreSQL).")
+            return
+        if options['listar']:
+            for nombre, desde, hasta in particiones():
+                self.stdout.write(f"{nombre}: {desde:%Y-%m-%d} - {hasta:%Y-%m-%d}")
+            return
+
+        acciones = mantener_particiones(
+            meses_adelante=options['meses_adelante'],
+            retener_meses=options['retener_meses'],
+            eliminar=options['eliminar'],
+            simular=options['simular'],
+        )
+        prefijo = "[simulación] " if options['simular'] else ""
+        retiro = 'eliminadas' if options['eliminar'] else 'desacopladas'
+        for nombre in acciones['creadas']:
+            self.stdout.write(f"{prefijo}Creada {nombre}")
+        for nombre in acciones['retiradas']:
+            self.stdout.write(f"{prefijo}Retirada {nombre}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefijo}{len(acciones['creadas'])} particiones creadas, {len(acciones['retiradas'])} {retiro}."
+        ))
@@ -0,0 +1,71 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+# Este módulo no importa modelos a nivel de módulo: los procesos hijos lo importan
+# (con 'spawn') antes de que _inicializar_proceso haya configurado Django.
+
+def _inicializar_proceso():
+    # Los procesos del pool arrancan con 'spawn' y tienen que configurar Django por su cuenta.
+    import django
+    django.setup()
+
+
+def _procesar(importacion_id):
+    from core.tareas import procesar_importacion
+    try:
+        procesar_importacion(importacion_id)
+    finally:
+        connections.close_all()
+    return importacion_id
+
+
+class Command(BaseCommand):
+    help = 'Procesa las importaciones de consumo pendientes con un pool de procesos local.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procesos', type=int, default=2,
+                            help='Importaciones que se procesan en paralelo.')
+        parser.add_argument('--intervalo', type=float, default=2.0,
+                            help='Segundos entre consultas de trabajos pendientes.')
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Procesa lo pendiente y termina, en lugar de quedarse esperando.')
+
+    def handle(self, *args, **options):
+        from core.models import ImportacionConsumo, InterfaceConsumo
+        from core.tareas import reclamar_pendientes
+
+        procesos = options['procesos']
+        contexto = multiprocessing.get_context('spawn')
+        en_curso = {}  # futuro -> id de importación
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto, initializer=_inicializar_proceso) as pool:
+            while True:
+                libres = procesos - len(en_curso)
+                if libres > 0:
+                    for importacion_id in reclamar_pendientes(libres):
+                        self.stdout.write(f"Procesando importación #{importacion_id}")
+                        en_curso[pool.submit(_procesar, importacion_id)] = importacion_id
+
+                if not en_curso:
+                    if options['una_vez']:
+                        break
+                    time.sleep(options['intervalo'])
+                    continue
+
+                terminados, _ = wait(en_curso, timeout=options['intervalo'], return_when=FIRST_COMPLETED)
+                for futuro in terminados:
+                    importacion_id = en_curso.pop(futuro)
+                    try:
+                        futuro.result()
+                        self.stdout.write(self.style.SUCCESS(f"Importación #{importacion_id} terminada"))
+                    except Exception as e:
+                        # El proceso murió sin poder registrar el error en la importación.
+                        self.stderr.write(f"Error en el proceso de la importación #{importacion_id}: {e}")
+                        ImportacionConsumo.objects.filter(pk=importacion_id, estado=ImportacionConsumo.EN_PROCESO).update(
+                            estado=ImportacionConsumo.ERROR, mensaje=f"El proceso de importación terminó inesperadamente: {e}"
+                        )
+                        InterfaceConsumo.objects.filter(importacion_id=importacion_id).delete()
@@ -0,0 +1,160 @@
+import http.client
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentil(duraciones, p):
+    """Percentil `p` (0-100) de una lista ordenada, por el rango más cercano."""
+    if not duraciones:
+        return float('nan')
+    return duraciones[min(len(duraciones) - 1, max(0, round(p / 100 * len(duraciones)) - 1))]
+
+
+class Command(BaseCommand):
+    help = ('Prueba de carga contra un servidor en marcha: subidas lentas a /api/lecturas/ y consultas '
+            'de tablero a /api/series/ en paralelo, con throughput y latencias p50/p95/p99 por tipo. '
+            'Para comparar despliegues, correrla igual contra '
+            '"gunicorn energiaccg.wsgi -w N" y "uvicorn energiaccg.asgi:application --workers N" '
+            '(con --async para las vistas /api/async/).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Servidor a probar.')
+        parser.add_argument('--async', dest='asincrono', action='store_true', help='Usa las rutas /api/async/.')
+        parser.add_argument('--duracion', type=float, default=30, help='Segundos de carga.')
+        parser.add_argument('--subidas', type=int, default=20, help='Clientes subiendo lecturas a la vez.')
+        parser.add_argument('--consultas', type=int, default=20, help='Clientes consultando series a la vez.')
+        parser.add_argument('--token', help="Clave de INGESTA_LECTURAS_TOKENS para las subidas.")
+        parser.add_argument('--sesion', help="Cookie 'sessionid' de un usuario staff para las consultas.")
+        parser.add_argument('--punto', type=int, help='PuntoMedicion de las lecturas subidas.')
+        parser.add_argument('--lecturas-por-subida', type=int, default=2000)
+        parser.add_argument('--bytes-por-segundo', type=int, default=50_000,
+                            help='Velocidad de cada subida (simula colectores con enlaces lentos).')
+        parser.add_argument('--medidor', type=int, action='append', help='Medidores de las consultas (repetible).')
+        parser.add_argument('--desde', default='2024-01-01')
+        parser.add_argument('--hasta', default='2024-02-01')
+        parser.add_argument('--max-puntos', type=int, default=2000)
+        parser.add_argument('--ventana-dias', type=int,
+                            help='Cada consulta pide una ventana al azar de estos días dentro del rango, para no '
+                                 'responder todo desde la caché de consultas.')
+        parser.add_argument('--timeout', type=float, default=120)
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            raise CommandError(f"URL inválida: {options['url']}")
+        if options['subidas'] and not (options['token'] and options['punto']):
+            raise CommandError("Las subidas necesitan --token y --punto (o --subidas 0).")
+        if options['consultas'] and not (options['sesion'] and options['medidor']):
+            raise CommandError("Las consultas necesitan --sesion y --medidor (o --consultas 0).")
+        self.options = options
+        self.url = url
+        self.prefijo = '/api/async' if options['asincrono'] else '/api'
+        self.fin = time.monotonic() + options['duracion']
+        self.resultados = {'subida': [], 'consulta': []}
+        self.errores = {'subida': 0, 'consulta': 0}
+        self.ultimo_error = {}
+        self.lock = threading.Lock()
+        # Fechas distintas para cada lectura subida: cada subida inserta y no choca con las anteriores.
+        self.lecturas = itertools.count()
+        self.origen = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+        hilos = [threading.Thread(target=self._cliente, args=('subida', self._subir)) for _ in range(options['subidas'])]
+        hilos += [threading.Thread(target=self._cliente, args=('consulta', self._consultar)) for _ in range(options['consultas'])]
+        self.stdout.write(
+            f"{options['url']}{self.prefijo}/: {options['subidas']} subidas y {options['consultas']} consultas "
+            f"concurrentes durante {options['duracion']:.0f} s..."
+        )
+        inicio = time.monotonic()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self._informe(time.monotonic() - inicio)
+
+    def _conexion(self):
+        clase = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+        return clase(self.url.hostname, self.url.port, timeout=self.options['timeout'])
+
+    def _cliente(self, tipo, peticion):
+        while time.monotonic() < self.fin:
+            inicio = time.monotonic()
+            try:
+                error = peticion()
+            except (OSError, http.client.HTTPException) as e:
+                error = f"{type(e).__name__}: {e}"
+            duracion = time.monotonic() - inicio
+            with self.lock:
+                if error is None:
+                    self.resultados[tipo].append(duracion)
+                else:
+                    self.errores[tipo] += 1
+                    self.ultimo_error[tipo] = error
+
+    @staticmethod
+    def _leer(conexion):
+        """None si la respuesta es 200; si no, el estado y el comienzo del cuerpo."""
+        respuesta = conexion.getresponse()
+        cuerpo = respuesta.read()
+        return None if respuesta.status == 200 else f"HTTP {respuesta.status}: {cuerpo[:200]!r}"
+
+    def _subir(self):
+        with self.lock:
+            inicio = next(self.lecturas)
+            for _ in range(self.options['lecturas_por_subida'] - 1):
+                next(self.lecturas)
+        cuerpo = ''.join(
+            json.dumps({'punto': self.options['punto'], 'fecha': (self.origen + timedelta(seconds=i)).isoformat(), 'valor': i % 100})
+            + '\n' for i in range(inicio, inicio + self.options['lecturas_por_subida'])
+        ).encode()
+        conexion = self._conexion()
+        try:
+            conexion.putrequest('POST', f'{self.prefijo}/lecturas/')
+            conexion.putheader('Content-Type', 'application/x-ndjson')
+            conexion.putheader('Content-Length', str(len(cuerpo)))
+            conexion.putheader('Authorization', f"Token {self.options['token']}")
+            conexion.endheaders()
+            # El cuerpo sale en pedazos de a 1/10 s, a la velocidad pedida.
+            pedazo = max(1, self.options['bytes_por_segundo'] // 10)
+            for i in range(0, len(cuerpo), pedazo):
+                conexion.send(cuerpo[i:i + pedazo])
+                time.sleep(0.1)
+            return self._leer(conexion)
+        finally:
+            conexion.close()
+
+    def _consultar(self):
+        medidores = '&'.join(f'medidor={m}' for m in self.options['medidor'])
+        desde, hasta = self.options['desde'], self.options['hasta']
+        if self.options['ventana_dias']:
+            inicio, fin = datetime.fromisoformat(desde), datetime.fromisoformat(hasta)
+            horas = max(0, int((fin - inicio).total_seconds() // 3600) - 24 * self.options['ventana_dias'])
+            inicio += timedelta(hours=random.randint(0, horas))
+            desde, hasta = inicio.isoformat(), (inicio + timedelta(days=self.options['ventana_dias'])).isoformat()
+        ruta = f"{self.prefijo}/series/?{medidores}&desde={desde}&hasta={hasta}&max_puntos={self.options['max_puntos']}"
+        conexion = self._conexion()
+        try:
+            conexion.request('GET', ruta, headers={'Cookie': f"sessionid={self.options['sesion']}"})
+            return self._leer(conexion)
+        finally:
+            conexion.close()
+
+    def _informe(self, duracion):
+        for tipo, duraciones in self.resultados.items():
+            duraciones.sort()
+            errores = self.errores[tipo]
+            if not duraciones and not errores:
+                continue
+            self.stdout.write(
+                f"{tipo:>9}: {len(duraciones):6d} ok, {errores:5d} errores, {len(duraciones) / duracion:8.1f} req/s, "
+                f"p50 {percentil(duraciones, 50) * 1000:8.0f} ms, p95 {percentil(duraciones, 95) * 1000:8.0f} ms, "
+                f"p99 {percentil(duraciones, 99) * 1000:8.0f} ms, máx {duraciones[-1] * 1000 if duraciones else 0:8.0f} ms"
+            )
+            if errores:
+                self.stdout.write(f"{'':>9}  último error: {self.ultimo_error[tipo]}")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.contadores import recalcular
+from core.management.commands.refrescar_resumenes import fecha_argumento
+
+
+class Command(BaseCommand):
+    help = ('Recalcula los consumos entre lecturas de los puntos con contador (ConsumoContador), con '
+            'vueltas y reinicios. Las lecturas guardadas una por una se recalculan solas.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--punto', type=int, nargs='+', help='Números internos de punto (por defecto, todos).')
+        parser.add_argument('--desde', type=fecha_argumento, help='Solo lecturas desde esta fecha (requiere --hasta).')
+        parser.add_argument('--hasta', type=fecha_argumento, help='Fecha final inclusive.')
+
+    def handle(self, *args, **options):
+        if (options['desde'] is None) != (options['hasta'] is None):
+            raise CommandError("Use --desde y --hasta juntos.")
+        consumos = recalcular(options['punto'], options['desde'], options['hasta'])
+        for tipo, cantidad in sorted(consumos.items()):
+            self.stdout.write(f"{tipo}: {cantidad}")
+        self.stdout.write(self.style.SUCCESS(f"Recálculo terminado: {sum(consumos.values())} consumos."))
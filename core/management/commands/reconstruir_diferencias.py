@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.diferencias import reconstruir_diferencias
+
+
+class Command(BaseCommand):
+    help = ('Recalcula desde Consumo la tabla vista_consumo_diferencia. Las importaciones la mantienen '
+            'solas; usar tras borrar o editar consumos a mano.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medidor', type=int, nargs='+', help='IDs de medidor (por defecto, todos).')
+
+    def handle(self, *args, **options):
+        filas = reconstruir_diferencias(options['medidor'])
+        self.stdout.write(self.style.SUCCESS(f"Diferencias recalculadas: {filas} filas."))
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from core.models import Consumo, Medidor
+from core.resumenes import NIVELES, inicio_intervalo, refrescar, siguiente_intervalo
+
+
+def fecha_argumento(texto):
+    try:
+        return timezone.make_aware(datetime.fromisoformat(texto))
+    except ValueError:
+        raise CommandError(f"Fecha inválida: {texto} (usar AAAA-MM-DD o AAAA-MM-DDTHH:MM).")
+
+
+class Command(BaseCommand):
+    help = ('Recalcula los resúmenes ConsumoHora/ConsumoDia/ConsumoMes. Sin opciones reconstruye todo '
+            'el rango de Consumo, mes a mes; las importaciones los mantienen solas.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', type=fecha_argumento, help='Fecha inicial (se extiende al inicio del mes).')
+        parser.add_argument('--hasta', type=fecha_argumento, help='Fecha final inclusive.')
+        parser.add_argument('--medidor', type=int, nargs='+', help='IDs de medidor (por defecto, todos).')
+
+    def handle(self, *args, **options):
+        medidores = options['medidor'] or list(Medidor.objects.values_list('id', flat=True))
+        rango = Consumo.objects.filter(medidor_id__in=medidores).aggregate(desde=Min('fecha'), hasta=Max('fecha'))
+        desde = options['desde'] or rango['desde']
+        hasta = options['hasta'] or rango['hasta']
+        if desde is None or hasta is None:
+            self.stdout.write("No hay consumos que resumir.")
+            return
+
+        # Un mes por transacción: acota la memoria del camino pandas y el tamaño de cada DELETE/INSERT.
+        mes = inicio_intervalo(desde, NIVELES[0])
+        total = 0
+        while mes <= hasta:
+            siguiente = siguiente_intervalo(mes, NIVELES[0])
+            horas = refrescar(medidores, mes, siguiente - timedelta(microseconds=1))
+            total += horas
+            self.stdout.write(f"{timezone.localtime(mes):%Y-%m}: {horas} horas")
+            mes = siguiente
+        self.stdout.write(self.style.SUCCESS(f"Resúmenes recalculados: {total} horas en total."))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.calidad import revisar
+from core.management.commands.refrescar_resumenes import fecha_argumento
+
+
+class Command(BaseCommand):
+    help = ('Busca huecos, lecturas fuera de grilla, duplicadas en un intervalo y deltas negativos en las '
+            'series de Consumo y los guarda en IncidenciaSerie. Las importaciones revisan solas su rango.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medidor', type=int, nargs='+', help='IDs de medidor (por defecto, todos).')
+        parser.add_argument('--desde', type=fecha_argumento, help='Solo lecturas desde esta fecha (requiere --hasta).')
+        parser.add_argument('--hasta', type=fecha_argumento, help='Fecha final inclusive.')
+        parser.add_argument('--reinferir', action='store_true',
+                            help='Vuelve a inferir intervalo y fase de cada medidor aunque ya tenga perfil.')
+
+    def handle(self, *args, **options):
+        if (options['desde'] is None) != (options['hasta'] is None):
+            raise CommandError("Use --desde y --hasta juntos.")
+        incidencias = revisar(options['medidor'], options['desde'], options['hasta'], reinferir=options['reinferir'])
+        for tipo, cantidad in sorted(incidencias.items()):
+            self.stdout.write(f"{tipo}: {cantidad}")
+        self.stdout.write(self.style.SUCCESS(f"Revisión terminada: {sum(incidencias.values())} incidencias."))
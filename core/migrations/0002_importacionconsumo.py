@@ -0,0 +1,56 @@
+# Generated by Django 5.1.7 on 2026-10-17 01:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportacionConsumo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archivo', models.FileField(upload_to='importaciones/')),
+                ('nombre_original', models.CharField(max_length=255)),
+                ('sobrescribir', models.BooleanField(default=False, verbose_name='Sobrescribir existentes')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_proceso', 'En proceso'), ('completado', 'Completado'), ('error', 'Error')], db_index=True, default='pendiente', max_length=20)),
+                ('filas_leidas', models.PositiveIntegerField(default=0)),
+                ('filas_staging', models.PositiveIntegerField(default=0)),
+                ('filas_fusionadas', models.PositiveIntegerField(default=0)),
+                ('filas_rechazadas', models.PositiveIntegerField(default=0)),
+                ('filas_duplicadas', models.PositiveIntegerField(default=0)),
+                ('filas_medidor_desconocido', models.PositiveIntegerField(default=0)),
+                ('errores', models.JSONField(blank=True, default=list)),
+                ('mensaje', models.TextField(blank=True, default='')),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('iniciado', models.DateTimeField(blank=True, null=True)),
+                ('finalizado', models.DateTimeField(blank=True, null=True)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Importación de Consumo',
+                'verbose_name_plural': 'Importaciones de Consumo',
+                'ordering': ['-creado'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='interfaceconsumo',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='interfaceconsumo',
+            name='importacion',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='staging', to='core.importacionconsumo'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='interfaceconsumo',
+            unique_together={('importacion', 'fecha', 'medidor')},
+        ),
+    ]
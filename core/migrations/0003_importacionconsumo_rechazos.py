@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-17 01:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_importacionconsumo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importacionconsumo',
+            name='rechazos',
+            field=models.FileField(blank=True, upload_to='importaciones/rechazos/'),
+        ),
+        migrations.AddField(
+            model_name='importacionconsumo',
+            name='rechazos_por_motivo',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.1.7 on 2026-10-17 01:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_importacionconsumo_rechazos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsumoDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inicio', models.DateTimeField()),
+                ('suma', models.FloatField(blank=True, null=True)),
+                ('minimo', models.FloatField(blank=True, null=True)),
+                ('maximo', models.FloatField(blank=True, null=True)),
+                ('lecturas', models.PositiveIntegerField(default=0)),
+                ('primera_fecha', models.DateTimeField()),
+                ('primer_valor', models.FloatField(blank=True, null=True)),
+                ('ultima_fecha', models.DateTimeField()),
+                ('ultimo_valor', models.FloatField(blank=True, null=True)),
+                ('medidor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.medidor')),
+            ],
+            options={
+                'verbose_name': 'Consumo por Día',
+                'verbose_name_plural': 'Consumos por Día',
+                'abstract': False,
+                'indexes': [models.Index(fields=['inicio'], name='core_consumodia_inicio')],
+                'unique_together': {('medidor', 'inicio')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ConsumoHora',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inicio', models.DateTimeField()),
+                ('suma', models.FloatField(blank=True, null=True)),
+                ('minimo', models.FloatField(blank=True, null=True)),
+                ('maximo', models.FloatField(blank=True, null=True)),
+                ('lecturas', models.PositiveIntegerField(default=0)),
+                ('primera_fecha', models.DateTimeField()),
+                ('primer_valor', models.FloatField(blank=True, null=True)),
+                ('ultima_fecha', models.DateTimeField()),
+                ('ultimo_valor', models.FloatField(blank=True, null=True)),
+                ('medidor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.medidor')),
+            ],
+            options={
+                'verbose_name': 'Consumo por Hora',
+                'verbose_name_plural': 'Consumos por Hora',
+                'abstract': False,
+                'indexes': [models.Index(fields=['inicio'], name='core_consumohora_inicio')],
+                'unique_together': {('medidor', 'inicio')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ConsumoMes',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inicio', models.DateTimeField()),
+                ('suma', models.FloatField(blank=True, null=True)),
+                ('minimo', models.FloatField(blank=True, null=True)),
+                ('maximo', models.FloatField(blank=True, null=True)),
+                ('lecturas', models.PositiveIntegerField(default=0)),
+                ('primera_fecha', models.DateTimeField()),
+                ('primer_valor', models.FloatField(blank=True, null=True)),
+                ('ultima_fecha', models.DateTimeField()),
+                ('ultimo_valor', models.FloatField(blank=True, null=True)),
+                ('medidor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.medidor')),
+            ],
+            options={
+                'verbose_name': 'Consumo por Mes',
+                'verbose_name_plural': 'Consumos por Mes',
+                'abstract': False,
+                'indexes': [models.Index(fields=['inicio'], name='core_consumomes_inicio')],
+                'unique_together': {('medidor', 'inicio')},
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# vista_consumo_diferencia pasa de vista (creada fuera de las migraciones) a tabla gestionada
+# por Django, mantenida de forma incremental por core.diferencias.
+
+from django.db import migrations, models
+
+DEFINICION_VISTA = """
+CREATE VIEW vista_consumo_diferencia AS
+SELECT medidor_id, fecha, consumo, consumo_anterior, consumo - consumo_anterior AS diferencia_consumo
+FROM (
+    SELECT medidor_id, fecha, consumo,
+           LAG(consumo) OVER (PARTITION BY medidor_id ORDER BY fecha) AS consumo_anterior
+    FROM core_consumo
+) lecturas
+WHERE consumo_anterior IS NOT NULL
+"""
+
+# Mismo cálculo que core.diferencias.reconstruir_diferencias, fijado aquí para que la migración no dependa del código.
+CARGA_INICIAL = """
+INSERT INTO vista_consumo_diferencia (medidor_id, fecha, consumo, consumo_anterior, diferencia_consumo)
+SELECT medidor_id, fecha, consumo, anterior, consumo - anterior
+FROM (
+    SELECT medidor_id, fecha, consumo,
+           LAG(consumo) OVER (PARTITION BY medidor_id ORDER BY fecha) AS anterior,
+           LAG(fecha) OVER (PARTITION BY medidor_id ORDER BY fecha) AS fecha_anterior
+    FROM core_consumo
+    WHERE medidor_id IS NOT NULL
+) lecturas
+WHERE fecha_anterior IS NOT NULL
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_resumenes_consumo'),
+    ]
+
+    operations = [
+        migrations.RunSQL('DROP VIEW IF EXISTS vista_consumo_diferencia', reverse_sql=DEFINICION_VISTA),
+        migrations.DeleteModel(name='VistaConsumoDiferencia'),
+        migrations.CreateModel(
+            name='VistaConsumoDiferencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('medidor_id', models.IntegerField()),
+                ('fecha', models.DateTimeField()),
+                ('consumo', models.FloatField(blank=True, null=True)),
+                ('consumo_anterior', models.FloatField(blank=True, null=True)),
+                ('diferencia_consumo', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Vista Consumo Diferencia',
+                'verbose_name_plural': 'Vista Consumo Diferencia',
+                'db_table': 'vista_consumo_diferencia',
+                'ordering': ['-fecha'],
+                'indexes': [models.Index(fields=['fecha'], name='vista_consumo_dif_fecha')],
+                'unique_together': {('medidor_id', 'fecha')},
+            },
+        ),
+        migrations.RunSQL(CARGA_INICIAL, reverse_sql=migrations.RunSQL.noop),
+    ]
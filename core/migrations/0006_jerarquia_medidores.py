@@ -0,0 +1,42 @@
+# Generated by Django 5.1.7 on 2026-10-17 02:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Mismo cálculo que core.jerarquia.reconstruir_jerarquia, fijado aquí para que la migración no dependa del código.
+CARGA_INICIAL = """
+INSERT INTO core_medidorancestro (ancestro_id, descendiente_id, profundidad)
+WITH RECURSIVE arbol (ancestro_id, descendiente_id, profundidad) AS (
+    SELECT id, id, 0 FROM core_medidor
+    UNION ALL
+    SELECT arbol.ancestro_id, m.id, arbol.profundidad + 1
+    FROM arbol JOIN core_medidor m ON m.medidor_padre_id = arbol.descendiente_id
+    WHERE arbol.profundidad < 1000
+)
+SELECT ancestro_id, descendiente_id, MIN(profundidad) FROM arbol GROUP BY ancestro_id, descendiente_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_consumo_diferencia_tabla'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedidorAncestro',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('profundidad', models.PositiveIntegerField()),
+                ('ancestro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendientes_arbol', to='core.medidor')),
+                ('descendiente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestros_arbol', to='core.medidor')),
+            ],
+            options={
+                'verbose_name': 'Ancestro de Medidor',
+                'verbose_name_plural': 'Ancestros de Medidores',
+                'unique_together': {('ancestro', 'descendiente')},
+            },
+        ),
+        migrations.RunSQL(CARGA_INICIAL, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,115 @@
+# En PostgreSQL core_consumo pasa a ser una tabla particionada por rango de fecha, una
+# partición por mes UTC más una partición por defecto para lo que caiga fuera. La tabla
+# vieja se renombra, los datos se copian en la misma transacción y después se elimina.
+# En otros motores no hace nada. Las particiones posteriores las maneja core.particiones
+# (comando particiones_consumo).
+#
+# Una tabla particionada exige que la clave primaria incluya la columna de partición:
+# en la base es (id, fecha), aunque para Django la clave sigue siendo `id` (la secuencia
+# garantiza que no se repite).
+#
+# Al final se corre ANALYZE: las tablas nuevas no tienen estadísticas hasta que pase
+# autovacuum y, sin ellas, el planificador elige nested loops sobre millones de filas.
+
+from django.db import migrations
+
+# Nombres que Django dio a las restricciones e índices de Consumo en 0001; se conservan.
+PK = 'core_consumo_pkey'
+UNICO = 'core_consumo_fecha_medidor_id_d67037e1_uniq'
+INDICE_MEDIDOR = 'core_consumo_medidor_id_77f57a51'
+FK_MEDIDOR = 'core_consumo_medidor_id_77f57a51_fk_core_medidor_id'
+
+RESTRICCIONES = f"""
+ALTER TABLE core_consumo ADD CONSTRAINT {UNICO} UNIQUE (fecha, medidor_id);
+CREATE INDEX {INDICE_MEDIDOR} ON core_consumo (medidor_id);
+ALTER TABLE core_consumo ADD CONSTRAINT {FK_MEDIDOR}
+    FOREIGN KEY (medidor_id) REFERENCES core_medidor (id) DEFERRABLE INITIALLY DEFERRED;
+"""
+
+
+def _renombrar_tabla(cursor, sufijo):
+    # Los nombres de índices son únicos por esquema: hay que moverlos junto con la tabla.
+    cursor.execute(f"""
+        ALTER TABLE core_consumo RENAME TO core_consumo_{sufijo};
+        ALTER INDEX {PK} RENAME TO core_consumo_{sufijo}_pkey;
+        ALTER INDEX {UNICO} RENAME TO core_consumo_{sufijo}_uniq;
+        ALTER INDEX {INDICE_MEDIDOR} RENAME TO core_consumo_{sufijo}_medidor;
+        ALTER SEQUENCE core_consumo_id_seq RENAME TO core_consumo_{sufijo}_id_seq;
+    """)
+
+
+def particionar(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        _renombrar_tabla(cursor, 'sin_particionar')
+        cursor.execute(f"""
+            CREATE SEQUENCE core_consumo_id_seq;
+            CREATE TABLE core_consumo (LIKE core_consumo_sin_particionar) PARTITION BY RANGE (fecha);
+            ALTER TABLE core_consumo ALTER COLUMN id SET DEFAULT nextval('core_consumo_id_seq');
+            ALTER SEQUENCE core_consumo_id_seq OWNED BY core_consumo.id;
+            ALTER TABLE core_consumo ADD CONSTRAINT {PK} PRIMARY KEY (id, fecha);
+            {RESTRICCIONES}
+            CREATE TABLE core_consumo_default PARTITION OF core_consumo DEFAULT;
+        """)
+        # Un mes por partición desde la lectura más antigua hasta tres meses después de hoy
+        # (o de la lectura más nueva, si es posterior).
+        cursor.execute("""
+            DO $$
+            DECLARE
+                mes timestamp;
+            BEGIN
+                FOR mes IN
+                    SELECT generate_series(
+                        date_trunc('month', COALESCE(MIN(fecha), now()) AT TIME ZONE 'UTC'),
+                        date_trunc('month', GREATEST(COALESCE(MAX(fecha), now()), now()) AT TIME ZONE 'UTC')
+                            + interval '3 months',
+                        interval '1 month'
+                    )
+                    FROM core_consumo_sin_particionar
+                LOOP
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF core_consumo FOR VALUES FROM (%L) TO (%L)',
+                        'core_consumo_p' || to_char(mes, 'YYYY_MM'),
+                        to_char(mes, 'YYYY-MM-DD HH24:MI:SS') || '+00',
+                        to_char(mes + interval '1 month', 'YYYY-MM-DD HH24:MI:SS') || '+00'
+                    );
+                END LOOP;
+            END $$;
+        """)
+        cursor.execute("""
+            INSERT INTO core_consumo (id, fecha, consumo, medidor_id)
+            SELECT id, fecha, consumo, medidor_id FROM core_consumo_sin_particionar;
+            SELECT setval('core_consumo_id_seq', COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM core_consumo;
+            DROP TABLE core_consumo_sin_particionar;
+            ANALYZE core_consumo;
+        """)
+
+
+def desparticionar(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        _renombrar_tabla(cursor, 'particionada')
+        cursor.execute(f"""
+            CREATE TABLE core_consumo (LIKE core_consumo_particionada);
+            ALTER TABLE core_consumo ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY (SEQUENCE NAME core_consumo_id_seq);
+            ALTER TABLE core_consumo ADD CONSTRAINT {PK} PRIMARY KEY (id);
+            {RESTRICCIONES}
+            INSERT INTO core_consumo (id, fecha, consumo, medidor_id)
+            SELECT id, fecha, consumo, medidor_id FROM core_consumo_particionada;
+            SELECT setval('core_consumo_id_seq', COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM core_consumo;
+            DROP TABLE core_consumo_particionada CASCADE;
+            ANALYZE core_consumo;
+        """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_jerarquia_medidores'),
+    ]
+
+    operations = [
+        migrations.RunPython(particionar, desparticionar),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 02:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_particionar_consumo'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='medidor',
+            name='nombre',
+            field=models.CharField(db_index=True, max_length=50),
+        ),
+    ]
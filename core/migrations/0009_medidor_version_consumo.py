@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_medidor_nombre_indice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medidor',
+            name='version_consumo',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.7 on 2026-10-17 02:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_medidor_version_consumo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerfilMedidor',
+            fields=[
+                ('medidor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='perfil', serialize=False, to='core.medidor')),
+                ('intervalo', models.PositiveIntegerField(help_text='Segundos entre lecturas consecutivas.')),
+                ('fase', models.PositiveIntegerField(default=0, help_text='Desfase en segundos de la grilla respecto de la época UTC.')),
+                ('acumulativo', models.BooleanField(default=False, help_text='La serie es un contador que solo crece.')),
+                ('muestras', models.PositiveIntegerField(default=0)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Perfil de Medidor',
+                'verbose_name_plural': 'Perfiles de Medidores',
+            },
+        ),
+        migrations.CreateModel(
+            name='IncidenciaSerie',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('hueco', 'Hueco'), ('fuera_de_grilla', 'Fuera de grilla'), ('duplicado', 'Duplicado en el intervalo'), ('delta_negativo', 'Delta negativo')], max_length=20)),
+                ('fecha', models.DateTimeField()),
+                ('fecha_anterior', models.DateTimeField(blank=True, null=True)),
+                ('faltantes', models.PositiveIntegerField(blank=True, null=True)),
+                ('diferencia', models.FloatField(blank=True, null=True)),
+                ('detectado', models.DateTimeField(auto_now_add=True)),
+                ('medidor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='incidencias', to='core.medidor')),
+            ],
+            options={
+                'verbose_name': 'Incidencia de Serie',
+                'verbose_name_plural': 'Incidencias de Series',
+                'indexes': [models.Index(fields=['medidor', 'fecha'], name='incidencia_medidor_fecha')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.7 on 2026-10-17 02:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_calidad_series'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='puntomedicion',
+            name='limite_contador',
+            field=models.FloatField(blank=True, help_text='Valor en el que el contador vuelve a cero. Vacío si no da la vuelta.', null=True, verbose_name='Límite del contador'),
+        ),
+        migrations.CreateModel(
+            name='ConsumoContador',
+            fields=[
+                ('documento', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='consumo_contador', serialize=False, to='core.documentomedicion')),
+                ('fecha', models.DateTimeField()),
+                ('delta', models.FloatField()),
+                ('tipo', models.CharField(choices=[('normal', 'Normal'), ('vuelta', 'Vuelta del contador'), ('reinicio', 'Reinicio del contador')], default='normal', max_length=10)),
+                ('documento_anterior', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.documentomedicion')),
+                ('punto_medicion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumos_contador', to='core.puntomedicion')),
+            ],
+            options={
+                'verbose_name': 'Consumo de Contador',
+                'verbose_name_plural': 'Consumos de Contadores',
+                'indexes': [models.Index(fields=['punto_medicion', 'fecha'], name='consumocontador_punto_fecha')],
+            },
+        ),
+    ]
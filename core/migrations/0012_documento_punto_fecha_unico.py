@@ -0,0 +1,52 @@
+# Generated by Django 5.1.7 on 2026-10-17 02:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+MAX_LISTADOS = 50
+
+
+def comprobar_duplicados(apps, schema_editor):
+    # Las lecturas repetidas las cargaron usuarios y de ellas cuelgan ConsumoContador: no se borran solas.
+    # Si hay, la migración se detiene con la lista para limpiarlas a mano y volver a migrar.
+    DocumentoMedicion = apps.get_model('core', 'DocumentoMedicion')
+    repetidos = list(
+        DocumentoMedicion.objects.values('punto_medicion', 'fecha_hora_lectura')
+        .annotate(cantidad=Count('id')).filter(cantidad__gt=1).order_by('punto_medicion', 'fecha_hora_lectura')
+    )
+    if not repetidos:
+        return
+    lineas = []
+    for grupo in repetidos[:MAX_LISTADOS]:
+        ids = DocumentoMedicion.objects.filter(
+            punto_medicion=grupo['punto_medicion'], fecha_hora_lectura=grupo['fecha_hora_lectura'],
+        ).order_by('id').values_list('id', flat=True)
+        lineas.append(f"  punto {grupo['punto_medicion']}, {grupo['fecha_hora_lectura']}: documentos {', '.join(map(str, ids))}")
+    if len(repetidos) > MAX_LISTADOS:
+        lineas.append(f"  ... y {len(repetidos) - MAX_LISTADOS} grupos más.")
+    raise RuntimeError(
+        f"Hay {len(repetidos)} grupos de DocumentoMedicion con el mismo punto de medición y fecha de lectura; "
+        f"la restricción documento_punto_fecha_unico no se puede crear. Deje un solo documento por grupo "
+        f"(borrar uno borra también sus ConsumoContador) y vuelva a ejecutar migrate:\n" + '\n'.join(lineas)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_consumo_contador'),
+    ]
+
+    operations = [
+        migrations.RunPython(comprobar_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='documentomedicion',
+            constraint=models.UniqueConstraint(fields=('punto_medicion', 'fecha_hora_lectura'), name='documento_punto_fecha_unico'),
+        ),
+        migrations.AlterField(
+            model_name='documentomedicion',
+            name='punto_medicion',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='core.puntomedicion'),
+        ),
+    ]
@@ -0,0 +1,119 @@
+# Índices para los accesos más comunes a Consumo y DocumentoMedicion:
+#
+# - consumo_medidor_fecha (medidor_id, fecha): consultas por medidor y rango (series, resúmenes,
+#   filtro por medidor del admin). Reemplaza al índice de la FK sobre medidor_id, que queda de más.
+# - documento_fecha (fecha_hora_lectura, id): la primera página del admin de lecturas, ordenada
+#   por fecha descendente. (punto_medicion, fecha_hora_lectura) ya lo da documento_punto_fecha_unico.
+#
+# No hay BRIN sobre Consumo.fecha: los rangos de fecha de todos los medidores ya los cubre el
+# índice único (fecha, medidor_id), y con filas cargadas medidor por medidor la correlación
+# física con la fecha es casi nula; el planificador igual elegía el BRIN y un día de todos los
+# medidores pasaba de 10 ms a 115 ms en la base de desarrollo (un millón de filas).
+#
+# En PostgreSQL se crean con CONCURRENTLY para no bloquear las escrituras, por eso la migración
+# no es atómica. core_consumo es particionada y no admite CONCURRENTLY: el índice se crea en la
+# tabla madre con ON ONLY (inválido), luego concurrentemente en cada partición y se le
+# acoplan; con la última queda válido. Las particiones que se creen después lo heredan.
+# Si la migración se corta a mitad, volver a correrla retoma: todo es IF [NOT] EXISTS y los
+# índices inválidos que deja un CONCURRENTLY fallido se borran y se vuelven a crear.
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Índice de la FK Consumo.medidor creado en 0001.
+INDICE_MEDIDOR = 'core_consumo_medidor_id_77f57a51'
+CONSUMO = [('consumo_medidor_fecha', 'btree (medidor_id, fecha)')]
+DOCUMENTO = [('documento_fecha', 'btree (fecha_hora_lectura, id)')]
+
+
+def _crear_concurrente(cursor, nombre, tabla, definicion):
+    cursor.execute(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = %s AND c.relnamespace = current_schema()::regnamespace",
+        [nombre],
+    )
+    fila = cursor.fetchone()
+    if fila is not None and not fila[0]:
+        cursor.execute(f'DROP INDEX CONCURRENTLY "{nombre}"')
+    cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{nombre}" ON "{tabla}" USING {definicion}')
+
+
+def _crear_indice(cursor, nombre, tabla, definicion):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [tabla])
+    if cursor.fetchone()[0] != 'p':
+        _crear_concurrente(cursor, nombre, tabla, definicion)
+        return
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS "{nombre}" ON ONLY "{tabla}" USING {definicion}')
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname",
+        [tabla],
+    )
+    for (particion,) in cursor.fetchall():
+        # Si el índice ya existía (corrida anterior) la partición ya tiene el suyo acoplado.
+        cursor.execute(
+            "SELECT 1 FROM pg_inherits i JOIN pg_index x ON x.indexrelid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s) AND x.indrelid = to_regclass(%s)",
+            [nombre, particion],
+        )
+        if cursor.fetchone():
+            continue
+        hijo = f"{particion}_{nombre.split('_', 1)[1]}"
+        _crear_concurrente(cursor, hijo, particion, definicion)
+        cursor.execute(f'ALTER INDEX "{nombre}" ATTACH PARTITION "{hijo}"')
+
+
+def crear_indices(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        if schema_editor.connection.vendor != 'postgresql':
+            cursor.execute("CREATE INDEX IF NOT EXISTS consumo_medidor_fecha ON core_consumo (medidor_id, fecha)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS documento_fecha ON core_documentomedicion (fecha_hora_lectura, id)")
+            cursor.execute(f"DROP INDEX IF EXISTS {INDICE_MEDIDOR}")
+            return
+        for nombre, definicion in CONSUMO:
+            _crear_indice(cursor, nombre, 'core_consumo', definicion)
+        for nombre, definicion in DOCUMENTO:
+            _crear_indice(cursor, nombre, 'core_documentomedicion', definicion)
+        # En una tabla particionada DROP INDEX no admite CONCURRENTLY; solo toca el catálogo.
+        cursor.execute(f"DROP INDEX IF EXISTS {INDICE_MEDIDOR}")
+
+
+def borrar_indices(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        if schema_editor.connection.vendor == 'postgresql':
+            _crear_indice(cursor, INDICE_MEDIDOR, 'core_consumo', 'btree (medidor_id)')
+        else:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {INDICE_MEDIDOR} ON core_consumo (medidor_id)")
+        # Borrar el índice de la madre borra los de las particiones.
+        for nombre, _ in CONSUMO + DOCUMENTO:
+            cursor.execute(f'DROP INDEX IF EXISTS "{nombre}"')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('core', '0012_documento_punto_fecha_unico'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(crear_indices, borrar_indices)],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='consumo',
+                    name='medidor',
+                    field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='consumos', to='core.medidor'),
+                ),
+                migrations.AddIndex(
+                    model_name='consumo',
+                    index=models.Index(fields=['medidor', 'fecha'], name='consumo_medidor_fecha'),
+                ),
+                migrations.AddIndex(
+                    model_name='documentomedicion',
+                    index=models.Index(fields=['fecha_hora_lectura', 'id'], name='documento_fecha'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_indices_consulta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LineaBaseMedidor',
+            fields=[
+                ('medidor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='linea_base', serialize=False, to='core.medidor')),
+                ('mediana', models.JSONField(default=list)),
+                ('mad', models.JSONField(default=list)),
+                ('hasta', models.DateTimeField(help_text='Fin (exclusivo) de las semanas de ConsumoHora usadas.')),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Línea Base de Medidor',
+                'verbose_name_plural': 'Líneas Base de Medidores',
+            },
+        ),
+        migrations.CreateModel(
+            name='AlertaConsumo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('pico', 'Pico'), ('caida', 'Caída'), ('meseta', 'Meseta (valor constante)')], max_length=10)),
+                ('severidad', models.PositiveSmallIntegerField(choices=[(1, 'Baja'), (2, 'Media'), (3, 'Alta')])),
+                ('desde', models.DateTimeField()),
+                ('hasta', models.DateTimeField()),
+                ('lecturas', models.PositiveIntegerField()),
+                ('valor', models.FloatField()),
+                ('esperado', models.FloatField(blank=True, null=True)),
+                ('puntaje', models.FloatField(blank=True, null=True)),
+                ('detectada', models.DateTimeField(auto_now_add=True)),
+                ('medidor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alertas', to='core.medidor')),
+            ],
+            options={
+                'verbose_name': 'Alerta de Consumo',
+                'verbose_name_plural': 'Alertas de Consumo',
+                'indexes': [models.Index(fields=['medidor', 'hasta'], name='alerta_medidor_hasta')],
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_anomalias_consumo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DemandaMedidor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateTimeField()),
+                ('intervalo', models.PositiveIntegerField(help_text='Segundos de cada intervalo del día en la demanda y el perfil.')),
+                ('dias', models.PositiveIntegerField(default=0)),
+                ('energia', models.FloatField(default=0)),
+                ('demanda_maxima', models.FloatField(blank=True, null=True)),
+                ('fecha_demanda_maxima', models.DateTimeField(blank=True, null=True)),
+                ('demanda_media', models.FloatField(blank=True, null=True)),
+                ('factor_carga', models.FloatField(blank=True, null=True)),
+                ('energia_bandas', models.JSONField(default=dict)),
+                ('perfil', models.JSONField(default=dict)),
+                ('calculado', models.DateTimeField(auto_now=True)),
+                ('medidor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='demandas', to='core.medidor')),
+            ],
+            options={
+                'verbose_name': 'Demanda de Medidor',
+                'verbose_name_plural': 'Demandas de Medidores',
+                'abstract': False,
+                'indexes': [models.Index(fields=['mes'], name='core_demandamedidor_mes')],
+                'unique_together': {('medidor', 'mes')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DemandaTipoMedidor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateTimeField()),
+                ('intervalo', models.PositiveIntegerField(help_text='Segundos de cada intervalo del día en la demanda y el perfil.')),
+                ('dias', models.PositiveIntegerField(default=0)),
+                ('energia', models.FloatField(default=0)),
+                ('demanda_maxima', models.FloatField(blank=True, null=True)),
+                ('fecha_demanda_maxima', models.DateTimeField(blank=True, null=True)),
+                ('demanda_media', models.FloatField(blank=True, null=True)),
+                ('factor_carga', models.FloatField(blank=True, null=True)),
+                ('energia_bandas', models.JSONField(default=dict)),
+                ('perfil', models.JSONField(default=dict)),
+                ('calculado', models.DateTimeField(auto_now=True)),
+                ('medidores', models.PositiveIntegerField(default=0)),
+                ('factor_coincidencia', models.FloatField(blank=True, null=True)),
+                ('tipo_medidor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='demandas', to='core.tipomedidor')),
+            ],
+            options={
+                'verbose_name': 'Demanda de Tipo de Medidor',
+                'verbose_name_plural': 'Demandas de Tipos de Medidores',
+                'abstract': False,
+                'indexes': [models.Index(fields=['mes'], name='core_demandatipomedidor_mes')],
+                'unique_together': {('tipo_medidor', 'mes')},
+            },
+        ),
+    ]
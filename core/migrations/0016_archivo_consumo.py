@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_demanda_mes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivoConsumo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateTimeField(unique=True)),
+                ('ruta', models.CharField(max_length=255)),
+                ('filas', models.PositiveIntegerField()),
+                ('medidores', models.PositiveIntegerField()),
+                ('suma', models.FloatField(blank=True, null=True)),
+                ('bytes', models.PositiveBigIntegerField()),
+                ('retiro', models.CharField(choices=[('borradas', 'Filas borradas'), ('eliminada', 'Partición eliminada'), ('desacoplada', 'Partición desacoplada')], max_length=20)),
+                ('archivado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Mes Archivado de Consumo',
+                'verbose_name_plural': 'Meses Archivados de Consumo',
+            },
+        ),
+    ]
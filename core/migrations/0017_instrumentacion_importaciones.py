@@ -0,0 +1,54 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_archivo_consumo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicionImportacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origen', models.CharField(choices=[('archivo', 'Archivo en cola (procesar_importaciones)'), ('admin', 'Importar del admin (django-import-export)')], max_length=20)),
+                ('nombre', models.CharField(blank=True, max_length=255)),
+                ('version', models.CharField(blank=True, db_index=True, max_length=100)),
+                ('exito', models.BooleanField(default=True)),
+                ('filas', models.PositiveIntegerField(default=0)),
+                ('segundos', models.FloatField()),
+                ('consultas', models.PositiveIntegerField(default=0)),
+                ('memoria_pico', models.PositiveBigIntegerField(default=0)),
+                ('creado', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('importacion', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mediciones', to='core.importacionconsumo')),
+            ],
+            options={
+                'verbose_name': 'Medición de Importación',
+                'verbose_name_plural': 'Mediciones de Importaciones',
+                'ordering': ['-creado'],
+            },
+        ),
+        migrations.CreateModel(
+            name='EtapaImportacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orden', models.PositiveSmallIntegerField()),
+                ('etapa', models.CharField(max_length=50)),
+                ('segundos', models.FloatField()),
+                ('filas', models.PositiveIntegerField(default=0)),
+                ('consultas', models.PositiveIntegerField(default=0)),
+                ('memoria_pico', models.PositiveBigIntegerField(default=0)),
+                ('medicion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='etapas', to='core.medicionimportacion')),
+            ],
+            options={
+                'verbose_name': 'Etapa de Importación',
+                'verbose_name_plural': 'Etapas de Importaciones',
+                'ordering': ['medicion', 'orden'],
+                'unique_together': {('medicion', 'etapa')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 04:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_instrumentacion_importaciones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importacionconsumo',
+            name='latido',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 from colorfield.fields import ColorField
 
@@ -13,34 +14,70 @@ class TipoMedidor(models.Model):
         
 class Medidor(models.Model):
     
-    nombre = models.CharField(max_length=50)
+    nombre = models.CharField(max_length=50, db_index=True)  # Búsquedas y cruces de importación por nombre
     tipo = models.CharField(max_length=50, blank=True, null=True)
     tipo_medidor = models.ForeignKey(TipoMedidor, on_delete=models.CASCADE, null=True, blank=True, related_name='medidores')
     medidor_padre = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='medidores_hijos')
+    # La sube cada importación que cambia consumos del medidor; forma parte de las claves de core.cache_consultas.
+    version_consumo = models.PositiveIntegerField(default=0, editable=False)
     def __str__(self):
         return self.nombre
 
+    def clean(self):
+        from django.core.exceptions import ValidationError
+        from .jerarquia import crea_ciclo
+        if self.pk and self.medidor_padre_id and crea_ciclo(self.pk, self.medidor_padre_id):
+            raise ValidationError({'medidor_padre': "El medidor padre no puede ser el propio medidor ni uno de sus descendientes."})
+
+
+class MedidorAncestro(models.Model):
+    """
+    Tabla de clausura del árbol medidor_padre: una fila por cada par (ancestro, descendiente),
+    incluido el propio medidor con profundidad 0. La mantiene core.jerarquia al guardar Medidor.
+    """
+    ancestro = models.ForeignKey(Medidor, on_delete=models.CASCADE, related_name='descendientes_arbol')
+    descendiente = models.ForeignKey(Medidor, on_delete=models.CASCADE, related_name='ancestros_arbol')
+    profundidad = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [['ancestro', 'descendiente']]
+        verbose_name = 'Ancestro de Medidor'
+        verbose_name_plural = 'Ancestros de Medidores'
+
+    def __str__(self):
+        return f"{self.ancestro_id} -> {self.descendiente_id} ({self.profundidad})"
+
 class VistaConsumoDiferencia(models.Model):
-    medidor_id = models.IntegerField(primary_key=True)  # Django necesita un primary_key
+    """
+    Diferencia entre cada lectura de Consumo y la anterior del mismo medidor.
+
+    Antes era una vista calculada en cada lectura; ahora es una tabla que mantiene
+    core.diferencias después de cada importación (conserva el nombre de la vista).
+    """
+    medidor_id = models.IntegerField()
     fecha = models.DateTimeField()
-    consumo = models.FloatField()
-    consumo_anterior = models.FloatField()
-    diferencia_consumo = models.FloatField()
+    consumo = models.FloatField(null=True, blank=True)
+    consumo_anterior = models.FloatField(null=True, blank=True)
+    diferencia_consumo = models.FloatField(null=True, blank=True)
 
     class Meta:
-        managed = False  # Evita que Django intente crear esta tabla
         db_table = 'vista_consumo_diferencia'
         verbose_name = 'Vista Consumo Diferencia'
         verbose_name_plural = 'Vista Consumo Diferencia'
         ordering = ['-fecha']
+        unique_together = [['medidor_id', 'fecha']]
+        indexes = [models.Index(fields=['fecha'], name='vista_consumo_dif_fecha')]
 
 class Consumo(models.Model):
     fecha = models.DateTimeField()
     consumo = models.FloatField(null=True, blank=True)
-    medidor = models.ForeignKey(Medidor, on_delete=models.CASCADE, null=True, blank=True, related_name='consumos')
+    # Sin índice propio: lo cubre consumo_medidor_fecha, que empieza por el medidor.
+    medidor = models.ForeignKey(Medidor, on_delete=models.CASCADE, null=True, blank=True, related_name='consumos', db_index=False)
     
     class Meta:
         unique_together = [['fecha', 'medidor']]
+        # unique_together sirve los rangos de fecha de todos los medidores; este, los de un medidor.
+        indexes = [models.Index(fields=['medidor', 'fecha'], name='consumo_medidor_fecha')]
         verbose_name = 'Consumo'
         verbose_name_plural = 'Consumos'
 
@@ -48,9 +85,269 @@ class Consumo(models.Model):
         return f"{self.medidor.nombre if self.medidor else 'Sin medidor'} - {self.fecha} - {self.consumo} kWh"
 
 
-from django.db import models
+class ResumenConsumo(models.Model):
+    """Agregado de Consumo por medidor e intervalo; lo mantiene core.resumenes a partir de cada importación."""
+    medidor = models.ForeignKey(Medidor, on_delete=models.CASCADE, related_name='+')
+    inicio = models.DateTimeField()  # Inicio del intervalo en settings.TIME_ZONE
+    suma = models.FloatField(null=True, blank=True)
+    minimo = models.FloatField(null=True, blank=True)
+    maximo = models.FloatField(null=True, blank=True)
+    lecturas = models.PositiveIntegerField(default=0)
+    primera_fecha = models.DateTimeField()
+    primer_valor = models.FloatField(null=True, blank=True)
+    ultima_fecha = models.DateTimeField()
+    ultimo_valor = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+        unique_together = [['medidor', 'inicio']]
+        # Las consultas por rango sin filtrar medidor (totales por tipo o generales) van por inicio.
+        indexes = [models.Index(fields=['inicio'], name='%(app_label)s_%(class)s_inicio')]
+
+    def __str__(self):
+        return f"{self.medidor_id} - {self.inicio} - {self.suma}"
+
+
+class ConsumoHora(ResumenConsumo):
+    class Meta(ResumenConsumo.Meta):
+        verbose_name = 'Consumo por Hora'
+        verbose_name_plural = 'Consumos por Hora'
+
+
+class ConsumoDia(ResumenConsumo):
+    class Meta(ResumenConsumo.Meta):
+        verbose_name = 'Consumo por Día'
+        verbose_name_plural = 'Consumos por Día'
+
+
+class ConsumoMes(ResumenConsumo):
+    class Meta(ResumenConsumo.Meta):
+        verbose_name = 'Consumo por Mes'
+        verbose_name_plural = 'Consumos por Mes'
+
+
+class PerfilMedidor(models.Model):
+    """Intervalo nominal y fase de la serie de un medidor, inferidos por core.calidad."""
+    medidor = models.OneToOneField(Medidor, on_delete=models.CASCADE, primary_key=True, related_name='perfil')
+    intervalo = models.PositiveIntegerField(help_text='Segundos entre lecturas consecutivas.')
+    fase = models.PositiveIntegerField(default=0, help_text='Desfase en segundos de la grilla respecto de la época UTC.')
+    acumulativo = models.BooleanField(default=False, help_text='La serie es un contador que solo crece.')
+    muestras = models.PositiveIntegerField(default=0)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Perfil de Medidor'
+        verbose_name_plural = 'Perfiles de Medidores'
+
+    def __str__(self):
+        return f"{self.medidor_id}: cada {self.intervalo} s"
+
+
+class IncidenciaSerie(models.Model):
+    """Hueco, lectura fuera de grilla, lectura duplicada o delta negativo en la serie de un medidor."""
+    HUECO = 'hueco'
+    FUERA_DE_GRILLA = 'fuera_de_grilla'
+    DUPLICADO = 'duplicado'
+    DELTA_NEGATIVO = 'delta_negativo'
+    TIPOS = [
+        (HUECO, 'Hueco'),
+        (FUERA_DE_GRILLA, 'Fuera de grilla'),
+        (DUPLICADO, 'Duplicado en el intervalo'),
+        (DELTA_NEGATIVO, 'Delta negativo'),
+    ]
+
+    medidor = models.ForeignKey(Medidor, on_delete=models.CASCADE, related_name='incidencias')
+    tipo = models.CharField(max_length=20, choices=TIPOS)
+    fecha = models.DateTimeField()  # Lectura donde se detecta (la posterior, en huecos y deltas)
+    fecha_anterior = models.DateTimeField(null=True, blank=True)
+    faltantes = models.PositiveIntegerField(null=True, blank=True)  # Lecturas que faltan en un hueco
+    diferencia = models.FloatField(null=True, blank=True)  # Delta de consumo, en deltas negativos
+    detectado = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Incidencia de Serie'
+        verbose_name_plural = 'Incidencias de Series'
+        indexes = [models.Index(fields=['medidor', 'fecha'], name='incidencia_medidor_fecha')]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} en {self.medidor_id} ({self.fecha})"
+
+
+class LineaBaseMedidor(models.Model):
+    """Consumo esperado de un medidor por hora de la semana, calculado por core.anomalias desde ConsumoHora."""
+    medidor = models.OneToOneField(Medidor, on_delete=models.CASCADE, primary_key=True, related_name='linea_base')
+    # 168 valores (lunes 0 h ... domingo 23 h, hora local); None donde no hay semanas suficientes.
+    mediana = models.JSONField(default=list)
+    mad = models.JSONField(default=list)
+    hasta = models.DateTimeField(help_text='Fin (exclusivo) de las semanas de ConsumoHora usadas.')
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Línea Base de Medidor'
+        verbose_name_plural = 'Líneas Base de Medidores'
+
+    def __str__(self):
+        return f"{self.medidor_id} hasta {self.hasta}"
+
+
+class AlertaConsumo(models.Model):
+    """Pico, caída o meseta en el consumo de un medidor, detectados por core.anomalias."""
+    PICO = 'pico'
+    CAIDA = 'caida'
+    MESETA = 'meseta'
+    TIPOS = [
+        (PICO, 'Pico'),
+        (CAIDA, 'Caída'),
+        (MESETA, 'Meseta (valor constante)'),
+    ]
+    BAJA = 1
+    MEDIA = 2
+    ALTA = 3
+    SEVERIDADES = [(BAJA, 'Baja'), (MEDIA, 'Media'), (ALTA, 'Alta')]
+
+    medidor = models.ForeignKey(Medidor, on_delete=models.CASCADE, related_name='alertas')
+    tipo = models.CharField(max_length=10, choices=TIPOS)
+    severidad = models.PositiveSmallIntegerField(choices=SEVERIDADES)
+    desde = models.DateTimeField()  # Primera y última lectura de la anomalía
+    hasta = models.DateTimeField()
+    lecturas = models.PositiveIntegerField()
+    valor = models.FloatField()  # El más alejado de lo esperado (el constante, en mesetas)
+    esperado = models.FloatField(null=True, blank=True)
+    puntaje = models.FloatField(null=True, blank=True)  # z robusto del valor; en mesetas, nulo
+    detectada = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Alerta de Consumo'
+        verbose_name_plural = 'Alertas de Consumo'
+        indexes = [models.Index(fields=['medidor', 'hasta'], name='alerta_medidor_hasta')]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} en {self.medidor_id} ({self.desde} - {self.hasta})"
+
+
+class DemandaMes(models.Model):
+    """Demanda, factor de carga, energía por banda horaria y perfil diario de un mes; los calcula core.demanda."""
+    mes = models.DateTimeField()  # Inicio del mes en settings.TIME_ZONE
+    intervalo = models.PositiveIntegerField(help_text='Segundos de cada intervalo del día en la demanda y el perfil.')
+    dias = models.PositiveIntegerField(default=0)  # Días del mes con lecturas
+    energia = models.FloatField(default=0)
+    # Demandas en energía por hora (kW si el consumo está en kWh).
+    demanda_maxima = models.FloatField(null=True, blank=True)
+    fecha_demanda_maxima = models.DateTimeField(null=True, blank=True)  # Inicio del intervalo de la máxima
+    demanda_media = models.FloatField(null=True, blank=True)  # Sobre los intervalos con lecturas
+    factor_carga = models.FloatField(null=True, blank=True)  # demanda_media / demanda_maxima
+    energia_bandas = models.JSONField(default=dict)  # {banda horaria: energía}
+    # Demanda por intervalo del día (hora local) sobre los días del mes: {'p10', 'p50', 'p90', 'maximo'}.
+    perfil = models.JSONField(default=dict)
+    calculado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+        indexes = [models.Index(fields=['mes'], name='%(app_label)s_%(class)s_mes')]
+
+
+class DemandaMedidor(DemandaMes):
+    medidor = models.ForeignKey(Medidor, on_delete=models.CASCADE, related_name='demandas')
+
+    class Meta(DemandaMes.Meta):
+        unique_together = [['medidor', 'mes']]
+        verbose_name = 'Demanda de Medidor'
+        verbose_name_plural = 'Demandas de Medidores'
+
+    def __str__(self):
+        return f"{self.medidor_id} - {self.mes:%Y-%m}"
+
+
+class DemandaTipoMedidor(DemandaMes):
+    """Suma hora a hora de los medidores del tipo (desde ConsumoHora), sin los acumulativos."""
+    tipo_medidor = models.ForeignKey(TipoMedidor, on_delete=models.CASCADE, related_name='demandas')
+    medidores = models.PositiveIntegerField(default=0)  # Medidores con lecturas en el mes
+    # Demanda máxima del conjunto / suma de las demandas máximas horarias de cada medidor.
+    factor_coincidencia = models.FloatField(null=True, blank=True)
+
+    class Meta(DemandaMes.Meta):
+        unique_together = [['tipo_medidor', 'mes']]
+        verbose_name = 'Demanda de Tipo de Medidor'
+        verbose_name_plural = 'Demandas de Tipos de Medidores'
+
+    def __str__(self):
+        return f"{self.tipo_medidor_id} - {self.mes:%Y-%m}"
+
+
+class ArchivoConsumo(models.Model):
+    """Mes de Consumo archivado en Parquet por core.archivo y retirado de la tabla."""
+    BORRADAS = 'borradas'
+    ELIMINADA = 'eliminada'
+    DESACOPLADA = 'desacoplada'
+    RETIROS = [
+        (BORRADAS, 'Filas borradas'),
+        (ELIMINADA, 'Partición eliminada'),
+        (DESACOPLADA, 'Partición desacoplada'),
+    ]
+
+    mes = models.DateTimeField(unique=True)  # Inicio del mes UTC, como las particiones de core_consumo
+    ruta = models.CharField(max_length=255)  # Relativa a settings.ARCHIVO_CONSUMO_DIR
+    filas = models.PositiveIntegerField()
+    medidores = models.PositiveIntegerField()
+    suma = models.FloatField(null=True, blank=True)  # Suma de consumo del mes, verificada contra la tabla
+    bytes = models.PositiveBigIntegerField()
+    retiro = models.CharField(max_length=20, choices=RETIROS)
+    archivado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Mes Archivado de Consumo'
+        verbose_name_plural = 'Meses Archivados de Consumo'
+
+    def __str__(self):
+        return f"{self.mes:%Y-%m} ({self.filas} lecturas)"
+
+
+class ImportacionConsumo(models.Model):
+    """Trabajo de importación de un archivo de consumos, procesado fuera del request por un worker."""
+    PENDIENTE = 'pendiente'
+    EN_PROCESO = 'en_proceso'
+    COMPLETADO = 'completado'
+    ERROR = 'error'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente'),
+        (EN_PROCESO, 'En proceso'),
+        (COMPLETADO, 'Completado'),
+        (ERROR, 'Error'),
+    ]
+
+    archivo = models.FileField(upload_to='importaciones/')
+    nombre_original = models.CharField(max_length=255)
+    sobrescribir = models.BooleanField(default=False, verbose_name="Sobrescribir existentes")
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=PENDIENTE, db_index=True)
+
+    filas_leidas = models.PositiveIntegerField(default=0)
+    filas_staging = models.PositiveIntegerField(default=0)
+    filas_fusionadas = models.PositiveIntegerField(default=0)
+    filas_rechazadas = models.PositiveIntegerField(default=0)
+    filas_duplicadas = models.PositiveIntegerField(default=0)
+    filas_medidor_desconocido = models.PositiveIntegerField(default=0)
+    errores = models.JSONField(default=list, blank=True)  # Ejemplos de errores de validación
+    rechazos_por_motivo = models.JSONField(default=dict, blank=True)
+    rechazos = models.FileField(upload_to='importaciones/rechazos/', blank=True)  # CSV fila/motivo/valor
+    mensaje = models.TextField(blank=True, default='')
+
+    creado = models.DateTimeField(auto_now_add=True)
+    iniciado = models.DateTimeField(null=True, blank=True)
+    latido = models.DateTimeField(null=True, blank=True)  # Última señal del worker (ver core.tareas)
+    finalizado = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Importación de Consumo'
+        verbose_name_plural = 'Importaciones de Consumo'
+        ordering = ['-creado']
+
+    def __str__(self):
+        return f"#{self.pk} {self.nombre_original} ({self.get_estado_display()})"
+
 
 class InterfaceConsumo(models.Model):
+    importacion = models.ForeignKey(ImportacionConsumo, on_delete=models.CASCADE, null=True, blank=True, related_name='staging')
     fecha = models.DateTimeField(null=True, blank=True)
     consumo = models.FloatField(null=True, blank=True)
     medidor = models.CharField(max_length=50, null=True, blank=True)
@@ -58,9 +355,67 @@ class InterfaceConsumo(models.Model):
     class Meta:
         db_table = 'interface_core_consumo'
         managed = True
-        unique_together = ['fecha', 'medidor']
+        # Cada importación tiene su propio lote en staging, así varias pueden correr en paralelo.
+        unique_together = ['importacion', 'fecha', 'medidor']
+
+
+class MedicionImportacion(models.Model):
+    """Tiempos, consultas y memoria de una importación de consumo, medidos por core.instrumentacion."""
+    ARCHIVO = 'archivo'
+    ADMIN = 'admin'
+    ORIGENES = [
+        (ARCHIVO, 'Archivo en cola (procesar_importaciones)'),
+        (ADMIN, 'Importar del admin (django-import-export)'),
+    ]
 
-        # NO unique_together HERE
+    importacion = models.ForeignKey(
+        ImportacionConsumo, on_delete=models.SET_NULL, null=True, blank=True, related_name='mediciones',
+    )
+    origen = models.CharField(max_length=20, choices=ORIGENES)
+    nombre = models.CharField(max_length=255, blank=True)
+    version = models.CharField(max_length=100, blank=True, db_index=True)  # settings.VERSION_DESPLIEGUE
+    exito = models.BooleanField(default=True)
+    filas = models.PositiveIntegerField(default=0)
+    segundos = models.FloatField()
+    consultas = models.PositiveIntegerField(default=0)
+    memoria_pico = models.PositiveBigIntegerField(default=0)  # Bytes, según settings.INSTRUMENTACION_MEMORIA; 0 si no se mide
+    creado = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Medición de Importación'
+        verbose_name_plural = 'Mediciones de Importaciones'
+        ordering = ['-creado']
+
+    def __str__(self):
+        return f"{self.nombre or self.get_origen_display()} ({self.segundos:.1f} s)"
+
+    @property
+    def filas_por_segundo(self):
+        return self.filas / self.segundos if self.segundos else 0.0
+
+
+class EtapaImportacion(models.Model):
+    """Una etapa de una MedicionImportacion; `segundos` es el tiempo propio, sin las etapas anidadas."""
+    medicion = models.ForeignKey(MedicionImportacion, on_delete=models.CASCADE, related_name='etapas')
+    orden = models.PositiveSmallIntegerField()
+    etapa = models.CharField(max_length=50)
+    segundos = models.FloatField()
+    filas = models.PositiveIntegerField(default=0)
+    consultas = models.PositiveIntegerField(default=0)
+    memoria_pico = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Etapa de Importación'
+        verbose_name_plural = 'Etapas de Importaciones'
+        ordering = ['medicion', 'orden']
+        unique_together = ['medicion', 'etapa']
+
+    def __str__(self):
+        return f"{self.etapa} ({self.segundos:.2f} s)"
+
+    @property
+    def filas_por_segundo(self):
+        return self.filas / self.segundos if self.segundos else 0.0
 
 from django.db import models
 
@@ -127,6 +482,10 @@ class PuntoMedicion(models.Model):
     categoria = models.ForeignKey(CategoriaPuntoMedicion, on_delete=models.SET_NULL, blank=True, null=True)
     caracteristica = models.ForeignKey(CaracteristicaMedicion, on_delete=models.PROTECT)
     es_contador = models.BooleanField(default=False, verbose_name="Es Contador")
+    limite_contador = models.FloatField(
+        blank=True, null=True, verbose_name="Límite del contador",
+        help_text="Valor en el que el contador vuelve a cero. Vacío si no da la vuelta.",
+    )
     # Removed fields: ambito_medicion_inferior, ambito_medicion_superior, valor_objetivo
 
     def __str__(self) -> str:  # Add explicit return type annotation
@@ -138,7 +497,8 @@ class PuntoMedicion(models.Model):
 
 class DocumentoMedicion(models.Model):
     """Registra las lecturas tomadas en los puntos de medición."""
-    punto_medicion = models.ForeignKey(PuntoMedicion, on_delete=models.CASCADE)
+    # Sin índice propio: lo cubre documento_punto_fecha_unico, que empieza por el punto.
+    punto_medicion = models.ForeignKey(PuntoMedicion, on_delete=models.CASCADE, db_index=False)
     fecha_hora_lectura = models.DateTimeField(verbose_name="Fecha y hora de lectura")  # Removed auto_now_add
     valor_leido = models.FloatField()
     lectura_contador = models.FloatField(blank=True, null=True, verbose_name="Lectura de Contador (si aplica)")
@@ -151,3 +511,36 @@ class DocumentoMedicion(models.Model):
         verbose_name = "Documento de Medición"
         verbose_name_plural = "Documentos de Medición"
         ordering = ['-fecha_hora_lectura']
+        # Para la primera página del admin (más recientes primero) y el filtro por fecha.
+        indexes = [models.Index(fields=['fecha_hora_lectura', 'id'], name='documento_fecha')]
+        # Una lectura por punto y momento: la ingesta masiva (core.ingesta) es idempotente sobre esta clave.
+        constraints = [
+            models.UniqueConstraint(fields=['punto_medicion', 'fecha_hora_lectura'], name='documento_punto_fecha_unico'),
+        ]
+
+
+class ConsumoContador(models.Model):
+    """Consumo entre dos lecturas de contador consecutivas de un punto, calculado por core.contadores."""
+    NORMAL = 'normal'
+    VUELTA = 'vuelta'
+    REINICIO = 'reinicio'
+    TIPOS = [
+        (NORMAL, 'Normal'),
+        (VUELTA, 'Vuelta del contador'),
+        (REINICIO, 'Reinicio del contador'),
+    ]
+
+    documento = models.OneToOneField(DocumentoMedicion, on_delete=models.CASCADE, primary_key=True, related_name='consumo_contador')
+    punto_medicion = models.ForeignKey(PuntoMedicion, on_delete=models.CASCADE, related_name='consumos_contador')
+    fecha = models.DateTimeField()  # Copia de fecha_hora_lectura del documento
+    documento_anterior = models.ForeignKey(DocumentoMedicion, on_delete=models.SET_NULL, null=True, related_name='+')
+    delta = models.FloatField()
+    tipo = models.CharField(max_length=10, choices=TIPOS, default=NORMAL)
+
+    class Meta:
+        verbose_name = 'Consumo de Contador'
+        verbose_name_plural = 'Consumos de Contadores'
+        indexes = [models.Index(fields=['punto_medicion', 'fecha'], name='consumocontador_punto_fecha')]
+
+    def __str__(self):
+        return f"{self.punto_medicion_id} {self.fecha}: {self.delta}"
@@ -0,0 +1,53 @@
+"""
+Conteos estimados para listados sobre tablas grandes (Consumo).
+
+Un COUNT(*) exacto recorre toda la tabla (o todas las particiones que cruza el filtro).
+En PostgreSQL el planificador ya tiene una estimación: sin filtros sale de pg_class
+(reltuples, sumando las particiones) y con filtros del plan de EXPLAIN, que no ejecuta
+la consulta. Por debajo de UMBRAL_CONTEO_EXACTO se cuenta de verdad, que ahí es barato.
+En otros motores siempre se cuenta.
+"""
+import json
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+UMBRAL_CONTEO_EXACTO = 10000
+
+
+def estimar_filas(queryset):
+    """Filas que PostgreSQL espera para `queryset`, sin ejecutarlo; None en otros motores."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    if not queryset.query.where:
+        tabla = queryset.model._meta.db_table
+        with connection.cursor() as cursor:
+            # Una tabla particionada no tiene filas propias: se suman las de sus particiones.
+            cursor.execute(
+                "SELECT COALESCE("
+                "(SELECT SUM(GREATEST(c.reltuples, 0)) FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(%s)), "
+                "(SELECT GREATEST(reltuples, 0) FROM pg_class WHERE oid = to_regclass(%s)))",
+                [tabla, tabla],
+            )
+            return int(cursor.fetchone()[0] or 0)
+    plan = queryset.explain(format='json')
+    if not plan:  # queryset.none() o un __in vacío: Django no llega a consultar
+        return 0
+    return int(json.loads(plan)[0]['Plan']['Plan Rows'])
+
+
+class PaginadorEstimado(Paginator):
+    """Paginator cuyo `count` es la estimación del planificador cuando la tabla es grande."""
+
+    estimado = False
+
+    @cached_property
+    def count(self):
+        filas = estimar_filas(self.object_list)
+        if filas is not None and filas > UMBRAL_CONTEO_EXACTO:
+            self.estimado = True
+            return filas
+        return super().count
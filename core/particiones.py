@@ -0,0 +1,175 @@
+"""
+Particiones mensuales de core_consumo en PostgreSQL (ver migración 0007).
+
+Cada mes UTC es una partición `core_consumo_pAAAA_MM`; lo que no cae en ninguna va a
+`core_consumo_default`. Las consultas que filtran Consumo por un rango de fecha
+(fecha__gte / fecha__lt, como consumos_en_rango) solo leen las particiones del rango;
+fecha__date, fecha__month y similares envuelven la columna en una función y obligan a
+revisarlas todas.
+
+mantener_particiones() crea las de los próximos meses, saca de la partición por defecto
+los meses que hayan caído ahí y, con retención, desacopla o elimina las más viejas: borrar
+un mes es un DROP/DETACH en lugar de un DELETE fila a fila. Los resúmenes
+(ConsumoHora/Dia/Mes) no se tocan, así que el histórico agregado se conserva.
+
+En SQLite no hay particiones: las funciones de mantenimiento no hacen nada.
+"""
+import logging
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection as default_connection, transaction
+from django.utils import timezone
+
+from .models import Consumo
+
+logger = logging.getLogger(__name__)
+
+TABLA = Consumo._meta.db_table
+DEFAULT = f"{TABLA}_default"
+_NOMBRE = re.compile(rf"^{TABLA}_p(\d{{4}})_(\d{{2}})$")
+
+
+def inicio_mes(fecha):
+    """Inicio (aware, UTC) del mes UTC que contiene `fecha`."""
+    utc = fecha.astimezone(dt_timezone.utc)
+    return datetime(utc.year, utc.month, 1, tzinfo=dt_timezone.utc)
+
+
+def sumar_meses(inicio, meses):
+    total = inicio.year * 12 + inicio.month - 1 + meses
+    return datetime(total // 12, total % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def rango_mes(fecha):
+    """[inicio, fin) del mes UTC de `fecha`: exactamente los límites de su partición."""
+    inicio = inicio_mes(fecha)
+    return inicio, sumar_meses(inicio, 1)
+
+
+def nombre_particion(inicio):
+    return f"{TABLA}_p{inicio:%Y_%m}"
+
+
+def consumos_en_rango(desde, hasta, medidores=None):
+    """Consumo con fecha en [desde, hasta), escrito para que PostgreSQL descarte las particiones de fuera."""
+    qs = Consumo.objects.filter(fecha__gte=desde, fecha__lt=hasta)
+    if medidores is not None:
+        qs = qs.filter(medidor__in=medidores)
+    return qs
+
+
+def esta_particionada(connection=None):
+    connection = connection or default_connection
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABLA])
+        fila = cursor.fetchone()
+    return fila is not None and fila[0] == 'p'
+
+
+def particiones(connection=None):
+    """Lista ordenada de (nombre, desde, hasta) de las particiones mensuales acopladas."""
+    connection = connection or default_connection
+    if not esta_particionada(connection):
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)",
+            [TABLA],
+        )
+        nombres = [fila[0] for fila in cursor.fetchall()]
+    resultado = []
+    for nombre in nombres:
+        coincidencia = _NOMBRE.match(nombre)
+        if coincidencia:
+            inicio = datetime(int(coincidencia[1]), int(coincidencia[2]), 1, tzinfo=dt_timezone.utc)
+            resultado.append((nombre, inicio, sumar_meses(inicio, 1)))
+    return sorted(resultado, key=lambda p: p[1])
+
+
+def crear_particion(inicio, connection=None):
+    """
+    Crea la partición del mes que empieza en `inicio`, pasando a ella las filas de ese mes que
+    estuvieran en la partición por defecto (con la default ocupada, PARTITION OF fallaría).
+    """
+    connection = connection or default_connection
+    inicio = inicio_mes(inicio)
+    fin = sumar_meses(inicio, 1)
+    nombre = nombre_particion(inicio)
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE "{nombre}" (LIKE {TABLA} INCLUDING DEFAULTS)')
+        cursor.execute(
+            f'WITH movidas AS (DELETE FROM {DEFAULT} WHERE fecha >= %s AND fecha < %s RETURNING *) '
+            f'INSERT INTO "{nombre}" SELECT * FROM movidas',
+            [inicio, fin],
+        )
+        movidas = cursor.rowcount
+        # ATTACH crea en la partición los índices y restricciones de la tabla madre.
+        cursor.execute(
+            f"ALTER TABLE {TABLA} ATTACH PARTITION \"{nombre}\" FOR VALUES FROM (%s) TO (%s)",
+            [inicio, fin],
+        )
+    logger.info(f"Partición {nombre} creada ({movidas} filas desde {DEFAULT}).")
+    return movidas
+
+
+def meses_en_default(connection=None):
+    """Inicios de los meses que tienen filas en la partición por defecto."""
+    connection = connection or default_connection
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT DISTINCT date_trunc('month', fecha AT TIME ZONE 'UTC') FROM {DEFAULT}")
+        return sorted(fila[0].replace(tzinfo=dt_timezone.utc) for fila in cursor.fetchall())
+
+
+def retirar_particion(nombre, eliminar=False, connection=None):
+    """
+    Saca una partición de core_consumo. Por defecto la desacopla y la renombra a
+    core_consumo_archivo_AAAA_MM (los datos quedan en una tabla aparte); con `eliminar`, la borra.
+    """
+    connection = connection or default_connection
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        if eliminar:
+            cursor.execute(f'DROP TABLE "{nombre}"')
+            destino = None
+        else:
+            destino = nombre.replace(f"{TABLA}_p", f"{TABLA}_archivo_", 1)
+            cursor.execute(f'ALTER TABLE {TABLA} DETACH PARTITION "{nombre}"')
+            cursor.execute(f'ALTER TABLE "{nombre}" RENAME TO "{destino}"')
+    logger.info(f"Partición {nombre} {'eliminada' if eliminar else f'desacoplada como {destino}'}.")
+    return destino
+
+
+def mantener_particiones(meses_adelante=3, retener_meses=None, eliminar=False, simular=False, ahora=None, connection=None):
+    """
+    Crea las particiones que falten hasta `meses_adelante` meses después del actual, crea las
+    de los meses con filas en la partición por defecto y, si se pasa `retener_meses`, retira las
+    que terminan antes de ese número de meses atrás. Con `simular` solo informa qué haría.
+
+    Devuelve {'creadas': [...], 'retiradas': [...]} con los nombres de las particiones.
+    """
+    connection = connection or default_connection
+    if not esta_particionada(connection):
+        return {'creadas': [], 'retiradas': []}
+    actual = inicio_mes(ahora or timezone.now())
+    existentes = {inicio for _, inicio, _ in particiones(connection)}
+
+    pendientes = {sumar_meses(actual, i) for i in range(meses_adelante + 1)}
+    pendientes.update(meses_en_default(connection))
+    if retener_meses is not None:
+        limite = sumar_meses(actual, -retener_meses)
+        # Un mes ya vencido que estaba en la default no se crea solo para retirarlo después.
+        pendientes = {inicio for inicio in pendientes if inicio >= limite}
+        retirar = [nombre for nombre, _, hasta in particiones(connection) if hasta <= limite]
+    else:
+        retirar = []
+    crear = sorted(pendientes - existentes)
+
+    if not simular:
+        for inicio in crear:
+            crear_particion(inicio, connection)
+        for nombre in retirar:
+            retirar_particion(nombre, eliminar, connection)
+    return {'creadas': [nombre_particion(inicio) for inicio in crear], 'retiradas': retirar}
@@ -0,0 +1,175 @@
+"""
+Clasificación de lecturas (DocumentoMedicion.valor_leido) en los RangoMedicion de su característica.
+
+Por característica se arma un IndiceRangos: los bordes de todos los rangos, ordenados, y para
+cada borde y cada tramo entre bordes el rango que le corresponde. Clasificar un valor es una
+búsqueda binaria (bisect para un valor, numpy.searchsorted para un arreglo entero), sin
+recorrer los rangos ni consultar la base por lectura.
+
+Los rangos son cerrados, [valor_min, valor_max]. Si un valor cae en más de uno gana el de
+mayor valor_min (el más específico); dos rangos que solo comparten un borde no se consideran
+solapados. Al armar el índice se registran los solapamientos, los huecos entre rangos
+consecutivos y los rangos invertidos (valor_min > valor_max, que se ignoran).
+
+Los índices se guardan en el backend de core.cache_consultas y se borran con las señales de
+RangoMedicion. Las operaciones que no pasan por save()/delete() (bulk_create, update()) no
+las disparan: después hay que llamar a invalidar().
+
+anotar_rango() hace lo mismo del lado de SQL, para filtrar u ordenar un queryset por rango.
+"""
+import bisect
+import logging
+from collections import namedtuple
+
+import numpy as np
+from django.db.models import OuterRef, Subquery
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache_consultas import backend
+from .models import RangoMedicion
+
+logger = logging.getLogger(__name__)
+
+PREFIJO = 'rangos'
+# Índice del tramo sin rango.
+SIN_RANGO = -1
+
+Problema = namedtuple('Problema', 'tipo desde hasta rangos')
+
+
+class IndiceRangos:
+    """Rangos de una característica preparados para búsqueda binaria."""
+
+    def __init__(self, caracteristica_id, rangos):
+        self.caracteristica_id = caracteristica_id
+        self.problemas = []
+        validos = []
+        for rango in rangos:
+            if rango.valor_min > rango.valor_max:
+                self.problemas.append(Problema('invertido', rango.valor_min, rango.valor_max, (rango.pk,)))
+            else:
+                validos.append(rango)
+        validos.sort(key=lambda r: (r.valor_min, r.valor_max, r.pk))
+        self._revisar(validos)
+
+        self.ids = np.array([r.pk for r in validos], dtype=np.int64)
+        self.colores = [r.color for r in validos]
+        self.descripciones = [r.descripcion for r in validos]
+        self.bordes = sorted({r.valor_min for r in validos} | {r.valor_max for r in validos})
+        # en_borde[j]: rango de un valor igual a bordes[j]; entre[j]: de uno entre bordes[j - 1] y bordes[j].
+        self.en_borde = np.array([self._ganador(validos, b, b) for b in self.bordes], dtype=np.int64)
+        self.entre = np.array(
+            [SIN_RANGO] + [self._ganador(validos, a, b) for a, b in zip(self.bordes, self.bordes[1:])]
+            + [SIN_RANGO], dtype=np.int64,
+        )
+        self._bordes = np.array(self.bordes, dtype=np.float64)
+
+    def _revisar(self, rangos):
+        # Recorrido por valor_min con el máximo alcanzado hasta ahora: lo que empieza antes está
+        # solapado, lo que empieza después deja un hueco.
+        alcance, ultimo = None, None
+        for rango in rangos:
+            if alcance is not None and rango.valor_min < alcance:
+                self.problemas.append(Problema('solapamiento', rango.valor_min, min(alcance, rango.valor_max), (ultimo.pk, rango.pk)))
+            elif alcance is not None and rango.valor_min > alcance:
+                self.problemas.append(Problema('hueco', alcance, rango.valor_min, (ultimo.pk, rango.pk)))
+            if alcance is None or rango.valor_max > alcance:
+                alcance, ultimo = rango.valor_max, rango
+
+    @staticmethod
+    def _ganador(rangos, desde, hasta):
+        """Posición del rango de mayor valor_min que cubre todo el tramo [desde, hasta]."""
+        for i in range(len(rangos) - 1, -1, -1):
+            if rangos[i].valor_min <= desde and hasta <= rangos[i].valor_max:
+                return i
+        return SIN_RANGO
+
+    def posicion(self, valor):
+        """Posición del rango de `valor` en el índice, o SIN_RANGO."""
+        j = bisect.bisect_left(self.bordes, valor)
+        if j < len(self.bordes) and self.bordes[j] == valor:
+            return int(self.en_borde[j])
+        return int(self.entre[j])
+
+    def posiciones(self, valores):
+        """posicion() de cada elemento de `valores`, vectorizado. NaN queda SIN_RANGO."""
+        valores = np.asarray(valores, dtype=np.float64)
+        j = np.searchsorted(self._bordes, valores, side='left')
+        if not len(self._bordes):
+            return self.entre[j]
+        cercano = np.minimum(j, len(self._bordes) - 1)
+        exacto = (j < len(self._bordes)) & (self._bordes[cercano] == valores)
+        return np.where(exacto, self.en_borde[cercano], self.entre[j])
+
+    def rango_id(self, valor):
+        posicion = self.posicion(valor)
+        return None if posicion == SIN_RANGO else int(self.ids[posicion])
+
+    def color(self, valor):
+        posicion = self.posicion(valor)
+        return None if posicion == SIN_RANGO else self.colores[posicion]
+
+
+def indice(caracteristica_id):
+    """IndiceRangos de la característica, de la caché o armado (y guardado) en el momento."""
+    cache = backend()
+    clave = f"{PREFIJO}:{caracteristica_id}"
+    resultado = cache.get(clave)
+    if resultado is None:
+        resultado = IndiceRangos(caracteristica_id, list(RangoMedicion.objects.filter(caracteristica_id=caracteristica_id)))
+        for problema in resultado.problemas:
+            logger.warning(
+                f"Rangos de la característica {caracteristica_id}: {problema.tipo} entre {problema.desde} y "
+                f"{problema.hasta} (rangos {', '.join(map(str, problema.rangos))})."
+            )
+        cache.set(clave, resultado)
+    return resultado
+
+
+def invalidar(caracteristica_ids):
+    backend().delete_many([f"{PREFIJO}:{c}" for c in caracteristica_ids])
+
+
+def clasificar(caracteristicas, valores):
+    """
+    Ids de RangoMedicion para cada par (característica, valor) de dos arreglos alineados; 0 si el
+    valor no cae en ningún rango. Un índice (y una búsqueda vectorizada) por característica.
+    """
+    caracteristicas = np.asarray(caracteristicas, dtype=np.int64)
+    valores = np.asarray(valores, dtype=np.float64)
+    resultado = np.zeros(len(valores), dtype=np.int64)
+    for caracteristica in np.unique(caracteristicas):
+        mascara = caracteristicas == caracteristica
+        idx = indice(int(caracteristica))
+        # SIN_RANGO (-1) toma el 0 agregado al final.
+        resultado[mascara] = np.append(idx.ids, 0)[idx.posiciones(valores[mascara])]
+    return resultado
+
+
+def anotar_rango(queryset, valor='valor_leido', caracteristica='punto_medicion__caracteristica'):
+    """
+    Anota `rango_id` y `rango_color` en un queryset (por defecto de DocumentoMedicion) con
+    subconsultas, con la misma regla que el índice: el rango de mayor valor_min que contiene el valor.
+    """
+    rangos = RangoMedicion.objects.filter(
+        caracteristica=OuterRef(caracteristica), valor_min__lte=OuterRef(valor), valor_max__gte=OuterRef(valor),
+    ).order_by('-valor_min', '-valor_max', '-pk')
+    return queryset.annotate(
+        rango_id=Subquery(rangos.values('pk')[:1]),
+        rango_color=Subquery(rangos.values('color')[:1]),
+    )
+
+
+@receiver(pre_save, sender=RangoMedicion)
+def _recordar_caracteristica(sender, instance, raw=False, **kwargs):
+    # Si el rango cambia de característica, también hay que invalidar el índice de la anterior.
+    instance._caracteristica_anterior = None if raw or instance.pk is None else RangoMedicion.objects.filter(
+        pk=instance.pk).values_list('caracteristica_id', flat=True).first()
+
+
+@receiver(post_save, sender=RangoMedicion)
+@receiver(post_delete, sender=RangoMedicion)
+def _invalidar_rango(sender, instance, **kwargs):
+    anterior = getattr(instance, '_caracteristica_anterior', None)
+    invalidar({instance.caracteristica_id} | ({anterior} if anterior else set()))
@@ -0,0 +1,254 @@
+"""
+Resúmenes de Consumo por medidor en intervalos de hora, día y mes.
+
+Las tablas ConsumoHora / ConsumoDia / ConsumoMes guardan suma, mínimo, máximo,
+cantidad de lecturas y primera/última lectura de cada intervalo. Se mantienen de
+forma incremental: tras cada importación solo se recalculan los intervalos que
+tocan los medidores y el rango de fechas del lote (refrescar_importacion). Las
+horas se calculan desde Consumo y los días y meses desde el nivel inmediatamente
+más fino, así un refresco nunca vuelve a leer meses de lecturas crudas.
+
+Los intervalos se cortan en settings.TIME_ZONE. En PostgreSQL todo se resuelve
+con INSERT ... SELECT; en otros motores (SQLite en desarrollo) se agrega con pandas.
+
+totales() parte el rango pedido en tramos y lee cada tramo del resumen más grueso
+que lo cubre entero (meses completos de ConsumoMes, días de ConsumoDia, etc.);
+solo los bordes que no llegan a una hora completa se leen de Consumo.
+"""
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import pandas as pd
+from django.db import connection as default_connection, transaction
+from django.db.models import Count, Max, Min, Sum
+from django.utils import timezone
+
+from .models import Consumo, ConsumoDia, ConsumoHora, ConsumoMes
+from .staging import rango_staging
+
+logger = logging.getLogger(__name__)
+
+# Del más grueso al más fino; cada nivel se calcula desde el siguiente y 'hora' desde Consumo.
+NIVELES = ['mes', 'dia', 'hora']
+MODELOS = {'hora': ConsumoHora, 'dia': ConsumoDia, 'mes': ConsumoMes}
+UNIDAD_SQL = {'hora': 'hour', 'dia': 'day', 'mes': 'month'}
+AGRUPACIONES = {
+    'medidor': 'medidor_id',
+    'tipo_medidor': 'medidor__tipo_medidor_id',
+    None: None,
+}
+
+
+def inicio_intervalo(fecha, nivel):
+    """Inicio (aware, en la zona por defecto) del intervalo de `nivel` que contiene `fecha`."""
+    local = timezone.localtime(fecha)
+    if nivel == 'hora':
+        return local.replace(minute=0, second=0, microsecond=0)
+    if nivel == 'dia':
+        return timezone.make_aware(datetime(local.year, local.month, local.day))
+    return timezone.make_aware(datetime(local.year, local.month, 1))
+
+
+def siguiente_intervalo(inicio, nivel):
+    """Inicio del intervalo siguiente a `inicio`."""
+    if nivel == 'hora':
+        # En UTC, para que una hora sea una hora también en los cambios de horario.
+        return timezone.localtime(inicio.astimezone(dt_timezone.utc) + timedelta(hours=1))
+    local = timezone.localtime(inicio)
+    if nivel == 'dia':
+        return timezone.make_aware(datetime(local.year, local.month, local.day) + timedelta(days=1))
+    anio, mes = (local.year + 1, 1) if local.month == 12 else (local.year, local.month + 1)
+    return timezone.make_aware(datetime(anio, mes, 1))
+
+
+def cubrir(desde, hasta, nivel):
+    """Rango [inicio, fin) de intervalos completos de `nivel` que contiene a [desde, hasta]."""
+    return inicio_intervalo(desde, nivel), siguiente_intervalo(inicio_intervalo(hasta, nivel), nivel)
+
+
+# --- Refresco ---------------------------------------------------------------------------
+
+def refrescar_importacion(importacion_id, connection=None):
+    """Recalcula los intervalos que toca el lote de staging de una importación (antes de borrarlo)."""
+    rango = rango_staging(importacion_id, connection)
+    if rango is None:
+        return 0
+    return refrescar(*rango, connection=connection)
+
+
+def refrescar(medidor_ids, desde, hasta, connection=None):
+    """
+    Recalcula hora, día y mes de `medidor_ids` para todos los intervalos que tocan [desde, hasta].
+
+    Devuelve la cantidad de filas de ConsumoHora escritas.
+    """
+    connection = connection or default_connection
+    medidor_ids = sorted(set(medidor_ids))
+    if not medidor_ids:
+        return 0
+    with transaction.atomic(using=connection.alias):
+        if connection.vendor == 'postgresql':
+            horas = _refrescar_sql(medidor_ids, desde, hasta, connection)
+        else:
+            horas = _refrescar_pandas(medidor_ids, desde, hasta, connection)
+    logger.info(f"Resúmenes de consumo refrescados: {len(medidor_ids)} medidores, {desde} - {hasta}, {horas} horas.")
+    return horas
+
+
+def _refrescar_sql(medidor_ids, desde, hasta, connection):
+    zona = timezone.get_current_timezone_name()
+    origen = Consumo._meta.db_table
+    escritas = {}
+    with connection.cursor() as cursor:
+        for nivel in reversed(NIVELES):
+            inicio, fin = cubrir(desde, hasta, nivel)
+            tabla = MODELOS[nivel]._meta.db_table
+            cursor.execute(
+                f"DELETE FROM {tabla} WHERE medidor_id = ANY(%s) AND inicio >= %s AND inicio < %s",
+                [medidor_ids, inicio, fin],
+            )
+            if nivel == 'hora':
+                # Desde lecturas crudas: el intervalo se corta en la zona local y se guarda como timestamptz.
+                cursor.execute(
+                    f"INSERT INTO {tabla} (medidor_id, inicio, suma, minimo, maximo, lecturas, "
+                    f"primera_fecha, primer_valor, ultima_fecha, ultimo_valor) "
+                    f"SELECT medidor_id, DATE_TRUNC('hour', fecha AT TIME ZONE %s) AT TIME ZONE %s AS intervalo, "
+                    f"SUM(consumo), MIN(consumo), MAX(consumo), COUNT(consumo), "
+                    f"MIN(fecha), (ARRAY_AGG(consumo ORDER BY fecha))[1], "
+                    f"MAX(fecha), (ARRAY_AGG(consumo ORDER BY fecha DESC))[1] "
+                    f"FROM {origen} WHERE medidor_id = ANY(%s) AND fecha >= %s AND fecha < %s "
+                    f"GROUP BY medidor_id, intervalo",
+                    [zona, zona, medidor_ids, inicio, fin],
+                )
+            else:
+                fino = MODELOS[NIVELES[NIVELES.index(nivel) + 1]]._meta.db_table
+                cursor.execute(
+                    f"INSERT INTO {tabla} (medidor_id, inicio, suma, minimo, maximo, lecturas, "
+                    f"primera_fecha, primer_valor, ultima_fecha, ultimo_valor) "
+                    f"SELECT medidor_id, DATE_TRUNC(%s, inicio AT TIME ZONE %s) AT TIME ZONE %s AS intervalo, "
+                    f"SUM(suma), MIN(minimo), MAX(maximo), SUM(lecturas), "
+                    f"MIN(primera_fecha), (ARRAY_AGG(primer_valor ORDER BY inicio))[1], "
+                    f"MAX(ultima_fecha), (ARRAY_AGG(ultimo_valor ORDER BY inicio DESC))[1] "
+                    f"FROM {fino} WHERE medidor_id = ANY(%s) AND inicio >= %s AND inicio < %s "
+                    f"GROUP BY medidor_id, intervalo",
+                    [UNIDAD_SQL[nivel], zona, zona, medidor_ids, inicio, fin],
+                )
+            escritas[nivel] = cursor.rowcount
+    return escritas['hora']
+
+
+def _refrescar_pandas(medidor_ids, desde, hasta, connection):
+    # Se leen las lecturas del rango del nivel más grueso; hora, día y mes se agregan desde ahí.
+    inicio, fin = cubrir(desde, hasta, NIVELES[0])
+    lecturas = pd.DataFrame.from_records(
+        Consumo.objects.using(connection.alias)
+        .filter(medidor_id__in=medidor_ids, fecha__gte=inicio, fecha__lt=fin)
+        .order_by('medidor_id', 'fecha')
+        .values_list('medidor_id', 'fecha', 'consumo'),
+        columns=['medidor_id', 'fecha', 'consumo'],
+    )
+    lecturas['fecha'] = pd.to_datetime(lecturas['fecha'], utc=True)
+    local = lecturas['fecha'].dt.tz_convert(timezone.get_current_timezone())
+
+    escritas = 0
+    for nivel in NIVELES:
+        modelo = MODELOS[nivel]
+        inicio, fin = cubrir(desde, hasta, nivel)
+        modelo.objects.using(connection.alias).filter(
+            medidor_id__in=medidor_ids, inicio__gte=inicio, inicio__lt=fin
+        ).delete()
+        if lecturas.empty:
+            continue
+        intervalos = _truncar(local, nivel)
+        en_rango = ((intervalos >= inicio) & (intervalos < fin)).to_numpy()
+        if not en_rango.any():
+            continue
+        grupos = lecturas[en_rango].assign(inicio=intervalos[en_rango]).groupby(['medidor_id', 'inicio'], sort=False)
+        resumen = grupos.agg(
+            suma=('consumo', 'sum'), minimo=('consumo', 'min'), maximo=('consumo', 'max'),
+            lecturas=('consumo', 'count'), primera_fecha=('fecha', 'first'), primer_valor=('consumo', 'first'),
+            ultima_fecha=('fecha', 'last'), ultimo_valor=('consumo', 'last'),
+        ).reset_index()
+        resumen = resumen.astype(object).where(resumen.notna(), None)
+        modelo.objects.using(connection.alias).bulk_create(
+            [modelo(**fila) for fila in resumen.to_dict('records')], batch_size=1000
+        )
+        if nivel == 'hora':
+            escritas = len(resumen)
+    return escritas
+
+
+def _truncar(local, nivel):
+    if nivel == 'hora':
+        return local.dt.floor('h', ambiguous=False, nonexistent='shift_forward')
+    naive = local.dt.tz_localize(None)
+    inicio = naive.dt.normalize() if nivel == 'dia' else naive.dt.to_period('M').dt.start_time
+    return inicio.dt.tz_localize(local.dt.tz, ambiguous=False, nonexistent='shift_forward')
+
+
+# --- Consultas --------------------------------------------------------------------------
+
+def tramos(desde, hasta, niveles=tuple(NIVELES)):
+    """
+    Parte [desde, hasta) en tramos (nivel, inicio, fin) cubiertos por intervalos completos
+    del nivel más grueso posible; nivel None significa leer lecturas crudas de Consumo.
+    """
+    if desde >= hasta:
+        return []
+    if not niveles:
+        return [(None, desde, hasta)]
+    nivel, resto = niveles[0], niveles[1:]
+    inicio = inicio_intervalo(desde, nivel)
+    if inicio != desde:
+        inicio = siguiente_intervalo(inicio, nivel)
+    fin = inicio_intervalo(hasta, nivel)
+    if inicio >= fin:
+        return tramos(desde, hasta, resto)
+    return tramos(desde, inicio, resto) + [(nivel, inicio, fin)] + tramos(fin, hasta, resto)
+
+
+def totales(desde, hasta, medidores=None, por='medidor', usar_resumenes=True):
+    """
+    Suma, mínimo, máximo y cantidad de lecturas de Consumo en [desde, hasta).
+
+    `por` agrupa por 'medidor', 'tipo_medidor' o None (total general). Devuelve un dict
+    {clave: {'suma', 'minimo', 'maximo', 'lecturas'}}. Con usar_resumenes=False todo el
+    rango se lee de Consumo (útil para comparar).
+    """
+    clave = AGRUPACIONES[por]
+    partes = tramos(desde, hasta) if usar_resumenes else [(None, desde, hasta)]
+    acumulado = {}
+    for nivel, inicio, fin in partes:
+        for fila in _agregar_tramo(nivel, inicio, fin, medidores, clave):
+            k = fila.pop(clave) if clave else None
+            total = acumulado.setdefault(k, {'suma': None, 'minimo': None, 'maximo': None, 'lecturas': 0})
+            total['lecturas'] += fila['lecturas'] or 0
+            if fila['suma'] is not None:
+                total['suma'] = (total['suma'] or 0) + fila['suma']
+            if fila['minimo'] is not None:
+                total['minimo'] = fila['minimo'] if total['minimo'] is None else min(total['minimo'], fila['minimo'])
+            if fila['maximo'] is not None:
+                total['maximo'] = fila['maximo'] if total['maximo'] is None else max(total['maximo'], fila['maximo'])
+    return acumulado
+
+
+def _agregar_tramo(nivel, inicio, fin, medidores, clave):
+    if nivel is None:
+        qs = Consumo.objects.filter(fecha__gte=inicio, fecha__lt=fin)
+        metricas = {'suma': Sum('consumo'), 'minimo': Min('consumo'), 'maximo': Max('consumo'), 'lecturas': Count('consumo')}
+    else:
+        qs = MODELOS[nivel].objects.filter(inicio__gte=inicio, inicio__lt=fin)
+        metricas = {'suma': Sum('suma'), 'minimo': Min('minimo'), 'maximo': Max('maximo'), 'lecturas': Sum('lecturas')}
+    if medidores is not None:
+        qs = qs.filter(medidor__in=medidores)
+    if clave:
+        return qs.values(clave).annotate(**metricas).order_by()
+    return [qs.aggregate(**metricas)]
+
+
+def serie(nivel, desde, hasta, medidores=None):
+    """Filas del resumen de `nivel` con inicio en [desde, hasta), ordenadas por medidor e inicio."""
+    qs = MODELOS[nivel].objects.filter(inicio__gte=desde, inicio__lt=hasta)
+    if medidores is not None:
+        qs = qs.filter(medidor__in=medidores)
+    return qs.order_by('medidor_id', 'inicio')
@@ -0,0 +1,161 @@
+"""
+Series de tiempo de Consumo para gráficos (API /api/series/).
+
+Cada serie sale en columnas: 'fechas' (epoch UTC en milisegundos) y 'valores', en lugar de
+un objeto por lectura. Con más de `max_puntos` lecturas en el rango se reduce en el servidor:
+
+- 'promedio': promedio por bucket de (hasta - desde) / max_puntos. Los buckets se arman con
+  el resumen más grueso cuyo intervalo entra en ese ancho (ConsumoMes/Dia/Hora, con
+  suma / lecturas) y solo con anchos menores a una hora desde Consumo: un gráfico de cinco
+  años no lee lecturas crudas, salvo las de los intervalos partidos en los bordes del rango.
+- 'lttb': Largest-Triangle-Three-Buckets sobre la serie más fina que no pase de
+  MAX_ENTRADA_LTTB puntos. Elige puntos reales, así que conserva picos y valles que el
+  promedio aplana.
+- 'ninguno': las lecturas crudas.
+
+Cada punto lleva la fecha de la primera lectura (o del primer intervalo) de su bucket.
+"""
+import math
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.utils import timezone
+
+from .archivo import leer
+from .models import Medidor
+from .resumenes import inicio_intervalo, serie, totales, tramos
+
+METODOS = ('promedio', 'lttb', 'ninguno')
+MAX_PUNTOS = 2000
+MAX_MEDIDORES = 50
+MAX_ENTRADA_LTTB = 100000
+# Duración de cada intervalo de resumen (la máxima, para el mes): un bucket de al menos
+# ese ancho contiene intervalos enteros.
+DURACION = {'hora': timedelta(hours=1), 'dia': timedelta(days=1), 'mes': timedelta(days=31)}
+
+
+def series(medidores, desde, hasta, max_puntos=MAX_PUNTOS, metodo='promedio'):
+    """
+    Series de los `medidores` (ids) en [desde, hasta). Devuelve un dict listo para JSON con
+    el método y la fuente usados ('consumo' o el nivel de resumen) y una serie por medidor.
+    """
+    nombres = dict(Medidor.objects.filter(pk__in=medidores).values_list('id', 'nombre'))
+    lecturas = max((t['lecturas'] for t in totales(desde, hasta, medidores).values()), default=0)
+    if metodo == 'ninguno' or lecturas <= max_puntos:
+        metodo, fuente = 'ninguno', None
+    elif metodo == 'promedio':
+        ancho = (hasta - desde) / max_puntos
+        fuente = next((nivel for nivel in ('mes', 'dia', 'hora') if DURACION[nivel] <= ancho), None)
+    else:
+        fuente = None if lecturas <= MAX_ENTRADA_LTTB else next(
+            (nivel for nivel in ('hora', 'dia') if (hasta - desde) / DURACION[nivel] <= MAX_ENTRADA_LTTB), 'mes'
+        )
+
+    df = _cargar(medidores, desde, hasta, fuente)
+    if metodo == 'promedio':
+        df = _promedio_por_bucket(df, fuente, desde, hasta, max_puntos)
+    df['valor'] = df['suma'] / df['lecturas'].where(df['lecturas'] > 0)
+    df['epoch'] = df['fecha'].dt.as_unit('ms').astype('int64')
+    grupos = {medidor: grupo for medidor, grupo in df.groupby('medidor', sort=False)}
+
+    resultado = []
+    for medidor in medidores:
+        grupo = grupos.get(medidor, df.iloc[:0])
+        fechas, valores = grupo['epoch'].to_numpy(), grupo['valor'].to_numpy()
+        if metodo == 'lttb':
+            validos = ~np.isnan(valores)
+            fechas, valores = fechas[validos], valores[validos]
+            indices = lttb(fechas.astype('float64'), valores, max_puntos)
+            fechas, valores = fechas[indices], valores[indices]
+        resultado.append({
+            'medidor': medidor,
+            'nombre': nombres.get(medidor),
+            'fechas': fechas.tolist(),
+            'valores': [None if np.isnan(v) else v for v in valores.tolist()],
+        })
+    return {
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'metodo': metodo,
+        'fuente': fuente or 'consumo',
+        'max_puntos': max_puntos,
+        'series': resultado,
+    }
+
+
+def _cargar(medidores, desde, hasta, fuente):
+    """DataFrame (medidor, fecha, suma, lecturas) ordenado, de Consumo o del resumen `fuente`."""
+    if fuente is None:
+        # Los meses archivados se leen del Parquet; sus resúmenes siguen en la base.
+        df = leer(desde, hasta, medidores).rename(columns={'consumo': 'suma'})
+        df['lecturas'] = df['suma'].notna().astype('int64')
+    else:
+        # Los intervalos que [desde, hasta) cubre enteros salen del resumen; los pedazos de los
+        # bordes, de las lecturas crudas, sumados en una fila por medidor con la fecha de la
+        # primera lectura: el primer bucket no arrastra datos de antes de `desde`.
+        partes = []
+        for nivel, inicio, fin in tramos(desde, hasta, (fuente,)):
+            if nivel is None:
+                crudas = leer(inicio, fin, medidores)
+                crudas['lecturas'] = crudas['consumo'].notna().astype('int64')
+                partes.append(crudas.groupby('medidor', as_index=False, sort=False).agg(
+                    fecha=('fecha', 'first'), suma=('consumo', 'sum'), lecturas=('lecturas', 'sum'),
+                ))
+            else:
+                filas = serie(nivel, inicio, fin, medidores).values_list('medidor_id', 'inicio', 'suma', 'lecturas')
+                resumen = pd.DataFrame.from_records(list(filas), columns=['medidor', 'fecha', 'suma', 'lecturas'])
+                resumen['fecha'] = pd.to_datetime(resumen['fecha'], utc=True)
+                partes.append(resumen.astype({'suma': 'float64'}))
+        df = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=['medidor', 'fecha', 'suma', 'lecturas'])
+        df = df.sort_values(['medidor', 'fecha'], kind='stable', ignore_index=True)
+    df['fecha'] = pd.to_datetime(df['fecha'], utc=True)
+    return df
+
+
+def _promedio_por_bucket(df, fuente, desde, hasta, max_puntos):
+    """Agrupa `df` por medidor y bucket: suma y lecturas acumuladas, fecha de la primera fila."""
+    if fuente is None:
+        ancho = (hasta - desde) / max_puntos
+        buckets = (df['fecha'] - pd.Timestamp(desde)) // pd.Timedelta(ancho)
+    else:
+        # Los intervalos de resumen se cortan en hora local: los buckets se cuentan igual, en
+        # cantidades enteras de horas, días o meses desde el primer intervalo del rango.
+        por_bucket = math.ceil((hasta - desde) / max_puntos / DURACION[fuente])
+        local = df['fecha'].dt.tz_convert(timezone.get_current_timezone()).dt.tz_localize(None)
+        origen = pd.Timestamp(inicio_intervalo(desde, fuente)).tz_localize(None)
+        if fuente == 'mes':
+            indice = (local.dt.year - origen.year) * 12 + local.dt.month - origen.month
+        else:
+            indice = (local - origen) // pd.Timedelta(DURACION[fuente])
+        buckets = indice // por_bucket
+    agregado = df.groupby([df['medidor'], buckets.rename('bucket')], sort=True).agg(
+        {'fecha': 'first', 'suma': 'sum', 'lecturas': 'sum'}
+    )
+    return agregado.reset_index(level='medidor').reset_index(drop=True)
+
+
+def lttb(x, y, umbral):
+    """Índices de los `umbral` puntos que elige Largest-Triangle-Three-Buckets sobre (x, y)."""
+    n = len(x)
+    if umbral >= n:
+        return np.arange(n)
+    if umbral < 3:
+        return np.array([0, n - 1][:umbral])
+    indices = np.empty(umbral, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    # umbral - 2 buckets entre el primer y el último punto, que siempre se conservan.
+    limites = np.linspace(1, n - 1, umbral - 1).astype(np.int64)
+    elegido = 0
+    for i in range(umbral - 2):
+        inicio, fin = limites[i], limites[i + 1]
+        if i == umbral - 3:
+            cx, cy = x[n - 1], y[n - 1]
+        else:
+            siguiente = slice(limites[i + 1], limites[i + 2])
+            cx, cy = x[siguiente].mean(), y[siguiente].mean()
+        # Área (al doble) del triángulo entre el punto elegido antes, cada candidato y el promedio del bucket siguiente.
+        areas = np.abs((x[elegido] - cx) * (y[inicio:fin] - y[elegido]) - (x[elegido] - x[inicio:fin]) * (cy - y[elegido]))
+        elegido = inicio + int(np.argmax(areas))
+        indices[i + 1] = elegido
+    return indices
@@ -0,0 +1,249 @@
+"""
+Procesamiento de importaciones de consumo fuera del request HTTP.
+
+La vista de carga solo guarda el archivo y crea un ImportacionConsumo pendiente;
+el comando `procesar_importaciones` toma los pendientes y los ejecuta con
+procesar_importacion(), que va dejando el progreso en el propio registro.
+
+Si un worker muere a mitad de una importación (kill, falta de memoria, reinicio del
+servidor) el registro queda en proceso: reclamar_pendientes() marca con error las que
+llevan más de settings.IMPORTACION_MINUTOS_ABANDONO minutos sin latido y borra su staging.
+El worker actualiza el latido después de cada bloque y antes de cada etapa posterior.
+"""
+import logging
+import tempfile
+from datetime import timedelta
+
+import pandas as pd
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .anomalias import detectar_importacion
+from .cache_consultas import invalidar
+from .calidad import revisar_importacion
+from .demanda import calcular_importacion
+from .diferencias import actualizar_diferencias_importacion
+from .importacion import importar_a_staging, FormatoNoSoportado, ColumnasFaltantes
+from .instrumentacion import Instrumentacion, etapa
+from .models import ImportacionConsumo, InterfaceConsumo, MedicionImportacion
+from .resumenes import refrescar_importacion
+from .staging import CargadorStaging, fusionar_staging
+
+logger = logging.getLogger(__name__)
+
+
+MINUTOS_ABANDONO = 120
+
+
+class ErrorImportacion(Exception):
+    pass
+
+
+def liberar_abandonadas():
+    """
+    Marca con error las importaciones en proceso sin latido hace más de IMPORTACION_MINUTOS_ABANDONO
+    minutos (su worker murió sin registrar el final) y borra su lote de staging. Devuelve sus ids.
+    """
+    minutos = getattr(settings, 'IMPORTACION_MINUTOS_ABANDONO', MINUTOS_ABANDONO)
+    limite = timezone.now() - timedelta(minutes=minutos)
+    with transaction.atomic():
+        ids = list(
+            ImportacionConsumo.objects.select_for_update(skip_locked=True)
+            .filter(estado=ImportacionConsumo.EN_PROCESO)
+            .filter(Q(latido__lt=limite) | Q(latido__isnull=True, iniciado__lt=limite))
+            .values_list('pk', flat=True)
+        )
+        if not ids:
+            return ids
+        # No se reintentan solas: si el archivo es lo que tumba al worker, volvería a tumbarlo.
+        ImportacionConsumo.objects.filter(pk__in=ids).update(
+            estado=ImportacionConsumo.ERROR,
+            mensaje=f"La importación pasó más de {minutos} minutos sin señales del proceso que la ejecutaba, "
+                    f"que terminó sin registrar el resultado. Vuelva a cargar el archivo.",
+            finalizado=timezone.now(),
+        )
+        InterfaceConsumo.objects.filter(importacion_id__in=ids).delete()
+    logger.warning(f"Importaciones abandonadas marcadas con error: {ids}")
+    return ids
+
+
+def reclamar_pendientes(limite):
+    """
+    Marca como en proceso hasta `limite` importaciones pendientes y devuelve sus ids. Antes libera
+    las abandonadas por un worker que murió (liberar_abandonadas).
+    """
+    liberar_abandonadas()
+    with transaction.atomic():
+        # skip_locked: varios workers pueden reclamar a la vez sin tomar el mismo trabajo.
+        ids = list(
+            ImportacionConsumo.objects.select_for_update(skip_locked=True)
+            .filter(estado=ImportacionConsumo.PENDIENTE)
+            .order_by('creado')
+            .values_list('pk', flat=True)[:limite]
+        )
+        ahora = timezone.now()
+        ImportacionConsumo.objects.filter(pk__in=ids).update(
+            estado=ImportacionConsumo.EN_PROCESO, iniciado=ahora, latido=ahora
+        )
+    return ids
+
+
+def _actualizar(importacion_id, **campos):
+    ImportacionConsumo.objects.filter(pk=importacion_id).update(**campos)
+
+
+def _latir(importacion_id, **campos):
+    """
+    Guarda `campos` y el latido que muestra que el worker sigue vivo. Devuelve False si la importación
+    ya no está en proceso (liberar_abandonadas la dio por abandonada).
+    """
+    en_proceso = ImportacionConsumo.objects.filter(pk=importacion_id, estado=ImportacionConsumo.EN_PROCESO)
+    return en_proceso.update(latido=timezone.now(), **campos) > 0
+
+
+def _finalizar(importacion_id, estado, mensaje):
+    """Registra el resultado solo si la importación sigue en proceso; no pisa una ya liberada."""
+    en_proceso = ImportacionConsumo.objects.filter(pk=importacion_id, estado=ImportacionConsumo.EN_PROCESO)
+    if en_proceso.update(estado=estado, mensaje=mensaje, finalizado=timezone.now()):
+        return True
+    logger.warning(f"La importación #{importacion_id} ya no estaba en proceso; no se registra como {estado}: {mensaje}")
+    return False
+
+
+def procesar_importacion(importacion_id):
+    """
+    Lee, valida, carga a staging y fusiona en Consumo el archivo de una importación. Cada etapa
+    queda medida en un MedicionImportacion (core.instrumentacion).
+    """
+    importacion = ImportacionConsumo.objects.get(pk=importacion_id)
+    if importacion.estado == ImportacionConsumo.PENDIENTE:
+        ahora = timezone.now()
+        _actualizar(importacion_id, estado=ImportacionConsumo.EN_PROCESO, iniciado=ahora, latido=ahora)
+
+    def progreso(resultado):
+        vigente = _latir(
+            importacion_id,
+            filas_leidas=resultado.filas_leidas,
+            filas_staging=resultado.filas_staging,
+            filas_rechazadas=resultado.filas_rechazadas,
+            filas_duplicadas=resultado.filas_duplicadas,
+        )
+        if not vigente:
+            # Su staging pudo borrarse a mitad de la carga: fusionar lo que quede sería una importación parcial.
+            raise ErrorImportacion("La importación se dio por abandonada mientras se cargaba.")
+
+    with Instrumentacion(MedicionImportacion.ARCHIVO, importacion.nombre_original, importacion_id) as medicion:
+        try:
+            with importacion.archivo.open('rb') as archivo, EscritorRechazos(importacion) as rechazos:
+                resultado = importar_a_staging(
+                    archivo, importacion.nombre_original, CargadorStaging(importacion_id),
+                    progreso=progreso, rechazos=rechazos,
+                )
+            medicion.filas = resultado.filas_leidas
+            _actualizar(importacion_id, errores=resultado.errores, rechazos_por_motivo=resultado.rechazos_por_motivo)
+
+            if resultado.filas_leidas == 0:
+                raise ErrorImportacion("El archivo está vacío.")
+            if resultado.filas_validas == 0:
+                raise ErrorImportacion(
+                    f"Ninguna fila válida para staging. {resultado.filas_rechazadas} filas del archivo con errores."
+                )
+
+            if not _latir(importacion_id):
+                raise ErrorImportacion("La importación se dio por abandonada mientras se cargaba.")
+            fusion = fusionar_staging(importacion_id, sobrescribir=importacion.sobrescribir)
+            # La fusión ya está confirmada en Consumo: los conteos y la invalidación de la caché no
+            # esperan a los refrescos de abajo, que pueden fallar.
+            _actualizar(
+                importacion_id,
+                filas_fusionadas=fusion['insertados'] + fusion['actualizados'],
+                filas_duplicadas=resultado.filas_duplicadas + fusion['duplicados'],
+                filas_medidor_desconocido=fusion['medidor_desconocido'],
+            )
+            if fusion['insertados'] or fusion['actualizados']:
+                with etapa('cache'):
+                    invalidar(fusion['medidores_modificados'])
+                try:
+                    # Después de los resúmenes: la línea base de las anomalías y la demanda por tipo salen de ConsumoHora.
+                    for nombre, refrescar in [
+                        ('resumenes', refrescar_importacion),
+                        ('diferencias', actualizar_diferencias_importacion),
+                        ('calidad', revisar_importacion),
+                        ('anomalias', detectar_importacion),
+                        ('demanda', calcular_importacion),
+                    ]:
+                        # La fusión ya está confirmada: el latido solo evita que se la dé por abandonada.
+                        _latir(importacion_id)
+                        with etapa(nombre):
+                            refrescar(importacion_id)
+                finally:
+                    # Otra vez al terminar, bien o mal: una consulta durante los refrescos pudo cachear
+                    # resúmenes a medio refrescar con la versión ya subida.
+                    with etapa('cache'):
+                        invalidar(fusion['medidores_modificados'])
+            if _finalizar(importacion_id, ImportacionConsumo.COMPLETADO, _resumen(resultado, fusion)):
+                importacion.archivo.delete(save=False)
+            else:
+                medicion.exito = False
+        except (FormatoNoSoportado, ColumnasFaltantes, ErrorImportacion) as e:
+            medicion.exito = False
+            _finalizar(importacion_id, ImportacionConsumo.ERROR, str(e))
+        except pd.errors.EmptyDataError:
+            medicion.exito = False
+            _finalizar(importacion_id, ImportacionConsumo.ERROR, "El archivo Excel/CSV está vacío o no contiene datos legibles.")
+        except Exception as e:
+            medicion.exito = False
+            logger.error(f"Error general durante la importación #{importacion_id}: {e}", exc_info=True)
+            _finalizar(importacion_id, ImportacionConsumo.ERROR, f"Error crítico al importar datos: {e}")
+        finally:
+            # El lote de staging ya no hace falta, haya terminado bien o no.
+            with etapa('limpieza'):
+                InterfaceConsumo.objects.filter(importacion_id=importacion_id).delete()
+
+
+class EscritorRechazos:
+    """
+    Acumula las tablas de rechazos de cada bloque en un CSV temporal y, al cerrar,
+    lo guarda en ImportacionConsumo.rechazos para descargarlo desde el admin.
+    """
+
+    def __init__(self, importacion):
+        self.importacion = importacion
+        self.filas = 0
+
+    def __enter__(self):
+        self.archivo = tempfile.TemporaryFile(mode='w+b')
+        return self
+
+    def __call__(self, tabla):
+        tabla.to_csv(self.archivo, header=self.filas == 0, index=False, encoding='utf-8')
+        self.filas += len(tabla)
+
+    def __exit__(self, *exc_info):
+        try:
+            if self.filas:
+                self.archivo.seek(0)
+                self.importacion.rechazos.save(f'rechazos_{self.importacion.pk}.csv', File(self.archivo), save=False)
+                _actualizar(self.importacion.pk, rechazos=self.importacion.rechazos.name)
+        finally:
+            self.archivo.close()
+
+
+def _resumen(resultado, fusion):
+    partes = [
+        f"{resultado.filas_validas} de {resultado.filas_leidas} filas pasaron la validación",
+        f"{fusion['insertados']} registros importados",
+    ]
+    if fusion['actualizados']:
+        partes.append(f"{fusion['actualizados']} sobrescritos")
+    if resultado.filas_duplicadas or fusion['duplicados']:
+        partes.append(f"{resultado.filas_duplicadas + fusion['duplicados']} duplicados omitidos")
+    if fusion['medidor_desconocido']:
+        partes.append(
+            f"{fusion['medidor_desconocido']} omitidos por medidor inexistente "
+            f"({', '.join(fusion['ejemplos_medidor_desconocido'][:3])})"
+        )
+    return '. '.join(partes) + '.'
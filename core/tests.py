@@ -1,3 +1,1522 @@
-from django.test import TestCase
+import io
+import json
+import math
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from importlib import import_module
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+import pandas as pd
+from tablib import Dataset
+
+from . import anomalias, archivo, cache_consultas, calidad, contadores, demanda, diferencias, exportacion, fechas, jerarquia, particiones, rangos, resumenes, series
+from .admin import ConsumoResource
+from .fechas import ParserFechas, _clave_cache
+from .importacion import ColumnasFaltantes, FormatoNoSoportado, importar_a_staging, iter_bloques
+from .models import (
+    AlertaConsumo, ArchivoConsumo, CaracteristicaMedicion, Consumo, ConsumoContador, ConsumoDia, ConsumoMes, DemandaMedidor, DemandaTipoMedidor, DocumentoMedicion,
+    ImportacionConsumo, IncidenciaSerie, InterfaceConsumo, LineaBaseMedidor, MedicionImportacion, Medidor, MedidorAncestro, PerfilMedidor, PuntoMedicion, RangoMedicion, TipoMedidor,
+    VistaConsumoDiferencia,
+)
+from .staging import CargadorStaging, fusionar_staging
+from .tareas import liberar_abandonadas, procesar_importacion, reclamar_pendientes
+from .validacion import MEDIDOR_MAX_LENGTH, MOTIVOS, convertir_consumo, validar_bloque
+
+
+class ConsumoResourceImportTests(TestCase):
+    """El import de ConsumoResource debe hacer un número de consultas que no crece con las filas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.medidores = [Medidor.objects.create(nombre=f'M{i}') for i in range(3)]
+
+    def _dataset(self, filas, inicio):
+        # Como llega desde el admin cuando el archivo usa ',' y el formato espera ';': una celda por fila.
+        dataset = Dataset(headers=['fecha,consumo,medidor'])
+        for i in range(filas):
+            fecha = inicio + timedelta(minutes=15 * i)
+            medidor = self.medidores[i % len(self.medidores)]
+            dataset.append([f"{fecha:%m/%d/%Y %H:%M},{i}.5,{medidor.pk}"])
+        return dataset
+
+    def _consultas_import(self, dataset):
+        # El refresco de resúmenes, la revisión de series, las anomalías y la demanda escriben por
+        # medidor e intervalo, no por fila; aquí solo se cuenta el import.
+        with mock.patch('core.resumenes.refrescar') as refrescar, mock.patch('core.calidad.revisar'), \
+                mock.patch('core.anomalias.detectar'), mock.patch('core.demanda.calcular'), CaptureQueriesContext(connection) as ctx:
+            result = ConsumoResource().import_data(dataset, dry_run=False)
+        refrescar.assert_called_once()
+        self.assertFalse(result.has_errors(), [e.error for row in result.row_errors() for e in row[1]])
+        return len(ctx.captured_queries)
+
+    def test_consultas_constantes(self):
+        pocas = self._consultas_import(self._dataset(10, datetime(2024, 1, 1)))
+        # 300 filas: bajo Meta.batch_size y bajo el límite de parámetros de SQLite para un solo INSERT.
+        muchas = self._consultas_import(self._dataset(300, datetime(2024, 2, 1)))
+        self.assertEqual(pocas, muchas)
+        self.assertEqual(Consumo.objects.count(), 310)
+
+    def test_actualiza_existentes_con_consultas_constantes(self):
+        self._consultas_import(self._dataset(200, datetime(2024, 1, 1)))
+        consultas = self._consultas_import(self._dataset(200, datetime(2024, 1, 1)))
+        self.assertEqual(consultas, self._consultas_import(self._dataset(20, datetime(2024, 1, 1))))
+        self.assertEqual(Consumo.objects.count(), 200)
+
+    def test_omite_medidores_inexistentes(self):
+        dataset = self._dataset(5, datetime(2024, 1, 1))
+        dataset.append(["01/01/2024 09:00,1.0,999999"])
+        self._consultas_import(dataset)
+        self.assertEqual(Consumo.objects.count(), 5)
+
+
+class LecturaArchivoTests(TestCase):
+
+    def setUp(self):
+        Medidor.objects.create(nombre='M1')
+        self.importacion = ImportacionConsumo.objects.create(nombre_original='consumos.csv')
+
+    def _importar(self, contenido, nombre, tamano_bloque=2):
+        return importar_a_staging(io.BytesIO(contenido), nombre, CargadorStaging(self.importacion.pk), tamano_bloque=tamano_bloque)
+
+    def _staging(self):
+        return list(InterfaceConsumo.objects.filter(importacion=self.importacion).order_by('fecha').values_list('fecha', 'consumo', 'medidor'))
+
+    def test_csv_con_separador_detectado(self):
+        contenido = "\ufefffecha;consumo;medidor\n2024-01-01 00:00;1,5;M1\n2024-01-01 00:15;2;M1\n2024-01-01 00:30;x;M1\n".encode()
+        bloques = list(iter_bloques(io.BytesIO(contenido), 'CONSUMOS.CSV', tamano_bloque=2))
+        self.assertEqual([len(b) for b in bloques], [2, 1])
+        self.assertEqual(list(bloques[0].columns), ['fecha', 'consumo', 'medidor'])
+        self.assertEqual(bloques[0]['consumo'].tolist(), ['1,5', '2'])
+
+        resultado = self._importar(contenido, 'consumos.csv')
+        self.assertEqual(
+            (resultado.bloques, resultado.filas_leidas, resultado.filas_validas, resultado.filas_staging, resultado.rechazos_por_motivo),
+            (2, 3, 2, 2, {'consumo_invalido': 1}),
+        )
+        self.assertEqual(resultado.errores, ["Fila 4: Valor de 'consumo' no es un número válido ('x')."])
+        self.assertEqual(self._staging(), [
+            (datetime(2024, 1, 1, 0, 0, tzinfo=dt_timezone.utc), 1.5, 'M1'),
+            (datetime(2024, 1, 1, 0, 15, tzinfo=dt_timezone.utc), 2.0, 'M1'),
+        ])
+
+    def test_xlsx_por_bloques(self):
+        from openpyxl import Workbook
+        libro = Workbook()
+        hoja = libro.active
+        hoja.append(['fecha', 'consumo', 'medidor'])
+        hoja.append([datetime(2024, 1, 1, 0, 0), 1.5, 'M1'])
+        hoja.append(['01/01/2024 00:15', 2, 'M1'])
+        hoja.append([datetime(2024, 1, 1, 0, 30), 3, ' M1 '])
+        contenido = io.BytesIO()
+        libro.save(contenido)
+
+        bloques = list(iter_bloques(io.BytesIO(contenido.getvalue()), 'consumos.xlsx', tamano_bloque=2))
+        self.assertEqual([len(b) for b in bloques], [2, 1])
+        resultado = self._importar(contenido.getvalue(), 'consumos.xlsx')
+        self.assertEqual((resultado.filas_leidas, resultado.filas_staging, resultado.filas_rechazadas), (3, 3, 0))
+        self.assertEqual([fila[1:] for fila in self._staging()], [(1.5, 'M1'), (2.0, 'M1'), (3.0, 'M1')])
+        self.assertEqual(self._staging()[1][0], datetime(2024, 1, 1, 0, 15, tzinfo=dt_timezone.utc))
+
+    def test_formato_y_columnas(self):
+        with self.assertRaises(FormatoNoSoportado):
+            list(iter_bloques(io.BytesIO(b''), 'consumos.txt'))
+        with self.assertRaises(ColumnasFaltantes) as error:
+            self._importar(b"fecha,valor,medidor\n2024-01-01 00:00,1,M1\n", 'consumos.csv')
+        self.assertEqual(error.exception.faltantes, ['consumo'])
+
+
+class CargadorStagingTests(TestCase):
+
+    def setUp(self):
+        self.importaciones = [ImportacionConsumo.objects.create(nombre_original=f'{i}.csv') for i in range(2)]
+
+    def _bloque(self, filas):
+        fechas, consumos, medidores = zip(*filas)
+        return pd.DataFrame({'fecha': pd.to_datetime(list(fechas), utc=True), 'consumo': consumos, 'medidor': list(medidores)})
+
+    def _cargar_lotes(self):
+        # Nombres con coma y comillas: en PostgreSQL viajan en el CSV del COPY.
+        primero = self._bloque([('2024-01-01 00:00', 1.5, 'M,1'), ('2024-01-01 00:15', 2.0, 'M,1'), ('2024-01-01 00:00', 3.0, 'M "2"')])
+        segundo = self._bloque([('2024-01-01 00:15', 9.0, 'M,1'), ('2024-01-01 00:30', 4.0, 'M,1')])
+        cargador = CargadorStaging(self.importaciones[0].pk)
+        self.assertEqual((cargador.cargar(primero), cargador.cargar(segundo), cargador.cargar(segundo.iloc[:0])), (3, 1, 0))
+        self.assertEqual((cargador.insertadas, cargador.duplicadas), (4, 1))
+
+        # Otra importación tiene su propio lote: las mismas filas no cuentan como duplicadas.
+        otro = CargadorStaging(self.importaciones[1].pk)
+        otro.cargar(primero)
+        self.assertEqual((otro.insertadas, otro.duplicadas), (3, 0))
+
+        lote = InterfaceConsumo.objects.filter(importacion=self.importaciones[0]).order_by('consumo')
+        self.assertEqual(list(lote.values_list('fecha', 'consumo', 'medidor')), [
+            (datetime(2024, 1, 1, 0, 0, tzinfo=dt_timezone.utc), 1.5, 'M,1'),
+            (datetime(2024, 1, 1, 0, 15, tzinfo=dt_timezone.utc), 2.0, 'M,1'),
+            (datetime(2024, 1, 1, 0, 0, tzinfo=dt_timezone.utc), 3.0, 'M "2"'),
+            (datetime(2024, 1, 1, 0, 30, tzinfo=dt_timezone.utc), 4.0, 'M,1'),
+        ])
+
+    def test_conteos(self):
+        with CaptureQueriesContext(connection) as consultas:
+            self._cargar_lotes()
+        copy = any('CREATE TEMP TABLE' in c['sql'] for c in consultas.captured_queries)
+        self.assertEqual(copy, connection.vendor == 'postgresql')
+
+    @skipUnless(connection.vendor == 'postgresql', "En los demás motores test_conteos ya usa executemany.")
+    def test_conteos_executemany(self):
+        with mock.patch.object(CargadorStaging, '_cargar_copy', CargadorStaging._cargar_executemany):
+            self._cargar_lotes()
+
+
+class FusionStagingTests(TestCase):
+
+    def setUp(self):
+        self.m1, self.m2 = Medidor.objects.create(nombre='M1'), Medidor.objects.create(nombre='M2')
+        Medidor.objects.create(nombre='M1')  # Nombre repetido: se cruza con el id menor
+        self.t0 = timezone.make_aware(datetime(2024, 1, 1))
+        self.t1 = self.t0 + timedelta(minutes=15)
+        Consumo.objects.create(medidor=self.m1, fecha=self.t0, consumo=1.0)
+        self.importacion = ImportacionConsumo.objects.create(nombre_original='consumos.csv')
+        InterfaceConsumo.objects.bulk_create([
+            InterfaceConsumo(importacion=self.importacion, fecha=fecha, consumo=consumo, medidor=medidor)
+            for fecha, consumo, medidor in [
+                (self.t0, 5.0, 'M1'), (self.t1, 2.0, 'M1'), (self.t0, 3.0, 'M2'), (self.t0, 9.0, 'Y'), (self.t1, 9.0, 'X'),
+            ]
+        ])
+
+    def _fusionar(self, sobrescribir):
+        fusion = fusionar_staging(self.importacion.pk, sobrescribir=sobrescribir)
+        fusion['medidores_modificados'] = sorted(fusion['medidores_modificados'])
+        return fusion
+
+    def _consumos(self):
+        return list(Consumo.objects.order_by('medidor_id', 'fecha').values_list('medidor_id', 'fecha', 'consumo'))
+
+    def test_sin_sobrescribir(self):
+        self.assertEqual(self._fusionar(False), {
+            'insertados': 2, 'actualizados': 0, 'duplicados': 1, 'medidor_desconocido': 2,
+            'ejemplos_medidor_desconocido': ['X', 'Y'], 'medidores_modificados': [self.m1.pk, self.m2.pk],
+        })
+        self.assertEqual(self._consumos(), [(self.m1.pk, self.t0, 1.0), (self.m1.pk, self.t1, 2.0), (self.m2.pk, self.t0, 3.0)])
+        # El mismo lote otra vez: todo lo cruzado ya existe.
+        fusion = self._fusionar(False)
+        self.assertEqual((fusion['insertados'], fusion['duplicados'], fusion['medidores_modificados']), (0, 3, []))
+
+    def test_sobrescribir(self):
+        fusion = self._fusionar(True)
+        self.assertEqual(
+            {k: fusion[k] for k in ('insertados', 'actualizados', 'duplicados', 'medidor_desconocido', 'medidores_modificados')},
+            {'insertados': 2, 'actualizados': 1, 'duplicados': 0, 'medidor_desconocido': 2, 'medidores_modificados': [self.m1.pk, self.m2.pk]},
+        )
+        self.assertEqual(self._consumos(), [(self.m1.pk, self.t0, 5.0), (self.m1.pk, self.t1, 2.0), (self.m2.pk, self.t0, 3.0)])
+        fusion = self._fusionar(True)
+        self.assertEqual((fusion['insertados'], fusion['actualizados'], fusion['duplicados']), (0, 3, 0))
+
+
+class TrabajosImportacionTests(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.medidor = Medidor.objects.create(nombre='M1')
+
+    def _importacion(self, estado, iniciado=None, latido=None):
+        importacion = ImportacionConsumo.objects.create(nombre_original='consumos.csv', estado=estado, iniciado=iniciado, latido=latido)
+        InterfaceConsumo.objects.create(importacion=importacion, fecha=timezone.now(), consumo=1.0, medidor='M1')
+        return importacion
+
+    def _con_archivo(self, contenido):
+        return ImportacionConsumo.objects.create(
+            nombre_original='consumos.csv', archivo=ContentFile(contenido.encode(), name='consumos.csv'),
+        )
+
+    def _staging_durante_fusion(self, importacion_id, **kwargs):
+        # Lo que había en staging justo antes de fusionar, para comprobar que después se borra.
+        self.filas_staging = InterfaceConsumo.objects.filter(importacion_id=importacion_id).count()
+        return fusionar_staging(importacion_id, **kwargs)
+
+    def test_ciclo_completo(self):
+        importaciones = [self._con_archivo(f"fecha,consumo,medidor\n2024-01-01 0{i}:00,{i},M1\n2024-01-01 0{i}:15,x,M1\n") for i in range(3)]
+        self.assertEqual(reclamar_pendientes(2), [importaciones[0].pk, importaciones[1].pk])
+        self.assertEqual(reclamar_pendientes(2), [importaciones[2].pk])  # Las ya reclamadas no se vuelven a tomar
+        self.assertEqual(reclamar_pendientes(2), [])
+        importacion = importaciones[0]
+        importacion.refresh_from_db()
+        self.assertEqual(importacion.estado, ImportacionConsumo.EN_PROCESO)
+        self.assertIsNotNone(importacion.iniciado)
+
+        with mock.patch('core.tareas.fusionar_staging', side_effect=self._staging_durante_fusion):
+            procesar_importacion(importacion.pk)
+        importacion.refresh_from_db()
+        self.assertEqual(self.filas_staging, 1)
+        self.assertEqual(
+            (importacion.estado, importacion.filas_leidas, importacion.filas_staging, importacion.filas_rechazadas, importacion.filas_fusionadas),
+            (ImportacionConsumo.COMPLETADO, 2, 1, 1, 1),
+        )
+        self.assertEqual(importacion.rechazos_por_motivo, {'consumo_invalido': 1})
+        self.assertIsNotNone(importacion.finalizado)
+        self.assertFalse(importacion.staging.exists())
+        self.assertFalse(importacion.archivo.storage.exists(importacion.archivo.name))
+        self.assertEqual(Consumo.objects.filter(medidor=self.medidor).count(), 1)
+
+    def test_errores_limpian_staging(self):
+        sin_validas = self._con_archivo("fecha,consumo,medidor\nayer,1,M1\n")
+        procesar_importacion(sin_validas.pk)
+        sin_validas.refresh_from_db()
+        self.assertEqual(sin_validas.estado, ImportacionConsumo.ERROR)
+        self.assertIn('Ninguna fila válida', sin_validas.mensaje)
+
+        importacion = self._con_archivo("fecha,consumo,medidor\n2024-01-01 00:00,1,M1\n")
+        with mock.patch('core.tareas.fusionar_staging', side_effect=RuntimeError('sin conexión')):
+            procesar_importacion(importacion.pk)
+        importacion.refresh_from_db()
+        self.assertEqual(importacion.estado, ImportacionConsumo.ERROR)
+        self.assertEqual(importacion.filas_staging, 1)
+        self.assertIn('sin conexión', importacion.mensaje)
+        self.assertIsNotNone(importacion.finalizado)
+        self.assertFalse(importacion.staging.exists())
+        self.assertFalse(Consumo.objects.exists())
+
+    @override_settings(IMPORTACION_MINUTOS_ABANDONO=30)
+    def test_libera_abandonadas(self):
+        hace = lambda minutos: timezone.now() - timedelta(minutes=minutos)
+        abandonada = self._importacion(ImportacionConsumo.EN_PROCESO, hace(180), hace(31))
+        sin_latido = self._importacion(ImportacionConsumo.EN_PROCESO, hace(31))  # Reclamada antes de que existiera el latido
+        en_curso = self._importacion(ImportacionConsumo.EN_PROCESO, hace(180), hace(5))  # Larga, pero late
+        pendiente = self._importacion(ImportacionConsumo.PENDIENTE)
+
+        self.assertEqual(reclamar_pendientes(5), [pendiente.pk])
+        for liberada in (abandonada, sin_latido):
+            liberada.refresh_from_db()
+            self.assertEqual(liberada.estado, ImportacionConsumo.ERROR)
+            self.assertIn('30 minutos', liberada.mensaje)
+            self.assertIsNotNone(liberada.finalizado)
+            self.assertFalse(liberada.staging.exists())
+        en_curso.refresh_from_db()
+        self.assertEqual((en_curso.estado, en_curso.staging.count()), (ImportacionConsumo.EN_PROCESO, 1))
+        pendiente.refresh_from_db()
+        self.assertIsNotNone(pendiente.latido)
+
+    def _procesar_liberando(self, importacion, antes_de_liberar=lambda: None):
+        # Procesa de a una fila por bloque y corre liberar_abandonadas después de cada progreso.
+        liberadas = []
+
+        def importar(*args, progreso, **kwargs):
+            def progreso_y_liberar(resultado):
+                progreso(resultado)
+                antes_de_liberar()
+                liberadas.extend(liberar_abandonadas())
+            return importar_a_staging(*args, progreso=progreso_y_liberar, tamano_bloque=1, **kwargs)
+
+        with mock.patch('core.tareas.importar_a_staging', side_effect=importar):
+            procesar_importacion(importacion.pk)
+        importacion.refresh_from_db()
+        return liberadas
+
+    @override_settings(IMPORTACION_MINUTOS_ABANDONO=30)
+    def test_importacion_larga_no_se_libera(self):
+        importacion = self._con_archivo("fecha,consumo,medidor\n2024-01-01 00:00,1,M1\n2024-01-01 00:15,2,M1\n2024-01-01 00:30,3,M1\n")
+        hace_horas = timezone.now() - timedelta(hours=3)
+        ImportacionConsumo.objects.filter(pk=importacion.pk).update(
+            estado=ImportacionConsumo.EN_PROCESO, iniciado=hace_horas, latido=hace_horas,
+        )
+        self.assertEqual(self._procesar_liberando(importacion), [])
+        self.assertEqual((importacion.estado, importacion.filas_fusionadas), (ImportacionConsumo.COMPLETADO, 3))
+        self.assertEqual(Consumo.objects.count(), 3)
+
+    @override_settings(IMPORTACION_MINUTOS_ABANDONO=30)
+    def test_liberada_durante_la_carga_no_se_completa(self):
+        importacion = self._con_archivo("fecha,consumo,medidor\n2024-01-01 00:00,1,M1\n2024-01-01 00:15,2,M1\n2024-01-01 00:30,3,M1\n")
+        reclamar_pendientes(1)
+
+        def silenciar():
+            # Como si el worker hubiera pasado más de 30 minutos sin latir.
+            ImportacionConsumo.objects.filter(pk=importacion.pk).update(latido=timezone.now() - timedelta(minutes=31))
+
+        self.assertEqual(self._procesar_liberando(importacion, silenciar), [importacion.pk])
+        self.assertEqual(importacion.estado, ImportacionConsumo.ERROR)
+        self.assertIn('sin señales', importacion.mensaje)
+        self.assertEqual(importacion.filas_fusionadas, 0)
+        self.assertFalse(Consumo.objects.exists())
+        self.assertFalse(importacion.staging.exists())
+        self.assertFalse(MedicionImportacion.objects.get(importacion=importacion).exito)
+
+class ValidacionConsumoTests(TestCase):
+
+    def _validar(self, filas, offset=0):
+        return validar_bloque(pd.DataFrame(filas, columns=['fecha', 'consumo', 'medidor'], dtype=object), offset)
+
+    def test_consumo_vacio_se_rechaza(self):
+        limpio, rechazos = self._validar([
+            ['2024-01-01 00:00', '1.5', 'M1'],
+            ['2024-01-01 00:15', None, 'M1'],
+            ['2024-01-01 00:30', '', 'M1'],
+            ['2024-01-01 00:45', '   ', 'M1'],
+        ])
+        self.assertEqual(limpio['consumo'].tolist(), [1.5])
+        self.assertEqual(rechazos[['fila', 'motivo']].values.tolist(), [[3, 'consumo_invalido'], [4, 'consumo_invalido'], [5, 'consumo_invalido']])
+
+    def test_motivos(self):
+        limpio, rechazos = self._validar([
+            ['2024-01-01 00:00', '1.5', ' M1 '],
+            ['ayer', '1', 'M1'],
+            ['2024-01-01 00:15', 'abc', 'M1'],
+            ['2024-01-01 00:30', '-1', 'M1'],
+            ['2024-01-01 00:45', '2e9', 'M1'],
+            ['2024-01-01 01:00', '1', '  '],
+            ['2024-01-01 01:15', '1', 'M' * (MEDIDOR_MAX_LENGTH + 1)],
+            ['01/01/2024 00:00', '3', 'M1'],  # La misma fecha que la primera, con otro formato
+            ['mañana', 'x', None],  # Solo se informa el primer motivo
+        ], offset=10)
+        self.assertEqual(rechazos[['fila', 'motivo']].values.tolist(), [
+            [13, 'fecha_invalida'], [14, 'consumo_invalido'], [15, 'consumo_negativo'], [16, 'consumo_fuera_de_rango'],
+            [17, 'medidor_vacio'], [18, 'medidor_muy_largo'], [19, 'duplicado'], [20, 'fecha_invalida'],
+        ])
+        self.assertEqual(rechazos['valor'].tolist()[:3], ['ayer', 'abc', '-1'])
+        self.assertEqual(set(rechazos['motivo']), set(MOTIVOS))
+        self.assertEqual(limpio.values.tolist(), [[pd.Timestamp('2024-01-01', tz='UTC'), 1.5, 'M1']])
+
+        with override_settings(IMPORTACION_CONSUMO_MAXIMO=1):
+            _, rechazos = self._validar([['2024-01-01 00:00', '1.5', 'M1']])
+        self.assertEqual(rechazos['motivo'].tolist(), ['consumo_fuera_de_rango'])
+
+    def test_coma_decimal(self):
+        serie = pd.Series(['1,5', '1.234,5', '1,234.5', '2', ' 3,0 ', None, 'x', 7, '-0,25'], dtype=object)
+        self.assertEqual(
+            convertir_consumo(serie).fillna(-99).tolist(), [1.5, 1234.5, 1234.5, 2.0, 3.0, -99, -99, 7.0, -0.25],
+        )
+
+
+class ParserFechasTests(TestCase):
+
+    def setUp(self):
+        fechas.backend().clear()
+
+    @override_settings(TIME_ZONE='America/Santiago')
+    def test_hora_local_a_utc(self):
+        parser = ParserFechas(usar_cache=False)
+        fechas = parser.parse(pd.Series(['01/02/2024 10:00', '15/07/2024 10:00', '2024-01-01T00:00:00Z', '08/09/2024 00:30', None]))
+        self.assertEqual(fechas.tolist()[:3], [
+            pd.Timestamp('2024-02-01 13:00', tz='UTC'),  # Verano: UTC-3
+            pd.Timestamp('2024-07-15 14:00', tz='UTC'),  # Invierno: UTC-4
+            pd.Timestamp('2024-01-01 00:00', tz='UTC'),  # Con zona explícita no se localiza
+        ])
+        # 00:30 del 8/9/2024 no existe en Santiago (cambio de horario) y una celda vacía no es fecha.
+        self.assertTrue(fechas.iloc[3:].isna().all())
+        # Las celdas que ya son fecha (Excel) también se localizan.
+        self.assertEqual(parser.parse(pd.Series([datetime(2024, 2, 1, 10, 0)], dtype=object)).tolist(), [pd.Timestamp('2024-02-01 13:00', tz='UTC')])
+
+    def test_formatos_por_medidor_en_cache(self):
+        medidores = pd.Series(['M1', 'M1', 'M2'])
+        primero = ParserFechas()
+        primero.parse(pd.Series(['05/03/2024 10:00', '06/03/2024 10:00', '2024-03-05 10:00']), medidores)
+        self.assertEqual(primero.detecciones, 1)
+        self.assertEqual(fechas.backend().get(_clave_cache('M1')), '%d/%m/%Y %H:%M')
+        self.assertEqual(fechas.backend().get(_clave_cache('M2')), '%Y-%m-%d %H:%M')
+
+        # Otra importación de los mismos medidores no vuelve a muestrear.
+        segundo = ParserFechas()
+        leidas = segundo.parse(pd.Series(['07/03/2024 10:00', '2024-03-07 11:00']), pd.Series(['M1', 'M2']))
+        self.assertEqual(segundo.detecciones, 0)
+        self.assertEqual(set(segundo.formatos), {'%d/%m/%Y %H:%M', '%Y-%m-%d %H:%M'})
+        self.assertEqual(leidas.tolist(), [pd.Timestamp('2024-03-07 10:00', tz='UTC'), pd.Timestamp('2024-03-07 11:00', tz='UTC')])
+
+        sin_cache = ParserFechas(usar_cache=False)
+        sin_cache.parse(pd.Series(['07/03/2024 10:00']), pd.Series(['M1']))
+        self.assertEqual(sin_cache.detecciones, 1)
+
+    def test_formatos_compartidos_entre_procesos(self):
+        # Los workers de procesar_importaciones son procesos distintos: la caché por proceso no sirve.
+        self.assertNotIsInstance(fechas.backend(), LocMemCache)
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        compartida = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directorio}
+        with override_settings(CACHES={**settings.CACHES, 'formatos_fecha': compartida}):
+            ParserFechas().parse(pd.Series(['05/03/2024 10:00']), pd.Series(['M1']))
+        # Otro proceso abre su propia conexión a la caché y encuentra el formato aprendido.
+        with override_settings(CACHES={**settings.CACHES, 'formatos_fecha': compartida}):
+            otro = ParserFechas()
+            otro.parse(pd.Series(['06/03/2024 10:00']), pd.Series(['M1']))
+        self.assertEqual((otro.detecciones, otro.formatos), (0, ['%d/%m/%Y %H:%M']))
+
+    def test_formato_mixed_como_ultimo_recurso(self):
+        parser = ParserFechas(usar_cache=False)
+        with mock.patch.object(ParserFechas, '_parse_generico', autospec=True, side_effect=ParserFechas._parse_generico) as generico:
+            fechas = parser.parse(pd.Series(['March 5, 2024 10:00', '05/03/2024 11:00', 'March 5, 2024 10:00', 'nada']))
+        self.assertEqual(generico.call_args.args[1].tolist(), ['March 5, 2024 10:00', 'March 5, 2024 10:00', 'nada'])
+        self.assertEqual(parser.formatos, ['%d/%m/%Y %H:%M'])  # Lo que no coincide con ningún candidato no agrega formatos
+        self.assertEqual(fechas.tolist()[:3], [
+            pd.Timestamp('2024-03-05 10:00', tz='UTC'), pd.Timestamp('2024-03-05 11:00', tz='UTC'), pd.Timestamp('2024-03-05 10:00', tz='UTC'),
+        ])
+        self.assertTrue(pd.isna(fechas.iloc[3]))
+
+
+@override_settings(TIME_ZONE='America/Santiago')  # Con cambio de horario, para probar el corte local de los intervalos
+class ResumenesConsumoTests(TestCase):
+
+    def setUp(self):
+        self.medidores = [Medidor.objects.create(nombre=f'R{i}') for i in range(2)]
+        inicio = timezone.make_aware(datetime(2024, 3, 25))
+        Consumo.objects.bulk_create([
+            Consumo(medidor=medidor, fecha=inicio + timedelta(minutes=15 * i), consumo=i % 7 + 0.5)
+            for medidor in self.medidores for i in range(4 * 24 * 45)
+        ])
+        resumenes.refrescar([m.pk for m in self.medidores], inicio, inicio + timedelta(days=45))
+
+    def _comparar(self, desde, hasta, por):
+        crudo = resumenes.totales(desde, hasta, por=por, usar_resumenes=False)
+        resumido = resumenes.totales(desde, hasta, por=por)
+        self.assertEqual(crudo.keys(), resumido.keys())
+        for clave, total in crudo.items():
+            self.assertEqual(total['lecturas'], resumido[clave]['lecturas'])
+            self.assertAlmostEqual(total['suma'], resumido[clave]['suma'])
+            self.assertEqual((total['minimo'], total['maximo']), (resumido[clave]['minimo'], resumido[clave]['maximo']))
+
+    def test_totales_coinciden_con_consumo(self):
+        desde = timezone.make_aware(datetime(2024, 3, 26, 5, 40))
+        hasta = timezone.make_aware(datetime(2024, 5, 3, 17, 10))
+        self.assertEqual([n for n, _, _ in resumenes.tramos(desde, hasta)], [None, 'hora', 'dia', 'mes', 'dia', 'hora', None])
+        self._comparar(desde, hasta, 'medidor')
+        self._comparar(desde, hasta, None)
+
+    def test_intervalos_en_hora_local(self):
+        dia = ConsumoDia.objects.filter(medidor=self.medidores[0]).order_by('inicio').first()
+        self.assertEqual(timezone.localtime(dia.inicio).hour, 0)
+        self.assertEqual(dia.lecturas, 4 * 24)
+        self.assertEqual(
+            sorted(timezone.localtime(m.inicio).date().isoformat() for m in ConsumoMes.objects.filter(medidor=self.medidores[0])),
+            ['2024-03-01', '2024-04-01', '2024-05-01'],
+        )
+
+    def test_refresco_incremental(self):
+        medidor = self.medidores[0]
+        fecha = timezone.make_aware(datetime(2024, 4, 2, 10, 15))
+        Consumo.objects.filter(medidor=medidor, fecha=fecha).update(consumo=1000)
+        resumenes.refrescar([medidor.pk], fecha, fecha)
+        self._comparar(timezone.make_aware(datetime(2024, 3, 25)), timezone.make_aware(datetime(2024, 5, 9)), 'medidor')
+
+
+class DiferenciasConsumoTests(TestCase):
+
+    def setUp(self):
+        self.medidores = [Medidor.objects.create(nombre=f'D{i}') for i in range(2)]
+        self.inicio = timezone.make_aware(datetime(2024, 1, 1))
+        Consumo.objects.bulk_create([
+            Consumo(medidor=medidor, fecha=self.inicio + timedelta(hours=2 * i), consumo=float(i * i))
+            for medidor in self.medidores for i in range(1, 50)
+        ])
+        diferencias.reconstruir_diferencias()
+
+    def _tabla(self):
+        return list(VistaConsumoDiferencia.objects.order_by('medidor_id', 'fecha').values_list(
+            'medidor_id', 'fecha', 'consumo', 'consumo_anterior', 'diferencia_consumo'))
+
+    def test_reconstruccion(self):
+        filas = self._tabla()
+        self.assertEqual(len(filas), 2 * 48)  # La primera lectura de cada medidor no tiene anterior
+        self.assertEqual(filas[0][2:], (4.0, 1.0, 3.0))
+
+    def test_actualizacion_incremental_igual_a_reconstruir(self):
+        medidor = self.medidores[0]
+        nuevas = [
+            self.inicio - timedelta(hours=5),  # Antes de la primera lectura del medidor
+            self.inicio + timedelta(hours=7),  # Entre lecturas existentes
+            self.inicio + timedelta(hours=9),
+            self.inicio + timedelta(hours=200),  # Después de la última
+        ]
+        Consumo.objects.bulk_create([Consumo(medidor=medidor, fecha=f, consumo=0.5) for f in nuevas])
+        Consumo.objects.filter(medidor=medidor, fecha=self.inicio + timedelta(hours=20)).update(consumo=-1)
+
+        diferencias.actualizar_diferencias([medidor.pk], nuevas[0], nuevas[2])
+        diferencias.actualizar_diferencias([medidor.pk], self.inicio + timedelta(hours=20), nuevas[3])
+        incremental = self._tabla()
+        diferencias.reconstruir_diferencias()
+        self.assertEqual(incremental, self._tabla())
+
+    def test_ventana_por_medidor(self):
+        # D0 tiene un hueco después de la lectura nueva; D1 no debe recalcularse sobre ese hueco.
+        d0, d1 = self.medidores
+        Consumo.objects.filter(medidor=d0, fecha__gt=self.inicio + timedelta(hours=10), fecha__lt=self.inicio + timedelta(hours=80)).delete()
+        diferencias.reconstruir_diferencias()
+        nueva = self.inicio + timedelta(hours=11)
+        Consumo.objects.bulk_create([Consumo(medidor=m, fecha=nueva, consumo=0.5) for m in self.medidores])
+        fuera = VistaConsumoDiferencia.objects.filter(medidor_id=d1.pk, fecha=self.inicio + timedelta(hours=40))
+        fuera.update(diferencia_consumo=999)
+
+        diferencias.actualizar_diferencias([d0.pk, d1.pk], nueva, nueva)
+        self.assertEqual(fuera.get().diferencia_consumo, 999)
+        fuera.update(diferencia_consumo=F('consumo') - F('consumo_anterior'))
+        incremental = self._tabla()
+        diferencias.reconstruir_diferencias()
+        self.assertEqual(incremental, self._tabla())
+
+
+class JerarquiaMedidoresTests(TestCase):
+    """Árbol: raiz -> (a -> (a1, a2 -> a21), b -> b1)."""
+
+    def setUp(self):
+        crear = lambda nombre, padre=None: Medidor.objects.create(nombre=nombre, medidor_padre=padre)
+        self.raiz = crear('raiz')
+        self.a, self.b = crear('a', self.raiz), crear('b', self.raiz)
+        self.a1, self.a2 = crear('a1', self.a), crear('a2', self.a)
+        self.a21, self.b1 = crear('a21', self.a2), crear('b1', self.b)
+        self.desde = timezone.make_aware(datetime(2024, 1, 1))
+        self.hasta = self.desde + timedelta(days=1)
+
+    def _clausura(self):
+        return set(MedidorAncestro.objects.values_list('ancestro_id', 'descendiente_id', 'profundidad'))
+
+    def _assert_igual_a_reconstruir(self):
+        actual = self._clausura()
+        jerarquia.reconstruir_jerarquia()
+        self.assertEqual(actual, self._clausura())
+
+    def test_alta_y_movimiento_de_subarbol(self):
+        self.assertEqual(set(jerarquia.descendientes(self.a)), {self.a, self.a1, self.a2, self.a21})
+        self.assertEqual(MedidorAncestro.objects.get(ancestro=self.raiz, descendiente=self.a21).profundidad, 3)
+        self._assert_igual_a_reconstruir()
+
+        self.a2.medidor_padre = self.b1
+        self.a2.save()
+        self.assertEqual(set(jerarquia.descendientes(self.a)), {self.a, self.a1})
+        self.assertEqual(MedidorAncestro.objects.get(ancestro=self.raiz, descendiente=self.a21).profundidad, 4)
+        self._assert_igual_a_reconstruir()
+
+        self.a2.medidor_padre = None
+        self.a2.save()
+        self.assertFalse(MedidorAncestro.objects.filter(ancestro=self.raiz, descendiente=self.a21).exists())
+        self._assert_igual_a_reconstruir()
+
+        self.b.delete()
+        self._assert_igual_a_reconstruir()
+
+    def test_rechaza_ciclos(self):
+        self.a.medidor_padre = self.a21
+        with self.assertRaises(jerarquia.CicloJerarquia):
+            self.a.save()
+        with self.assertRaises(ValidationError):
+            self.a.full_clean()
+
+    def test_consumo_subarbol_y_balance(self):
+        consumos = {self.raiz: 100, self.a: 60, self.b: 30, self.a1: 25, self.a2: 30, self.a21: 30, self.b1: 30}
+        Consumo.objects.bulk_create([
+            Consumo(medidor=medidor, fecha=self.desde + timedelta(hours=h), consumo=valor / 4)
+            for medidor, valor in consumos.items() for h in range(4)
+        ])
+        resumenes.refrescar([m.pk for m in consumos], self.desde, self.hasta)
+
+        with self.assertNumQueries(1):
+            total = jerarquia.consumo_subarbol(self.a, self.desde, self.hasta)
+        self.assertEqual((total['suma'], total['lecturas']), (145, 16))
+        self.assertEqual(jerarquia.consumo_subarbol(self.a, self.desde, self.hasta, usar_resumenes=True)['suma'], 145)
+        self.assertEqual(
+            {k: v['suma'] for k, v in jerarquia.totales_subarboles([self.a, self.b], self.desde, self.hasta).items()},
+            {self.a.pk: 145, self.b.pk: 60},
+        )
+
+        perdidas = {fila['nombre']: fila['perdida'] for fila in jerarquia.balance(self.desde, self.hasta)}
+        self.assertEqual(perdidas, {'raiz': 10, 'a': 5, 'a2': 0, 'b': 0})
+        self.assertEqual([fila['nombre'] for fila in jerarquia.balance(self.desde, self.hasta, umbral=8)], ['raiz', 'a'])
+
+
+@skipUnless(connection.vendor == 'postgresql', "Las particiones de core_consumo solo existen en PostgreSQL.")
+class ParticionesConsumoTests(TestCase):
+
+    def setUp(self):
+        self.medidor = Medidor.objects.create(nombre='M1')
+        self.ahora = datetime(2030, 6, 15, tzinfo=dt_timezone.utc)
+
+    def _particion_de(self, consumo):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT tableoid::regclass::text FROM {particiones.TABLA} WHERE id = %s", [consumo.pk])
+            return cursor.fetchone()[0]
+
+    def test_mantener_crea_meses_futuros_y_vacia_default(self):
+        self.assertTrue(particiones.esta_particionada())
+        viejo = Consumo.objects.create(medidor=self.medidor, fecha=datetime(2010, 3, 31, 23, tzinfo=dt_timezone.utc), consumo=1)
+        self.assertEqual(self._particion_de(viejo), particiones.DEFAULT)
+
+        acciones = particiones.mantener_particiones(meses_adelante=2, ahora=self.ahora)
+        self.assertEqual(acciones['creadas'], [
+            'core_consumo_p2010_03', 'core_consumo_p2030_06', 'core_consumo_p2030_07', 'core_consumo_p2030_08',
+        ])
+        self.assertEqual(self._particion_de(viejo), 'core_consumo_p2010_03')
+        self.assertEqual(particiones.meses_en_default(), [])
+        plan = particiones.consumos_en_rango(*particiones.rango_mes(viejo.fecha)).explain()
+        self.assertIn('core_consumo_p2010_03', plan)
+        self.assertNotIn('core_consumo_p2030_06', plan)
+        self.assertEqual(particiones.mantener_particiones(meses_adelante=2, ahora=self.ahora)['creadas'], [])
+
+    def test_retencion_desacopla_o_elimina(self):
+        for mes in (1, 2, 3):
+            Consumo.objects.create(medidor=self.medidor, fecha=datetime(2030, mes, 10, tzinfo=dt_timezone.utc), consumo=mes)
+        particiones.mantener_particiones(meses_adelante=0, ahora=self.ahora)
+
+        simulado = particiones.mantener_particiones(meses_adelante=0, retener_meses=4, simular=True, ahora=self.ahora)
+        # Las que creó la migración para el mes real también quedan vencidas frente a 2030.
+        self.assertIn('core_consumo_p2030_01', simulado['retiradas'])
+        self.assertNotIn('core_consumo_p2030_02', simulado['retiradas'])
+        self.assertEqual(Consumo.objects.count(), 3)
+
+        particiones.mantener_particiones(meses_adelante=0, retener_meses=4, ahora=self.ahora)
+        self.assertEqual(sorted(Consumo.objects.values_list('consumo', flat=True)), [2, 3])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT consumo FROM core_consumo_archivo_2030_01")
+            self.assertEqual(cursor.fetchall(), [(1,)])
+
+        particiones.mantener_particiones(meses_adelante=0, retener_meses=3, eliminar=True, ahora=self.ahora)
+        self.assertEqual(list(Consumo.objects.values_list('consumo', flat=True)), [3])
+        self.assertNotIn('core_consumo_p2030_02', connection.introspection.table_names())
+
+
+@skipUnless(exportacion.PARQUET_DISPONIBLE, "requiere pyarrow")
+class ArchivoConsumoTests(TestCase):
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        ajuste = override_settings(ARCHIVO_CONSUMO_DIR=directorio)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        self.m1 = Medidor.objects.create(nombre='M1')
+        self.m2 = Medidor.objects.create(nombre='M2')
+        self.enero = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        self.febrero = datetime(2024, 2, 1, tzinfo=dt_timezone.utc)
+        Consumo.objects.bulk_create([
+            Consumo(medidor=m, fecha=self.enero + timedelta(hours=h), consumo=m.pk * 1000 + h)
+            for m in (self.m1, self.m2) for h in range(24 * 40)
+        ])
+        # En PostgreSQL, con particiones de enero y febrero: el mes archivado se retira con un DROP.
+        particiones.mantener_particiones(meses_adelante=0)
+
+    def _lecturas(self, df):
+        return [(int(m), f.to_pydatetime(), c) for m, f, c in df.itertuples(index=False)]
+
+    def test_archivar_y_leer_mezclando_con_la_tabla(self):
+        desde, hasta = datetime(2024, 1, 20, tzinfo=dt_timezone.utc), datetime(2024, 2, 5, tzinfo=dt_timezone.utc)
+        esperado = self._lecturas(archivo.leer(desde, hasta, [self.m1.pk]))
+        self.assertEqual(len(esperado), 16 * 24)
+
+        registro = archivo.archivar_mes(self.enero)
+        self.assertEqual((registro.filas, registro.medidores), (2 * 31 * 24, 2))
+        self.assertEqual(
+            registro.retiro, ArchivoConsumo.ELIMINADA if particiones.esta_particionada() else ArchivoConsumo.BORRADAS,
+        )
+        self.assertTrue((archivo.directorio() / registro.ruta).exists())
+        self.assertFalse(Consumo.objects.filter(fecha__lt=self.febrero).exists())
+        self.assertEqual(self._lecturas(archivo.leer(desde, hasta, [self.m1.pk])), esperado)
+        puntos = series.series([self.m1.pk], desde, hasta, metodo='ninguno')['series'][0]['valores']
+        self.assertEqual(puntos, [c for _, _, c in esperado])
+
+        # Una lectura corregida y una nueva en el mes archivado: leer() las toma de la tabla y el
+        # siguiente archivado las pasa al Parquet.
+        corregida = datetime(2024, 1, 25, tzinfo=dt_timezone.utc)
+        Consumo.objects.create(medidor=self.m1, fecha=corregida, consumo=-1)
+        Consumo.objects.create(medidor=self.m1, fecha=corregida + timedelta(minutes=30), consumo=-2)
+        esperado = sorted(
+            [l for l in esperado if l[1] != corregida] + [(self.m1.pk, corregida, -1.0), (self.m1.pk, corregida + timedelta(minutes=30), -2.0)],
+            key=lambda l: l[1],
+        )
+        self.assertEqual(self._lecturas(archivo.leer(desde, hasta, [self.m1.pk])), esperado)
+        self.assertEqual(archivo.archivar_mes(self.enero).filas, 2 * 31 * 24 + 1)
+        self.assertFalse(Consumo.objects.filter(fecha__lt=self.febrero).exists())
+        self.assertEqual(self._lecturas(archivo.leer(desde, hasta, [self.m1.pk])), esperado)
+
+        with self.assertRaises(archivo.ErrorArchivo):
+            archivo.archivar_mes(timezone.now())
+
+    def test_exportar_y_listar_mes_archivado(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        consultas = [
+            f'desde=2024-01-30&hasta=2024-02-01&medidores={self.m2.pk}&formato=csv',
+            'desde=2024-01-30&hasta=2024-02-01&formato=parquet',
+        ]
+        antes = [b''.join(self.client.get(f'/admin/core/consumo/export/?{c}').streaming_content) for c in consultas]
+        self.assertEqual(len(antes[0].decode('utf-8-sig').splitlines()), 1 + 3 * 24)
+
+        # Los resúmenes del mes quedan en la base: el filtro por mes lo sigue ofreciendo.
+        resumenes.refrescar([self.m1.pk, self.m2.pk], self.enero, self.febrero)
+        archivo.archivar_mes(self.enero)
+        despues = [b''.join(self.client.get(f'/admin/core/consumo/export/?{c}').streaming_content) for c in consultas]
+        self.assertEqual(despues[0], antes[0])
+        # El Parquet cambia de row groups (un tramo por mes), no de filas.
+        import pyarrow.parquet as pq
+        self.assertEqual(pq.read_table(io.BytesIO(despues[1])).to_pylist(), pq.read_table(io.BytesIO(antes[1])).to_pylist())
+
+        respuesta = self.client.get('/admin/core/consumo/?mes=2024-01')
+        self.assertIn('está archivado en Parquet', ' '.join(str(m) for m in respuesta.context['messages']))
+
+
+class ConsumoAdminChangelistTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        cls.m1, cls.m2 = Medidor.objects.create(nombre='M1'), Medidor.objects.create(nombre='M2')
+        inicio = timezone.make_aware(datetime(2024, 1, 31, 20))
+        # Dos medidores por fecha: el cursor tiene que desempatar por id dentro de la misma fecha.
+        Consumo.objects.bulk_create([
+            Consumo(medidor=medidor, fecha=inicio + timedelta(hours=h), consumo=h)
+            for h in range(12) for medidor in (cls.m1, cls.m2)
+        ])
+        resumenes.refrescar([cls.m1.pk, cls.m2.pk], inicio, inicio + timedelta(hours=12))
+        cls.todos = list(Consumo.objects.order_by('-fecha', '-id').values_list('pk', flat=True))
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def _pagina(self, consulta=''):
+        respuesta = self.client.get(f'/admin/core/consumo/{consulta}')
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.context['cl']
+
+    def test_paginacion_por_cursor(self):
+        cl = self._pagina()
+        self.assertEqual([c.pk for c in cl.result_list], self.todos[:10])
+        self.assertIsNone(cl.url_recientes)
+        cl = self._pagina(cl.url_antiguos)
+        self.assertEqual([c.pk for c in cl.result_list], self.todos[10:20])
+        cl = self._pagina(cl.url_antiguos)
+        self.assertEqual([c.pk for c in cl.result_list], self.todos[20:])
+        self.assertIsNone(cl.url_antiguos)
+        cl = self._pagina(cl.url_recientes)
+        self.assertEqual([c.pk for c in cl.result_list], self.todos[10:20])
+        self.assertEqual(cl.result_count, 24)
+
+    def test_busqueda_y_filtros(self):
+        self.assertEqual(self._pagina(f'?q=M2').result_count, 12)
+        self.assertEqual(self._pagina(f'?q=M').result_count, 0)
+        self.assertEqual([c.pk for c in self._pagina(f'?q={self.todos[3]}').result_list], [self.todos[3]])
+        self.assertEqual(self._pagina(f'?medidor={self.m1.pk}').result_count, 12)
+        # 2024-01-31 20:00 a 2024-02-01 07:00 UTC: cuatro horas en enero.
+        self.assertEqual(self._pagina('?mes=2024-01').result_count, 8)
+        cl = self._pagina(f'?mes=2024-02&medidor={self.m2.pk}')
+        self.assertEqual(cl.result_count, 8)
+        self.assertEqual(cl.get_query_string(remove=['despues']).count('despues'), 0)
+
+
+class ExportacionConsumoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        electrico, agua = TipoMedidor.objects.create(nombre='Eléctrico'), TipoMedidor.objects.create(nombre='Agua')
+        cls.m1 = Medidor.objects.create(nombre='M1', tipo_medidor=electrico)
+        cls.m2 = Medidor.objects.create(nombre='M2', tipo_medidor=agua)
+        inicio = timezone.make_aware(datetime(2024, 1, 31, 20))
+        Consumo.objects.bulk_create([
+            Consumo(medidor=medidor, fecha=inicio + timedelta(hours=h), consumo=h + 0.5)
+            for h in range(12) for medidor in (cls.m1, cls.m2)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def _exportar(self, consulta):
+        respuesta = self.client.get(f'/admin/core/consumo/export/?{consulta}')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta.streaming)
+        return b''.join(respuesta.streaming_content)
+
+    def test_csv_filtros(self):
+        self.assertIn('form', self.client.get('/admin/core/consumo/export/').context)
+        # 'hasta' es inclusive: el 31 de enero completo son las cuatro horas desde las 20:00.
+        contenido = self._exportar(f'desde=2024-01-31&hasta=2024-01-31&tipos_medidor={self.m2.tipo_medidor_id}&formato=csv')
+        self.assertTrue(contenido.startswith(b'\xef\xbb\xbf'))
+        filas = contenido.decode('utf-8-sig').splitlines()
+        self.assertEqual(filas[0], 'fecha;consumo;medidor')
+        self.assertEqual(filas[1:], [f'01/31/2024 {h}:00;{h - 20 + 0.5};{self.m2.pk}' for h in range(20, 24)])
+
+        contenido = self._exportar(f'desde=2024-01-01&hasta=2024-02-29&medidores={self.m1.pk}&formato=csv')
+        self.assertEqual(len(contenido.decode('utf-8-sig').splitlines()), 13)
+        self.assertEqual(self.client.get('/admin/core/consumo/export/?desde=2024-02-01&hasta=2024-01-01&formato=csv').status_code, 200)
+
+    @skipUnless(exportacion.PARQUET_DISPONIBLE, "requiere pyarrow")
+    def test_parquet(self):
+        import io
+        import pyarrow.parquet as pq
+        contenido = self._exportar('desde=2024-02-01&hasta=2024-02-01&formato=parquet')
+        tabla = pq.read_table(io.BytesIO(contenido))
+        self.assertEqual(tabla.column_names, ['fecha', 'consumo', 'medidor'])
+        self.assertEqual(tabla.num_rows, 16)
+        self.assertEqual(tabla.column('medidor').to_pylist()[:2], [self.m1.pk, self.m2.pk])
+        self.assertEqual(tabla.column('fecha')[0].as_py(), timezone.make_aware(datetime(2024, 2, 1)))
+
+
+class SeriesConsumoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        cls.medidor = Medidor.objects.create(nombre='M1')
+        cls.desde = timezone.make_aware(datetime(2024, 3, 1))
+        cls.hasta = cls.desde + timedelta(days=10)
+        # Lecturas cada 15 minutos; el valor es el día del mes, salvo un pico aislado.
+        Consumo.objects.bulk_create([
+            Consumo(medidor=cls.medidor, fecha=fecha, consumo=500.0 if i == 300 else float(fecha.day))
+            for i, fecha in enumerate(cls.desde + timedelta(minutes=15 * i) for i in range(960))
+        ])
+        resumenes.refrescar([cls.medidor.pk], cls.desde, cls.hasta)
+
+    def setUp(self):
+        cache_consultas.backend().clear()
+        self.client.force_login(self.usuario)
+
+    def _series(self, consulta, estado=200):
+        respuesta = self.client.get(f'/api/series/{self.medidor.pk}/?desde=2024-03-01&hasta=2024-03-11&{consulta}')
+        self.assertEqual(respuesta.status_code, estado)
+        return respuesta.json()
+
+    def test_reduccion(self):
+        crudo = self._series('max_puntos=5000')
+        self.assertEqual((crudo['metodo'], crudo['fuente']), ('ninguno', 'consumo'))
+        self.assertEqual(len(crudo['series'][0]['fechas']), 960)
+        self.assertEqual(crudo['series'][0]['fechas'][1] - crudo['series'][0]['fechas'][0], 15 * 60 * 1000)
+
+        # Un punto por día, armado desde ConsumoDia.
+        diario = self._series('max_puntos=10')
+        self.assertEqual(diario['fuente'], 'dia')
+        self.assertEqual(diario['series'][0]['fechas'][0], int(self.desde.timestamp() * 1000))
+        # El pico (lectura 300) cae el 4 de marzo y sube el promedio de ese día.
+        self.assertEqual(diario['series'][0]['valores'], [1.0, 2.0, 3.0, (95 * 4 + 500) / 96, 5.0, 6.0, 7.0, 8.0, 9.0, 10.0])
+
+        horario = self._series('max_puntos=100')
+        self.assertEqual(horario['fuente'], 'hora')
+        self.assertLessEqual(len(horario['series'][0]['valores']), 100)
+
+        lttb = self._series('max_puntos=50&metodo=lttb')
+        self.assertEqual(len(lttb['series'][0]['valores']), 50)
+        self.assertIn(500.0, lttb['series'][0]['valores'])
+
+    def test_bordes_de_resumen_desde_lecturas(self):
+        # Fuera de [desde, hasta) las lecturas valen 100: ni el primer ni el último día partido
+        # pueden traerlas desde ConsumoDia.
+        desde, hasta = self.desde + timedelta(hours=12), self.desde + timedelta(days=9, hours=12)
+        Consumo.objects.filter(fecha__lt=desde).update(consumo=100.0)
+        Consumo.objects.filter(fecha__gte=hasta).update(consumo=100.0)
+        resumenes.refrescar([self.medidor.pk], self.desde, self.hasta)
+
+        resultado = series.series([self.medidor.pk], desde, hasta, max_puntos=5)
+        self.assertEqual(resultado['fuente'], 'dia')
+        # Buckets de dos días: medio 1 de marzo con el 2, ..., el 9 con medio 10 de marzo.
+        serie = resultado['series'][0]
+        self.assertEqual(serie['fechas'], [int(f.timestamp() * 1000) for f in (
+            desde, self.desde + timedelta(days=2), self.desde + timedelta(days=4), self.desde + timedelta(days=6), self.desde + timedelta(days=8),
+        )])
+        self.assertEqual(serie['valores'], [
+            (48 * 1 + 96 * 2) / 144, (96 * 3 + 95 * 4 + 500) / 192, 5.5, 7.5, (96 * 9 + 48 * 10) / 144,
+        ])
+
+    def test_errores(self):
+        self.assertEqual(self._series('metodo=otro', 400)['error'], "'metodo' debe ser uno de: promedio, lttb, ninguno.")
+        self.assertIn('error', self.client.get('/api/series/?desde=2024-03-01&hasta=2024-03-11').json())
+        self.assertEqual(self.client.get(f'/api/series/{self.medidor.pk + 1}/?desde=2024-03-01&hasta=2024-03-11').status_code, 404)
+
+
+class CacheConsultasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.m1, cls.m2 = Medidor.objects.create(nombre='M1'), Medidor.objects.create(nombre='M2')
+        cls.desde = timezone.make_aware(datetime(2024, 3, 1))
+        Consumo.objects.bulk_create([
+            Consumo(medidor=medidor, fecha=cls.desde + timedelta(hours=h), consumo=1.0)
+            for h in range(4) for medidor in (cls.m1, cls.m2)
+        ])
+
+    def setUp(self):
+        cache_consultas.backend().clear()
+
+    def _consultar(self, medidor, calculos):
+        def calcular():
+            calculos.append(medidor.pk)
+            return {'medidor': medidor.pk}
+        return cache_consultas.cacheado('prueba', [medidor.pk], self.desde, self.desde + timedelta(days=1), 'hora', calcular)
+
+    def test_importacion_invalida_solo_medidores_modificados(self):
+        calculos = []
+        for medidor in (self.m1, self.m2, self.m1, self.m2):
+            self._consultar(medidor, calculos)
+        self.assertEqual(calculos, [self.m1.pk, self.m2.pk])
+
+        # M1 trae una lectura nueva; la de M2 ya existe.
+        importacion = ImportacionConsumo.objects.create(archivo='m.csv', nombre_original='m.csv')
+        InterfaceConsumo.objects.bulk_create([
+            InterfaceConsumo(importacion=importacion, fecha=self.desde + timedelta(hours=4), consumo=2.0, medidor='M1'),
+            InterfaceConsumo(importacion=importacion, fecha=self.desde, consumo=2.0, medidor='M2'),
+        ])
+        fusion = fusionar_staging(importacion.pk)
+        self.assertEqual(fusion['medidores_modificados'], [self.m1.pk])
+        cache_consultas.invalidar(fusion['medidores_modificados'])
+
+        self._consultar(self.m1, calculos)
+        self._consultar(self.m2, calculos)
+        self.assertEqual(calculos, [self.m1.pk, self.m2.pk, self.m1.pk])
+        estadisticas = cache_consultas.estadisticas()
+        self.assertEqual((estadisticas['aciertos'], estadisticas['fallos'], estadisticas['invalidaciones']), (3, 3, 1))
+
+        # Una entrada que el backend descartó antes de tiempo cuenta como desalojo.
+        cache_consultas.backend().delete(
+            cache_consultas.clave('prueba', [self.m2.pk], self.desde, self.desde + timedelta(days=1), 'hora')
+        )
+        self._consultar(self.m2, calculos)
+        self.assertEqual(cache_consultas.estadisticas()['desalojos'], 1)
+
+    def test_refresco_fallido_invalida_igual(self):
+        # Si un refresco posterior a la fusión falla, las lecturas nuevas ya están en Consumo: la
+        # caché de M1 no puede seguir sirviendo la serie vieja y los conteos de la fusión quedan.
+        calculos = []
+        self._consultar(self.m1, calculos)
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media):
+            importacion = ImportacionConsumo.objects.create(
+                nombre_original='m.csv', archivo=ContentFile(f"fecha,consumo,medidor\n{self.desde + timedelta(hours=5):%Y-%m-%d %H:%M},2,M1\n".encode(), name='m.csv'),
+            )
+            with mock.patch('core.tareas.refrescar_importacion', side_effect=RuntimeError('sin espacio')):
+                procesar_importacion(importacion.pk)
+        importacion.refresh_from_db()
+        self.assertEqual((importacion.estado, importacion.filas_fusionadas), (ImportacionConsumo.ERROR, 1))
+        self._consultar(self.m1, calculos)
+        self.assertEqual(calculos, [self.m1.pk, self.m1.pk])
+
+
+class CalidadSeriesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.medidor = Medidor.objects.create(nombre='M1')
+        cls.contador = Medidor.objects.create(nombre='C1')
+        cls.inicio = timezone.make_aware(datetime(2024, 3, 1))
+        cada15 = [cls.inicio + timedelta(minutes=15 * i) for i in range(40)]
+        # Falta la lectura 10 y las 20 a 22; la 30 llega desfasada y hay una segunda lectura en la ranura 32.
+        fechas = [f for i, f in enumerate(cada15) if i not in (10, 20, 21, 22)]
+        fechas[fechas.index(cada15[30])] += timedelta(minutes=3)
+        fechas.append(cada15[32] + timedelta(minutes=2))
+        Consumo.objects.bulk_create([Consumo(medidor=cls.medidor, fecha=f, consumo=1.0) for f in fechas])
+        # Contador horario que se reinicia en la lectura 150.
+        Consumo.objects.bulk_create([
+            Consumo(medidor=cls.contador, fecha=cls.inicio + timedelta(hours=i), consumo=float(i if i < 150 else i - 150))
+            for i in range(200)
+        ])
+
+    def _incidencias(self, medidor, tipo):
+        return list(IncidenciaSerie.objects.filter(medidor=medidor, tipo=tipo).order_by('fecha').values_list('fecha', flat=True))
+
+    def test_revision_completa_e_incremental(self):
+        calidad.revisar()
+        perfil = PerfilMedidor.objects.get(medidor=self.medidor)
+        self.assertEqual((perfil.intervalo, perfil.fase, perfil.acumulativo), (900, 0, False))
+        self.assertTrue(PerfilMedidor.objects.get(medidor=self.contador).acumulativo)
+
+        q = lambda i: self.inicio + timedelta(minutes=15 * i)
+        huecos = IncidenciaSerie.objects.filter(medidor=self.medidor, tipo=IncidenciaSerie.HUECO).order_by('fecha')
+        self.assertEqual([(h.fecha_anterior, h.fecha, h.faltantes) for h in huecos], [(q(9), q(11), 1), (q(19), q(23), 3)])
+        self.assertEqual(self._incidencias(self.medidor, IncidenciaSerie.FUERA_DE_GRILLA),
+                         [q(30) + timedelta(minutes=3), q(32) + timedelta(minutes=2)])
+        self.assertEqual(self._incidencias(self.medidor, IncidenciaSerie.DUPLICADO), [q(32) + timedelta(minutes=2)])
+        self.assertEqual(self._incidencias(self.contador, IncidenciaSerie.DELTA_NEGATIVO), [self.inicio + timedelta(hours=150)])
+
+        # Llega la lectura que faltaba: la revisión del rango solo toca su vecindario.
+        Consumo.objects.create(medidor=self.medidor, fecha=q(10), consumo=1.0)
+        calidad.revisar([self.medidor.pk], q(10), q(10))
+        self.assertEqual([(h.fecha_anterior, h.fecha) for h in huecos.all()], [(q(19), q(23))])
+        self.assertEqual(IncidenciaSerie.objects.filter(medidor=self.medidor).count(), 4)
+
+    def test_ventana_por_medidor(self):
+        # M3 tiene un hueco de 150 h después de la lectura nueva; el contador no debe releerse ni reescribirse en él.
+        calidad.revisar()
+        m3 = Medidor.objects.create(nombre='M3')
+        Consumo.objects.bulk_create([Consumo(medidor=m3, fecha=self.inicio + timedelta(hours=h), consumo=1.0) for h in (0, 150)])
+        nueva = self.inicio + timedelta(hours=1, minutes=30)
+        Consumo.objects.bulk_create([Consumo(medidor=m, fecha=nueva, consumo=1.0) for m in (self.contador, m3)])
+        fuera = IncidenciaSerie.objects.create(medidor=self.contador, tipo=IncidenciaSerie.HUECO, fecha=self.inicio + timedelta(hours=100))
+
+        with mock.patch.object(calidad, '_detectar', wraps=calidad._detectar) as detectar:
+            calidad.revisar([self.contador.pk, m3.pk], nueva, nueva)
+        leidas = detectar.call_args.args[0].groupby('medidor').size().to_dict()
+        self.assertEqual(leidas, {self.contador.pk: 3, m3.pk: 3})  # Anterior, nueva y siguiente de cada uno
+        self.assertTrue(IncidenciaSerie.objects.filter(pk=fuera.pk).exists())
+        self.assertEqual(self._incidencias(self.contador, IncidenciaSerie.FUERA_DE_GRILLA), [nueva])
+
+
+class AnomaliasConsumoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.medidor = Medidor.objects.create(nombre='M1')
+        cls.inicio = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        # Cinco semanas cada 15 minutos con ciclo diario y algo de ruido; un pico el día 30 a las
+        # 10:00, una caída a cero el día 31 de 6:00 a 8:00 y una meseta el día 32 de 0:00 a 8:00.
+        valores = {cls._q(30, 10): 60.0}
+        valores.update({cls._q(31, 6) + timedelta(minutes=15 * i): 0.0 for i in range(8)})
+        valores.update({cls._q(32, 0) + timedelta(minutes=15 * i): 12.0 for i in range(33)})
+        Consumo.objects.bulk_create([
+            Consumo(medidor=cls.medidor, fecha=fecha, consumo=valores.get(fecha, cls._normal(i, fecha)))
+            for i, fecha in enumerate(cls.inicio + timedelta(minutes=15 * i) for i in range(35 * 96))
+        ])
+        resumenes.refrescar([cls.medidor.pk], cls.inicio, cls._q(35, 0))
+
+    @classmethod
+    def _q(cls, dia, hora):
+        return cls.inicio + timedelta(days=dia, hours=hora)
+
+    @staticmethod
+    def _normal(i, fecha):
+        return 10 + 5 * math.sin(2 * math.pi * (fecha.hour + fecha.minute / 60) / 24) + ((i * 7919) % 11 - 5) / 10
+
+    def _alertas(self):
+        return list(AlertaConsumo.objects.order_by('desde').values_list('tipo', 'desde', 'hasta', 'lecturas', 'severidad'))
+
+    def test_deteccion_completa_e_incremental(self):
+        anomalias.detectar()
+        self.assertEqual(self._alertas(), [
+            (AlertaConsumo.PICO, self._q(30, 10), self._q(30, 10), 1, AlertaConsumo.ALTA),
+            (AlertaConsumo.CAIDA, self._q(31, 6), self._q(31, 7.75), 8, AlertaConsumo.ALTA),
+            (AlertaConsumo.MESETA, self._q(32, 0), self._q(32, 8), 33, AlertaConsumo.BAJA),
+        ])
+        base = LineaBaseMedidor.objects.get(medidor=self.medidor)
+        self.assertEqual(len(base.mediana), anomalias.HORAS_SEMANA)
+
+        # Llega un día más con un pico: solo se puntúa ese día, con la línea base guardada.
+        Consumo.objects.bulk_create([
+            Consumo(medidor=self.medidor, fecha=fecha, consumo=40.0 if fecha == self._q(35, 12) else self._normal(i, fecha))
+            for i, fecha in enumerate(self._q(35, 0) + timedelta(minutes=15 * i) for i in range(96))
+        ])
+        anteriores = set(AlertaConsumo.objects.values_list('pk', flat=True))
+        self.assertEqual(anomalias.detectar([self.medidor.pk], self._q(35, 0), self._q(35, 23.75)), {AlertaConsumo.PICO: 1})
+        self.assertTrue(anteriores < set(AlertaConsumo.objects.values_list('pk', flat=True)))
+        self.assertEqual(LineaBaseMedidor.objects.get(medidor=self.medidor).hasta, base.hasta)
+
+    def test_medidor_sin_linea_base(self):
+        # Un medidor recién creado no tiene semanas de ConsumoHora: su línea base queda vacía y se
+        # lo puntúa solo contra la ventana, en el mismo lote que uno con historia.
+        nuevo = Medidor.objects.create(nombre='M2')
+        Consumo.objects.bulk_create([
+            Consumo(medidor=nuevo, fecha=fecha, consumo=40.0 if fecha == self._q(35, 12) else self._normal(i, fecha))
+            for i, fecha in enumerate(self._q(35, 0) + timedelta(minutes=15 * i) for i in range(96))
+        ])
+        resumenes.refrescar([nuevo.pk], self._q(35, 0), self._q(36, 0))
+        self.assertEqual(anomalias.detectar([nuevo.pk], self._q(35, 0), self._q(35, 23.75)), {AlertaConsumo.PICO: 1})
+        anomalias.detectar([self.medidor.pk, nuevo.pk], self._q(35, 0), self._q(35, 23.75), recalcular_base=True)
+        base = LineaBaseMedidor.objects.get(medidor=nuevo)
+        self.assertEqual(base.mediana, [None] * anomalias.HORAS_SEMANA)
+        self.assertTrue(any(v is not None for v in LineaBaseMedidor.objects.get(medidor=self.medidor).mediana))
+
+
+class DemandaMesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        tipo = TipoMedidor.objects.create(nombre='Bombas')
+        cls.m1 = Medidor.objects.create(nombre='M1', tipo_medidor=tipo)
+        cls.m2 = Medidor.objects.create(nombre='M2', tipo_medidor=tipo)
+        PerfilMedidor.objects.create(medidor=cls.m1, intervalo=900, muestras=100)
+        cls.inicio = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        # M1 cada 15 minutos: 1 por lectura, 2 de 18:00 a 19:00 y 5 el día 10 a las 19:00.
+        # M2 por hora: 4, y 10 el día 10 a las 3:00.
+        fechas = [cls.inicio + timedelta(minutes=15 * i) for i in range(31 * 96)]
+        Consumo.objects.bulk_create(
+            [Consumo(medidor=cls.m1, fecha=f, consumo=2.0 if f.hour == 18 else 1.0) for f in fechas if f != cls._h(9, 19)]
+            + [Consumo(medidor=cls.m1, fecha=cls._h(9, 19), consumo=5.0)]
+            + [Consumo(medidor=cls.m2, fecha=f, consumo=10.0 if f == cls._h(9, 3) else 4.0) for f in fechas if f.minute == 0]
+        )
+        resumenes.refrescar([cls.m1.pk, cls.m2.pk], cls.inicio, fechas[-1])
+
+    @classmethod
+    def _h(cls, dia, hora):
+        return cls.inicio + timedelta(days=dia, hours=hora)
+
+    def test_indicadores_por_medidor_y_tipo(self):
+        self.assertEqual(demanda.calcular(), {'medidores': 2, 'tipos': 1})
+        m1 = DemandaMedidor.objects.get(medidor=self.m1)
+        self.assertEqual((m1.mes, m1.intervalo, m1.dias), (self.inicio, 900, 31))
+        self.assertAlmostEqual(m1.energia, 31 * 96 + 31 * 4 + 4)
+        self.assertEqual((m1.demanda_maxima, m1.fecha_demanda_maxima), (20.0, self._h(9, 19)))
+        self.assertAlmostEqual(m1.factor_carga, m1.energia / (31 * 24) / 20)
+        self.assertEqual(m1.energia_bandas, {'punta': 31 * 20 + 31 * 4 + 4, 'valle': 31 * 28, 'llano': 31 * 48})
+        self.assertEqual(len(m1.perfil['p50']), 96)
+        self.assertEqual((m1.perfil['p50'][0], m1.perfil['p50'][72], m1.perfil['maximo'][76]), (4.0, 8.0, 20.0))
+
+        m2 = DemandaMedidor.objects.get(medidor=self.m2)
+        self.assertEqual((m2.intervalo, m2.demanda_maxima, m2.fecha_demanda_maxima), (3600, 10.0, self._h(9, 3)))
+
+        # Hora a hora M1 llega a 8 (18:00 y el día 10 a las 19:00) y M2 a 10; juntos, a 14.
+        tipo = DemandaTipoMedidor.objects.get()
+        self.assertEqual((tipo.medidores, tipo.demanda_maxima, tipo.fecha_demanda_maxima), (2, 14.0, self._h(9, 3)))
+        self.assertAlmostEqual(tipo.factor_coincidencia, 14 / 18)
+        self.assertAlmostEqual(tipo.energia, m1.energia + m2.energia)
+
+        # Recalcular un mes de un medidor reemplaza sus filas y las de su tipo.
+        Consumo.objects.filter(medidor=self.m2, fecha=self._h(9, 3)).update(consumo=4.0)
+        resumenes.refrescar([self.m2.pk], self._h(9, 3), self._h(9, 3))
+        self.assertEqual(demanda.calcular([self.m2.pk], self._h(9, 3), self._h(9, 3)), {'medidores': 1, 'tipos': 1})
+        self.assertEqual(DemandaMedidor.objects.get(medidor=self.m2).demanda_maxima, 4.0)
+        self.assertEqual(DemandaTipoMedidor.objects.get().demanda_maxima, 12.0)
+
+
+class RangosMedicionTests(TestCase):
+
+    def setUp(self):
+        cache_consultas.backend().clear()
+        self.temperatura = CaracteristicaMedicion.objects.create(nombre='Temperatura', unidad_medida='°C')
+        self.presion = CaracteristicaMedicion.objects.create(nombre='Presión', unidad_medida='bar')
+        crear = lambda c, a, b, color: RangoMedicion.objects.create(caracteristica=c, valor_min=a, valor_max=b, descripcion=color, color=color)
+        self.normal = crear(self.temperatura, 0, 50, '#00FF00')
+        self.alto = crear(self.temperatura, 50, 80, '#FFFF00')
+        # Se solapa con el alto y deja un hueco (90, 100) antes del crítico.
+        self.alerta = crear(self.temperatura, 70, 90, '#FF8800')
+        self.critico = crear(self.temperatura, 100, 150, '#FF0000')
+        self.baja = crear(self.presion, 0, 10, '#0000FF')
+
+    def test_indice_sql_e_invalidacion(self):
+        with self.assertLogs('core.rangos', 'WARNING') as logs:
+            indice = rangos.indice(self.temperatura.pk)
+            self.assertEqual(
+                [(p.tipo, p.desde, p.hasta) for p in indice.problemas], [('solapamiento', 70, 80), ('hueco', 90, 100)],
+            )
+            valores = [-1, 0, 25, 50, 75, 85, 95, 100, 150, 151, float('nan')]
+            esperados = [0, self.normal.pk, self.normal.pk, self.alto.pk, self.alerta.pk, self.alerta.pk, 0,
+                         self.critico.pk, self.critico.pk, 0, 0]
+            self.assertEqual(rangos.clasificar([self.temperatura.pk] * len(valores), valores).tolist(), esperados)
+            self.assertEqual([indice.rango_id(v) or 0 for v in valores], esperados)
+            self.assertEqual(rangos.clasificar([self.temperatura.pk, self.presion.pk], [5, 5]).tolist(), [self.normal.pk, self.baja.pk])
+
+            punto = PuntoMedicion.objects.create(descripcion='Caldera', caracteristica=self.temperatura)
+            ahora = timezone.now()
+            DocumentoMedicion.objects.bulk_create([
+                DocumentoMedicion(punto_medicion=punto, fecha_hora_lectura=ahora + timedelta(minutes=i), valor_leido=v)
+                for i, v in enumerate(valores[:-1])
+            ])
+            anotados = rangos.anotar_rango(DocumentoMedicion.objects.order_by('valor_leido')).values_list('rango_id', flat=True)
+            self.assertEqual([r or 0 for r in anotados], esperados[:-1])
+
+            # Guardar o borrar un rango invalida el índice de su característica (y de la anterior, si cambia).
+            self.alerta.valor_min = 80
+            self.alerta.save()
+            self.assertEqual(rangos.indice(self.temperatura.pk).rango_id(75), self.alto.pk)
+            self.critico.caracteristica = self.presion
+            self.critico.save()
+            self.assertIsNone(rangos.indice(self.temperatura.pk).rango_id(120))
+            self.assertEqual(rangos.indice(self.presion.pk).rango_id(120), self.critico.pk)
+            self.baja.delete()
+            self.assertIsNone(rangos.indice(self.presion.pk).rango_id(5))
+
+        self.assertIn('solapamiento entre 70.0 y 80.0', logs.output[0])
+
+
+class ConsumoContadorTests(TestCase):
+
+    def setUp(self):
+        caracteristica = CaracteristicaMedicion.objects.create(nombre='Energía', unidad_medida='kWh')
+        self.punto = PuntoMedicion.objects.create(
+            descripcion='Contador', caracteristica=caracteristica, es_contador=True, limite_contador=1000,
+        )
+        self.inicio = timezone.make_aware(datetime(2024, 3, 1))
+        # 900 -> 990 -> 20 es una vuelta (30 de consumo); 20 -> 5 es un reinicio del equipo.
+        self.documentos = [
+            DocumentoMedicion.objects.create(
+                punto_medicion=self.punto, fecha_hora_lectura=self.inicio + timedelta(days=i), valor_leido=0, lectura_contador=v,
+            )
+            for i, v in enumerate([900, 950, 990, 20, 5, 40])
+        ]
+
+    def _deltas(self):
+        return list(ConsumoContador.objects.order_by('fecha').values_list('delta', 'tipo'))
+
+    def test_vueltas_reinicios_e_incremental(self):
+        esperados = [(50, 'normal'), (40, 'normal'), (30, 'vuelta'), (5, 'reinicio'), (35, 'normal')]
+        self.assertEqual(self._deltas(), esperados)
+        self.assertEqual(contadores.consumo([self.punto.pk], self.inicio, self.inicio + timedelta(days=10)), {self.punto.pk: 160})
+
+        # Una lectura intercalada solo cambia su consumo y el de la siguiente.
+        DocumentoMedicion.objects.create(
+            punto_medicion=self.punto, fecha_hora_lectura=self.inicio + timedelta(days=1, hours=12), valor_leido=0, lectura_contador=970,
+        )
+        self.assertEqual(self._deltas()[1:3], [(20, 'normal'), (20, 'normal')])
+        self.documentos[3].delete()
+        self.assertEqual(self._deltas()[3], (15, 'vuelta'))
+
+        # Sin límite, la bajada de 990 a 5 es un reinicio.
+        self.punto.limite_contador = None
+        self.punto.save()
+        self.assertEqual(self._deltas()[3:], [(5, 'reinicio'), (35, 'normal')])
+        self.assertEqual(contadores.recalcular(), {'normal': 4, 'reinicio': 1})
+
+    def test_ventana_por_punto(self):
+        # A tiene un hueco de un mes después de la lectura nueva; B no debe recalcularse sobre ese hueco.
+        caracteristica = CaracteristicaMedicion.objects.get()
+        a, b = (PuntoMedicion.objects.create(descripcion=n, caracteristica=caracteristica, es_contador=True) for n in 'AB')
+        dias = {a: [0, 1, 30], b: range(31)}
+        for punto, lista in dias.items():
+            for dia in lista:
+                DocumentoMedicion.objects.create(
+                    punto_medicion=punto, fecha_hora_lectura=self.inicio + timedelta(days=dia), valor_leido=0, lectura_contador=10 * dia,
+                )
+        nueva = self.inicio + timedelta(days=1, hours=12)
+        DocumentoMedicion.objects.bulk_create([
+            DocumentoMedicion(punto_medicion=p, fecha_hora_lectura=nueva, valor_leido=0, lectura_contador=15) for p in (a, b)
+        ])
+        fuera = ConsumoContador.objects.filter(punto_medicion=b, fecha=self.inicio + timedelta(days=10))
+        fuera.update(delta=999)
+
+        self.assertEqual(contadores.recalcular([a.pk, b.pk], nueva, nueva), {'normal': 4})  # La nueva y la siguiente de cada punto
+        self.assertEqual(fuera.get().delta, 999)
+        fuera.update(delta=10)
+        incremental = list(ConsumoContador.objects.order_by('punto_medicion', 'fecha').values_list('punto_medicion', 'fecha', 'delta', 'tipo'))
+        contadores.recalcular([a.pk, b.pk])
+        self.assertEqual(incremental, list(ConsumoContador.objects.order_by('punto_medicion', 'fecha').values_list('punto_medicion', 'fecha', 'delta', 'tipo')))
+
+
+@override_settings(INGESTA_LECTURAS_TOKENS=['clave-colector'])
+class IngestaLecturasTests(TestCase):
+
+    def setUp(self):
+        cache_consultas.backend().clear()
+        energia = CaracteristicaMedicion.objects.create(nombre='Energía', unidad_medida='kWh')
+        self.punto = PuntoMedicion.objects.create(descripcion='Tablero', caracteristica=energia)
+        self.contador = PuntoMedicion.objects.create(descripcion='Contador', caracteristica=energia, es_contador=True)
+
+    def _enviar(self, cuerpo, content_type='application/x-ndjson', **parametros):
+        consulta = '?sobrescribir=1' if parametros.get('sobrescribir') else ''
+        return self.client.post(
+            f'/api/lecturas/{consulta}', cuerpo, content_type=content_type, HTTP_AUTHORIZATION='Token clave-colector',
+        )
+
+    def test_ndjson_idempotente_con_rechazos(self):
+        lineas = [
+            {'punto': self.punto.pk, 'fecha': '2024-03-01T00:00:00Z', 'valor': 1.5, 'unidad': 'KWH'},
+            {'punto': self.punto.pk, 'fecha': '2024-03-01T00:15:00-03:00', 'valor': '2', 'observaciones': 'ok'},
+            {'punto': self.contador.pk, 'fecha': '2024-03-01 00:00', 'valor': 0, 'lectura_contador': 100},
+            {'punto': self.contador.pk, 'fecha': '2024-03-01 01:00', 'valor': 0, 'lectura_contador': 130},
+            {'punto': 999, 'fecha': '2024-03-01T00:00:00Z', 'valor': 1},
+            {'punto': self.punto.pk, 'fecha': 'ayer', 'valor': 1},
+            {'punto': self.punto.pk, 'fecha': '2024-03-01T02:00:00Z', 'valor': 1, 'unidad': 'm3'},
+            {'punto': self.punto.pk, 'fecha': '2024-03-01T00:00:00+00:00', 'valor': 9},
+        ]
+        cuerpo = '\n'.join(json.dumps(l) for l in lineas) + '\n{no es json\n'
+        datos = self._enviar(cuerpo).json()
+        self.assertEqual(
+            {k: datos[k] for k in ('recibidas', 'insertadas', 'actualizadas', 'duplicadas', 'rechazadas')},
+            {'recibidas': 9, 'insertadas': 4, 'actualizadas': 0, 'duplicadas': 0, 'rechazadas': 5},
+        )
+        self.assertEqual([(r['fila'], r['motivo']) for r in datos['rechazos']], [
+            (5, 'punto_desconocido'), (6, 'fecha_invalida'), (7, 'unidad_incorrecta'), (8, 'duplicado'), (9, 'json_invalido'),
+        ])
+        documento = DocumentoMedicion.objects.get(punto_medicion=self.punto, valor_leido=2)
+        self.assertEqual(documento.fecha_hora_lectura, datetime(2024, 3, 1, 3, 15, tzinfo=dt_timezone.utc))
+        self.assertEqual(list(ConsumoContador.objects.values_list('delta', flat=True)), [30])
+
+        # Reenviar el mismo lote no duplica; con sobrescribir se actualiza.
+        self.assertEqual(self._enviar(cuerpo).json()['duplicadas'], 4)
+        self.assertEqual(self._enviar(cuerpo, sobrescribir=True).json()['actualizadas'], 4)
+        self.assertEqual(DocumentoMedicion.objects.count(), 4)
+
+    def test_csv_y_autenticacion(self):
+        cuerpo = f"punto,fecha,valor,lectura_contador\n{self.punto.pk},2024-03-01T00:00Z,1.5,\n{self.punto.pk},2024-03-01T00:15Z,x,\n"
+        datos = self._enviar(cuerpo, 'text/csv; charset=utf-8').json()
+        self.assertEqual((datos['insertadas'], datos['rechazos'][0]['fila'], datos['rechazos'][0]['motivo']), (1, 3, 'valor_invalido'))
+        self.assertEqual(self._enviar(cuerpo, 'application/xml').status_code, 415)
+        # Sin token ni sesión de staff no se acepta.
+        respuesta = self.client.post('/api/lecturas/', cuerpo, content_type='text/csv')
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertEqual(DocumentoMedicion.objects.count(), 1)
+
+    @skipUnless(connection.vendor == 'postgresql', "Quitar la restricción dentro de la transacción del test requiere PostgreSQL.")
+    def test_migracion_no_borra_documentos_repetidos(self):
+        migracion = import_module('core.migrations.0012_documento_punto_fecha_unico')
+        restriccion = next(c for c in DocumentoMedicion._meta.constraints if c.name == 'documento_punto_fecha_unico')
+        with connection.schema_editor() as editor:
+            editor.remove_constraint(DocumentoMedicion, restriccion)
+        fecha = timezone.make_aware(datetime(2024, 3, 1))
+        documentos = [DocumentoMedicion.objects.create(punto_medicion=self.punto, fecha_hora_lectura=fecha, valor_leido=v) for v in (1, 2)]
+        with self.assertRaisesRegex(RuntimeError, f"punto {self.punto.pk}, .*: documentos {documentos[0].pk}, {documentos[1].pk}"):
+            migracion.comprobar_duplicados(apps, None)
+        self.assertEqual(DocumentoMedicion.objects.count(), 2)
+
+
+@override_settings(METRICAS_TOKENS=['clave-prometheus'], VERSION_DESPLIEGUE='v2')
+class InstrumentacionImportacionTests(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.medidor = Medidor.objects.create(nombre='M1')
+
+    def _procesar(self, contenido):
+        importacion = ImportacionConsumo.objects.create(
+            nombre_original='consumos.csv', archivo=ContentFile(contenido.encode(), name='consumos.csv'),
+        )
+        procesar_importacion(importacion.pk)
+        return MedicionImportacion.objects.get(importacion=importacion)
+
+    def test_etapas_de_procesar_importacion(self):
+        medicion = self._procesar(
+            "fecha,consumo,medidor\n2024-01-01 00:00,1,M1\n2024-01-01 01:00,2,M1\n2024-01-01 02:00,x,M1\n"
+        )
+        self.assertEqual((medicion.exito, medicion.filas, medicion.version), (True, 3, 'v2'))
+        etapas = {e.etapa: e for e in medicion.etapas.all()}
+        self.assertLessEqual(
+            {'lectura', 'validacion', 'fechas', 'staging', 'busqueda_duplicados', 'fusion', 'resumenes', 'limpieza'}, set(etapas),
+        )
+        self.assertEqual((etapas['fechas'].filas, etapas['staging'].filas, etapas['fusion'].filas), (3, 2, 2))
+        self.assertGreaterEqual(etapas['fusion'].consultas, 1)
+        # Tiempos propios: las etapas anidadas (fechas en validacion) no se cuentan dos veces.
+        self.assertAlmostEqual(sum(e.segundos for e in etapas.values()), medicion.segundos, delta=1e-6)
+        self.assertEqual(sum(e.consultas for e in etapas.values()), medicion.consultas)
+
+    def test_importacion_con_error(self):
+        medicion = self._procesar("fecha,medidor\n2024-01-01 00:00,M1\n")
+        self.assertFalse(medicion.exito)
+        self.assertEqual(ImportacionConsumo.objects.get().estado, ImportacionConsumo.ERROR)
+
+    @override_settings(INSTRUMENTACION_MEMORIA='tracemalloc')
+    def test_import_del_admin(self):
+        dataset = Dataset(headers=['fecha', 'consumo', 'medidor'])
+        dataset.append(['01/01/2024 00:00', '1.5', str(self.medidor.pk)])
+        ConsumoResource().import_data(dataset, dry_run=True)
+        self.assertFalse(MedicionImportacion.objects.exists())
+        ConsumoResource().import_data(dataset, dry_run=False, file_name='consumos.csv')
+        medicion = MedicionImportacion.objects.get()
+        self.assertEqual((medicion.origen, medicion.nombre, medicion.filas), (MedicionImportacion.ADMIN, 'consumos.csv', 1))
+        self.assertLessEqual({'validacion', 'busqueda_duplicados', 'insercion', 'resumenes'}, set(medicion.etapas.values_list('etapa', flat=True)))
+        self.assertGreater(medicion.memoria_pico, 0)
+
+    def test_metricas_prometheus(self):
+        self._procesar("fecha,consumo,medidor\n2024-01-01 00:00,1,M1\n")
+        respuesta = self.client.get('/metricas/', HTTP_AUTHORIZATION='Token clave-prometheus')
+        self.assertEqual(respuesta.status_code, 200)
+        texto = respuesta.content.decode()
+        self.assertIn('energiaccg_importaciones_total{origen="archivo",exito="true"} 1\n', texto)
+        self.assertIn('energiaccg_importacion_etapa_filas_total{origen="archivo",etapa="lectura"} 1\n', texto)
+        self.assertIn('energiaccg_importacion_ultima_filas_por_segundo{origen="archivo",version="v2"}', texto)
+        self.assertEqual(self.client.get('/metricas/', HTTP_AUTHORIZATION='Token otra').status_code, 302)
+
+
+@override_settings(INGESTA_LECTURAS_TOKENS=['clave-colector'])
+class VistasAsyncTests(TransactionTestCase):
+    # TransactionTestCase: el pool de las vistas async usa sus propias conexiones y no vería los
+    # datos de la transacción de un TestCase.
+
+    def setUp(self):
+        cache_consultas.backend().clear()
+        self.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        self.medidor = Medidor.objects.create(nombre='M1')
+        desde = timezone.make_aware(datetime(2024, 3, 1))
+        Consumo.objects.bulk_create([
+            Consumo(medidor=self.medidor, fecha=desde + timedelta(minutes=15 * i), consumo=float(i)) for i in range(96)
+        ])
+        self.punto = PuntoMedicion.objects.create(
+            descripcion='Tablero', caracteristica=CaracteristicaMedicion.objects.create(nombre='Energía', unidad_medida='kWh'),
+        )
+        self.importacion = ImportacionConsumo.objects.create(archivo='importaciones/x.csv', nombre_original='x.csv', filas_leidas=10)
+        self.consulta = f'{self.medidor.pk}/?desde=2024-03-01&hasta=2024-03-02&max_puntos=24'
+        self.client.force_login(self.usuario)
+        self.esperado = self.client.get(f'/api/series/{self.consulta}').json()
+        cache_consultas.backend().clear()
+
+    async def test_series_estado_e_ingesta(self):
+        await self.async_client.aforce_login(self.usuario)
+        respuesta = await self.async_client.get(f'/api/async/series/{self.consulta}')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json(), self.esperado)
+        self.assertEqual((await self.async_client.get('/api/async/series/?desde=2024-03-01&hasta=2024-03-02')).status_code, 400)
+        self.assertEqual((await self.async_client.get(f'/api/async/series/{self.medidor.pk + 1}/?desde=2024-03-01&hasta=2024-03-02')).status_code, 404)
+
+        estado = (await self.async_client.get(f'/api/async/importaciones/{self.importacion.pk}/estado/')).json()
+        self.assertEqual((estado['estado'], estado['filas_leidas'], estado['terminado']), (ImportacionConsumo.PENDIENTE, 10, False))
+        self.assertEqual((await self.async_client.get(f'/api/async/importaciones/{self.importacion.pk + 1}/estado/')).status_code, 404)
+
+        cuerpo = f'{{"punto": {self.punto.pk}, "fecha": "2024-03-01T00:00:00Z", "valor": 1}}\n'
+        respuesta = await self.async_client.post(
+            '/api/async/lecturas/', cuerpo, content_type='application/x-ndjson', headers={'Authorization': 'Token clave-colector'},
+        )
+        self.assertEqual(respuesta.json()['insertadas'], 1)
+        self.assertEqual(await DocumentoMedicion.objects.acount(), 1)
+        # Sin token ni sesión, al login del admin.
+        self.async_client.cookies.clear()
+        self.assertEqual((await self.async_client.post('/api/async/lecturas/', cuerpo, content_type='application/x-ndjson')).status_code, 302)
+
+
+@skipUnless(connection.vendor == 'postgresql', "Los planes de consulta que se revisan son los de PostgreSQL.")
+class IndicesConsultaTests(TestCase):
+    # Regresión de planes: las consultas del admin y de la importación tienen que seguir usando
+    # los índices de la migración 0013 (y los únicos de Consumo y DocumentoMedicion).
+
+    @classmethod
+    def setUpTestData(cls):
+        medidores = Medidor.objects.bulk_create([Medidor(nombre=f'M{i}') for i in range(30)])
+        energia = CaracteristicaMedicion.objects.create(nombre='Energía', unidad_medida='kWh')
+        puntos = PuntoMedicion.objects.bulk_create([PuntoMedicion(descripcion=f'P{i}', caracteristica=energia) for i in range(20)])
+        cls.medidor, cls.punto = medidores[0], puntos[0]
+        cls.desde = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        with connection.cursor() as cursor:
+            # Un mes cada 15 minutos por medidor y 2000 lecturas por punto.
+            cursor.execute(
+                "INSERT INTO core_consumo (fecha, consumo, medidor_id) SELECT f, 1, m "
+                "FROM unnest(%s::bigint[]) m, generate_series(%s::timestamptz, %s::timestamptz - interval '15 minutes', "
+                "interval '15 minutes') f",
+                [[m.pk for m in medidores], cls.desde, cls.desde + timedelta(days=31)],
+            )
+            cursor.execute(
+                "INSERT INTO core_documentomedicion (punto_medicion_id, fecha_hora_lectura, valor_leido) "
+                "SELECT p, %s::timestamptz + i * interval '1 hour', i FROM unnest(%s::bigint[]) p, generate_series(0, 1999) i",
+                [cls.desde, [p.pk for p in puntos]],
+            )
+            cursor.execute("ANALYZE core_consumo; ANALYZE core_documentomedicion")
+
+    def _plan(self, queryset):
+        """(índices, tipos de nodo) del plan de `queryset`."""
+        indices, nodos = set(), set()
+        pendientes = [json.loads(queryset.explain(format='json'))[0]['Plan']]
+        while pendientes:
+            nodo = pendientes.pop()
+            nodos.add(nodo['Node Type'])
+            if 'Index Name' in nodo:
+                indices.add(nodo['Index Name'])
+            pendientes.extend(nodo.get('Plans', []))
+        return indices, nodos
+
+    def assertUsaIndice(self, queryset, sufijo):
+        indices, nodos = self._plan(queryset)
+        self.assertNotIn('Seq Scan', nodos)
+        self.assertTrue(indices and all(i.endswith(sufijo) for i in indices), f"{indices} no terminan en {sufijo}")
+
+    def test_consumo(self):
+        dia = self.desde + timedelta(days=10)
+        # Admin filtrado por medidor, series y resúmenes de los medidores de una importación.
+        self.assertUsaIndice(Consumo.objects.filter(medidor=self.medidor).order_by('-fecha', '-id')[:100], 'medidor_fecha')
+        self.assertUsaIndice(particiones.consumos_en_rango(dia, dia + timedelta(days=7), [self.medidor.pk]), 'medidor_fecha')
+        # Un día de todos los medidores (filtro por mes del admin, exportación): el único (fecha, medidor).
+        self.assertUsaIndice(particiones.consumos_en_rango(dia, dia + timedelta(days=1)), 'fecha_medidor_id_key')
+
+    def test_documento_medicion(self):
+        dia = self.desde + timedelta(days=30)
+        # Primera página del admin (ordering del modelo más el pk que agrega el changelist) y date_hierarchy.
+        self.assertUsaIndice(DocumentoMedicion.objects.order_by('-fecha_hora_lectura', '-pk')[:100], 'documento_fecha')
+        self.assertUsaIndice(
+            DocumentoMedicion.objects.filter(fecha_hora_lectura__gte=dia, fecha_hora_lectura__lt=dia + timedelta(days=1))
+            .order_by('-fecha_hora_lectura', '-pk')[:100], 'documento_fecha',
+        )
+        # Lectura anterior de un punto, como la busca core.contadores al recalcular tras la ingesta.
+        self.assertUsaIndice(
+            DocumentoMedicion.objects.filter(punto_medicion=self.punto, fecha_hora_lectura__lt=dia)
+            .order_by('-fecha_hora_lectura')[:1], 'documento_punto_fecha_unico',
+        )
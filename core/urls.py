@@ -5,4 +5,13 @@ from . import views
 urlpatterns = [
     path('import-consumo/', views.import_excel, name='import_consumo'),
     path('admin-menu/', views.admin_menu, name='admin_menu'),  # New entry
+    path('api/series/', views.api_series, name='api_series'),
+    path('api/series/<int:medidor_id>/', views.api_series, name='api_series_medidor'),
+    path('api/lecturas/', views.api_lecturas, name='api_lecturas'),
+    path('api/async/series/', views.api_series_async, name='api_series_async'),
+    path('api/async/series/<int:medidor_id>/', views.api_series_async, name='api_series_medidor_async'),
+    path('api/async/lecturas/', views.api_lecturas_async, name='api_lecturas_async'),
+    path('api/async/importaciones/<int:pk>/estado/', views.importacion_estado_async, name='importacion_estado_async'),
+    path('api/cache/', views.api_cache_estadisticas, name='api_cache_estadisticas'),
+    path('metricas/', views.metricas, name='metricas'),
 ]
\ No newline at end of file
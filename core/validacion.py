@@ -0,0 +1,132 @@
+"""
+Validación por columnas de los bloques de un archivo de consumos.
+
+Cada bloque se valida con operaciones vectorizadas (sin recorrer filas) y el
+resultado es el bloque limpio más una tabla compacta de rechazos con columnas
+fila / motivo / valor, que se acumula en un CSV descargable desde el admin.
+
+Un consumo vacío se rechaza (consumo_invalido), igual que en la importación del admin
+(ConsumoResource). La carga anterior lo guardaba como NaN, que en PostgreSQL queda NaN y
+arruina las sumas de los resúmenes, y en SQLite queda NULL.
+"""
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .fechas import ParserFechas
+from .instrumentacion import etapa
+from .models import InterfaceConsumo
+
+# Motivos de rechazo, en el orden en que se evalúan: una fila se rechaza solo por el primero.
+MOTIVOS = {
+    'fecha_invalida': "Fecha no pudo ser procesada a datetime",
+    'consumo_invalido': "Valor de 'consumo' no es un número válido",
+    'consumo_negativo': "Valor de 'consumo' negativo",
+    'consumo_fuera_de_rango': "Valor de 'consumo' fuera de rango",
+    'medidor_vacio': "Nombre de medidor (columna 'medidor') vacío o ausente",
+    'medidor_muy_largo': "Nombre de medidor demasiado largo",
+    'duplicado': "Fila duplicada (fecha, medidor) dentro del archivo",
+}
+COLUMNAS_RECHAZO = ['fila', 'motivo', 'valor']
+
+MEDIDOR_MAX_LENGTH = InterfaceConsumo._meta.get_field('medidor').max_length
+
+
+def consumo_maximo():
+    return getattr(settings, 'IMPORTACION_CONSUMO_MAXIMO', 1e9)
+
+
+def convertir_consumo(serie):
+    """
+    Convierte la columna 'consumo' a float admitiendo coma decimal ("1,5", "1.234,5").
+
+    El caso común (números o texto con punto decimal) se resuelve con un solo to_numeric;
+    solo los valores que fallan pasan por la normalización de separadores. Las celdas vacías
+    quedan NaN y validar_bloque las rechaza como consumo_invalido.
+    """
+    numeros = pd.to_numeric(serie, errors='coerce').astype('float64')
+    pendientes = numeros.isna() & serie.notna()
+    if not pendientes.any():
+        return numeros
+
+    texto = serie[pendientes].astype(str).str.strip()
+    ultima_coma = texto.str.rfind(',')
+    coma_decimal = ultima_coma > texto.str.rfind('.')
+    # Si la coma va después del último punto es decimal y los puntos son de miles; si no, la coma es de miles.
+    normalizado = texto.where(
+        ~coma_decimal,
+        texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False),
+    )
+    normalizado = normalizado.where(coma_decimal | (ultima_coma < 0), normalizado.str.replace(',', '', regex=False))
+    numeros[pendientes] = pd.to_numeric(normalizado, errors='coerce')
+    return numeros
+
+
+def validar_bloque(df, offset, parser_fechas=None):
+    """
+    Valida y convierte un bloque con operaciones por columna.
+
+    Devuelve (DataFrame válido con columnas fecha/consumo/medidor, DataFrame de rechazos).
+    `offset` es la cantidad de filas de datos anteriores al bloque, para numerar filas como en el archivo.
+    `parser_fechas` debería ser el mismo ParserFechas para todos los bloques de un archivo.
+    """
+    df = df.reset_index(drop=True)
+    numero_fila = np.arange(offset + 2, offset + 2 + len(df))  # +2: encabezado y base 1
+    if parser_fechas is None:
+        parser_fechas = ParserFechas(usar_cache=False)
+
+    medidores = df['medidor'].astype('string').str.strip()
+    with etapa('fechas') as medida:
+        fechas = parser_fechas.parse(df['fecha'], medidores)
+        medida.filas += len(df)
+    consumos = convertir_consumo(df['consumo'])
+
+    chequeos = [
+        ('fecha_invalida', 'fecha', fechas.isna().to_numpy()),
+        ('consumo_invalido', 'consumo', consumos.isna().to_numpy()),
+        ('consumo_negativo', 'consumo', (consumos < 0).to_numpy()),
+        ('consumo_fuera_de_rango', 'consumo', (consumos > consumo_maximo()).to_numpy()),
+        ('medidor_vacio', 'medidor', (medidores.isna() | (medidores == '')).to_numpy(dtype=bool, na_value=True)),
+        ('medidor_muy_largo', 'medidor', (medidores.str.len() > MEDIDOR_MAX_LENGTH).to_numpy(dtype=bool, na_value=False)),
+    ]
+
+    rechazada = np.zeros(len(df), dtype=bool)
+    partes = []
+    for motivo, columna, mascara in chequeos:
+        nuevas = mascara & ~rechazada
+        if nuevas.any():
+            partes.append(_tabla_rechazos(numero_fila[nuevas], motivo, df[columna].to_numpy()[nuevas]))
+            rechazada |= nuevas
+
+    limpio = pd.DataFrame({
+        'fecha': fechas[~rechazada],
+        'consumo': consumos[~rechazada],
+        'medidor': medidores[~rechazada].astype(object),
+    })
+    # Duplicados dentro del bloque; los que cruzan bloques los descarta y cuenta el cargador de staging.
+    duplicada = limpio.duplicated(['fecha', 'medidor'], keep='first').to_numpy()
+    if duplicada.any():
+        filas_validas = numero_fila[~rechazada]
+        partes.append(_tabla_rechazos(
+            filas_validas[duplicada], 'duplicado',
+            (limpio['fecha'].astype(str) + ' / ' + limpio['medidor'].astype(str)).to_numpy()[duplicada],
+        ))
+        limpio = limpio[~duplicada]
+
+    if partes:
+        rechazos = pd.concat(partes, ignore_index=True).sort_values('fila', kind='stable', ignore_index=True)
+    else:
+        rechazos = pd.DataFrame(columns=COLUMNAS_RECHAZO)
+    return limpio, rechazos
+
+
+def _tabla_rechazos(filas, motivo, valores):
+    return pd.DataFrame({'fila': filas, 'motivo': motivo, 'valor': pd.Series(valores, dtype=object).astype(str)})
+
+
+def describir_rechazos(rechazos, limite):
+    """Mensajes legibles para las primeras `limite` filas de la tabla de rechazos."""
+    return [
+        f"Fila {fila}: {MOTIVOS[motivo]} ('{valor}')."
+        for fila, motivo, valor in rechazos.head(limite).itertuples(index=False)
+    ]
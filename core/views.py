@@ -1,11 +1,22 @@
-from django.shortcuts import render, redirect
+from django.conf import settings
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.db import connection, transaction, IntegrityError
-from .models import InterfaceConsumo, Consumo, Medidor # Asegúrate que tus modelos están aquí
-import pandas as pd
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from .models import ImportacionConsumo, Medidor # Asegúrate que tus modelos están aquí
+import hmac
 import logging
+import threading
 from django.contrib.admin.views.decorators import staff_member_required
-from django.utils import timezone # Para fechas conscientes de zona horaria si es necesario
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_POST
+from .importacion import EXTENSIONES_SOPORTADAS
+from . import cache_consultas, ingesta, instrumentacion, series
 
 logger = logging.getLogger(__name__)
 
@@ -13,298 +24,263 @@ logger = logging.getLogger(__name__)
 def import_excel(request):
     if request.method == 'POST' and request.FILES.get('excel_file'):
         excel_file = request.FILES['excel_file']
-        try:
-            # --- 1. TRUNCATE staging table (InterfaceConsumo) ---
-            # This clears the staging table before loading new data.
-            staging_table_name = InterfaceConsumo._meta.db_table
-            with transaction.atomic(): # Envolver truncate y carga a staging
-                with connection.cursor() as cursor:
-                    try:
-                        # PostgreSQL specific for resetting identity.
-                        # Adjust for other DBs if ID is auto-increment and needs reset.
-                        cursor.execute(f"TRUNCATE TABLE {staging_table_name} RESTART IDENTITY;")
-                        logger.info(f"Staging table '{staging_table_name}' truncated and identity reset.")
-                    except Exception as e_truncate_restart:
-                        logger.warning(f"TRUNCATE ... RESTART IDENTITY failed for {staging_table_name}: {e_truncate_restart}. Trying DELETE...")
-                        cursor.execute(f"DELETE FROM {staging_table_name};")
-                        # For SQLite, if you need to reset auto-increment for a table named 'staging_table_name':
-                        # cursor.execute(f"DELETE FROM sqlite_sequence WHERE name='{staging_table_name}';")
-                        logger.info(f"Staging table '{staging_table_name}' cleared with DELETE.")
-
-                # --- 2. Load Excel/CSV to DataFrame and Basic Validations ---
-                if excel_file.name.endswith('.xlsx'):
-                    df = pd.read_excel(excel_file, engine='openpyxl')
-                elif excel_file.name.endswith('.xls'):
-                    df = pd.read_excel(excel_file, engine='xlrd')
-                elif excel_file.name.endswith('.csv'):
-                    df = pd.read_csv(excel_file, encoding='utf-8', sep=',') # O el separador que uses
-                else:
-                    messages.error(request, "Formato de archivo no soportado. Use .xlsx, .xls o .csv.")
-                    return redirect('admin:core_consumo_changelist') # Ajusta el redirect a tu vista de lista
-
-                if df.empty:
-                    messages.error(request, "El archivo está vacío.")
-                    return redirect('admin:core_consumo_changelist')
-
-                required_columns = ['fecha', 'consumo', 'medidor'] # Nombres de columnas en Excel/CSV
-                missing_columns = [col for col in required_columns if col not in df.columns]
-                if missing_columns:
-                    messages.error(request, f"Columnas faltantes en el archivo: {', '.join(missing_columns)}. Se requieren: {', '.join(required_columns)}")
-                    return redirect('admin:core_consumo_changelist')
-
-                # --- 3. Date Parsing and Validation (Output: datetime objects) ---
-                try:
-                    # Intenta varios formatos, el resultado debe ser datetime objects
-                    parsed_dates = pd.to_datetime(df['fecha'], format='%d/%m/%Y %H:%M', errors='coerce')
-                    if parsed_dates.isnull().any():
-                        failed_indices_1 = parsed_dates[parsed_dates.isnull()].index
-                        parsed_dates_fallback_1 = pd.to_datetime(df.loc[failed_indices_1, 'fecha'], format='%d/%m/%Y %H', errors='coerce')
-                        parsed_dates.loc[failed_indices_1] = parsed_dates.loc[failed_indices_1].fillna(parsed_dates_fallback_1)
-                    if parsed_dates.isnull().any():
-                        failed_indices_2 = parsed_dates[parsed_dates.isnull()].index
-                        parsed_dates_fallback_2 = pd.to_datetime(df.loc[failed_indices_2, 'fecha'], format='%d/%m/%Y', errors='coerce')
-                        parsed_dates.loc[failed_indices_2] = parsed_dates.loc[failed_indices_2].fillna(parsed_dates_fallback_2)
-                    if parsed_dates.isnull().any():
-                        failed_indices_3 = parsed_dates[parsed_dates.isnull()].index
-                        parsed_dates_fallback_3 = pd.to_datetime(df.loc[failed_indices_3, 'fecha'], infer_datetime_format=True, errors='coerce')
-                        parsed_dates.loc[failed_indices_3] = parsed_dates.loc[failed_indices_3].fillna(parsed_dates_fallback_3)
-
-                    if parsed_dates.isnull().any():
-                        problem_indices = parsed_dates[parsed_dates.isnull()].index.tolist()
-                        example_problems = df.loc[problem_indices, 'fecha'].astype(str).head(5).tolist()
-                        messages.error(request, (
-                            f"Error en el formato de fecha para algunas filas. "
-                            f"Se intentó con DD/MM/YYYY HH:MM, DD/MM/YYYY HH, DD/MM/YYYY y formatos genéricos. "
-                            f"Ejemplos de valores problemáticos en la columna 'fecha': {', '.join(example_problems)}. "
-                            "Por favor, corrija el archivo."
-                        ))
-                        return redirect('admin:core_consumo_changelist')
-
-                    # Almacenar objetos datetime. Si USE_TZ=True, considera hacerlos conscientes.
-                    # Por ahora, asumimos que Django los manejará como naive y los convertirá si es necesario.
-                    df['fecha_for_db'] = parsed_dates # Ahora es una serie de datetimes
-
-                except KeyError:
-                    messages.error(request, "La columna 'fecha' no se encontró en el archivo.")
-                    return redirect('admin:core_consumo_changelist')
-                except Exception as e:
-                    logger.error(f"Error inesperado procesando la columna 'fecha': {e}", exc_info=True)
-                    messages.error(request, f'Error inesperado procesando la columna "fecha": {str(e)}')
-                    return redirect('admin:core_consumo_changelist')
-
-                # --- 4. Prepare and Bulk Insert into InterfaceConsumo (Staging Table) ---
-                interface_records_to_create = []
-                skipped_rows_validation_errors = []
-
-                for index, row in df.iterrows():
-                    try:
-                        # row['fecha_for_db'] es ahora un objeto datetime de Pandas (Timestamp)
-                        # o NaT si falló la conversión.
-                        fecha_dt_obj = row['fecha_for_db']
-
-                        if pd.isna(fecha_dt_obj):
-                            skipped_rows_validation_errors.append(f"Fila {index + 2}: Fecha '{row['fecha']}' no pudo ser procesada a datetime.")
-                            continue
-
-                        # Convertir Pandas Timestamp a Python datetime si es necesario para el ORM,
-                        # aunque Django suele manejar Timestamps bien.
-                        # Si InterfaceConsumo.fecha es DateTimeField, esto es correcto.
-                        # Si InterfaceConsumo.fecha fuera DateField, usarías: fecha_dt_obj.date()
-                        python_datetime = fecha_dt_obj.to_pydatetime()
-
-
-                        try:
-                            consumo_valor = float(row['consumo'])
-                        except ValueError:
-                            skipped_rows_validation_errors.append(f"Fila {index + 2}: Valor de 'consumo' ('{row['consumo']}') no es un número válido.")
-                            continue
-
-                        # --- Handling Medidor Name from File ---
-                        medidor_nombre_from_file_raw = row.get('medidor')
-                        if pd.isna(medidor_nombre_from_file_raw) or not str(medidor_nombre_from_file_raw).strip():
-                            skipped_rows_validation_errors.append(f"Fila {index + 2}: Nombre de medidor (columna 'medidor') vacío o ausente.")
-                            continue
-                        # Clean the medidor name - this should be the full string
-                        medidor_nombre_cleaned = str(medidor_nombre_from_file_raw).strip()
-                        # --- End Handling Medidor Name ---
-
-                        interface_records_to_create.append(InterfaceConsumo(
-                            fecha=python_datetime, # Usar el datetime completo
-                            consumo=consumo_valor,
-                            medidor=medidor_nombre_cleaned # Storing the cleaned, full name in staging
-                        ))
-                    except KeyError as e:
-                        skipped_rows_validation_errors.append(f"Fila {index + 2}: Columna faltante '{e}' al preparar para staging.")
-                    except Exception as e:
-                        logger.error(f"Error preparando fila {index + 2} para staging: {e}", exc_info=True)
-                        skipped_rows_validation_errors.append(f"Fila {index + 2}: Error inesperado '{str(e)}' al preparar para staging.")
-
-                if not interface_records_to_create:
-                    if skipped_rows_validation_errors:
-                        error_summary = "; ".join(skipped_rows_validation_errors[:3]) + ("..." if len(skipped_rows_validation_errors) > 3 else "")
-                        messages.warning(request, f"Ninguna fila válida para staging. {len(skipped_rows_validation_errors)} filas del archivo con errores: {error_summary}")
-                    else:
-                        messages.error(request, "El archivo no contiene registros válidos para cargar en la tabla de staging.")
-                    return redirect('admin:core_consumo_changelist')
-
-                # InterfaceConsumo tiene unique_together = ['fecha', 'medidor']
-                # Usar ignore_conflicts=True para evitar errores si el archivo tiene duplicados exactos
-                # que coincidan con esta restricción de la tabla de staging.
-                # This bulk_create should save the full 'medidor_nombre_cleaned' strings.
-                InterfaceConsumo.objects.bulk_create(interface_records_to_create, ignore_conflicts=True)
-                # Nota: ignore_conflicts=True no devuelve IDs, y el número de creados podría ser menor
-                # si hubo conflictos. Para un conteo exacto, necesitarías consultar la tabla.
-                # Por simplicidad, asumimos que la mayoría o todos se cargan.
-                actual_staged_count = InterfaceConsumo.objects.count() # Contar después para saber cuántos hay realmente
-                logger.info(f"{len(interface_records_to_create)} records intentados para staging. {actual_staged_count} records ahora en staging '{staging_table_name}'.")
-            # Fin del transaction.atomic() para staging
-
-            # --- 5. Process from InterfaceConsumo to Consumo ---
-            staged_records = InterfaceConsumo.objects.all() # Fetching records from staging
-
-            if not staged_records.exists():
-                 messages.info(request, "No hay registros en la tabla de staging para procesar (posiblemente todos eran duplicados dentro del archivo).")
-                 return redirect('admin:core_consumo_changelist')
-
-            # --- Extracting Medidor Names from Staging ---
-            # This set should contain the full medidor names as stored in InterfaceConsumo
-            medidor_names_from_staging = set(s.medidor for s in staged_records if s.medidor)
-            # --- End Extracting Medidor Names ---
-
-            if not medidor_names_from_staging:
-                messages.error(request, "No se encontraron nombres de medidores válidos en los datos de staging.")
-                return redirect('admin:core_consumo_changelist')
-
-            # Fetch existing Medidor objects by their name
-            existing_medidores_dict = {m.nombre: m for m in Medidor.objects.filter(nombre__in=medidor_names_from_staging)}
-
-            # --- MODIFICACIÓN: No crear nuevos medidores si no existen ---
-            # Comentamos o eliminamos la lógica de creación de nuevos medidores
-            # medidores_to_create_names = list(medidor_names_from_staging - set(existing_medidores_dict.keys()))
-            # if medidores_to_create_names:
-            #     new_medidores_objs = [Medidor(nombre=name, tipo='IMPORTADO_EXCEL') for name in medidores_to_create_names]
-            #     try:
-            #         Medidor.objects.bulk_create(new_medidores_objs, ignore_conflicts=True)
-            #         logger.info(f"Intentada creación masiva de {len(new_medidores_objs)} nuevos medidores.")
-            #         for med_obj in Medidor.objects.filter(nombre__in=medidores_to_create_names):
-            #              if med_obj.nombre not in existing_medidores_dict:
-            #                   existing_medidores_dict[med_obj.nombre] = med_obj
-            #     except IntegrityError as ie:
-            #         logger.error(f"Error de integridad al crear medidores: {ie}", exc_info=True)
-            #         messages.error(request, f"Error al crear nuevos medidores: {str(ie)}")
-            #         return redirect('admin:core_consumo_changelist')
-            # --- FIN MODIFICACIÓN ---
-
-            consumo_records_to_create_candidates = []
-            skipped_by_python_duplicate_check = 0
-            errors_processing_staging = []
-            skipped_medidor_not_found = [] # Lista para notificar medidores no encontrados
-
-            # Consumo.fecha es DateTimeField, Consumo.medidor es ForeignKey
-            # Crear un set de tuplas (datetime, medidor_id) para chequeo de duplicados
-            # Fetching existing Consumo records to check for duplicates before inserting
-            existing_consumo_tuples = set(
-                (c.fecha, c.medidor_id) for c in Consumo.objects.filter(
-                    medidor__nombre__in=medidor_names_from_staging # Efficient filter using names found in staging
-                ).only('fecha', 'medidor_id')
+        if not excel_file.name.lower().endswith(EXTENSIONES_SOPORTADAS):
+            messages.error(request, "Formato de archivo no soportado. Use .xlsx, .xls o .csv.")
+            return redirect('admin:core_consumo_changelist') # Ajusta el redirect a tu vista de lista
+
+        # El archivo se guarda y se procesa fuera del request (comando procesar_importaciones),
+        # así los uploads grandes no bloquean el worker web ni llegan al timeout.
+        importacion = ImportacionConsumo.objects.create(
+            archivo=excel_file,
+            nombre_original=excel_file.name,
+            sobrescribir=bool(request.POST.get('sobrescribir')),
+            usuario=request.user if request.user.is_authenticated else None,
+        )
+        logger.info(f"Importación #{importacion.pk} ({excel_file.name}) encolada.")
+        messages.info(request, f"Archivo '{excel_file.name}' recibido. La importación #{importacion.pk} se procesará en segundo plano.")
+        return redirect('admin:core_consumo_importacion', importacion.pk)
+
+    return render(request, 'admin/import_excel.html') # Asegúrate que tu template de importación existe
+
+
+def _estado_importacion(importacion):
+    return {
+        'id': importacion.pk,
+        'estado': importacion.estado,
+        'estado_display': importacion.get_estado_display(),
+        'terminado': importacion.estado in (ImportacionConsumo.COMPLETADO, ImportacionConsumo.ERROR),
+        'filas_leidas': importacion.filas_leidas,
+        'filas_staging': importacion.filas_staging,
+        'filas_fusionadas': importacion.filas_fusionadas,
+        'filas_rechazadas': importacion.filas_rechazadas,
+        'filas_duplicadas': importacion.filas_duplicadas,
+        'filas_medidor_desconocido': importacion.filas_medidor_desconocido,
+        'errores': importacion.errores[:5],
+        'rechazos_por_motivo': importacion.rechazos_por_motivo,
+        'rechazos_url': reverse('admin:core_consumo_importacion_rechazos', args=[importacion.pk]) if importacion.rechazos else None,
+        'mensaje': importacion.mensaje,
+    }
+
+
+@staff_member_required
+def importacion_estado(request, pk):
+    """Progreso de una importación en JSON, consultado periódicamente por la página de progreso."""
+    return JsonResponse(_estado_importacion(get_object_or_404(ImportacionConsumo, pk=pk)))
+
+
+def _fecha_parametro(texto, nombre):
+    try:
+        fecha = datetime.fromisoformat(texto)
+    except (TypeError, ValueError):
+        raise ValueError(f"Parámetro '{nombre}' inválido: use AAAA-MM-DD o AAAA-MM-DDTHH:MM.")
+    return fecha if timezone.is_aware(fecha) else timezone.make_aware(fecha)
+
+
+def _enteros(textos, nombre):
+    try:
+        return [int(texto) for texto in textos]
+    except ValueError:
+        raise ValueError(f"Parámetro '{nombre}' inválido: debe ser un número entero.")
+
+
+def _parametros_series(request, medidor_id):
+    """(medidores, desde, hasta, max_puntos, metodo) de la consulta; ValueError con el mensaje para el 400."""
+    medidores = [medidor_id] if medidor_id is not None else _enteros(request.GET.getlist('medidor'), 'medidor')
+    if not medidores:
+        raise ValueError("Falta el parámetro 'medidor'.")
+    if len(medidores) > series.MAX_MEDIDORES:
+        raise ValueError(f"Como máximo {series.MAX_MEDIDORES} medidores por consulta.")
+    desde = _fecha_parametro(request.GET.get('desde'), 'desde')
+    hasta = _fecha_parametro(request.GET.get('hasta'), 'hasta')
+    if hasta <= desde:
+        raise ValueError("'hasta' debe ser posterior a 'desde'.")
+    max_puntos = _enteros([request.GET.get('max_puntos', series.MAX_PUNTOS)], 'max_puntos')[0]
+    if not 2 <= max_puntos <= series.MAX_ENTRADA_LTTB:
+        raise ValueError(f"'max_puntos' debe estar entre 2 y {series.MAX_ENTRADA_LTTB}.")
+    metodo = request.GET.get('metodo', 'promedio')
+    if metodo not in series.METODOS:
+        raise ValueError(f"'metodo' debe ser uno de: {', '.join(series.METODOS)}.")
+    return list(dict.fromkeys(medidores)), desde, hasta, max_puntos, metodo
+
+
+def _medidores_inexistentes(medidores, existentes):
+    faltantes = [m for m in medidores if m not in existentes]
+    return JsonResponse({'error': f"Medidores inexistentes: {faltantes}"}, status=404)
+
+
+def _respuesta_series(medidores, desde, hasta, max_puntos, metodo):
+    datos = cache_consultas.cacheado(
+        'series', medidores, desde, hasta, f'{metodo}:{max_puntos}',
+        lambda: series.series(medidores, desde, hasta, max_puntos=max_puntos, metodo=metodo),
+    )
+    return JsonResponse(datos, json_dumps_params={'separators': (',', ':')})
+
+
+@staff_member_required
+def api_series(request, medidor_id=None):
+    """
+    Series de consumo en columnas (fechas en epoch ms, valores), reducidas en el servidor.
+
+    GET /api/series/?medidor=1&medidor=2&desde=2024-01-01&hasta=2025-01-01[&max_puntos=2000][&metodo=promedio|lttb|ninguno]
+    o /api/series/<medidor_id>/ con los mismos parámetros. `hasta` es exclusivo.
+    """
+    try:
+        parametros = _parametros_series(request, medidor_id)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    medidores = parametros[0]
+    existentes = set(Medidor.objects.filter(pk__in=medidores).values_list('pk', flat=True))
+    if len(existentes) < len(medidores):
+        return _medidores_inexistentes(medidores, existentes)
+    return _respuesta_series(*parametros)
+
+
+@staff_member_required
+def api_cache_estadisticas(request):
+    """Contadores de la caché de consultas (core.cache_consultas), para ajustar tamaño y timeout."""
+    return JsonResponse(cache_consultas.estadisticas())
+
+
+def _token_valido(request, claves):
+    """True si el encabezado 'Authorization: Token <clave>' trae una de `claves`."""
+    encabezado = request.headers.get('Authorization', '')
+    if not encabezado.startswith('Token '):
+        return False
+    token = encabezado[len('Token '):].strip()
+    return any(hmac.compare_digest(token, valido) for valido in claves)
+
+
+def _token_ingesta_valido(request):
+    return _token_valido(request, getattr(settings, 'INGESTA_LECTURAS_TOKENS', ()))
+
+
+def metricas(request):
+    """
+    Historial de core.instrumentacion en el formato de texto de Prometheus.
+
+    GET /metricas/ con 'Authorization: Token <clave>' de settings.METRICAS_TOKENS (en Prometheus,
+    authorization.type: Token) o con una sesión de staff.
+    """
+    if _token_valido(request, getattr(settings, 'METRICAS_TOKENS', ())):
+        return _respuesta_metricas()
+    return _metricas_staff(request)
+
+
+@staff_member_required
+def _metricas_staff(request):
+    return _respuesta_metricas()
+
+
+def _respuesta_metricas():
+    return HttpResponse(instrumentacion.metricas_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@csrf_exempt
+@require_POST
+def api_lecturas(request):
+    """
+    Ingesta masiva de DocumentoMedicion (core.ingesta).
+
+    POST /api/lecturas/[?sobrescribir=1] con Content-Type application/x-ndjson o text/csv.
+    Los colectores se autentican con 'Authorization: Token <clave>' (sin sesión ni CSRF); sin
+    token hace falta una sesión de staff, con CSRF como cualquier POST del sitio.
+    """
+    if _token_ingesta_valido(request):
+        return _ingestar_lecturas(request)
+    return _api_lecturas_staff(request)
+
+
+@csrf_protect
+@staff_member_required
+def _api_lecturas_staff(request):
+    return _ingestar_lecturas(request)
+
+
+def _ingestar_lecturas(request):
+    formato = ingesta.formato(request.content_type)
+    if formato is None:
+        return JsonResponse(
+            {'error': f"Content-Type no soportado: use {', '.join(ingesta.FORMATOS)}."}, status=415,
+        )
+    # Se lee del stream y no de request.body: el cuerpo puede pasar DATA_UPLOAD_MAX_MEMORY_SIZE.
+    resultado = ingesta.ingestar(request, formato, sobrescribir=request.GET.get('sobrescribir') in ('1', 'true'))
+    return JsonResponse(resultado, status=400 if 'error' in resultado else 200)
+
+
+# Variantes async (/api/async/...) para servir con energiaccg.asgi (uvicorn). Bajo ASGI las
+# vistas síncronas corren todas en un único hilo compartido, así que una serie pesada o una
+# ingesta frena a los demás requests del proceso. Estas hacen las búsquedas con el ORM async y
+# mandan el armado de series y el parseo de lecturas a un pool acotado de
+# settings.VISTAS_ASYNC_HILOS hilos: pandas, numpy y psycopg2 sueltan el GIL en lo pesado, y
+# un pool de procesos no serviría porque el trabajo necesita la conexión y el cuerpo del request.
+# El cuerpo ya llega completo: el handler ASGI lo vuelca a un archivo temporal antes de llamar
+# a la vista, así que una subida lenta no ocupa ningún hilo mientras llega.
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _pool_vistas():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'VISTAS_ASYNC_HILOS', 4), thread_name_prefix='vistas-async',
             )
+        return _pool
 
-            with transaction.atomic(): # Transacción para la carga a la tabla Consumo
-                for stag_rec in staged_records: # stag_rec.fecha es datetime
-                    # --- Linking Staging Record to Medidor Object ---
-                    # Using the full medidor name from the staging record to find the Medidor object
-                    medidor_obj = existing_medidores_dict.get(stag_rec.medidor) # stag_rec.medidor is the full name
-                    # --- End Linking ---
-
-                    # --- MODIFICACIÓN: Omitir si el medidor no se encuentra ---
-                    if not medidor_obj or not medidor_obj.id:
-                        error_msg = f"Medidor '{stag_rec.medidor}' (fecha: {stag_rec.fecha.strftime('%Y-%m-%d %H:%M') if stag_rec.fecha else 'N/A'}) no encontrado en la base de datos. Registro omitido."
-                        skipped_medidor_not_found.append(error_msg) # Añadir a la lista de omitidos por medidor no encontrado
-                        logger.warning(error_msg)
-                        continue # Omitir este registro
-                    # --- FIN MODIFICACIÓN ---
-
-                    # stag_rec.fecha ya es un objeto datetime (si InterfaceConsumo.fecha es DateTimeField)
-                    # Si InterfaceConsumo.fecha es DateField, stag_rec.fecha es date.
-                    # En ese caso, Consumo.fecha (DateTimeField) tomaría la hora 00:00:00.
-                    # Asumiendo que stag_rec.fecha es datetime:
-                    current_consumo_tuple = (stag_rec.fecha, medidor_obj.id)
-
-                    if current_consumo_tuple not in existing_consumo_tuples:
-                        consumo_records_to_create_candidates.append(Consumo(
-                            fecha=stag_rec.fecha, # stag_rec.fecha is the datetime
-                            consumo=stag_rec.consumo,
-                            medidor=medidor_obj # Linking to the correct Medidor object (with full name)
-                        ))
-                    else:
-                        skipped_by_python_duplicate_check += 1
-
-                final_imported_count_candidates = len(consumo_records_to_create_candidates)
-                if consumo_records_to_create_candidates:
-                    try:
-                        # Consumo.Meta.unique_together = [['fecha', 'medidor']]
-                        # ignore_conflicts=True hace que la BD maneje los duplicados silenciosamente
-                        # This bulk_create inserts Consumo records linked to the Medidor objects.
-                        Consumo.objects.bulk_create(consumo_records_to_create_candidates, ignore_conflicts=True)
-                    except IntegrityError as e: # No debería ocurrir con ignore_conflicts=True y unique_together
-                        logger.error(f"IntegrityError durante bulk_create final en Consumo (inesperado con ignore_conflicts): {e}", exc_info=True)
-                        messages.error(request, f"Error de base de datos al guardar consumos finales: {str(e)}")
-                        return redirect('admin:core_consumo_changelist')
-
-            # --- Mensajes consolidados ---
-            total_rows_in_file = len(df)
-            initial_staged_intent_count = len(interface_records_to_create) # Los que pasaron validación de fila
-
-            if initial_staged_intent_count > 0:
-                 messages.success(request, f'{initial_staged_intent_count} registros del archivo pasaron la validación inicial y se intentaron cargar a staging. {actual_staged_count} registros están ahora en staging.')
-            if skipped_rows_validation_errors:
-                 error_summary_validation = "; ".join(skipped_rows_validation_errors[:3]) + ("..." if len(skipped_rows_validation_errors) > 3 else "")
-                 messages.warning(request, f'{len(skipped_rows_validation_errors)} de {total_rows_in_file} filas del archivo fueron omitidas por errores de validación antes del staging. Ejemplos: {error_summary_validation}')
-
-            if final_imported_count_candidates > 0:
-                # Este es el número de registros que pasaron el chequeo de duplicados de Python y se enviaron a la BD.
-                # El número real insertado podría ser menor si ignore_conflicts actuó sobre duplicados no detectados por Python.
-                messages.success(request, f'{final_imported_count_candidates} registros de staging fueron preparados para importación a la tabla principal (Consumo).')
-            elif actual_staged_count > 0 and not errors_processing_staging and not skipped_medidor_not_found and skipped_by_python_duplicate_check == actual_staged_count:
-                 messages.info(request, 'No se prepararon nuevos registros para la tabla principal: todos los registros válidos de staging ya existían (según chequeo).')
-            elif actual_staged_count > 0:
-                 messages.info(request, 'No se prepararon nuevos registros para la tabla principal (verifique duplicados, errores de procesamiento desde staging y medidores no encontrados).')
-
-
-            if skipped_by_python_duplicate_check > 0:
-                messages.info(request, f'{skipped_by_python_duplicate_check} registros de staging fueron identificados como duplicados (según chequeo Python) y no se intentaron cargar a la tabla principal.')
-
-            # --- MODIFICACIÓN: Mensaje para medidores no encontrados ---
-            if skipped_medidor_not_found:
-                error_summary_medidor = "; ".join(skipped_medidor_not_found[:3]) + ("..." if len(skipped_medidor_not_found) > 3 else "")
-                messages.warning(request, f"{len(skipped_medidor_not_found)} registros fueron omitidos porque el medidor asociado no existe en la base de datos. Ejemplos: {error_summary_medidor}")
-            # --- FIN MODIFICACIÓN ---
-
-            if errors_processing_staging:
-                error_summary_staging = "; ".join(errors_processing_staging[:3]) + ("..." if len(errors_processing_staging) > 3 else "")
-                messages.warning(request, f"{len(errors_processing_staging)} errores ocurrieron al procesar registros desde staging hacia Consumo. Ejemplos: {error_summary_staging}")
-
-            # Opcional: Limpiar InterfaceConsumo después del procesamiento.
-            # Comenta esto si quieres revisar InterfaceConsumo después de la importación.
-            # InterfaceConsumo.objects.all().delete()
-            # logger.info(f"Staging table '{staging_table_name}' cleared after processing.")
-
-            return redirect('admin:core_consumo_changelist') # Ajusta a tu vista
-
-        except pd.errors.EmptyDataError:
-            messages.error(request, "El archivo Excel/CSV está vacío o no contiene datos legibles.")
-            logger.warning("Pandas EmptyDataError durante importación.", exc_info=True)
-            return redirect('admin:core_consumo_changelist')
-        except IntegrityError as e_outer: # Por ejemplo, si el TRUNCATE falla dentro de la transacción
-            logger.error(f"Error de integridad general durante la importación: {e_outer}", exc_info=True)
-            messages.error(request, f'Error de base de datos durante la importación: {str(e_outer)}')
-            return redirect('admin:core_consumo_changelist')
-        except Exception as e:
-            logger.error(f"Error general durante la importación del archivo Excel/CSV: {e}", exc_info=True)
-            messages.error(request, f'Error crítico al importar datos: {str(e)}')
-            return redirect('admin:core_consumo_changelist')
 
-    return render(request, 'admin/import_excel.html') # Asegúrate que tu template de importación existe
+async def _en_pool(funcion, *args):
+    """Ejecuta `funcion` en el pool de las vistas async, con las conexiones del hilo como en un request."""
+    def tarea():
+        # Cada hilo del pool tiene su conexión; se cierra o reutiliza según CONN_MAX_AGE.
+        close_old_connections()
+        try:
+            return funcion(*args)
+        finally:
+            close_old_connections()
+    return await sync_to_async(tarea, thread_sensitive=False, executor=_pool_vistas())()
+
+
+@staff_member_required
+async def api_series_async(request, medidor_id=None):
+    """api_series para ASGI: mismos parámetros y respuesta."""
+    try:
+        parametros = _parametros_series(request, medidor_id)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    medidores = parametros[0]
+    existentes = {pk async for pk in Medidor.objects.filter(pk__in=medidores).values_list('pk', flat=True)}
+    if len(existentes) < len(medidores):
+        return _medidores_inexistentes(medidores, existentes)
+    return await _en_pool(_respuesta_series, *parametros)
+
+
+@staff_member_required
+async def importacion_estado_async(request, pk):
+    """importacion_estado para ASGI: la página de progreso lo consulta cada pocos segundos."""
+    try:
+        importacion = await ImportacionConsumo.objects.aget(pk=pk)
+    except ImportacionConsumo.DoesNotExist:
+        raise Http404
+    return JsonResponse(_estado_importacion(importacion))
+
+
+@csrf_exempt
+@require_POST
+async def api_lecturas_async(request):
+    """api_lecturas para ASGI: misma autenticación y respuesta; la ingesta corre en el pool."""
+    if _token_ingesta_valido(request):
+        return await _en_pool(_ingestar_lecturas, request)
+    return await _api_lecturas_staff_async(request)
+
+
+@csrf_protect
+@staff_member_required
+async def _api_lecturas_staff_async(request):
+    return await _en_pool(_ingestar_lecturas, request)
 
 
 # Asumiendo que esta es otra vista, también debería estar protegida si es parte del admin
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -88,6 +90,59 @@ DATABASES = {
 }
 
 
+# Caché
+# 'consultas' guarda los resultados de core.cache_consultas. LocMemCache es por proceso;
+# para compartirla entre workers se puede cambiar por Redis o Memcached sin tocar el código.
+# 'formatos_fecha' guarda los formatos de fecha aprendidos por medidor (core.fechas). Tiene que
+# ser compartida: las importaciones corren en los procesos de procesar_importaciones y con
+# LocMemCache cada una empezaría de cero. En disco sirve para los workers de un mismo servidor;
+# con varios servidores, Redis o Memcached.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'consultas': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'consultas',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+    'formatos_fecha': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_FORMATOS_FECHA_DIR', Path(tempfile.gettempdir()) / 'energiaccg_formatos_fecha'),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+CACHE_CONSULTAS = 'consultas'
+CACHE_FORMATOS_FECHA = 'formatos_fecha'
+
+# Claves con las que los colectores de campo envían lecturas a /api/lecturas/
+# ('Authorization: Token <clave>'). Mejor leerlas del entorno que dejarlas en el repositorio.
+INGESTA_LECTURAS_TOKENS = [t for t in os.environ.get('INGESTA_LECTURAS_TOKENS', '').split(',') if t]
+
+# Hilos por proceso para el trabajo pesado de las vistas /api/async/ (series, ingesta) bajo
+# energiaccg.asgi. Cada hilo puede tener abierta una conexión a la base.
+VISTAS_ASYNC_HILOS = int(os.environ.get('VISTAS_ASYNC_HILOS', 4))
+
+# Directorio de los meses de Consumo archivados en Parquet (core.archivo). Tiene que ser el
+# mismo disco para todos los procesos que consultan.
+ARCHIVO_CONSUMO_DIR = Path(os.environ.get('ARCHIVO_CONSUMO_DIR', BASE_DIR / 'archivo_consumo'))
+
+# Medición de las importaciones (core.instrumentacion). VERSION_DESPLIEGUE queda en cada
+# medición para comparar antes y después de un despliegue (p. ej. el hash del commit).
+# INSTRUMENTACION_MEMORIA: 'rss' (pico de RSS del proceso, sin costo), 'tracemalloc' (memoria
+# de Python, más precisa pero duplica el tiempo de importación) o '' para no medirla.
+# METRICAS_TOKENS son las claves con las que Prometheus lee /metricas/ ('Authorization: Token <clave>').
+VERSION_DESPLIEGUE = os.environ.get('VERSION_DESPLIEGUE', '')
+INSTRUMENTACION_MEMORIA = os.environ.get('INSTRUMENTACION_MEMORIA', 'rss')
+METRICAS_TOKENS = [t for t in os.environ.get('METRICAS_TOKENS', '').split(',') if t]
+
+# Minutos sin latido tras los que una importación en proceso se da por abandonada (su worker
+# murió) y se marca con error. El worker late después de cada bloque y antes de cada etapa:
+# tiene que superar lo que tarda el paso más largo (en general la fusión de un archivo grande).
+IMPORTACION_MINUTOS_ABANDONO = int(os.environ.get('IMPORTACION_MINUTOS_ABANDONO', 120))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -124,6 +179,10 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Archivos subidos (importaciones de consumo en cola)
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 